@@ -11,102 +11,190 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Init module for TensorFlow Model Analysis."""
+"""Init module for TensorFlow Model Analysis.
+
+The public API is loaded lazily: submodules are only imported the first time
+one of their attributes is accessed (e.g. tfma.EvalConfig or tfma.metrics).
+This keeps the cost of `import tensorflow_model_analysis` low for processes
+(such as Beam workers) that only need a small part of the API.
+"""
 
-# pylint: disable=unused-import
 # pylint: disable=g-bad-import-order
 
+import importlib
+import sys
+import types as _python_types
+
+from tensorflow_model_analysis.version import VERSION_STRING
+
+# Public attributes that are aliases for entire modules (attribute -> module).
+#
 # TODO(b/77140537) For API docs
 # We want to document the view module, but it doesn't work with
 # the current tools, so we have a temporary stub.
-from tensorflow_model_analysis.api import tfma_unit as test
-
-from tensorflow_model_analysis.api.model_eval_lib import default_eval_shared_model
-from tensorflow_model_analysis.api.model_eval_lib import default_evaluators
-from tensorflow_model_analysis.api.model_eval_lib import default_extractors
-from tensorflow_model_analysis.api.model_eval_lib import default_writers
-from tensorflow_model_analysis.api.model_eval_lib import EvalResult
-from tensorflow_model_analysis.api.model_eval_lib import ExtractAndEvaluate
-from tensorflow_model_analysis.api.model_eval_lib import ExtractEvaluateAndWriteResults
-from tensorflow_model_analysis.api.model_eval_lib import InputsToExtracts
-from tensorflow_model_analysis.api.model_eval_lib import load_eval_result
-from tensorflow_model_analysis.api.model_eval_lib import load_eval_results
-from tensorflow_model_analysis.api.model_eval_lib import make_eval_results
-from tensorflow_model_analysis.api.model_eval_lib import multiple_data_analysis
-from tensorflow_model_analysis.api.model_eval_lib import multiple_model_analysis
-from tensorflow_model_analysis.api.model_eval_lib import output_filename
-from tensorflow_model_analysis.api.model_eval_lib import run_model_analysis
-from tensorflow_model_analysis.api.model_eval_lib import WriteResults
-
-from tensorflow_model_analysis.api.verifier_lib import Validate
-
-from tensorflow_model_analysis.config import AggregationOptions
-from tensorflow_model_analysis.config import BinarizationOptions
-from tensorflow_model_analysis.config import InputDataSpec
-from tensorflow_model_analysis.config import EvalConfig
-from tensorflow_model_analysis.config import MetricConfig
-from tensorflow_model_analysis.config import MetricsSpec
-from tensorflow_model_analysis.config import ModelSpec
-from tensorflow_model_analysis.config import Options
-from tensorflow_model_analysis.config import OutputDataSpec
-from tensorflow_model_analysis.config import SlicingSpec
-from tensorflow_model_analysis.config import verify_eval_config
-
-from tensorflow_model_analysis.constants import ANALYSIS_KEY
-from tensorflow_model_analysis.constants import ATTRIBUTIONS_KEY
-from tensorflow_model_analysis.constants import BASELINE_KEY
-from tensorflow_model_analysis.constants import BASELINE_SCORE_KEY
-from tensorflow_model_analysis.constants import CANDIDATE_KEY
-from tensorflow_model_analysis.constants import DATA_CENTRIC_MODE
-from tensorflow_model_analysis.constants import EXAMPLE_SCORE_KEY
-from tensorflow_model_analysis.constants import EXAMPLE_WEIGHTS_KEY
-# TODO(b/120222218): Remove after passing of native FPL supported.
-from tensorflow_model_analysis.constants import FEATURES_PREDICTIONS_LABELS_KEY
-from tensorflow_model_analysis.constants import FEATURES_KEY
-from tensorflow_model_analysis.constants import INPUT_KEY
-from tensorflow_model_analysis.constants import LABELS_KEY
-from tensorflow_model_analysis.constants import METRICS_KEY
-from tensorflow_model_analysis.constants import MODEL_CENTRIC_MODE
-from tensorflow_model_analysis.constants import PLOTS_KEY
-from tensorflow_model_analysis.constants import PREDICTIONS_KEY
-from tensorflow_model_analysis.constants import SLICE_KEY_TYPES_KEY
-
-from tensorflow_model_analysis.eval_metrics_graph import eval_metrics_graph
-from tensorflow_model_analysis.eval_saved_model import export
-from tensorflow_model_analysis.eval_saved_model import exporter
-
-from tensorflow_model_analysis.post_export_metrics import post_export_metrics
-
-from tensorflow_model_analysis.model_util import model_construct_fn
-
-from tensorflow_model_analysis.types import AddMetricsCallbackType
-from tensorflow_model_analysis.types import EvalSharedModel
-from tensorflow_model_analysis.types import Extracts
-# TODO(b/120222218): Remove after passing of native FPL supported.
-from tensorflow_model_analysis.types import FeaturesPredictionsLabels
-# TODO(b/120222218): Remove after passing of native FPL supported.
-from tensorflow_model_analysis.types import MaterializedColumn
-from tensorflow_model_analysis.types import ModelLoader
-from tensorflow_model_analysis.types import TensorType
-from tensorflow_model_analysis.types import TensorTypeMaybeDict
-
-from tensorflow_model_analysis.util import create_keys_key
-from tensorflow_model_analysis.util import create_values_key
-from tensorflow_model_analysis.util import compound_key
-from tensorflow_model_analysis.util import unique_key
+_LAZY_MODULES = {
+    'test': 'tensorflow_model_analysis.api.tfma_unit',
+    'eval_metrics_graph':
+        'tensorflow_model_analysis.eval_metrics_graph.eval_metrics_graph',
+    'export': 'tensorflow_model_analysis.eval_saved_model.export',
+    'exporter': 'tensorflow_model_analysis.eval_saved_model.exporter',
+    'post_export_metrics':
+        'tensorflow_model_analysis.post_export_metrics.post_export_metrics',
+    'extractors': 'tensorflow_model_analysis.extractors',
+    'slicer': 'tensorflow_model_analysis.slicer',
+    'validators': 'tensorflow_model_analysis.validators',
+    'evaluators': 'tensorflow_model_analysis.evaluators',
+    'metrics': 'tensorflow_model_analysis.metrics',
+    'writers': 'tensorflow_model_analysis.writers',
+    'view': 'tensorflow_model_analysis.view',
+}
 
-from tensorflow_model_analysis.version import VERSION_STRING
+# Public attributes that are defined in submodules (module -> [attribute]).
+_LAZY_ATTRIBUTES = {
+    'tensorflow_model_analysis.api.in_memory_eval_lib': [
+        'compute_metrics_from_dataframe',
+        'compute_metrics_in_memory',
+        'to_eval_result',
+    ],
+    'tensorflow_model_analysis.api.model_eval_lib': [
+        'default_eval_shared_model',
+        'default_evaluators',
+        'default_extractors',
+        'default_writers',
+        'EvalResult',
+        'ExtractAndEvaluate',
+        'ExtractEvaluateAndWriteResults',
+        'InputsToExtracts',
+        'load_eval_result',
+        'load_eval_results',
+        'load_windowed_eval_results',
+        'make_eval_results',
+        'multiple_data_analysis',
+        'multiple_model_analysis',
+        'output_filename',
+        'run_model_analysis',
+        'WriteResults',
+    ],
+    'tensorflow_model_analysis.api.verifier_lib': ['Validate',],
+    'tensorflow_model_analysis.config': [
+        'AggregationOptions',
+        'BinarizationOptions',
+        'ConfidenceIntervalOptions',
+        'InputDataSpec',
+        'EvalConfig',
+        'MetricConfig',
+        'MetricsSpec',
+        'ModelSpec',
+        'Options',
+        'OutputDataSpec',
+        'QueryGroupingOptions',
+        'SlicingSpec',
+        'verify_eval_config',
+    ],
+    'tensorflow_model_analysis.constants': [
+        'ANALYSIS_KEY',
+        'ATTRIBUTIONS_KEY',
+        'BASELINE_KEY',
+        'BASELINE_SCORE_KEY',
+        'CANDIDATE_KEY',
+        'DATA_CENTRIC_MODE',
+        'EXAMPLE_SCORE_KEY',
+        'EXAMPLE_WEIGHTS_KEY',
+        # TODO(b/120222218): Remove after passing of native FPL supported.
+        'FEATURES_PREDICTIONS_LABELS_KEY',
+        'FEATURES_KEY',
+        'INPUT_KEY',
+        'LABELS_KEY',
+        'METRICS_KEY',
+        'MODEL_CENTRIC_MODE',
+        'PLOTS_KEY',
+        'PREDICTIONS_KEY',
+        'SLICE_DISCOVERY_KEY',
+        'SLICE_KEY_TYPES_KEY',
+    ],
+    'tensorflow_model_analysis.model_util': ['model_construct_fn',],
+    'tensorflow_model_analysis.types': [
+        'AddMetricsCallbackType',
+        'EvalSharedModel',
+        'Extracts',
+        # TODO(b/120222218): Remove after passing of native FPL supported.
+        'FeaturesPredictionsLabels',
+        # TODO(b/120222218): Remove after passing of native FPL supported.
+        'MaterializedColumn',
+        'ModelLoader',
+        'TensorType',
+        'TensorTypeMaybeDict',
+    ],
+    'tensorflow_model_analysis.util': [
+        'create_keys_key',
+        'create_values_key',
+        'compound_key',
+        'unique_key',
+    ],
+}
+
+_ATTRIBUTE_TO_MODULE = {}
+for _module_name, _attribute_names in _LAZY_ATTRIBUTES.items():
+  for _attribute_name in _attribute_names:
+    _ATTRIBUTE_TO_MODULE[_attribute_name] = _module_name
+
+
+def _load(name):
+  """Imports the value for the given public attribute and caches it."""
+  if name in _LAZY_MODULES:
+    value = importlib.import_module(_LAZY_MODULES[name])
+  elif name in _ATTRIBUTE_TO_MODULE:
+    value = getattr(importlib.import_module(_ATTRIBUTE_TO_MODULE[name]), name)
+  else:
+    # Subpackages not re-exported above (e.g. tfma.api, tfma.proto) are still
+    # reachable as attributes the same way they would be after an eager import.
+    try:
+      value = importlib.import_module('{}.{}'.format(__name__, name))
+    except ImportError as e:
+      if getattr(e, 'name', None) != '{}.{}'.format(__name__, name):
+        raise
+      raise AttributeError('module {!r} has no attribute {!r}'.format(
+          __name__, name))
+  globals()[name] = value
+  return value
+
+
+def __getattr__(name):  # pylint: disable=invalid-name
+  if name.startswith('__'):
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
+  return _load(name)
+
+
+def __dir__():  # pylint: disable=invalid-name
+  return sorted(
+      set(globals()) | set(_LAZY_MODULES) | set(_ATTRIBUTE_TO_MODULE))
+
+
+class _LazyModule(_python_types.ModuleType):
+  """Module type that keeps module aliases from being shadowed.
+
+  Importing a subpackage binds it as an attribute of its parent package. Some
+  public names (e.g. tfma.post_export_metrics) are aliases for a module nested
+  within the subpackage of the same name, so the alias is kept instead.
+  """
+
+  def __setattr__(self, name, value):
+    if (name in _LAZY_MODULES and
+        getattr(value, '__name__', None) == '{}.{}'.format(__name__, name) and
+        _LAZY_MODULES[name] != value.__name__):
+      return
+    super(_LazyModule, self).__setattr__(name, value)
+
+
+# Module level __getattr__ (PEP 562) is only supported in python >= 3.7, older
+# versions fall back to importing the full API eagerly.
+if sys.version_info >= (3, 7):
+  sys.modules[__name__].__class__ = _LazyModule
+else:
+  for _name in list(_ATTRIBUTE_TO_MODULE) + list(_LAZY_MODULES):
+    _load(_name)
 
-# TODO(b/73882264): The orders should be kept in order to make benchmark on
-# DataFlow work. We need to look into why the import orders matters for the
-# DataFlow benchmark.
-from tensorflow_model_analysis import extractors
-from tensorflow_model_analysis import slicer
-from tensorflow_model_analysis import validators
-from tensorflow_model_analysis import evaluators
-from tensorflow_model_analysis import metrics
-from tensorflow_model_analysis import writers
-from tensorflow_model_analysis import view
 
 def _jupyter_nbextension_paths():
   return [{
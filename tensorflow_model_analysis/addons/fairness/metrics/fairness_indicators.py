@@ -0,0 +1,169 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fairness Indicators metrics for the V2 metrics API.
+
+All the rates are derived from the binary confusion matrices at the given
+thresholds which are in turn derived from the calibration histogram shared with
+the other confusion matrix based metrics of the same model, output and sub key.
+The examples are therefore only bucketed once no matter how many thresholds
+(or instances of the metric) are used.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+from typing import Any, Dict, List, Optional, Text
+
+import numpy as np
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import math_util
+from tensorflow_model_analysis.metrics import binary_confusion_matrices
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+
+FAIRNESS_INDICATORS_METRICS_NAME = 'fairness_indicators_metrics'
+DEFAULT_THRESHOLDS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+
+# Names of the rates computed at each threshold.
+POSITIVE_RATE_NAME = 'positive_rate'
+TRUE_POSITIVE_RATE_NAME = 'true_positive_rate'
+FALSE_POSITIVE_RATE_NAME = 'false_positive_rate'
+NEGATIVE_RATE_NAME = 'negative_rate'
+TRUE_NEGATIVE_RATE_NAME = 'true_negative_rate'
+FALSE_NEGATIVE_RATE_NAME = 'false_negative_rate'
+
+
+class FairnessIndicators(metric_types.Metric):
+  """Fairness indicators metrics.
+
+  Computes the following rates at each threshold:
+
+    * positive_rate: (tp + fp) / total
+    * true_positive_rate: tp / (tp + fn)
+    * false_positive_rate: fp / (fp + tn)
+    * negative_rate: (tn + fn) / total
+    * true_negative_rate: tn / (tn + fp)
+    * false_negative_rate: fn / (fn + tp)
+
+  The rates are output using the keys '<name>/<rate>@<threshold>' (e.g.
+  'fairness_indicators_metrics/false_positive_rate@0.50'). Rates whose
+  denominator is zero are 0.0 (as in the post export fairness indicators).
+  """
+
+  def __init__(self,
+               thresholds: Optional[List[float]] = None,
+               name: Text = FAIRNESS_INDICATORS_METRICS_NAME):
+    """Initializes fairness indicators metrics.
+
+    Args:
+      thresholds: Thresholds to compute the rates at. Defaults to [0.1, 0.2,
+        ..., 0.9].
+      name: Metric name.
+    """
+    super(FairnessIndicators, self).__init__(
+        metric_util.merge_per_key_computations(_fairness_indicators_metrics),
+        thresholds=thresholds,
+        name=name)
+
+
+metric_types.register_metric(FairnessIndicators)
+
+
+def _threshold_digits(thresholds: List[float]) -> int:
+  """Returns the number of digits used to display the thresholds in keys."""
+  # At least 2 digits are used for readability, more are used if needed to
+  # differentiate between the thresholds (this matches the post export metric
+  # for thresholds that str() does not write in scientific notation). Digits
+  # are counted in the positional representation so that e.g. 1e-05 uses 5.
+  digits = [2]
+  for t in thresholds:
+    _, _, decimals = np.format_float_positional(t, trim='-').partition('.')
+    digits.append(len(decimals))
+  return max(digits)
+
+
+def _fairness_indicators_metrics(
+    thresholds: Optional[List[float]] = None,
+    name: Text = FAIRNESS_INDICATORS_METRICS_NAME,
+    eval_config: Optional[config.EvalConfig] = None,
+    model_name: Text = '',
+    output_name: Text = '',
+    sub_key: Optional[metric_types.SubKey] = None,
+    class_weights: Optional[Dict[int, float]] = None
+) -> metric_types.MetricComputations:
+  """Returns metric computations for fairness indicators."""
+  thresholds = sorted(set(thresholds or DEFAULT_THRESHOLDS))
+  digits = _threshold_digits(thresholds)
+
+  rate_names = (POSITIVE_RATE_NAME, TRUE_POSITIVE_RATE_NAME,
+                FALSE_POSITIVE_RATE_NAME, NEGATIVE_RATE_NAME,
+                TRUE_NEGATIVE_RATE_NAME, FALSE_NEGATIVE_RATE_NAME)
+  keys = {}
+  for rate_name in rate_names:
+    keys[rate_name] = [
+        metric_types.MetricKey(
+            name='%s/%s@%.*f' % (name, rate_name, digits, t),
+            model_name=model_name,
+            output_name=output_name,
+            sub_key=sub_key) for t in thresholds
+    ]
+
+  # Make sure matrices are calculated. These are derived from the shared
+  # calibration histogram so no additional combiners are needed. The thresholds
+  # are part of the name so that the matrices do not clash with those computed
+  # at other thresholds (e.g. by other instances of this metric).
+  matrices_computations = binary_confusion_matrices.binary_confusion_matrices(
+      name='%s@%s' % (binary_confusion_matrices.BINARY_CONFUSION_MATRICES_NAME,
+                      ','.join('%.*f' % (digits, t) for t in thresholds)),
+      eval_config=eval_config,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key,
+      class_weights=class_weights,
+      thresholds=thresholds)
+  matrices_key = matrices_computations[-1].keys[-1]
+
+  def result(
+      metrics: Dict[metric_types.MetricKey, Any]
+  ) -> Dict[metric_types.MetricKey, float]:
+    """Returns fairness indicators metrics."""
+    matrices = metrics[matrices_key]
+    tp = np.array(matrices.tp, dtype=np.float64)
+    tn = np.array(matrices.tn, dtype=np.float64)
+    fp = np.array(matrices.fp, dtype=np.float64)
+    fn = np.array(matrices.fn, dtype=np.float64)
+    total = tp + tn + fp + fn
+    rates = {
+        POSITIVE_RATE_NAME: math_util.divide_no_nan(tp + fp, total),
+        TRUE_POSITIVE_RATE_NAME: math_util.divide_no_nan(tp, tp + fn),
+        FALSE_POSITIVE_RATE_NAME: math_util.divide_no_nan(fp, fp + tn),
+        NEGATIVE_RATE_NAME: math_util.divide_no_nan(tn + fn, total),
+        TRUE_NEGATIVE_RATE_NAME: math_util.divide_no_nan(tn, tn + fp),
+        FALSE_NEGATIVE_RATE_NAME: math_util.divide_no_nan(fn, fn + tp),
+    }
+    output = {}
+    for rate_name, values in rates.items():
+      for key, value in zip(keys[rate_name], values):
+        output[key] = float(value)
+    return output
+
+  derived_computation = metric_types.DerivedMetricComputation(
+      keys=[k for rate_name in rate_names for k in keys[rate_name]],
+      result=result)
+  computations = matrices_computations
+  computations.append(derived_computation)
+  return computations
@@ -0,0 +1,165 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for fairness indicators metrics."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import apache_beam as beam
+from apache_beam.testing import util
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis.addons.fairness.metrics import fairness_indicators
+from tensorflow_model_analysis.eval_saved_model import testutil
+from tensorflow_model_analysis.evaluators import computation_graph
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+
+
+def _key(name):
+  return metric_types.MetricKey(
+      name='%s/%s' % (fairness_indicators.FAIRNESS_INDICATORS_METRICS_NAME,
+                      name))
+
+
+class FairnessIndicatorsTest(testutil.TensorflowModelAnalysisTest):
+
+  def testFairnessIndicatorsAtThresholds(self):
+    computations = fairness_indicators.FairnessIndicators(
+        thresholds=[0.95, 0.5]).computations()
+    histogram = computations[0]
+    matrices = computations[1]
+    metrics = computations[2]
+
+    examples = []
+    for label, prediction in ((0.0, 0.0), (0.0, 0.6), (1.0, 0.3), (1.0, 0.9),
+                              (0.0, 1.0), (0.0, 0.6)):
+      examples.append({
+          'labels': np.array([label]),
+          'predictions': np.array([prediction]),
+          'example_weights': np.array([1.0]),
+      })
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create(examples)
+          | 'Process' >> beam.Map(metric_util.to_standard_metric_inputs)
+          | 'AddSlice' >> beam.Map(lambda x: ((), x))
+          | 'ComputeHistogram' >> beam.CombinePerKey(histogram.combiner)
+          | 'ComputeMatrices' >> beam.Map(
+              lambda x: (x[0], matrices.result(x[1])))  # pyformat: ignore
+          | 'ComputeMetrics' >> beam.Map(lambda x: (x[0], metrics.result(x[1])))
+      )  # pyformat: ignore
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          got_slice_key, got_metrics = got[0]
+          self.assertEqual(got_slice_key, ())
+          # @0.50: tp = 1, tn = 1, fp = 3, fn = 1
+          # @0.95: tp = 0, tn = 3, fp = 1, fn = 2
+          self.assertDictElementsAlmostEqual(
+              got_metrics, {
+                  _key('positive_rate@0.50'): 4.0 / 6.0,
+                  _key('true_positive_rate@0.50'): 1.0 / 2.0,
+                  _key('false_positive_rate@0.50'): 3.0 / 4.0,
+                  _key('negative_rate@0.50'): 2.0 / 6.0,
+                  _key('true_negative_rate@0.50'): 1.0 / 4.0,
+                  _key('false_negative_rate@0.50'): 1.0 / 2.0,
+                  _key('positive_rate@0.95'): 1.0 / 6.0,
+                  _key('true_positive_rate@0.95'): 0.0,
+                  _key('false_positive_rate@0.95'): 1.0 / 4.0,
+                  _key('negative_rate@0.95'): 5.0 / 6.0,
+                  _key('true_negative_rate@0.95'): 3.0 / 4.0,
+                  _key('false_negative_rate@0.95'): 1.0,
+              },
+              places=5)
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result, label='result')
+
+  def testFairnessIndicatorsWithZeroDenominators(self):
+    computations = fairness_indicators.FairnessIndicators(
+        thresholds=[0.5]).computations()
+    histogram = computations[0]
+    matrices = computations[1]
+    metrics = computations[2]
+
+    example = {
+        'labels': np.array([1.0]),
+        'predictions': np.array([1.0]),
+        'example_weights': np.array([1.0]),
+    }
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create([example])
+          | 'Process' >> beam.Map(metric_util.to_standard_metric_inputs)
+          | 'AddSlice' >> beam.Map(lambda x: ((), x))
+          | 'ComputeHistogram' >> beam.CombinePerKey(histogram.combiner)
+          | 'ComputeMatrices' >> beam.Map(
+              lambda x: (x[0], matrices.result(x[1])))  # pyformat: ignore
+          | 'ComputeMetrics' >> beam.Map(lambda x: (x[0], metrics.result(x[1])))
+      )  # pyformat: ignore
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          _, got_metrics = got[0]
+          self.assertAlmostEqual(
+              got_metrics[_key('true_positive_rate@0.50')], 1.0)
+          # There are no negative examples so the rates with the number of
+          # negatives as denominator are 0.0 (matching the legacy metrics).
+          self.assertEqual(got_metrics[_key('false_positive_rate@0.50')], 0.0)
+          self.assertEqual(got_metrics[_key('true_negative_rate@0.50')], 0.0)
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result, label='result')
+
+  def testFairnessIndicatorsShareCalibrationHistogram(self):
+    computations = (
+        fairness_indicators.FairnessIndicators(
+            thresholds=[0.25, 0.5]).computations() +
+        fairness_indicators.FairnessIndicators(
+            thresholds=[0.75], name='other').computations())
+    metric_computations, derived_computations = computation_graph.build(
+        computations)
+    self.assertLen(metric_computations, 1)
+    # Two sets of confusion matrices plus the two sets of rates.
+    self.assertLen(derived_computations, 4)
+
+  def testThresholdDigits(self):
+    self.assertEqual(
+        fairness_indicators._threshold_digits([0.1, 0.5]), 2)
+    self.assertEqual(
+        fairness_indicators._threshold_digits([0.1, 0.125]), 3)
+    self.assertEqual(
+        fairness_indicators._threshold_digits([1e-05, 2e-05]), 5)
+
+
+if __name__ == '__main__':
+  tf.test.main()
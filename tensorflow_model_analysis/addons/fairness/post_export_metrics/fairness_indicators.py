@@ -24,7 +24,9 @@ from __future__ import division
 from __future__ import print_function
 
 # Standard Imports
+import numpy as np
 import tensorflow as tf
+from tensorflow_model_analysis import math_util
 from tensorflow_model_analysis import types
 from tensorflow_model_analysis.post_export_metrics import metric_keys
 from tensorflow_model_analysis.post_export_metrics import post_export_metrics
@@ -73,6 +75,18 @@ class _FairnessIndicators(post_export_metrics._ConfusionMatrixBasedMetric):
   thresholds_key = metric_keys.FAIRNESS_CONFUSION_MATRIX_THESHOLDS
   matrices_key = metric_keys.FAIRNESS_CONFUSION_MATRIX_MATRICES
 
+  # Rates computed at each threshold as (metric name, confusion matrix value).
+  _RATES = (
+      ('positive_rate', 'positive_rate'),
+      ('true_positive_rate', 'recall'),
+      ('false_positive_rate', 'fpr'),
+      ('negative_rate', 'negative_rate'),
+      ('true_negative_rate', 'tnr'),
+      ('false_negative_rate', 'fnr'),
+  )
+
+  supports_numpy = True
+
   def __init__(self,
                thresholds: Optional[List[float]] = None,
                example_weight_key: Optional[Text] = None,
@@ -137,35 +151,39 @@ class _FairnessIndicators(post_export_metrics._ConfusionMatrixBasedMetric):
                                                 tf.no_op()),
     }
     for i, threshold in enumerate(self._thresholds):
-      output_dict[self._metric_key(
-          metric_keys.base_key(
-              'positive_rate@%.*f' %
-              (self._key_digits, threshold)))] = (values['positive_rate'][i],
-                                                  update_op)
-      output_dict[self._metric_key(
-          metric_keys.base_key(
-              'true_positive_rate@%.*f' %
-              (self._key_digits, threshold)))] = (values['recall'][i],
-                                                  update_op)
-      output_dict[self._metric_key(
-          metric_keys.base_key(
-              'false_positive_rate@%.*f' %
-              (self._key_digits, threshold)))] = (values['fpr'][i], update_op)
-      output_dict[self._metric_key(
-          metric_keys.base_key(
-              'negative_rate@%.*f' %
-              (self._key_digits, threshold)))] = (values['negative_rate'][i],
-                                                  update_op)
-      output_dict[self._metric_key(
-          metric_keys.base_key(
-              'true_negative_rate@%.*f' %
-              (self._key_digits, threshold)))] = (values['tnr'][i], update_op)
-      output_dict[self._metric_key(
-          metric_keys.base_key(
-              'false_negative_rate@%.*f' %
-              (self._key_digits, threshold)))] = (values['fnr'][i], update_op)
+      for name, value_key in self._RATES:
+        output_dict[self._rate_metric_key(name, threshold)] = (
+            values[value_key][i], update_op)
     return output_dict  # pytype: disable=bad-return-type
 
+  def numpy_metric_values(
+      self, metric_variables: List[np.ndarray]) -> Dict[Text, Any]:
+    values = self.numpy_confusion_matrix_values(metric_variables)
+    tp, fp, tn, fn = values['tp'], values['fp'], values['tn'], values['fn']
+    values['tnr'] = math_util.divide_no_nan(tn, tn + fp)
+    values['fpr'] = math_util.divide_no_nan(fp, fp + tn)
+    values['positive_rate'] = math_util.divide_no_nan(
+        tp + fp, tp + fp + tn + fn)
+    values['fnr'] = math_util.divide_no_nan(fn, fn + tp)
+    values['negative_rate'] = math_util.divide_no_nan(
+        tn + fn, tp + fp + tn + fn)
+
+    output_dict = {
+        self._metric_key(self.matrices_key):
+            self.numpy_joined_confusion_matrix(metric_variables),
+        self._metric_key(self.thresholds_key):
+            self._numpy_thresholds,
+    }
+    for i, threshold in enumerate(self._thresholds):
+      for name, value_key in self._RATES:
+        output_dict[self._rate_metric_key(name, threshold)] = (
+            values[value_key][i])
+    return output_dict
+
+  def _rate_metric_key(self, name: Text, threshold: float) -> Text:
+    return self._metric_key(
+        metric_keys.base_key('%s@%.*f' % (name, self._key_digits, threshold)))
+
   def populate_stats_and_pop(
       self, unused_slice_key: slicer.SliceKeyType, combine_metrics: Dict[Text,
                                                                          Any],
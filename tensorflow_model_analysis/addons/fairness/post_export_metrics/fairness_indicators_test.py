@@ -45,6 +45,7 @@ _TEST_SEED = 857586
 class FairnessIndicatorsTest(testutil.TensorflowModelAnalysisTest):
 
   compute_confidence_intervals = False  # Set to True to test uncertainty.
+  compute_post_export_metrics_with_numpy = False
   deterministic_test_seed = _TEST_SEED
 
   def _getEvalExportDir(self):
@@ -73,7 +74,9 @@ class FairnessIndicatorsTest(testutil.TensorflowModelAnalysisTest):
         slicing_specs=slicing_specs)
     eval_shared_model = self.createTestEvalSharedModel(
         eval_saved_model_path=eval_export_dir,
-        add_metrics_callbacks=metrics_callbacks)
+        add_metrics_callbacks=metrics_callbacks,
+        compute_post_export_metrics_with_numpy=(
+            self.compute_post_export_metrics_with_numpy))
     extractors = model_eval_lib.default_extractors(
         eval_config=eval_config, eval_shared_models=[eval_shared_model])
     with beam.Pipeline() as pipeline:
@@ -314,6 +317,10 @@ class FairnessIndicatorsTest(testutil.TensorflowModelAnalysisTest):
         eval_export_dir, [fairness_metrics],
         custom_metrics_check=check_result)
 
+  def testFairnessIndicatorsAtThresholdsWeightedWithNumpy(self):
+    self.compute_post_export_metrics_with_numpy = True
+    self.testFairnessIndicatorsAtThresholdsWeighted()
+
   def testFairnessIndicatorsAtThresholdsWeightedWithUncertainty(self):
     self.compute_confidence_intervals = True
     temp_eval_export_dir = self._getEvalExportDir()
@@ -0,0 +1,294 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""API for computing metrics over in-memory data without running a pipeline.
+
+The metrics are computed in-process using the same computations, combiners and
+derived metrics as the V2 metrics and plots evaluator, so the results match
+those of run_model_analysis for the same EvalConfig. This is intended for
+interactive use and for small datasets (e.g. in notebooks or unit tests) where
+the cost of starting a Beam pipeline dominates the cost of the evaluation.
+All the examples of a slice are added to each combiner with a single
+add_inputs call, so combiners that override add_inputs (e.g. the calibration
+histogram used by the confusion matrix based metrics) process each slice as a
+batch.
+
+Example usage:
+
+  eval_config = tfma.EvalConfig(
+      model_specs=[tfma.ModelSpec()],
+      metrics_specs=tfma.metrics.specs_from_metrics(
+          [tfma.metrics.ExampleCount(), tfma.metrics.AUC()]),
+      slicing_specs=[tfma.SlicingSpec(), tfma.SlicingSpec(feature_keys=['f'])])
+  metrics = tfma.compute_metrics_in_memory(
+      eval_config, labels=labels, predictions=predictions,
+      features={'f': f})
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import collections
+
+from typing import Any, Dict, List, Optional, Text, Union
+
+import numpy as np
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import constants
+from tensorflow_model_analysis import types
+from tensorflow_model_analysis.api import model_eval_lib
+from tensorflow_model_analysis.evaluators import metrics_and_plots_evaluator_v2
+from tensorflow_model_analysis.metrics import metric_specs
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+from tensorflow_model_analysis.slicer import slicer_lib as slicer
+from tensorflow_model_analysis.writers import metrics_and_plots_serialization
+
+# Values for a batch of examples. Dicts are used for multi-model and
+# multi-output labels, predictions and example weights.
+_BatchValuesType = Union[np.ndarray, List[Any], Dict[Text, Any]]
+
+
+def _num_examples(values: _BatchValuesType) -> int:
+  if isinstance(values, dict):
+    if not values:
+      raise ValueError('at least one value must be provided')
+    return _num_examples(next(iter(values.values())))
+  return len(values)
+
+
+def _example_value(values: _BatchValuesType, index: int) -> Any:
+  """Returns the value for the example at the given index of the batch."""
+  if isinstance(values, dict):
+    return {k: _example_value(v, index) for k, v in values.items()}
+  return np.atleast_1d(np.asarray(values[index]))
+
+
+def _to_extracts(
+    labels: _BatchValuesType,
+    predictions: _BatchValuesType,
+    example_weights: Optional[_BatchValuesType],
+    features: Optional[Dict[Text, _BatchValuesType]],
+    slice_spec: List[slicer.SingleSliceSpec]) -> List[types.Extracts]:
+  """Returns the (sliced) extracts for each example."""
+  num_examples = _num_examples(predictions)
+  for name, values in (('labels', labels), ('example_weights', example_weights),
+                       ('features', features)):
+    if values is None or (isinstance(values, dict) and not values):
+      continue
+    if _num_examples(values) != num_examples:
+      raise ValueError(
+          'the number of {} ({}) does not match the number of predictions '
+          '({})'.format(name, _num_examples(values), num_examples))
+  result = []
+  for i in range(num_examples):
+    example_features = {}
+    if features:
+      example_features = _example_value(features, i)
+    extracts = {
+        constants.FEATURES_KEY: example_features,
+        constants.LABELS_KEY: _example_value(labels, i),
+        constants.PREDICTIONS_KEY: _example_value(predictions, i),
+        constants.EXAMPLE_WEIGHTS_KEY: (
+            np.array([1.0]) if example_weights is None else
+            _example_value(example_weights, i)),
+    }
+    extracts[constants.SLICE_KEY_TYPES_KEY] = list(
+        slicer.get_slices_for_features_dict(example_features, slice_spec))
+    result.append(extracts)
+  return result
+
+
+def _group_by_query_key(extracts: List[types.Extracts],
+                        query_key: Text) -> List[List[types.Extracts]]:
+  """Groups extracts by query key (see query_grouping.GroupByQueryKey)."""
+  queries = collections.OrderedDict()
+  for e in extracts:
+    value = metric_util.to_scalar(
+        e[constants.FEATURES_KEY].get(query_key), tensor_name=query_key)
+    key = '' if value is None else '{}'.format(value)
+    queries.setdefault(key, []).append(e)
+  return list(queries.values())
+
+
+def _compute_per_slice(
+    extracts: List[Union[types.Extracts, List[types.Extracts]]],
+    eval_config: config.EvalConfig,
+    metrics_specs: List[config.MetricsSpec],
+    eval_shared_models: Optional[List[types.EvalSharedModel]]
+) -> Dict[slicer.SliceKeyType, Dict[Any, Any]]:
+  """Computes the metrics and plots for each slice.
+
+  Args:
+    extracts: Extracts for each example (or list of extracts for each query).
+    eval_config: Eval config.
+    metrics_specs: Subset of the metric specs to compute metrics for.
+    eval_shared_models: Optional shared model instances.
+
+  Returns:
+    Dict of slice key to dict of metrics and plots.
+  """
+  model_loaders = None
+  if eval_shared_models:
+    model_loaders = {m.model_path: m.model_loader for m in eval_shared_models}
+  return metrics_and_plots_evaluator_v2.compute_per_slice_in_process(
+      extracts,
+      metric_specs.to_computations(
+          metrics_specs, eval_config=eval_config, model_loaders=model_loaders),
+      k_anonymization_count=eval_config.options.k_anonymization_count.value)
+
+
+def compute_metrics_in_memory(
+    eval_config: config.EvalConfig,
+    labels: _BatchValuesType,
+    predictions: _BatchValuesType,
+    example_weights: Optional[_BatchValuesType] = None,
+    features: Optional[Dict[Text, _BatchValuesType]] = None,
+    eval_shared_models: Optional[List[types.EvalSharedModel]] = None
+) -> Dict[slicer.SliceKeyType, Dict[metric_types.MetricKey, Any]]:
+  """Computes the metrics and plots for in-memory labels and predictions.
+
+  The first dimension of each of the values is the batch (i.e. example)
+  dimension. Multi-model and multi-output labels, predictions and example
+  weights are passed as dicts keyed by model name and/or output name (in the
+  same way as they are stored in the extracts).
+
+  Args:
+    eval_config: Eval config. The slicing_specs are applied to the features and
+      the metrics_specs (including those keyed by query_key) are computed.
+    labels: Labels for each example.
+    predictions: Predictions for each example.
+    example_weights: Optional example weights for each example (defaults to 1.0
+      for each example).
+    features: Optional dict of feature name to feature values for each example.
+      The features are used for slicing, for query_keys and by metrics that
+      require features.
+    eval_shared_models: Optional shared model instances. Required if any of the
+      metrics are computed using the model.
+
+  Returns:
+    Dict of slice key to dict of metric and plot keys to values. Slices (other
+    than the overall slice) with fewer examples than the k_anonymization_count
+    contain an error instead of their metrics and plots.
+
+  Raises:
+    ValueError: If bootstrapped confidence intervals are requested or the
+      number of examples differ between the inputs.
+  """
+  if (eval_config.options.compute_confidence_intervals.value and
+      not metric_util.compute_analytic_confidence_intervals(eval_config)):
+    raise ValueError('bootstrapped confidence intervals are not supported when '
+                     'computing metrics in memory (use the ANALYTIC method): '
+                     'eval_config={}'.format(eval_config))
+  slice_spec = [
+      slicer.SingleSliceSpec(spec=spec) for spec in eval_config.slicing_specs
+  ] or [slicer.SingleSliceSpec()]
+  extracts = _to_extracts(labels, predictions, example_weights, features,
+                          slice_spec)
+
+  # Separate metrics based on query_key (which may be None).
+  metrics_specs_by_query_key = collections.OrderedDict()
+  for spec in eval_config.metrics_specs:
+    metrics_specs_by_query_key.setdefault(spec.query_key, []).append(spec)
+
+  result = {}
+  for query_key, metrics_specs in metrics_specs_by_query_key.items():
+    inputs = extracts
+    if query_key:
+      inputs = _group_by_query_key(extracts, query_key)
+    for slice_key, metrics in _compute_per_slice(inputs, eval_config,
+                                                 metrics_specs,
+                                                 eval_shared_models).items():
+      result.setdefault(slice_key, {}).update(metrics)
+  return result
+
+
+def compute_metrics_from_dataframe(
+    eval_config: config.EvalConfig,
+    dataframe: Any,
+    label_column: Text = 'label',
+    prediction_column: Text = 'prediction',
+    example_weight_column: Optional[Text] = None,
+    eval_shared_models: Optional[List[types.EvalSharedModel]] = None
+) -> Dict[slicer.SliceKeyType, Dict[metric_types.MetricKey, Any]]:
+  """Computes the metrics and plots for the rows of a DataFrame.
+
+  Args:
+    eval_config: Eval config.
+    dataframe: pandas DataFrame (or any other mapping of column name to column
+      values) with one row per example.
+    label_column: Name of the column containing the labels.
+    prediction_column: Name of the column containing the predictions.
+    example_weight_column: Optional name of the column containing the example
+      weights.
+    eval_shared_models: Optional shared model instances. Required if any of the
+      metrics are computed using the model.
+
+  Returns:
+    Dict of slice key to dict of metric and plot keys to values (see
+    compute_metrics_in_memory). The columns other than the label, prediction
+    and example weight columns are used as the features.
+  """
+  columns = {k: np.asarray(dataframe[k]) for k in dataframe.keys()}
+  labels = columns.pop(label_column)
+  predictions = columns.pop(prediction_column)
+  example_weights = None
+  if example_weight_column:
+    example_weights = columns.pop(example_weight_column)
+  return compute_metrics_in_memory(
+      eval_config,
+      labels=labels,
+      predictions=predictions,
+      example_weights=example_weights,
+      features=columns,
+      eval_shared_models=eval_shared_models)
+
+
+def to_eval_result(
+    eval_config: config.EvalConfig,
+    metrics_and_plots: Dict[slicer.SliceKeyType, Dict[metric_types.MetricKey,
+                                                      Any]],
+    model_name: Optional[Text] = None) -> model_eval_lib.EvalResult:
+  """Converts in-memory metrics and plots into an EvalResult.
+
+  The EvalResult is the same as the one that load_eval_result returns for the
+  output of run_model_analysis, so it can be rendered using tfma.view.
+
+  Args:
+    eval_config: Eval config the metrics and plots were computed with.
+    metrics_and_plots: Output of compute_metrics_in_memory or
+      compute_metrics_from_dataframe.
+    model_name: The name of the model if multiple models are evaluated together.
+
+  Returns:
+    EvalResult.
+  """
+  serialized_metrics = []
+  serialized_plots = []
+  for sliced_metrics_and_plots in metrics_and_plots.items():
+    serialized_metrics.append(
+        metrics_and_plots_serialization.serialize_metrics(
+            metrics_and_plots_evaluator_v2.filter_by_key_type(
+                sliced_metrics_and_plots, metric_types.MetricKey), None))
+    serialized_plots.append(
+        metrics_and_plots_serialization.serialize_plots(
+            metrics_and_plots_evaluator_v2.filter_by_key_type(
+                sliced_metrics_and_plots, metric_types.PlotKey), None))
+  return model_eval_lib.EvalResult(
+      slicing_metrics=metrics_and_plots_serialization.deserialize_metrics(
+          serialized_metrics, model_name=model_name),
+      plots=metrics_and_plots_serialization.deserialize_plots(serialized_plots),
+      config=eval_config)
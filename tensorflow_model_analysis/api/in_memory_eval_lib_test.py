@@ -0,0 +1,198 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for in-memory evaluation API."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import types
+from tensorflow_model_analysis.api import in_memory_eval_lib
+from tensorflow_model_analysis.eval_saved_model import testutil
+from tensorflow_model_analysis.metrics import calibration
+from tensorflow_model_analysis.metrics import example_count
+from tensorflow_model_analysis.metrics import metric_specs
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import query_statistics
+from tensorflow_model_analysis.metrics import weighted_example_count
+from tensorflow_model_analysis.post_export_metrics import metric_keys
+
+
+def _key(name):
+  return metric_types.MetricKey(name=name)
+
+
+class InMemoryEvalLibTest(testutil.TensorflowModelAnalysisTest):
+
+  def _eval_config(self, slicing_specs=None, options=None, query_key=None):
+    return config.EvalConfig(
+        model_specs=[config.ModelSpec()],
+        metrics_specs=metric_specs.specs_from_metrics(
+            [
+                example_count.ExampleCount(),
+                weighted_example_count.WeightedExampleCount(),
+                calibration.MeanLabel(),
+                calibration.MeanPrediction(),
+            ],
+            query_key=query_key),
+        slicing_specs=slicing_specs,
+        options=options)
+
+  def testComputeMetricsInMemory(self):
+    got = in_memory_eval_lib.compute_metrics_in_memory(
+        self._eval_config(),
+        labels=np.array([0.0, 1.0, 1.0, 0.0]),
+        predictions=np.array([0.2, 0.8, 0.6, 0.4]),
+        example_weights=np.array([1.0, 1.0, 2.0, 4.0]))
+    self.assertEqual(list(got.keys()), [()])
+    self.assertDictElementsAlmostEqual(
+        got[()], {
+            _key(example_count.EXAMPLE_COUNT_NAME): 4.0,
+            _key(weighted_example_count.WEIGHTED_EXAMPLE_COUNT_NAME): 8.0,
+            _key(calibration.MEAN_LABEL_NAME): 3.0 / 8.0,
+            _key(calibration.MEAN_PREDICTION_NAME): 4.4 / 8.0,
+        })
+
+  def testComputeMetricsInMemoryWithSlicing(self):
+    got = in_memory_eval_lib.compute_metrics_in_memory(
+        self._eval_config(slicing_specs=[
+            config.SlicingSpec(),
+            config.SlicingSpec(feature_keys=['language'])
+        ]),
+        labels=np.array([0.0, 1.0, 1.0]),
+        predictions=np.array([0.2, 0.8, 0.6]),
+        features={'language': np.array(['english', 'chinese', 'english'])})
+    self.assertLen(got, 3)
+    self.assertAlmostEqual(got[()][_key(example_count.EXAMPLE_COUNT_NAME)], 3.0)
+    self.assertAlmostEqual(
+        got[(('language', 'english'),)][_key(calibration.MEAN_LABEL_NAME)],
+        0.5)
+    self.assertAlmostEqual(
+        got[(('language', 'chinese'),)][_key(
+            calibration.MEAN_PREDICTION_NAME)], 0.8)
+
+  def testComputeMetricsInMemoryWithKAnonymization(self):
+    options = config.Options()
+    options.k_anonymization_count.value = 2
+    got = in_memory_eval_lib.compute_metrics_in_memory(
+        self._eval_config(
+            slicing_specs=[
+                config.SlicingSpec(),
+                config.SlicingSpec(feature_keys=['language'])
+            ],
+            options=options),
+        labels=np.array([0.0, 1.0, 1.0]),
+        predictions=np.array([0.2, 0.8, 0.6]),
+        features={'language': np.array(['english', 'chinese', 'english'])})
+    self.assertIn(metric_keys.ERROR_METRIC, got[(('language', 'chinese'),)])
+    self.assertNotIn(metric_keys.ERROR_METRIC, got[(('language', 'english'),)])
+    self.assertNotIn(metric_keys.ERROR_METRIC, got[()])
+
+  def testComputeMetricsInMemoryWithQueryKey(self):
+    eval_config = config.EvalConfig(
+        model_specs=[config.ModelSpec()],
+        metrics_specs=metric_specs.specs_from_metrics(
+            [query_statistics.QueryStatistics()], query_key='query_id'))
+    got = in_memory_eval_lib.compute_metrics_in_memory(
+        eval_config,
+        labels=np.array([1.0, 0.0, 1.0, 0.0, 0.0]),
+        predictions=np.array([0.9, 0.1, 0.7, 0.3, 0.2]),
+        features={'query_id': np.array(['a', 'a', 'b', 'b', 'b'])})
+    self.assertDictElementsAlmostEqual(
+        got[()], {
+            _key(query_statistics.TOTAL_QUERIES_NAME): 2.0,
+            _key(query_statistics.TOTAL_DOCUMENTS_NAME): 5.0,
+            _key(query_statistics.MIN_DOCUMENTS_NAME): 2.0,
+            _key(query_statistics.MAX_DOCUMENTS_NAME): 3.0,
+        })
+
+  def testComputeMetricsFromDataframe(self):
+    # Any mapping of column name to column values (e.g. a pandas DataFrame).
+    dataframe = {
+        'label': [0.0, 1.0, 1.0],
+        'prediction': [0.2, 0.8, 0.6],
+        'weight': [1.0, 2.0, 1.0],
+        'language': ['english', 'chinese', 'english'],
+    }
+    got = in_memory_eval_lib.compute_metrics_from_dataframe(
+        self._eval_config(
+            slicing_specs=[config.SlicingSpec(feature_keys=['language'])]),
+        dataframe,
+        example_weight_column='weight')
+    self.assertCountEqual(
+        got.keys(), [(('language', 'english'),), (('language', 'chinese'),)])
+    self.assertAlmostEqual(
+        got[(('language', 'chinese'),)][_key(
+            weighted_example_count.WEIGHTED_EXAMPLE_COUNT_NAME)], 2.0)
+
+  def testComputeMetricsInMemoryRaisesErrorForMismatchedInputs(self):
+    with self.assertRaisesRegexp(ValueError, 'number of labels'):
+      in_memory_eval_lib.compute_metrics_in_memory(
+          self._eval_config(),
+          labels=np.array([0.0, 1.0]),
+          predictions=np.array([0.2, 0.8, 0.6]))
+
+  def testComputeMetricsInMemoryWithAnalyticConfidenceIntervals(self):
+    options = config.Options()
+    options.compute_confidence_intervals.value = True
+    options.confidence_intervals.method = (
+        config.ConfidenceIntervalOptions.ANALYTIC)
+    got = in_memory_eval_lib.compute_metrics_in_memory(
+        self._eval_config(options=options),
+        labels=np.array([0.0, 1.0, 1.0, 0.0]),
+        predictions=np.array([0.2, 0.8, 0.6, 0.4]),
+        example_weights=np.array([1.0, 1.0, 2.0, 4.0]))
+    mean_label = got[()][_key(calibration.MEAN_LABEL_NAME)]
+    self.assertIsInstance(mean_label, types.ValueWithConfidenceInterval)
+    self.assertAlmostEqual(mean_label.value, 3.0 / 8.0)
+    self.assertLess(mean_label.lower_bound, mean_label.value)
+    self.assertGreater(mean_label.upper_bound, mean_label.value)
+    # Metrics without an analytic interval are computed without one.
+    self.assertAlmostEqual(
+        got[()][_key(weighted_example_count.WEIGHTED_EXAMPLE_COUNT_NAME)], 8.0)
+
+  def testComputeMetricsInMemoryRaisesErrorForBootstrap(self):
+    options = config.Options()
+    options.compute_confidence_intervals.value = True
+    with self.assertRaisesRegexp(ValueError, 'bootstrapped confidence'):
+      in_memory_eval_lib.compute_metrics_in_memory(
+          self._eval_config(options=options),
+          labels=np.array([0.0, 1.0]),
+          predictions=np.array([0.2, 0.8]))
+
+  def testToEvalResult(self):
+    eval_config = self._eval_config()
+    eval_result = in_memory_eval_lib.to_eval_result(
+        eval_config,
+        in_memory_eval_lib.compute_metrics_in_memory(
+            eval_config,
+            labels=np.array([0.0, 1.0]),
+            predictions=np.array([0.2, 0.8])))
+    self.assertEqual(eval_result.config, eval_config)
+    self.assertLen(eval_result.slicing_metrics, 1)
+    got_slice_key, got_metrics = eval_result.slicing_metrics[0]
+    self.assertEqual(got_slice_key, ())
+    self.assertAlmostEqual(
+        got_metrics[''][''][example_count.EXAMPLE_COUNT_NAME]['doubleValue'],
+        2.0)
+    self.assertLen(eval_result.plots, 1)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -18,6 +18,8 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
+import datetime
+import multiprocessing
 import os
 import pickle
 import tempfile
@@ -41,6 +43,7 @@ from tensorflow_model_analysis.extractors import input_extractor
 from tensorflow_model_analysis.extractors import predict_extractor
 from tensorflow_model_analysis.extractors import predict_extractor_v2
 from tensorflow_model_analysis.extractors import slice_key_extractor
+from tensorflow_model_analysis.metrics import metric_util
 from tensorflow_model_analysis.post_export_metrics import post_export_metrics
 from tensorflow_model_analysis.proto import config_pb2
 from tensorflow_model_analysis.slicer import slicer_lib as slicer
@@ -215,6 +218,57 @@ def load_eval_result(output_path: Text,
       config=eval_config)
 
 
+def load_windowed_eval_results(output_path: Text,
+                               model_name: Optional[Text] = None) -> EvalResults:
+  """Loads the results of a windowed evaluation as a time series.
+
+  Args:
+    output_path: Output path of the windowed evaluation (see the window_fn
+      argument of ExtractEvaluateAndWriteResults).
+    model_name: The name of the model if multiple models are evaluated together.
+
+  Returns:
+    An EvalResults containing an EvalResult per window sorted by the start of
+    the windows. The input data location in the config of each EvalResult is
+    set to the window's time range so that the windows are labeled in the time
+    series view. The results of windows that are still open reflect the latest
+    pane written (e.g. by early firings).
+  """
+  eval_config = load_eval_config(output_path)
+  output_spec = _get_output_data_spec(eval_config, model_name)
+  metrics_path = output_filename(output_spec, constants.METRICS_KEY)
+  plots_path = output_filename(output_spec, constants.PLOTS_KEY)
+  results = []
+  for start, end in metrics_and_plots_writer.list_windows(metrics_path):
+    window_config = config.EvalConfig()
+    window_config.CopyFrom(eval_config)
+    del window_config.input_data_specs[:]
+    window_config.input_data_specs.add(location='{}..{}'.format(
+        _format_window_time(start), _format_window_time(end)))
+    plots = []
+    window_plots_path = metrics_and_plots_writer.latest_window_output_path(
+        plots_path, start, end)
+    if window_plots_path is not None:
+      plots = metrics_and_plots_serialization.load_and_deserialize_plots(
+          path=window_plots_path)
+    results.append(
+        EvalResult(
+            slicing_metrics=(
+                metrics_and_plots_serialization.load_and_deserialize_metrics(
+                    path=metrics_and_plots_writer.latest_window_output_path(
+                        metrics_path, start, end),
+                    model_name=model_name)),
+            plots=plots,
+            config=window_config))
+  return make_eval_results(results, constants.DATA_CENTRIC_MODE)
+
+
+def _format_window_time(micros: int) -> Text:
+  """Formats window start/end (in microseconds since the epoch) as UTC time."""
+  return (datetime.datetime(1970, 1, 1) +
+          datetime.timedelta(microseconds=micros)).isoformat() + 'Z'
+
+
 def _get_output_data_spec(eval_config: config.EvalConfig,
                           model_name: Text) -> Optional[config.OutputDataSpec]:
   """Returns output data spec with given model name or default."""
@@ -242,7 +296,10 @@ def default_eval_shared_model(
     example_weight_key: Optional[Union[Text, Dict[Text, Text]]] = None,
     additional_fetches: Optional[List[Text]] = None,
     blacklist_feature_fetches: Optional[List[Text]] = None,
-    tags: Optional[List[Text]] = None) -> types.EvalSharedModel:
+    tags: Optional[List[Text]] = None,
+    compute_post_export_metrics_with_numpy: bool = False,
+    warmup_model: bool = False,
+    model_cache_dir: Optional[Text] = None) -> types.EvalSharedModel:
   """Returns default EvalSharedModel.
 
   Args:
@@ -264,6 +321,17 @@ def default_eval_shared_model(
       scenarios where features are large (e.g. images) and can lead to excessive
       memory use if stored.
     tags: Model tags (e.g. 'serve' for serving or 'eval' for EvalSavedModel).
+    compute_post_export_metrics_with_numpy: True to compute the post export
+      metrics that support it (e.g. auc_plots) from the fetched features,
+      predictions and labels using NumPy instead of TF metric ops. This avoids
+      running the metric ops and fetching and setting their metric variables in
+      the TF session, which is much faster for metrics with many thresholds.
+    warmup_model: True to run inference on synthetic inputs after the model is
+      loaded so that the first batch is not slowed down by lazy initialization.
+    model_cache_dir: Optional local directory to copy remote models (e.g. on
+      GCS) into before loading them. Copies are reused by later loads,
+      including loads by other processes (e.g. restarted workers) on the same
+      machine.
   """
   if tags is None:
     tags = [eval_constants.EVAL_TAG]
@@ -291,21 +359,29 @@ def default_eval_shared_model(
         add_metrics_callbacks.append(example_weight_callback)
     # pytype: enable=module-attr
 
+  # Metrics computed using NumPy are not added to the graph.
+  graph_metrics_callbacks = post_export_metrics.graph_metrics_callbacks(
+      add_metrics_callbacks, compute_post_export_metrics_with_numpy)
+
   return types.EvalSharedModel(
       model_path=eval_saved_model_path,
       add_metrics_callbacks=add_metrics_callbacks,
       include_default_metrics=include_default_metrics,
       example_weight_key=example_weight_key,
       additional_fetches=additional_fetches,
+      compute_post_export_metrics_with_numpy=(
+          compute_post_export_metrics_with_numpy),
       model_loader=types.ModelLoader(
           tags=tags,
           construct_fn=model_util.model_construct_fn(
               eval_saved_model_path=eval_saved_model_path,
-              add_metrics_callbacks=add_metrics_callbacks,
+              add_metrics_callbacks=graph_metrics_callbacks,
               include_default_metrics=include_default_metrics,
               additional_fetches=additional_fetches,
               blacklist_feature_fetches=blacklist_feature_fetches,
-              tags=tags)))
+              tags=tags,
+              warmup_model=warmup_model,
+              model_cache_dir=model_cache_dir)))
 
 
 def default_extractors(  # pylint: disable=invalid-name
@@ -387,6 +463,7 @@ def default_evaluators(  # pylint: disable=invalid-name
        eval_constants.EVAL_TAG in eval_shared_models[0].model_loader.tags) and
       (not eval_config or not eval_config.metrics_specs)):
     # Backwards compatibility for previous EvalSavedModel implementation.
+    hot_key_fanout = None
     if eval_config is not None:
       if eval_config.options.HasField('desired_batch_size'):
         desired_batch_size = eval_config.options.desired_batch_size.value
@@ -395,13 +472,16 @@ def default_evaluators(  # pylint: disable=invalid-name
             eval_config.options.compute_confidence_intervals.value)
       if eval_config.options.HasField('k_anonymization_count'):
         k_anonymization_count = eval_config.options.k_anonymization_count.value
+      if eval_config.options.HasField('hot_key_fanout'):
+        hot_key_fanout = eval_config.options.hot_key_fanout.value
     return [
         metrics_and_plots_evaluator.MetricsAndPlotsEvaluator(
             eval_shared_models[0],
             desired_batch_size,
             compute_confidence_intervals=compute_confidence_intervals,
             k_anonymization_count=k_anonymization_count,
-            serialize=serialize)
+            serialize=serialize,
+            hot_key_fanout=hot_key_fanout)
     ]
   else:
     return [
@@ -415,6 +495,8 @@ def default_writers(
     eval_shared_models: Optional[List[types.EvalSharedModel]] = None,
     output_path: Optional[Text] = None,
     eval_config: config.EvalConfig = None,
+    deterministic_output: bool = False,
+    windowed: bool = False
 ) -> List[writer.Writer]:  # pylint: disable=invalid-name
   """Returns the default writers for use in WriteResults.
 
@@ -423,6 +505,10 @@ def default_writers(
     eval_shared_models: Shared models (multi-model evaluation).
     output_path: Deprecated (use EvalConfig).
     eval_config: Eval config.
+    deterministic_output: True to sort the written records so that the output
+      files do not depend on the order the slices were computed in.
+    windowed: True if the evaluation is windowed, in which case the results of
+      each window are written separately (see load_windowed_eval_results).
   """
   # TODO(b/141016373): Add support for multiple models.
   if eval_config is not None:
@@ -439,7 +525,10 @@ def default_writers(
   }
   return [
       metrics_and_plots_writer.MetricsAndPlotsWriter(
-          eval_shared_model=eval_shared_models[0], output_paths=output_paths)
+          eval_shared_model=eval_shared_models[0],
+          output_paths=output_paths,
+          deterministic_output=deterministic_output,
+          windowed=windowed)
   ]
 
 
@@ -605,7 +694,9 @@ def ExtractEvaluateAndWriteResults(  # pylint: disable=invalid-name
     desired_batch_size: Optional[int] = None,
     write_config: Optional[bool] = True,
     compute_confidence_intervals: Optional[bool] = False,
-    k_anonymization_count: int = 1) -> beam.pvalue.PDone:
+    k_anonymization_count: int = 1,
+    window_fn: Optional[beam.transforms.window.WindowFn] = None,
+    early_results_delay: Optional[float] = None) -> beam.pvalue.PDone:
   """PTransform for performing extraction, evaluation, and writing results.
 
   Users who want to construct their own Beam pipelines instead of using the
@@ -636,6 +727,24 @@ def ExtractEvaluateAndWriteResults(  # pylint: disable=invalid-name
   and subject to change. Users should only use the TFMA functions to write and
   read the results.
 
+  Unbounded sources (e.g. Pub/Sub) can be evaluated continuously by setting a
+  window_fn. The metrics and plots are then computed per window and slice using
+  the examples' event timestamps and the results of each window are written as
+  soon as the watermark passes the end of the window (and every
+  early_results_delay seconds before that if set):
+
+    with beam.Pipeline(options=streaming_options) as p:
+      _ = (p
+           | 'ReadData' >> beam.io.ReadFromPubSub(subscription=...)
+           | 'ExtractEvaluateAndWriteResults' >>
+           tfma.ExtractEvaluateAndWriteResults(
+               eval_config=eval_config,
+               eval_shared_models=[eval_shared_model],
+               window_fn=beam.window.FixedWindows(60 * 60),
+               early_results_delay=60))
+    results = tfma.load_windowed_eval_results(output_path)
+    tfma.view.render_time_series(results)
+
   Args:
     examples: PCollection of input examples. Can be any format the model accepts
       (e.g. string containing CSV row, TensorFlow.Example, etc).
@@ -659,9 +768,19 @@ def ExtractEvaluateAndWriteResults(  # pylint: disable=invalid-name
     write_config: Deprecated (use EvalConfig).
     compute_confidence_intervals: Deprecated (use EvalConfig).
     k_anonymization_count: Deprecated (use EvalConfig).
+    window_fn: Optional window function (e.g. beam.window.FixedWindows or
+      beam.window.SlidingWindows) to compute the metrics and plots per window.
+      Only supported by the metrics and plots evaluator for EvalConfigs with
+      metrics_specs. Data arriving after the watermark has passed the end of
+      its window is dropped.
+    early_results_delay: Optional delay (in seconds of processing time) after
+      which early results are written for windows that are still open. Each
+      early result replaces the previous result for the window. Not supported
+      with query_key based metrics or confidence intervals.
 
   Raises:
-    ValueError: If matching Extractor not found for an Evaluator.
+    ValueError: If matching Extractor not found for an Evaluator or if the
+      windowing is not supported by the EvalConfig.
 
   Returns:
     PDone.
@@ -706,6 +825,20 @@ def ExtractEvaluateAndWriteResults(  # pylint: disable=invalid-name
         slicing_specs=slicing_specs,
         options=options)
 
+  if window_fn is not None:
+    _validate_windowing(eval_config, early_results_delay)
+    trigger = beam.transforms.trigger.AfterWatermark()
+    if early_results_delay:
+      trigger = beam.transforms.trigger.AfterWatermark(
+          early=beam.transforms.trigger.AfterProcessingTime(
+              early_results_delay))
+    # The panes accumulate so that each firing outputs the results for all the
+    # examples seen in the window so far.
+    examples = examples | 'WindowInto' >> beam.WindowInto(
+        window_fn,
+        trigger=trigger,
+        accumulation_mode=beam.transforms.trigger.AccumulationMode.ACCUMULATING)
+
   if not extractors:
     extractors = default_extractors(
         eval_config=eval_config,
@@ -721,7 +854,9 @@ def ExtractEvaluateAndWriteResults(  # pylint: disable=invalid-name
 
   if not writers:
     writers = default_writers(
-        eval_config=eval_config, eval_shared_models=eval_shared_models)
+        eval_config=eval_config,
+        eval_shared_models=eval_shared_models,
+        windowed=window_fn is not None)
 
   # pylint: disable=no-value-for-parameter
   _ = (
@@ -739,6 +874,59 @@ def ExtractEvaluateAndWriteResults(  # pylint: disable=invalid-name
   return beam.pvalue.PDone(examples.pipeline)
 
 
+def _validate_windowing(eval_config: config.EvalConfig,
+                        early_results_delay: Optional[float]):
+  """Raises ValueError if windowing is not supported by the eval config."""
+  if not eval_config.metrics_specs:
+    raise ValueError(
+        'windowed evaluation requires an EvalConfig with metrics_specs: '
+        'eval_config={}'.format(eval_config))
+  if early_results_delay:
+    # Stages that combine the outputs of earlier combiners (e.g. grouping by
+    # query key and merging bootstrap samples) would combine the results of
+    # every early firing. Analytic confidence intervals are computed by the
+    # combiners themselves.
+    if (eval_config.options.compute_confidence_intervals.value and
+        not metric_util.compute_analytic_confidence_intervals(eval_config)):
+      raise ValueError(
+          'early_results_delay is not supported with bootstrapped confidence '
+          'intervals: eval_config={}'.format(eval_config))
+    if any(spec.query_key for spec in eval_config.metrics_specs):
+      raise ValueError(
+          'early_results_delay is not supported with query_key based metrics: '
+          'eval_config={}'.format(eval_config))
+
+
+def _local_pipeline_options(
+    pipeline_options: Optional[beam.options.pipeline_options.PipelineOptions],
+    num_workers: int) -> beam.options.pipeline_options.PipelineOptions:
+  """Returns pipeline options for running the DirectRunner in processes.
+
+  Args:
+    pipeline_options: Optional pipeline options to update.
+    num_workers: Number of processes (0 to use one process per CPU).
+
+  Raises:
+    ValueError: If the pipeline options are for a runner other than the
+      DirectRunner.
+  """
+  if pipeline_options is None:
+    pipeline_options = beam.options.pipeline_options.PipelineOptions()
+  runner = pipeline_options.view_as(
+      beam.options.pipeline_options.StandardOptions).runner
+  if runner not in (None, 'DirectRunner', 'direct'):
+    raise ValueError(
+        'num_local_workers can only be used with the DirectRunner: '
+        'runner={}'.format(runner))
+  direct_options = pipeline_options.view_as(
+      beam.options.pipeline_options.DirectOptions)
+  direct_options.direct_num_workers = num_workers or multiprocessing.cpu_count()
+  # Older versions of Beam only support running the workers in threads.
+  if hasattr(direct_options, 'direct_running_mode'):
+    direct_options.direct_running_mode = 'multi_processing'
+  return pipeline_options
+
+
 def run_model_analysis(
     eval_shared_model: Optional[types.EvalSharedModel] = None,
     eval_shared_models: Optional[List[types.EvalSharedModel]] = None,
@@ -754,7 +942,8 @@ def run_model_analysis(
     write_config: Optional[bool] = True,
     desired_batch_size: Optional[int] = None,
     compute_confidence_intervals: Optional[bool] = False,
-    k_anonymization_count: int = 1) -> EvalResult:
+    k_anonymization_count: int = 1,
+    num_local_workers: Optional[int] = None) -> EvalResult:
   """Runs TensorFlow model analysis.
 
   It runs a Beam pipeline to compute the slicing metrics exported in TensorFlow
@@ -788,15 +977,29 @@ def run_model_analysis(
     desired_batch_size: Deprecated (use EvalConfig).
     compute_confidence_intervals: Deprecated (use EvalConfig).
     k_anonymization_count: Deprecated (use EvalConfig).
+    num_local_workers: Optional number of processes to run the pipeline in
+      locally (0 to use one process per CPU). The input files are split between
+      the processes, each of which loads its own copy of the model(s), and the
+      metrics accumulators computed by each process are merged at the end. The
+      metrics and plots records are then written sorted, so the same records
+      are written in the same order for any number of workers. The metric
+      values may differ by floating point rounding between worker counts since
+      the order the accumulators are merged in is not fixed. Can only be used
+      with the DirectRunner (the default runner).
 
   Returns:
     An EvalResult that can be used with the TFMA visualization functions.
 
   Raises:
-    ValueError: If the file_format is unknown to us.
+    ValueError: If the file_format is unknown to us or num_local_workers is set
+      for a runner other than the DirectRunner.
   """
   _assert_tensorflow_version()
 
+  if num_local_workers is not None:
+    pipeline_options = _local_pipeline_options(pipeline_options,
+                                               num_local_workers)
+
   if eval_shared_model is not None:
     eval_shared_models = [eval_shared_model]
 
@@ -850,6 +1053,15 @@ def run_model_analysis(
     raise NotImplementedError(
         'multiple output_data_specs are not yet supported.')
 
+  if not writers:
+    # When running in multiple local workers the output should not depend on
+    # the number of workers. Sorting the records collects them on a single
+    # worker, so it is only done in that case.
+    writers = default_writers(
+        eval_config=eval_config,
+        eval_shared_models=eval_shared_models,
+        deterministic_output=num_local_workers is not None)
+
   with beam.Pipeline(options=pipeline_options) as p:
     if (not eval_config.input_data_specs[0].file_format or
         eval_config.input_data_specs[0].file_format == 'tfrecords'):
@@ -23,6 +23,9 @@ import tempfile
 
 # Standard Imports
 
+from absl.testing import parameterized
+import apache_beam as beam
+from apache_beam.testing import test_stream
 import tensorflow as tf
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis import constants
@@ -41,6 +44,7 @@ from tensorflow_model_analysis.evaluators.query_metrics import query_statistics
 from tensorflow_model_analysis.extractors import feature_extractor
 from tensorflow_model_analysis.extractors import predict_extractor
 from tensorflow_model_analysis.extractors import slice_key_extractor
+from tensorflow_model_analysis.metrics import example_count
 from tensorflow_model_analysis.metrics import metric_specs
 from tensorflow_model_analysis.metrics import ndcg
 from tensorflow_model_analysis.post_export_metrics import metric_keys
@@ -58,11 +62,13 @@ LegacyConfig = NamedTuple(
      ('compute_confidence_intervals', bool), ('k_anonymization_count', int)])
 
 
-class EvaluateTest(testutil.TensorflowModelAnalysisTest):
+class EvaluateTest(testutil.TensorflowModelAnalysisTest,
+                   parameterized.TestCase):
 
   def setUp(self):
     super(EvaluateTest, self).setUp()
     self.longMessage = True  # pylint: disable=invalid-name
+    self.num_local_workers = None
 
   def _getTempDir(self):
     return tempfile.mkdtemp()
@@ -98,6 +104,16 @@ class EvaluateTest(testutil.TensorflowModelAnalysisTest):
       # Only pass if expected_value also evaluates to False.
       self.assertFalse(expected_value, msg='Actual value was empty.')
 
+  def assertNestedAllClose(self, got, expected):
+    if isinstance(expected, dict):
+      self.assertCountEqual(got.keys(), expected.keys())
+      for key in expected:
+        self.assertNestedAllClose(got[key], expected[key])
+    elif isinstance(expected, (int, float)):
+      self.assertAllClose(got, expected)
+    else:
+      self.assertEqual(got, expected)
+
   def assertSliceMetricsEqual(self, expected_metrics, got_metrics):
     self.assertItemsEqual(
         list(expected_metrics.keys()),
@@ -272,7 +288,8 @@ class EvaluateTest(testutil.TensorflowModelAnalysisTest):
         eval_shared_models=[
             model_eval_lib.default_eval_shared_model(
                 eval_saved_model_path=model_location, example_weight_key='age')
-        ])
+        ],
+        num_local_workers=self.num_local_workers)
     # We only check some of the metrics to ensure that the end-to-end
     # pipeline works.
     expected = {
@@ -322,6 +339,127 @@ class EvaluateTest(testutil.TensorflowModelAnalysisTest):
     self.assertMetricsAlmostEqual(eval_result.slicing_metrics, expected)
     self.assertFalse(eval_result.plots)
 
+  def testRunModelAnalysisWithLocalWorkers(self):
+    self.num_local_workers = 2
+    self.testRunModelAnalysis()
+
+  @parameterized.named_parameters(('OneWorker', 1), ('TwoWorkers', 2))
+  def testRunModelAnalysisIsDeterministic(self, num_local_workers):
+    model_location = self._exportEvalSavedModel(
+        linear_classifier.simple_linear_classifier)
+    examples = [
+        self._makeExample(age=float(i), language=language, label=float(i % 2))
+        for i in range(10)
+        for language in ('english', 'chinese', 'hindi')
+    ]
+    data_location = self._writeTFExamplesToTFRecords(examples)
+    results = []
+    # Every run sets num_local_workers, which writes the records sorted.
+    for workers in (1, num_local_workers, num_local_workers):
+      output_path = self._getTempDir()
+      model_eval_lib.run_model_analysis(
+          eval_shared_model=model_eval_lib.default_eval_shared_model(
+              eval_saved_model_path=model_location),
+          data_location=data_location,
+          slice_spec=[slicer.SingleSliceSpec(columns=['language'])],
+          output_path=output_path,
+          num_local_workers=workers)
+      results.append(model_eval_lib.load_eval_result(output_path))
+    for result in results[1:]:
+      # The records are written in the same order for any number of workers,
+      # but the metric values may differ in the last bits since the order the
+      # accumulators are merged in depends on the workers.
+      self.assertEqual([slice_key for slice_key, _ in result.slicing_metrics],
+                       [slice_key for slice_key, _ in
+                        results[0].slicing_metrics])
+      for (_, got), (_, expected) in zip(result.slicing_metrics,
+                                         results[0].slicing_metrics):
+        self.assertNestedAllClose(got, expected)
+
+  def testLocalPipelineOptions(self):
+    options = model_eval_lib._local_pipeline_options(None, 4)
+    self.assertEqual(
+        options.view_as(
+            beam.options.pipeline_options.DirectOptions).direct_num_workers, 4)
+    with self.assertRaisesRegexp(ValueError, 'DirectRunner'):
+      model_eval_lib._local_pipeline_options(
+          beam.options.pipeline_options.PipelineOptions(
+              runner='DataflowRunner'), 4)
+
+  def testExtractEvaluateAndWriteResultsWithWindows(self):
+    model_location = self._exportEvalSavedModel(
+        linear_classifier.simple_linear_classifier)
+    output_path = self._getTempDir()
+    eval_config = config.EvalConfig(
+        model_specs=[config.ModelSpec(location=model_location)],
+        output_data_specs=[
+            config.OutputDataSpec(default_location=output_path)
+        ],
+        metrics_specs=metric_specs.specs_from_metrics(
+            [example_count.ExampleCount()]))
+    timestamps = [0, 10, 20, 70, 80]
+    examples = [
+        beam.window.TimestampedValue(
+            self._makeExample(age=float(i), language='english',
+                              label=float(i % 2)).SerializeToString(), t)
+        for i, t in enumerate(timestamps)
+    ]
+    stream = (
+        test_stream.TestStream().advance_watermark_to(0).add_elements(
+            examples).advance_watermark_to_infinity())
+    options = beam.options.pipeline_options.PipelineOptions()
+    options.view_as(
+        beam.options.pipeline_options.StandardOptions).streaming = True
+    with beam.Pipeline(options=options) as pipeline:
+      # pylint: disable=no-value-for-parameter
+      _ = (
+          pipeline
+          | 'ReadData' >> stream
+          | 'ExtractEvaluateAndWriteResults' >>
+          model_eval_lib.ExtractEvaluateAndWriteResults(
+              eval_config=eval_config,
+              eval_shared_model=model_eval_lib.default_eval_shared_model(
+                  eval_saved_model_path=model_location),
+              window_fn=beam.window.FixedWindows(60)))
+      # pylint: enable=no-value-for-parameter
+
+    eval_results = model_eval_lib.load_windowed_eval_results(output_path)
+    self.assertEqual(eval_results.get_mode(), constants.DATA_CENTRIC_MODE)
+    results = eval_results.get_results()
+    self.assertLen(results, 2)
+    self.assertEqual([r.config.input_data_specs[0].location for r in results],
+                     [
+                         '1970-01-01T00:00:00Z..1970-01-01T00:01:00Z',
+                         '1970-01-01T00:01:00Z..1970-01-01T00:02:00Z'
+                     ])
+    for result, expected_count in zip(results, [3.0, 2.0]):
+      self.assertLen(result.slicing_metrics, 1)
+      got_slice_key, got_metrics = result.slicing_metrics[0]
+      self.assertEqual(got_slice_key, ())
+      self.assertAlmostEqual(
+          got_metrics[''][''][example_count.EXAMPLE_COUNT_NAME]['doubleValue'],
+          expected_count)
+
+  def testValidateWindowing(self):
+    with self.assertRaisesRegexp(ValueError, 'metrics_specs'):
+      model_eval_lib._validate_windowing(config.EvalConfig(), None)
+    eval_config = config.EvalConfig(
+        metrics_specs=metric_specs.specs_from_metrics(
+            [example_count.ExampleCount()], query_key='query_id'))
+    # Results are only written once per window without early results.
+    model_eval_lib._validate_windowing(eval_config, None)
+    with self.assertRaisesRegexp(ValueError, 'query_key'):
+      model_eval_lib._validate_windowing(eval_config, 60)
+    eval_config = config.EvalConfig(
+        metrics_specs=metric_specs.specs_from_metrics(
+            [example_count.ExampleCount()]))
+    eval_config.options.compute_confidence_intervals.value = True
+    with self.assertRaisesRegexp(ValueError, 'confidence intervals'):
+      model_eval_lib._validate_windowing(eval_config, 60)
+    eval_config.options.confidence_intervals.method = (
+        config.ConfidenceIntervalOptions.ANALYTIC)
+    model_eval_lib._validate_windowing(eval_config, 60)
+
   def testRunModelAnalysisWithKerasModel(self):
     input_layer = tf.keras.layers.Input(shape=(28 * 28,), name='data')
     output_layer = tf.keras.layers.Dense(
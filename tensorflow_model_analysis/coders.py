@@ -0,0 +1,350 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Beam coders for the values that TFMA shuffles between workers.
+
+By default Beam encodes accumulators and other values that are not primitives
+by pickling them. The coders here encode NumPy arrays as raw bytes and the
+nested containers holding them natively, which is both smaller and faster to
+encode and decode than pickling.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import pickle
+import sys
+
+from typing import Any, Iterable, List, Optional, Text, Type
+
+import apache_beam as beam
+from apache_beam.coders import coder_impl
+import numpy as np
+from tensorflow_model_analysis import constants
+
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_FLOAT = 4
+_TEXT = 5
+_BYTES = 6
+_LIST = 7
+_TUPLE = 8
+_DICT = 9
+_ARRAY = 10
+_OBJECT_ARRAY = 11
+_SCALAR = 12
+_VOCABULARY_TEXT = 13
+_PICKLED = 14
+
+_MIN_INT64 = -(1 << 63)
+_MAX_INT64 = (1 << 63) - 1
+
+# Keys used by the standard extracts.
+_EXTRACTS_KEYS = (constants.INPUT_KEY, constants.FEATURES_KEY,
+                  constants.LABELS_KEY, constants.PREDICTIONS_KEY,
+                  constants.EXAMPLE_WEIGHTS_KEY, constants.SLICE_KEY_TYPES_KEY,
+                  constants.SLICE_KEYS_KEY, constants.ATTRIBUTIONS_KEY,
+                  constants.FEATURES_PREDICTIONS_LABELS_KEY,
+                  constants.BASELINE_SCORE_KEY, constants.EXAMPLE_SCORE_KEY)
+
+
+def _write_array(out: Any, value: np.ndarray):
+  out.write(value.dtype.str.encode('ascii'), True)
+  out.write_var_int64(value.ndim)
+  for dim in value.shape:
+    out.write_var_int64(dim)
+  out.write(np.ascontiguousarray(value).tobytes(), True)
+
+
+def _read_array(stream: Any) -> np.ndarray:
+  dtype = np.dtype(stream.read_all(True).decode('ascii'))
+  shape = tuple(stream.read_var_int64() for _ in range(stream.read_var_int64()))
+  # Copied so that the array is writable.
+  return np.frombuffer(stream.read_all(True), dtype=dtype).reshape(shape).copy()
+
+
+class ValueCoder(beam.coders.Coder):
+  """Coder for (nested) values containing NumPy arrays.
+
+  None, bools, ints, floats, text, bytes, lists, tuples, dicts, NumPy arrays
+  and NumPy scalars are encoded natively (NumPy arrays as their raw bytes).
+  Values of other types (including subclasses of the above such as
+  NamedTuples) are pickled.
+  """
+
+  def __init__(self, vocabulary: Optional[Iterable[Text]] = None):
+    """Initializes coder.
+
+    Args:
+      vocabulary: Optional strings (e.g. dict keys) that are expected to occur
+        frequently. These are encoded using their index in the vocabulary.
+    """
+    self._vocabulary = tuple(vocabulary or ())
+    self._vocabulary_index = {v: i for i, v in enumerate(self._vocabulary)}
+
+  def encode(self, value: Any) -> bytes:
+    out = coder_impl.create_OutputStream()
+    self._write_value(value, out)
+    return out.get()
+
+  def decode(self, encoded: bytes) -> Any:
+    return self._read_value(coder_impl.create_InputStream(encoded))
+
+  def _write_value(self, value: Any, out: Any):
+    """Writes value to output stream."""
+    # Exact types are checked so that subclasses (e.g. NamedTuples) are pickled.
+    # pylint: disable=unidiomatic-typecheck
+    if value is None:
+      out.write_byte(_NONE)
+    elif value is True:
+      out.write_byte(_TRUE)
+    elif value is False:
+      out.write_byte(_FALSE)
+    elif type(value) is int and _MIN_INT64 <= value <= _MAX_INT64:
+      out.write_byte(_INT)
+      out.write_var_int64(value)
+    elif type(value) is float:
+      out.write_byte(_FLOAT)
+      out.write_bigendian_double(value)
+    elif type(value) is Text:
+      index = self._vocabulary_index.get(value)
+      if index is None:
+        out.write_byte(_TEXT)
+        out.write(value.encode('utf-8'), True)
+      else:
+        out.write_byte(_VOCABULARY_TEXT)
+        out.write_var_int64(index)
+    elif type(value) is bytes:
+      out.write_byte(_BYTES)
+      out.write(value, True)
+    elif type(value) in (list, tuple):
+      out.write_byte(_LIST if type(value) is list else _TUPLE)
+      out.write_var_int64(len(value))
+      for v in value:
+        self._write_value(v, out)
+    elif type(value) is dict:
+      out.write_byte(_DICT)
+      out.write_var_int64(len(value))
+      for k, v in value.items():
+        self._write_value(k, out)
+        self._write_value(v, out)
+    elif type(value) is np.ndarray:
+      if value.dtype.hasobject:
+        out.write_byte(_OBJECT_ARRAY)
+        out.write_var_int64(value.ndim)
+        for dim in value.shape:
+          out.write_var_int64(dim)
+        for v in value.ravel():
+          self._write_value(v, out)
+      else:
+        out.write_byte(_ARRAY)
+        _write_array(out, value)
+    elif isinstance(value, np.generic) and not value.dtype.hasobject:
+      out.write_byte(_SCALAR)
+      _write_array(out, np.asarray(value))
+    else:
+      out.write_byte(_PICKLED)
+      out.write(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), True)
+    # pylint: enable=unidiomatic-typecheck
+
+  def _read_value(self, stream: Any) -> Any:
+    """Reads value from input stream."""
+    tag = stream.read_byte()
+    if tag == _NONE:
+      return None
+    elif tag == _TRUE:
+      return True
+    elif tag == _FALSE:
+      return False
+    elif tag == _INT:
+      return stream.read_var_int64()
+    elif tag == _FLOAT:
+      return stream.read_bigendian_double()
+    elif tag == _TEXT:
+      return stream.read_all(True).decode('utf-8')
+    elif tag == _VOCABULARY_TEXT:
+      return self._vocabulary[stream.read_var_int64()]
+    elif tag == _BYTES:
+      return stream.read_all(True)
+    elif tag == _LIST:
+      return [self._read_value(stream) for _ in range(stream.read_var_int64())]
+    elif tag == _TUPLE:
+      return tuple(
+          self._read_value(stream) for _ in range(stream.read_var_int64()))
+    elif tag == _DICT:
+      result = {}
+      for _ in range(stream.read_var_int64()):
+        k = self._read_value(stream)
+        result[k] = self._read_value(stream)
+      return result
+    elif tag == _ARRAY:
+      return _read_array(stream)
+    elif tag == _OBJECT_ARRAY:
+      shape = tuple(
+          stream.read_var_int64() for _ in range(stream.read_var_int64()))
+      result = np.empty(shape, dtype=object)
+      flat = result.reshape(-1)
+      for i in range(flat.size):
+        flat[i] = self._read_value(stream)
+      return result
+    elif tag == _SCALAR:
+      return _read_array(stream)[()]
+    elif tag == _PICKLED:
+      return pickle.loads(stream.read_all(True))
+    raise ValueError('unknown tag {} found while decoding value'.format(tag))
+
+  def is_deterministic(self) -> bool:
+    return False
+
+
+class ExtractsCoder(ValueCoder):
+  """Coder for extracts.
+
+  The keys of the standard extracts and of the given features are encoded using
+  their index in a vocabulary and the (NumPy) values are encoded by ValueCoder.
+  """
+
+  def __init__(self, feature_keys: Optional[Iterable[Text]] = None):
+    """Initializes coder.
+
+    Args:
+      feature_keys: Optional keys of the features that the extracts contain.
+    """
+    super(ExtractsCoder, self).__init__(
+        vocabulary=_EXTRACTS_KEYS + tuple(sorted(feature_keys or ())))
+
+
+def _slot_names(cls: Type[Any]) -> List[Text]:
+  names = []
+  for c in reversed(cls.__mro__):
+    slots = c.__dict__.get('__slots__', ())
+    names.extend([slots] if isinstance(slots, Text) else slots)
+  return names
+
+
+def _defines(cls: Type[Any], name: Text) -> bool:
+  return any(name in c.__dict__ for c in cls.__mro__ if c is not object)
+
+
+class AccumulatorCoder(beam.coders.Coder):
+  """Coder for accumulator classes that use __slots__.
+
+  The accumulator state (the result of __getstate__ if the class defines it,
+  otherwise the values of its slots) is encoded using a ValueCoder. This avoids
+  pickling the accumulator class along with each accumulator and encodes the
+  NumPy arrays that accumulators typically hold as raw bytes.
+  """
+
+  def __init__(self,
+               accumulator_class: Type[Any],
+               value_coder: Optional[ValueCoder] = None):
+    """Initializes coder.
+
+    Args:
+      accumulator_class: Class of the accumulators to encode.
+      value_coder: Coder for the state of the accumulators. Defaults to
+        ValueCoder.
+    """
+    self._accumulator_class = accumulator_class
+    self._value_coder = value_coder or ValueCoder()
+    self._slots = _slot_names(accumulator_class)
+    self._uses_state = _defines(accumulator_class, '__getstate__')
+
+  def encode(self, value: Any) -> bytes:
+    if self._uses_state:
+      state = value.__getstate__()
+    else:
+      state = tuple(getattr(value, slot) for slot in self._slots)
+    return self._value_coder.encode(state)
+
+  def decode(self, encoded: bytes) -> Any:
+    state = self._value_coder.decode(encoded)
+    result = self._accumulator_class.__new__(self._accumulator_class)
+    if self._uses_state:
+      result.__setstate__(state)
+    else:
+      for slot, value in zip(self._slots, state):
+        setattr(result, slot, value)
+    return result
+
+  def is_deterministic(self) -> bool:
+    return False
+
+
+class SliceKeyTypeHint(object):
+  """Type hint for PCollections keyed by slice (slicer.SliceKeyType).
+
+  Slice keys are plain tuples, this class is only used as a type hint so that
+  SliceKeyCoder is used to encode them (e.g. when grouping by slice).
+  """
+
+
+class SliceKeyCoder(beam.coders.Coder):
+  """Deterministic coder for slice keys.
+
+  Slice keys are tuples of (column, value) where the values are text, bytes,
+  ints or floats. The column names are interned when decoded since the same few
+  columns are shared by all the slice keys.
+  """
+
+  def encode(self, value: Any) -> bytes:
+    out = coder_impl.create_OutputStream()
+    out.write_var_int64(len(value))
+    for column, column_value in value:
+      out.write(column.encode('utf-8'), True)
+      if isinstance(column_value, np.generic):
+        column_value = column_value.item()
+      if isinstance(column_value, Text):
+        out.write_byte(_TEXT)
+        out.write(column_value.encode('utf-8'), True)
+      elif isinstance(column_value, bytes):
+        out.write_byte(_BYTES)
+        out.write(column_value, True)
+      elif isinstance(column_value, float):
+        out.write_byte(_FLOAT)
+        out.write_bigendian_double(column_value)
+      elif isinstance(column_value, int):
+        out.write_byte(_INT)
+        out.write_var_int64(column_value)
+      else:
+        raise TypeError('unsupported slice value {} for column {}'.format(
+            column_value, column))
+    return out.get()
+
+  def decode(self, encoded: bytes) -> Any:
+    stream = coder_impl.create_InputStream(encoded)
+    result = []
+    for _ in range(stream.read_var_int64()):
+      column = sys.intern(stream.read_all(True).decode('utf-8'))
+      tag = stream.read_byte()
+      if tag == _TEXT:
+        column_value = stream.read_all(True).decode('utf-8')
+      elif tag == _BYTES:
+        column_value = stream.read_all(True)
+      elif tag == _FLOAT:
+        column_value = stream.read_bigendian_double()
+      else:
+        column_value = stream.read_var_int64()
+      result.append((column, column_value))
+    return tuple(result)
+
+  def is_deterministic(self) -> bool:
+    return True
+
+
+beam.coders.registry.register_coder(SliceKeyTypeHint, SliceKeyCoder)
@@ -0,0 +1,132 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for coders."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import pickle
+
+import apache_beam as beam
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis import coders
+from tensorflow_model_analysis import constants
+from tensorflow_model_analysis.metrics import metric_types
+
+
+class _Accumulator(object):
+  __slots__ = ['matrices', 'counts', 'num_examples']
+
+
+class _BufferedAccumulator(object):
+  __slots__ = ['buffer', 'count']
+
+  def __getstate__(self):
+    return (self.buffer[:self.count],)
+
+  def __setstate__(self, state):
+    self.buffer, = state
+    self.count = len(self.buffer)
+
+
+class CodersTest(tf.test.TestCase):
+
+  def testValueCoder(self):
+    coder = coders.ValueCoder()
+    for value in (None, True, False, 0, -3, 2**70, 1.5, u'text', b'bytes',
+                  [1, (2.0, u'a')], {
+                      u'a': [1],
+                      (1, 2): None
+                  }, np.float32(0.5), np.int64(7),
+                  metric_types.MetricKey(name='metric')):
+      decoded = coder.decode(coder.encode(value))
+      self.assertEqual(decoded, value)
+      self.assertIs(type(decoded), type(value))
+
+    for value in (np.array([[1.0, 2.0], [3.0, 4.0]], dtype=np.float32),
+                  np.array([], dtype=np.int64), np.array([b'a', None],
+                                                          dtype=object)):
+      decoded = coder.decode(coder.encode(value))
+      self.assertEqual(decoded.dtype, value.dtype)
+      self.assertEqual(decoded.shape, value.shape)
+      self.assertEqual(decoded.tolist(), value.tolist())
+      # Decoded arrays are writable so that accumulators can update them.
+      self.assertTrue(decoded.flags.writeable)
+
+  def testExtractsCoder(self):
+    extracts = {
+        constants.LABELS_KEY: np.array([1.0]),
+        constants.PREDICTIONS_KEY: np.array([0.3, 0.7]),
+        constants.EXAMPLE_WEIGHTS_KEY: np.array([1.0]),
+        constants.SLICE_KEY_TYPES_KEY: [(), (('gender', 'f'),)],
+        constants.FEATURES_KEY: {
+            'query': np.array([b'query1'], dtype=object),
+            'gain': np.array([0.5])
+        }
+    }
+    coder = coders.ExtractsCoder(feature_keys=['query', 'gain'])
+    encoded = coder.encode(extracts)
+    self.assertLess(len(encoded), len(pickle.dumps(extracts)))
+    decoded = coder.decode(encoded)
+    self.assertCountEqual(decoded.keys(), extracts.keys())
+    self.assertEqual(decoded[constants.SLICE_KEY_TYPES_KEY],
+                     extracts[constants.SLICE_KEY_TYPES_KEY])
+    self.assertAllClose(decoded[constants.PREDICTIONS_KEY], [0.3, 0.7])
+    self.assertEqual(decoded[constants.FEATURES_KEY]['query'].tolist(),
+                     [b'query1'])
+
+  def testAccumulatorCoder(self):
+    accumulator = _Accumulator()
+    accumulator.matrices = np.ones((2, 3, 4))
+    accumulator.counts = {(0, 1, 2): 3.0}
+    accumulator.num_examples = 5
+    coder = coders.AccumulatorCoder(_Accumulator)
+    decoded = coder.decode(coder.encode(accumulator))
+    self.assertIsInstance(decoded, _Accumulator)
+    self.assertAllClose(decoded.matrices, accumulator.matrices)
+    self.assertEqual(decoded.counts, {(0, 1, 2): 3.0})
+    self.assertEqual(decoded.num_examples, 5)
+
+  def testAccumulatorCoderUsesGetState(self):
+    accumulator = _BufferedAccumulator()
+    accumulator.buffer = np.arange(100)
+    accumulator.count = 2
+    coder = coders.AccumulatorCoder(_BufferedAccumulator)
+    decoded = coder.decode(coder.encode(accumulator))
+    self.assertEqual(decoded.buffer.tolist(), [0, 1])
+    self.assertEqual(decoded.count, 2)
+
+  def testSliceKeyCoder(self):
+    coder = coders.SliceKeyCoder()
+    self.assertTrue(coder.is_deterministic())
+    for slice_key in ((), (('gender', 'f'),), (('age', 5), ('score', 0.5),
+                                                 ('id', b'x'))):
+      self.assertEqual(coder.decode(coder.encode(slice_key)), slice_key)
+    self.assertEqual(
+        coder.decode(coder.encode((('age', np.int64(5)),))), (('age', 5),))
+    with self.assertRaises(TypeError):
+      coder.encode((('feature', [1, 2]),))
+
+  def testSliceKeyCoderIsRegistered(self):
+    self.assertIsInstance(
+        beam.coders.registry.get_coder(coders.SliceKeyTypeHint),
+        coders.SliceKeyCoder)
+
+
+if __name__ == '__main__':
+  tf.test.main()
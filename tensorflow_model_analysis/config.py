@@ -29,6 +29,8 @@ BinarizationOptions = config_pb2.BinarizationOptions
 AggregationOptions = config_pb2.AggregationOptions
 MetricConfig = config_pb2.MetricConfig
 MetricsSpec = config_pb2.MetricsSpec
+QueryGroupingOptions = config_pb2.QueryGroupingOptions
+ConfidenceIntervalOptions = config_pb2.ConfidenceIntervalOptions
 Options = config_pb2.Options
 EvalConfig = config_pb2.EvalConfig
 
@@ -67,6 +67,8 @@ METRICS_KEY = 'metrics'
 PLOTS_KEY = 'plots'
 # Analysis output key.
 ANALYSIS_KEY = 'analysis'
+# Discovered slices output key.
+SLICE_DISCOVERY_KEY = 'slice_discovery'
 
 # Keys for validation alternatives
 BASELINE_KEY = 'baseline'
@@ -25,6 +25,7 @@ from tensorflow_model_analysis import model_util
 from tensorflow_model_analysis import types
 from tensorflow_model_analysis.eval_saved_model import load
 from tensorflow_model_analysis.eval_saved_model import util
+from tensorflow_model_analysis.post_export_metrics import post_export_metrics
 from typing import Dict, Iterable, List, Optional, Union, Sequence, Text, Tuple
 
 from tensorflow.core.example import example_pb2
@@ -160,17 +161,23 @@ class TensorflowModelAnalysisTest(tf.test.TestCase):
       include_default_metrics: Optional[bool] = True,
       example_weight_key: Optional[Union[Text, Dict[Text, Text]]] = None,
       additional_fetches: Optional[List[Text]] = None,
-      tags: Optional[Text] = None) -> types.EvalSharedModel:
+      tags: Optional[Text] = None,
+      compute_post_export_metrics_with_numpy: bool = False
+  ) -> types.EvalSharedModel:
 
+    graph_metrics_callbacks = post_export_metrics.graph_metrics_callbacks(
+        add_metrics_callbacks, compute_post_export_metrics_with_numpy)
     return types.EvalSharedModel(
         eval_saved_model_path,
         add_metrics_callbacks=add_metrics_callbacks,
         example_weight_key=example_weight_key,
+        compute_post_export_metrics_with_numpy=(
+            compute_post_export_metrics_with_numpy),
         model_loader=types.ModelLoader(
             tags=tags,
             construct_fn=model_util.model_construct_fn(
                 eval_saved_model_path=eval_saved_model_path,
-                add_metrics_callbacks=add_metrics_callbacks,
+                add_metrics_callbacks=graph_metrics_callbacks,
                 include_default_metrics=include_default_metrics,
                 additional_fetches=additional_fetches,
                 tags=tags)))
@@ -18,3 +18,4 @@ from tensorflow_model_analysis.evaluators.evaluator import Evaluation
 from tensorflow_model_analysis.evaluators.evaluator import Evaluator
 from tensorflow_model_analysis.evaluators.evaluator import verify_evaluator
 from tensorflow_model_analysis.evaluators.metrics_and_plots_evaluator import MetricsAndPlotsEvaluator
+from tensorflow_model_analysis.evaluators.slice_discovery_evaluator import SliceDiscoveryEvaluator
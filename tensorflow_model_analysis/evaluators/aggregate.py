@@ -22,10 +22,14 @@ from __future__ import print_function
 import apache_beam as beam
 import numpy as np
 
+from tensorflow_model_analysis import coders
 from tensorflow_model_analysis import constants
 from tensorflow_model_analysis import model_util
 from tensorflow_model_analysis import types
 from tensorflow_model_analysis.eval_metrics_graph import eval_metrics_graph
+from tensorflow_model_analysis.eval_saved_model import encoding
+from tensorflow_model_analysis.eval_saved_model import util
+from tensorflow_model_analysis.post_export_metrics import post_export_metrics
 from tensorflow_model_analysis.slicer import slicer_lib as slicer
 from typing import Any, Dict, Generator, Iterable, List, Optional, Text, Tuple, Union
 
@@ -38,7 +42,8 @@ def ComputePerSliceMetrics(  # pylint: disable=invalid-name
     eval_shared_model: types.EvalSharedModel,
     desired_batch_size: Optional[int] = None,
     compute_with_sampling: Optional[bool] = False,
-    random_seed_for_testing: Optional[int] = None) -> beam.pvalue.PCollection:
+    random_seed_for_testing: Optional[int] = None,
+    hot_key_fanout: Optional[int] = None) -> beam.pvalue.PCollection:
   """PTransform for computing, aggregating and combining metrics.
 
   Args:
@@ -47,6 +52,8 @@ def ComputePerSliceMetrics(  # pylint: disable=invalid-name
     desired_batch_size: Optional batch size for batching in Aggregate.
     compute_with_sampling: True to compute with sampling.
     random_seed_for_testing: Seed to use for unit testing.
+    hot_key_fanout: Optional fanout to use when combining the examples of each
+      slice (see slicer.hot_key_fanout_fn).
 
   Returns:
     PCollection of (slice key, dict of metrics).
@@ -69,7 +76,8 @@ def ComputePerSliceMetrics(  # pylint: disable=invalid-name
               eval_shared_model=eval_shared_model,
               desired_batch_size=desired_batch_size,
               compute_with_sampling=compute_with_sampling,
-              seed_for_testing=random_seed_for_testing))
+              seed_for_testing=random_seed_for_testing)).with_hot_key_fanout(
+                  slicer.hot_key_fanout_fn(hot_key_fanout))
       | 'InterpretOutput' >> beam.ParDo(
           _ExtractOutputDoFn(eval_shared_model=eval_shared_model)))
 
@@ -89,44 +97,120 @@ def _add_metric_variables(  # pylint: disable=invalid-name
     return right
 
 
+def _add_numpy_metric_variables(  # pylint: disable=invalid-name
+    left: Optional[List[List[np.ndarray]]],
+    right: Optional[List[List[np.ndarray]]]
+) -> Optional[List[List[np.ndarray]]]:
+  """Returns left and right NumPy metric variables (one list per metric)."""
+  if left is not None and right is not None:
+    return [_add_metric_variables(x, y) for x, y in zip(left, right)]
+  elif left is not None:
+    return left
+  else:
+    return right
+
+
+def _merge_fpl_values(
+    fpls: List[types.FeaturesPredictionsLabels],
+    group: Text,
+    keys: Optional[List[Text]] = None) -> types.TensorValueMaybeDict:
+  """Merges the values of the FPLs into a batch of values.
+
+  Args:
+    fpls: FPLs to merge.
+    group: Name of the FPL field to merge (features, predictions or labels).
+    keys: Optional keys to merge. Defaults to all keys.
+
+  Returns:
+    Dict of batched values keyed like the FPL field, or the batched value itself
+    if the model did not output a dict.
+  """
+  if keys is None:
+    keys = list(getattr(fpls[0], group).keys())
+  merged = {}
+  for key in keys:
+    merged[key] = util.merge_tensor_values(
+        [getattr(fpl, group)[key][encoding.NODE_SUFFIX] for fpl in fpls])
+  return util.extract_tensor_maybe_dict(group, merged)
+
+
+def _numpy_metrics(eval_shared_model: types.EvalSharedModel) -> List[Any]:
+  """Returns the post export metrics to compute using NumPy (if enabled)."""
+  if not eval_shared_model.compute_post_export_metrics_with_numpy:
+    return []
+  metrics = []
+  for callback in eval_shared_model.add_metrics_callbacks:
+    metric = post_export_metrics.get_numpy_metric(callback)
+    if metric is not None and metric.supports_numpy:
+      metrics.append(metric)
+  return metrics
+
+
 class _AggState(object):
   """Combine state for AggregateCombineFn.
 
   There are two parts to the state: the metric variables (the actual state),
   and a list of FeaturesPredictionsLabels or other inputs. See
-  _AggregateCombineFn for why we need this.
+  _AggregateCombineFn for why we need this. The total number of inputs that
+  were added is also tracked. When post export metrics are computed using
+  NumPy, their metric variables and the FPLs of the inputs are also kept.
   """
 
-  __slots__ = ['metric_variables', 'inputs']
+  __slots__ = [
+      'metric_variables', 'numpy_metric_variables', 'inputs', 'fpls',
+      'num_inputs'
+  ]
 
   def __init__(self):
     self.metric_variables = None  # type: Optional[types.MetricVariablesType]
+    self.numpy_metric_variables = None  # type: Optional[List[Any]]
     self.inputs = [
     ]  # type: List[Union[bytes, types.FeaturesPredictionsLabels]]
+    self.fpls = []  # type: List[types.FeaturesPredictionsLabels]
+    self.num_inputs = 0
 
   def copy_from(  # pylint: disable=invalid-name
       self, other: '_AggState') -> None:
     if other.metric_variables:
       self.metric_variables = other.metric_variables
+    if other.numpy_metric_variables:
+      self.numpy_metric_variables = other.numpy_metric_variables
     self.inputs = other.inputs
+    self.fpls = other.fpls
+    self.num_inputs = other.num_inputs
 
   def __iadd__(self, other: '_AggState') -> '_AggState':
     self.metric_variables = _add_metric_variables(self.metric_variables,
                                                   other.metric_variables)
+    self.numpy_metric_variables = _add_numpy_metric_variables(
+        self.numpy_metric_variables, other.numpy_metric_variables)
     self.inputs.extend(other.inputs)
+    self.fpls.extend(other.fpls)
+    self.num_inputs += other.num_inputs
     return self
 
-  def add_input(self, new_input) -> None:
+  def add_input(self,
+                new_input,
+                fpl: Optional[types.FeaturesPredictionsLabels] = None) -> None:
     self.inputs.append(new_input)
+    if fpl is not None:
+      self.fpls.append(fpl)
+    self.num_inputs += 1
 
   def add_metrics_variables(  # pylint: disable=invalid-name
       self, metric_variables: types.MetricVariablesType) -> None:
     self.metric_variables = _add_metric_variables(self.metric_variables,
                                                   metric_variables)
 
+  def add_numpy_metric_variables(  # pylint: disable=invalid-name
+      self, numpy_metric_variables: List[List[np.ndarray]]) -> None:
+    self.numpy_metric_variables = _add_numpy_metric_variables(
+        self.numpy_metric_variables, numpy_metric_variables)
+
 
 @beam.typehints.with_input_types(types.Extracts)
-@beam.typehints.with_output_types(Optional[List[Any]])
+@beam.typehints.with_output_types(Optional[Tuple[Optional[List[Any]],
+                                                 Optional[List[Any]]]])
 class _AggregateCombineFn(model_util.CombineFnWithModels):
   """Aggregate combine function.
 
@@ -150,6 +234,10 @@ class _AggregateCombineFn(model_util.CombineFnWithModels):
   and accumulate FeaturesPredictionsLabels accordingly. We do one final
   "intro metrics" and merge step before producing the final output value.
 
+  If the EvalSharedModel computes post export metrics using NumPy, the metric
+  variables of those metrics are computed from the batched FPLs without using
+  the EvalMetricsGraph and are combined by adding them together.
+
   See also:
   BEAM-3737: Key-aware batching function
   (https://issues.apache.org/jira/browse/BEAM-3737).
@@ -180,13 +268,22 @@ class _AggregateCombineFn(model_util.CombineFnWithModels):
     self._compute_with_sampling = compute_with_sampling
     self._random_state = np.random.RandomState(seed_for_testing)
 
+    self._numpy_metrics = _numpy_metrics(eval_shared_model)
+    self._numpy_feature_keys = sorted(
+        set(key for metric in self._numpy_metrics
+            for key in metric.numpy_feature_keys()))
+
     # Metrics.
     self._combine_batch_size = beam.metrics.Metrics.distribution(
         constants.METRICS_NAMESPACE, 'combine_batch_size')
     self._num_compacts = beam.metrics.Metrics.counter(
         constants.METRICS_NAMESPACE, 'num_compacts')
+    self._num_examples_per_slice = beam.metrics.Metrics.distribution(
+        constants.METRICS_NAMESPACE, 'num_examples_per_slice')
 
-  def _poissonify(self, accumulator: _AggState) -> List[bytes]:
+  def _poissonify(
+      self, accumulator: _AggState
+  ) -> Tuple[List[bytes], List[types.FeaturesPredictionsLabels]]:
     # pylint: disable=line-too-long
     """Creates a bootstrap resample of the data in an accumulator.
 
@@ -205,14 +302,31 @@ class _AggregateCombineFn(model_util.CombineFnWithModels):
       accumulator: Accumulator containing FPLs from a sample
 
     Returns:
-      A list of FPLs representing a bootstrap resample of the accumulator items.
+      Lists of inputs and FPLs representing a bootstrap resample of the
+      accumulator items (the FPLs are only resampled if the accumulator
+      contains them).
     """
-    result = []
+    inputs = []
+    fpls = []
     if accumulator.inputs:
       poisson_counts = self._random_state.poisson(1, len(accumulator.inputs))
       for i, input_item in enumerate(accumulator.inputs):
-        result.extend([input_item] * poisson_counts[i])
-    return result
+        inputs.extend([input_item] * poisson_counts[i])
+        if accumulator.fpls:
+          fpls.extend([accumulator.fpls[i]] * poisson_counts[i])
+    return inputs, fpls
+
+  def _numpy_metric_variables(
+      self,
+      fpls: List[types.FeaturesPredictionsLabels]) -> List[List[np.ndarray]]:
+    """Returns the metric variables of the NumPy metrics for a batch of FPLs."""
+    features = _merge_fpl_values(fpls, 'features', self._numpy_feature_keys)
+    predictions = _merge_fpl_values(fpls, 'predictions')
+    labels = _merge_fpl_values(fpls, 'labels')
+    return [
+        metric.numpy_metric_variables(features, predictions, labels)
+        for metric in self._numpy_metrics
+    ]
 
   def _maybe_do_batch(self,
                       accumulator: _AggState,
@@ -238,27 +352,38 @@ class _AggregateCombineFn(model_util.CombineFnWithModels):
       if accumulator.inputs:
         self._combine_batch_size.update(batch_size)
         inputs_for_metrics = accumulator.inputs
+        fpls_for_metrics = accumulator.fpls
         if self._compute_with_sampling:
           # If we are computing with multiple bootstrap replicates, use fpls
           # generated by the Poisson bootstrapping technique.
-          inputs_for_metrics = self._poissonify(accumulator)
+          inputs_for_metrics, fpls_for_metrics = self._poissonify(accumulator)
         if inputs_for_metrics:
           accumulator.add_metrics_variables(
               self._eval_metrics_graph.metrics_reset_update_get_list(
                   inputs_for_metrics))
+          if self._numpy_metrics:
+            accumulator.add_numpy_metric_variables(
+                self._numpy_metric_variables(fpls_for_metrics))
         else:
           # Call to metrics_reset_update_get_list does a reset prior to the
           # metrics update, but does not handle empty updates. Explicitly
           # calling just reset here, to make the flow clear.
           self._eval_metrics_graph.reset_metric_variables()
         del accumulator.inputs[:]
+        del accumulator.fpls[:]
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return coders.AccumulatorCoder(_AggState)
 
   def create_accumulator(self) -> _AggState:
     return _AggState()
 
   def add_input(self, accumulator: _AggState,
                 elem: types.Extracts) -> _AggState:
-    accumulator.add_input(elem[constants.INPUT_KEY])
+    fpl = None
+    if self._numpy_metrics:
+      fpl = elem[constants.FEATURES_PREDICTIONS_LABELS_KEY]
+    accumulator.add_input(elem[constants.INPUT_KEY], fpl)
     self._maybe_do_batch(accumulator)
     return accumulator
 
@@ -283,17 +408,25 @@ class _AggregateCombineFn(model_util.CombineFnWithModels):
     return accumulator
 
   def extract_output(
-      self, accumulator: _AggState) -> Optional[types.MetricVariablesType]:
+      self, accumulator: _AggState
+  ) -> Optional[Tuple[Optional[types.MetricVariablesType],
+                      Optional[List[List[np.ndarray]]]]]:
     # It's possible that the accumulator has not been fully flushed, if it was
     # not produced by a call to compact (which is not guaranteed across all Beam
     # Runners), so we defensively flush it here again, before we extract data
     # from it, to ensure correctness.
     self._maybe_do_batch(accumulator, force=True)
-    return accumulator.metric_variables
+    if not self._compute_with_sampling:
+      self._num_examples_per_slice.update(accumulator.num_inputs)
+    if (not accumulator.metric_variables and
+        not accumulator.numpy_metric_variables):
+      return None
+    return (accumulator.metric_variables, accumulator.numpy_metric_variables)
 
 
-@beam.typehints.with_input_types(Tuple[slicer.SliceKeyType,
-                                       Optional[List[Any]]])
+@beam.typehints.with_input_types(
+    Tuple[slicer.SliceKeyType, Optional[Tuple[Optional[List[Any]],
+                                              Optional[List[Any]]]]])
 # TODO(b/123516222): Add output typehints. Similarly elsewhere that it applies.
 class _ExtractOutputDoFn(model_util.DoFnWithModels):
   """A DoFn that extracts the metrics output."""
@@ -301,6 +434,7 @@ class _ExtractOutputDoFn(model_util.DoFnWithModels):
   def __init__(self, eval_shared_model: types.EvalSharedModel) -> None:
     super(_ExtractOutputDoFn,
           self).__init__({'': eval_shared_model.model_loader})
+    self._numpy_metrics = _numpy_metrics(eval_shared_model)
 
     # This keeps track of the number of times the poisson bootstrap encounters
     # an empty set of elements for a slice sample. Should be extremely rare in
@@ -310,13 +444,22 @@ class _ExtractOutputDoFn(model_util.DoFnWithModels):
         constants.METRICS_NAMESPACE, 'num_bootstrap_empties')
 
   def process(
-      self, element: Tuple[slicer.SliceKeyType, types.MetricVariablesType]
+      self, element: Tuple[slicer.SliceKeyType,
+                           Optional[Tuple[Optional[types.MetricVariablesType],
+                                          Optional[List[List[np.ndarray]]]]]]
   ) -> Generator[Tuple[slicer.SliceKeyType, Dict[Text, Any]], None, None]:
-    (slice_key, metric_variables) = element
-    if metric_variables:
-      eval_saved_model = self._loaded_models[''].eval_saved_model
-      result = eval_saved_model.metrics_set_variables_and_get_values(
-          metric_variables)
+    (slice_key, output) = element
+    if output:
+      metric_variables, numpy_metric_variables = output
+      result = {}
+      if metric_variables:
+        eval_saved_model = self._loaded_models[''].eval_saved_model
+        result = eval_saved_model.metrics_set_variables_and_get_values(
+            metric_variables)
+      if numpy_metric_variables:
+        for metric, variables in zip(self._numpy_metrics,
+                                     numpy_metric_variables):
+          result.update(metric.numpy_metric_values(variables))
       yield (slice_key, result)
     else:
       # Increase a counter for empty bootstrap samples. When sampling is not
@@ -19,6 +19,7 @@ from __future__ import print_function
 import os
 # Standard Imports
 
+from absl.testing import parameterized
 import apache_beam as beam
 from apache_beam.testing import util
 import tensorflow as tf
@@ -37,7 +38,8 @@ def create_test_input(predict_list, slice_list):
   return results
 
 
-class AggregateTest(testutil.TensorflowModelAnalysisTest):
+class AggregateTest(testutil.TensorflowModelAnalysisTest,
+                    parameterized.TestCase):
 
   def _getEvalExportDir(self):
     return os.path.join(self._getTempDir(), 'eval_export_dir')
@@ -85,7 +87,10 @@ class AggregateTest(testutil.TensorflowModelAnalysisTest):
 
       util.assert_that(metrics, check_result)
 
-  def testAggregateMultipleSlices(self):
+  @parameterized.named_parameters(('default_fanout', None),
+                                  ('all_slices_fanout', 2),
+                                  ('no_fanout', 1))
+  def testAggregateMultipleSlices(self, hot_key_fanout):
     temp_eval_export_dir = self._getEvalExportDir()
     _, eval_export_dir = linear_classifier.simple_linear_classifier(
         None, temp_eval_export_dir)
@@ -123,7 +128,9 @@ class AggregateTest(testutil.TensorflowModelAnalysisTest):
           pipeline
           | 'CreateTestInput' >> beam.Create(test_input)
           | 'ComputePerSliceMetrics' >> aggregate.ComputePerSliceMetrics(
-              eval_shared_model=eval_shared_model, desired_batch_size=3))
+              eval_shared_model=eval_shared_model,
+              desired_batch_size=3,
+              hot_key_fanout=hot_key_fanout))
 
       def check_result(got):
         self.assertEqual(3, len(got), 'got: %s' % got)
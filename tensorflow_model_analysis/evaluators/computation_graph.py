@@ -0,0 +1,576 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Graph of the metric computations run by the metrics and plots evaluator.
+
+Metrics are defined as lists of computations where derived computations
+typically include copies of the computations that they depend on. The graph
+built here removes duplicate computations (based on a fingerprint of their
+configuration), removes computations whose outputs are never used, and orders
+the derived computations so that each one runs after the computations that it
+depends on.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import functools
+import hashlib
+import heapq
+import types as python_types
+
+from typing import Any, Callable, Dict, List, Set, Text, Tuple
+
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis.metrics import metric_types
+
+from google.protobuf import message
+
+# Max number of values visited per fingerprint. Values that are reached after
+# the budget is used up are identified by object identity instead of by their
+# contents (the fingerprint is still stable, but may miss duplicates).
+_MAX_FINGERPRINT_VALUES = 10000
+
+_PENDING = 0
+_RUNNING = 1
+_DONE = 2
+
+
+def _is_private(key: metric_types.MetricKey) -> bool:
+  return key.name.startswith('_')
+
+
+class _Fingerprinter(object):
+  """Computes fingerprints of computation configs.
+
+  The fingerprint of a value is based on its type and contents: primitives by
+  value, containers by their items, protos by their serialized form, functions
+  by their code and the values they close over, and other objects by their
+  attributes. Fingerprints of objects are cached by identity so that shared
+  values (e.g. the eval config) are only visited once.
+  """
+
+  def __init__(self):
+    self._memo = {}  # id -> (value, digest)
+    self._active = set()  # type: Set[int]
+    self._budget = 0
+
+  def __call__(self, value: Any) -> Text:
+    self._budget = _MAX_FINGERPRINT_VALUES
+    return self._digest(value).hex()
+
+  def _digest(self, value: Any) -> bytes:
+    """Returns the digest for value."""
+    if value is None or isinstance(value, (bool, int, float, complex, Text,
+                                           bytes)):
+      return self._hash(type(value).__name__, repr(value))
+    if isinstance(value, np.generic):
+      return self._hash(type(value).__name__, repr(value.item()))
+    if isinstance(value, python_types.ModuleType):
+      return self._hash('module', value.__name__)
+    if isinstance(value, type):
+      return self._hash('class', value.__module__, value.__qualname__)
+    value_id = id(value)
+    if value_id in self._memo:
+      return self._memo[value_id][1]
+    if value_id in self._active:
+      return self._hash('cycle')
+    self._budget -= 1
+    if self._budget < 0:
+      return self._hash('id', str(value_id))
+    self._active.add(value_id)
+    try:
+      digest = self._hash(*self._parts(value))
+    finally:
+      self._active.discard(value_id)
+    # The value is kept in the memo so that its id is not reused.
+    self._memo[value_id] = (value, digest)
+    return digest
+
+  def _parts(self, value: Any) -> List[Any]:
+    """Returns the parts that the fingerprint of a (non-primitive) value uses."""
+    if isinstance(value, np.ndarray):
+      if value.dtype == object:
+        return (['ndarray', repr(value.shape)] +
+                [self._digest(v) for v in value.ravel()])
+      return [
+          'ndarray',
+          str(value.dtype),
+          repr(value.shape),
+          np.ascontiguousarray(value).tobytes()
+      ]
+    if isinstance(value, message.Message):
+      return [
+          'proto', value.DESCRIPTOR.full_name,
+          value.SerializeToString(deterministic=True)
+      ]
+    if isinstance(value, (list, tuple)):
+      return [_class_name(value)] + [self._digest(v) for v in value]
+    if isinstance(value, dict):
+      return [_class_name(value)] + sorted(
+          self._digest(k) + self._digest(v) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+      return [_class_name(value)] + sorted(self._digest(v) for v in value)
+    if isinstance(value, functools.partial):
+      return [
+          'partial',
+          self._digest(value.func),
+          self._digest(value.args),
+          self._digest(value.keywords)
+      ]
+    if isinstance(value, python_types.FunctionType):
+      return [
+          'function', value.__module__, value.__qualname__,
+          self._code_digest(value.__code__),
+          self._digest(value.__defaults__),
+          self._digest(value.__kwdefaults__)
+      ] + [self._digest(_cell_contents(c)) for c in value.__closure__ or ()]
+    if isinstance(value, python_types.MethodType):
+      return [
+          'method',
+          self._digest(value.__func__),
+          self._digest(value.__self__)
+      ]
+    if isinstance(value, python_types.BuiltinFunctionType):
+      return [
+          'builtin',
+          getattr(value, '__module__', None) or '', value.__qualname__
+      ]
+    attributes = _attributes(value)
+    if attributes is None:
+      return ['id', str(id(value))]
+    return [_class_name(value)] + sorted(
+        self._hash(k) + self._digest(v) for k, v in attributes.items())
+
+  def _code_digest(self, code: python_types.CodeType) -> bytes:
+    consts = [
+        self._code_digest(c)
+        if isinstance(c, python_types.CodeType) else self._digest(c)
+        for c in code.co_consts
+    ]
+    return self._hash('code', code.co_code, repr(code.co_names), *consts)
+
+  def _hash(self, *parts: Any) -> bytes:
+    hasher = hashlib.sha256()
+    for part in parts:
+      if not isinstance(part, bytes):
+        part = part.encode('utf-8')
+      hasher.update(str(len(part)).encode('utf-8'))
+      hasher.update(b':')
+      hasher.update(part)
+    return hasher.digest()
+
+
+def _class_name(value: Any) -> Text:
+  return '{}.{}'.format(type(value).__module__, type(value).__qualname__)
+
+
+def _cell_contents(cell: Any) -> Any:
+  try:
+    return cell.cell_contents
+  except ValueError:  # Empty cell.
+    return None
+
+
+def _attributes(value: Any) -> Any:
+  """Returns dict of the attributes of an object or None if unavailable."""
+  attributes = {}
+  for cls in type(value).__mro__:
+    for slot in getattr(cls, '__slots__', ()):
+      if isinstance(slot, Text) and hasattr(value, slot):
+        attributes[slot] = getattr(value, slot)
+  if hasattr(value, '__dict__'):
+    attributes.update(vars(value))
+  elif not attributes:
+    return None
+  return attributes
+
+
+def fingerprint(value: Any) -> Text:
+  """Returns a fingerprint of the configuration of a computation (or value).
+
+  Computations created independently using the same settings (e.g. the binary
+  confusion matrices for the same thresholds created by different metrics)
+  have the same fingerprint.
+
+  Args:
+    value: Value to fingerprint (e.g. a combiner or derived result function).
+  """
+  return _Fingerprinter()(value)
+
+
+class _References(object):
+  """Keys and key names that a derived result function may read."""
+
+  __slots__ = ['keys', 'names', 'unknown']
+
+  def __init__(self):
+    self.keys = set()  # type: Set[metric_types.MetricKey]
+    self.names = set()  # type: Set[Text]
+    # True if the references could not be determined.
+    self.unknown = False
+
+  def may_read(self, key: metric_types.MetricKey) -> bool:
+    return self.unknown or key in self.keys or key.name in self.names
+
+
+def _references(result: Callable[..., Any]) -> _References:
+  """Returns the keys (or key names) that a result function may read.
+
+  Derived results read their inputs using keys that they close over (e.g. the
+  key of the binary confusion matrices computation) or build from names that
+  they close over (e.g. the per class keys used by macro averages). All keys
+  and strings reachable from the function's closure, defaults, constants and
+  referenced globals are collected. This over-approximates the inputs, which
+  is safe because it can only cause computations to be kept.
+
+  Args:
+    result: Result function of a DerivedMetricComputation.
+  """
+  references = _References()
+  visited = set()  # type: Set[int]
+
+  def visit_code(code: python_types.CodeType, global_values: Dict[Text, Any]):
+    for c in code.co_consts:
+      if isinstance(c, python_types.CodeType):
+        visit_code(c, global_values)
+      else:
+        visit(c)
+    for name in code.co_names:
+      if name in global_values:
+        value = global_values[name]
+        if not isinstance(value, (python_types.ModuleType, type)):
+          visit(value)
+
+  def visit(value: Any):
+    if isinstance(value, metric_types.MetricKey):
+      references.keys.add(value)
+      references.names.add(value.name)
+      return
+    if isinstance(value, Text):
+      references.names.add(value)
+      return
+    if id(value) in visited:
+      return
+    visited.add(id(value))
+    if isinstance(value, dict):
+      for k, v in value.items():
+        visit(k)
+        visit(v)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+      for v in value:
+        visit(v)
+    elif isinstance(value, functools.partial):
+      visit(value.func)
+      visit(value.args)
+      visit(value.keywords or {})
+    elif isinstance(value, python_types.FunctionType):
+      visit(value.__defaults__ or ())
+      visit(value.__kwdefaults__ or {})
+      for cell in value.__closure__ or ():
+        visit(_cell_contents(cell))
+      visit_code(value.__code__, value.__globals__)
+
+  if isinstance(result, (python_types.FunctionType, functools.partial)):
+    visit(result)
+  else:
+    references.unknown = True
+  return references
+
+
+def _live_computations(
+    computations: List[metric_types.MetricComputation],
+    derived_computations: List[metric_types.DerivedMetricComputation],
+    references: List[_References]) -> Tuple[List[bool], List[bool]]:
+  """Returns which computations and derived computations are used.
+
+  Computations with public keys are always used. Computations that only have
+  private keys are used if a used derived computation may read one of them.
+
+  Args:
+    computations: Metric computations.
+    derived_computations: Derived metric computations.
+    references: References of each of the derived computations.
+
+  Returns:
+    Tuple of (computation used flags, derived computation used flags).
+  """
+  producers_by_key = {}
+  producers_by_name = {}
+  for i, c in enumerate(derived_computations):
+    for key in c.keys:
+      producers_by_key.setdefault(key, []).append(i)
+      producers_by_name.setdefault(key.name, []).append(i)
+
+  derived_live = [False] * len(derived_computations)
+  pending = [
+      i for i, c in enumerate(derived_computations)
+      if not c.keys or not all(_is_private(k) for k in c.keys)
+  ]
+  used = _References()
+  while pending:
+    i = pending.pop()
+    if derived_live[i]:
+      continue
+    derived_live[i] = True
+    refs = references[i]
+    if refs.unknown:
+      used.unknown = True
+      pending.extend(range(len(derived_computations)))
+      continue
+    used.keys.update(refs.keys)
+    used.names.update(refs.names)
+    for key in refs.keys:
+      pending.extend(producers_by_key.get(key, []))
+    for name in refs.names:
+      pending.extend(producers_by_name.get(name, []))
+
+  computations_live = [
+      not c.keys or not all(_is_private(k) for k in c.keys) or
+      any(used.may_read(k) for k in c.keys) for c in computations
+  ]
+  return computations_live, derived_live
+
+
+def _topological_order(
+    derived_computations: List[metric_types.DerivedMetricComputation],
+    references: List[_References]) -> List[int]:
+  """Returns order of derived computations with producers before readers.
+
+  The order is stable (computations without dependencies between them keep
+  their original order). Computations that are part of a cycle (which can only
+  be caused by over-approximated references) are added in their original
+  order. Dependencies that could not be determined statically are resolved at
+  evaluation time (see DerivedMetricsEvaluator).
+
+  Args:
+    derived_computations: Derived metric computations.
+    references: References of each of the derived computations.
+  """
+  producers_by_key = {}
+  producers_by_name = {}
+  for i, c in enumerate(derived_computations):
+    for key in c.keys:
+      producers_by_key.setdefault(key, set()).add(i)
+      producers_by_name.setdefault(key.name, set()).add(i)
+
+  readers = [[] for _ in derived_computations]
+  num_dependencies = [0] * len(derived_computations)
+  for i, refs in enumerate(references):
+    dependencies = set()
+    for key in refs.keys:
+      dependencies.update(producers_by_key.get(key, ()))
+    for name in refs.names:
+      dependencies.update(producers_by_name.get(name, ()))
+    dependencies.discard(i)
+    num_dependencies[i] = len(dependencies)
+    for j in dependencies:
+      readers[j].append(i)
+
+  ready = [i for i, n in enumerate(num_dependencies) if n == 0]
+  heapq.heapify(ready)
+  order = []
+  while ready:
+    i = heapq.heappop(ready)
+    order.append(i)
+    for j in readers[i]:
+      num_dependencies[j] -= 1
+      if num_dependencies[j] == 0:
+        heapq.heappush(ready, j)
+  if len(order) < len(derived_computations):
+    ordered = set(order)
+    order.extend(i for i in range(len(derived_computations)) if i not in ordered)
+  return order
+
+
+def build(
+    computations: metric_types.MetricComputations
+) -> Tuple[List[metric_types.MetricComputation],
+           List[metric_types.DerivedMetricComputation]]:
+  """Builds the graph of computations to run.
+
+  Computations are de-duplicated using a fingerprint of their configuration:
+  MetricComputations are identical if their keys, preprocessors and combiners
+  are and derived computations are identical if their keys and result
+  functions (including the values the functions close over) are. Distinct
+  MetricComputations with the same class and keys would output conflicting
+  values, so only the first is kept (and a warning is logged).
+  Computations whose outputs are all private and never read by a used derived
+  computation are removed, and the derived computations are ordered so that
+  they run after the derived computations they read from.
+
+  Args:
+    computations: Computations.
+
+  Returns:
+    Tuple of (metric computations, derived metric computations).
+
+  Raises:
+    TypeError: If an unsupported computation type is found.
+  """
+  fingerprinter = _Fingerprinter()
+  metric_computations = []
+  derived_computations = []
+  fingerprints = set()
+  class_and_keys_seen = set()
+  derived_fingerprints = set()
+  for c in computations:
+    if isinstance(c, metric_types.MetricComputation):
+      c_fingerprint = fingerprinter((c.keys, c.preprocessor, c.combiner))
+      if c_fingerprint in fingerprints:
+        continue
+      fingerprints.add(c_fingerprint)
+      class_and_keys = (c.__class__.__name__, frozenset(c.keys))
+      if class_and_keys in class_and_keys_seen:
+        tf.compat.v1.logging.warning(
+            'Metric computations for keys %s have different configurations '
+            '(e.g. the same metric name was used for different metrics). '
+            'Only the first computation will be used.', c.keys)
+        continue
+      class_and_keys_seen.add(class_and_keys)
+      metric_computations.append(c)
+    elif isinstance(c, metric_types.DerivedMetricComputation):
+      c_fingerprint = fingerprinter((c.keys, c.result))
+      if c_fingerprint in derived_fingerprints:
+        continue
+      derived_fingerprints.add(c_fingerprint)
+      derived_computations.append(c)
+    else:
+      raise TypeError('Unsupported metric computation type: {}'.format(c))
+
+  references = [_references(c.result) for c in derived_computations]
+  computations_live, derived_live = _live_computations(metric_computations,
+                                                       derived_computations,
+                                                       references)
+  metric_computations = [
+      c for c, live in zip(metric_computations, computations_live) if live
+  ]
+  live_indices = [i for i, live in enumerate(derived_live) if live]
+  derived_computations = [derived_computations[i] for i in live_indices]
+  references = [references[i] for i in live_indices]
+  derived_computations = [
+      derived_computations[i]
+      for i in _topological_order(derived_computations, references)
+  ]
+  return metric_computations, derived_computations
+
+
+class _DerivedMetrics(dict):
+  """Dict of metrics that runs derived computations for missing keys.
+
+  Used to resolve dependencies between derived computations that could not be
+  determined when the computations were ordered.
+  """
+
+  def __init__(self, metrics: Dict[metric_types.MetricKey, Any],
+               derived_computations: List[
+                   metric_types.DerivedMetricComputation],
+               producers: Dict[metric_types.MetricKey, List[int]]):
+    super(_DerivedMetrics, self).__init__(metrics)
+    self._derived_computations = derived_computations
+    self._producers = producers
+    self._states = [_PENDING] * len(derived_computations)
+
+  def evaluate(self, index: int):
+    """Runs derived computation at index (if not already run)."""
+    state = self._states[index]
+    if state == _DONE:
+      return
+    if state == _RUNNING:
+      raise ValueError(
+          'cycle found in derived metric computations for keys: {}'.format(
+              self._derived_computations[index].keys))
+    self._states[index] = _RUNNING
+    result = self._derived_computations[index].result(self)
+    self._states[index] = _DONE
+    dict.update(self, result)
+
+  def evaluate_all(self):
+    for i, state in enumerate(self._states):
+      if state == _PENDING:
+        self.evaluate(i)
+
+  def _evaluate_producers(self, key: metric_types.MetricKey):
+    for i in self._producers.get(key, ()):
+      self.evaluate(i)
+
+  def __missing__(self, key: metric_types.MetricKey) -> Any:
+    self._evaluate_producers(key)
+    if not dict.__contains__(self, key):
+      raise KeyError(key)
+    return dict.__getitem__(self, key)
+
+  def __contains__(self, key: Any) -> bool:
+    if not dict.__contains__(self, key):
+      self._evaluate_producers(key)
+    return dict.__contains__(self, key)
+
+  def get(self, key: Any, default: Any = None) -> Any:
+    return self[key] if key in self else default
+
+  def __iter__(self):
+    self.evaluate_all()
+    return dict.__iter__(self)
+
+  def __len__(self) -> int:
+    self.evaluate_all()
+    return dict.__len__(self)
+
+  def keys(self):
+    self.evaluate_all()
+    return dict.keys(self)
+
+  def values(self):
+    self.evaluate_all()
+    return dict.values(self)
+
+  def items(self):
+    self.evaluate_all()
+    return dict.items(self)
+
+
+class DerivedMetricsEvaluator(object):
+  """Adds the results of derived computations to the metrics for a slice."""
+
+  def __init__(
+      self,
+      derived_computations: List[metric_types.DerivedMetricComputation]):
+    self._derived_computations = derived_computations
+    self._producers = {}  # type: Dict[metric_types.MetricKey, List[int]]
+    for i, c in enumerate(derived_computations):
+      for key in c.keys:
+        self._producers.setdefault(key, []).append(i)
+
+  def __call__(
+      self, metrics: Dict[metric_types.MetricKey, Any]
+  ) -> Dict[metric_types.MetricKey, Any]:
+    """Returns metrics updated with the results of the derived computations.
+
+    Derived computations are run in order. A computation that reads a key
+    produced by a derived computation that has not run yet causes that
+    computation to be run first.
+
+    Args:
+      metrics: Dict of metric key to value for the metric computations.
+
+    Raises:
+      ValueError: If the derived computations depend on each other.
+    """
+    derived_metrics = _DerivedMetrics(metrics, self._derived_computations,
+                                      self._producers)
+    derived_metrics.evaluate_all()
+    return dict.copy(derived_metrics)
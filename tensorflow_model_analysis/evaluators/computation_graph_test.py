@@ -0,0 +1,145 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for computation graph."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import tensorflow as tf
+from tensorflow_model_analysis.eval_saved_model import testutil
+from tensorflow_model_analysis.evaluators import computation_graph
+from tensorflow_model_analysis.metrics import aggregation
+from tensorflow_model_analysis.metrics import binary_confusion_matrices
+from tensorflow_model_analysis.metrics import calibration_histogram
+from tensorflow_model_analysis.metrics import confusion_matrix_metrics
+from tensorflow_model_analysis.metrics import metric_types
+
+
+def _derived(name, reads=None, value=1.0):
+  key = metric_types.MetricKey(name=name)
+
+  def result(metrics):
+    total = value
+    for read in reads or []:
+      total += metrics[metric_types.MetricKey(name=read)]
+    return {key: total}
+
+  return metric_types.DerivedMetricComputation(keys=[key], result=result)
+
+
+class ComputationGraphTest(testutil.TensorflowModelAnalysisTest):
+
+  def testFingerprint(self):
+    histogram1 = calibration_histogram.calibration_histogram(
+        num_buckets=10, sub_key=metric_types.SubKey(class_id=1))
+    histogram2 = calibration_histogram.calibration_histogram(
+        num_buckets=10, sub_key=metric_types.SubKey(class_id=1))
+    histogram3 = calibration_histogram.calibration_histogram(
+        num_buckets=10, sub_key=metric_types.SubKey(class_id=1),
+        class_weights={1: 0.5})
+    self.assertEqual(
+        computation_graph.fingerprint(histogram1[0].combiner),
+        computation_graph.fingerprint(histogram2[0].combiner))
+    self.assertNotEqual(
+        computation_graph.fingerprint(histogram1[0].combiner),
+        computation_graph.fingerprint(histogram3[0].combiner))
+
+    matrices1 = binary_confusion_matrices.binary_confusion_matrices(
+        thresholds=[0.5])
+    matrices2 = binary_confusion_matrices.binary_confusion_matrices(
+        thresholds=[0.5])
+    matrices3 = binary_confusion_matrices.binary_confusion_matrices(
+        thresholds=[0.25, 0.5])
+    self.assertEqual(
+        computation_graph.fingerprint(matrices1[-1].result),
+        computation_graph.fingerprint(matrices2[-1].result))
+    self.assertNotEqual(
+        computation_graph.fingerprint(matrices1[-1].result),
+        computation_graph.fingerprint(matrices3[-1].result))
+
+  def testBuildDedupsComputations(self):
+    sub_keys = [metric_types.SubKey(class_id=i) for i in range(3)]
+    computations = []
+    for metric in (confusion_matrix_metrics.Specificity(),
+                   confusion_matrix_metrics.FallOut(),
+                   confusion_matrix_metrics.MissRate()):
+      computations.extend(metric.computations(sub_keys=sub_keys))
+      computations.extend(
+          aggregation.macro_average(
+              metric.get_config()['name'], sub_keys=sub_keys))
+    metric_computations, derived_computations = computation_graph.build(
+        computations)
+
+    # One histogram and one set of confusion matrices per class.
+    self.assertLen(metric_computations, 3)
+    matrices_keys = [
+        k for c in derived_computations for k in c.keys
+        if k.name.startswith(
+            binary_confusion_matrices.BINARY_CONFUSION_MATRICES_NAME)
+    ]
+    self.assertLen(matrices_keys, 3)
+    # 3 metrics * (3 classes + macro average) + 3 confusion matrices.
+    self.assertLen(derived_computations, 15)
+
+  def testBuildRemovesUnusedComputations(self):
+    histogram = calibration_histogram.calibration_histogram(num_buckets=10)
+    used = _derived('used', reads=['_private'])
+    metric_computations, derived_computations = computation_graph.build(
+        histogram + [_derived('_private'), _derived('_unused'), used])
+    self.assertEmpty(metric_computations)
+    self.assertEqual([c.keys[0].name for c in derived_computations],
+                     ['_private', 'used'])
+
+  def testBuildOrdersDerivedComputations(self):
+    _, derived_computations = computation_graph.build([
+        _derived('c', reads=['b']),
+        _derived('b', reads=['_a']),
+        _derived('_a'),
+        _derived('d'),
+    ])
+    self.assertEqual([c.keys[0].name for c in derived_computations],
+                     ['_a', 'b', 'c', 'd'])
+    evaluator = computation_graph.DerivedMetricsEvaluator(derived_computations)
+    self.assertEqual(
+        evaluator({}), {
+            metric_types.MetricKey(name='_a'): 1.0,
+            metric_types.MetricKey(name='b'): 2.0,
+            metric_types.MetricKey(name='c'): 3.0,
+            metric_types.MetricKey(name='d'): 1.0,
+        })
+
+  def testDerivedMetricsEvaluatorRunsUnorderedDependenciesFirst(self):
+    evaluator = computation_graph.DerivedMetricsEvaluator(
+        [_derived('b', reads=['a']),
+         _derived('a', reads=['input'])])
+    self.assertEqual(
+        evaluator({metric_types.MetricKey(name='input'): 1.0}), {
+            metric_types.MetricKey(name='input'): 1.0,
+            metric_types.MetricKey(name='a'): 2.0,
+            metric_types.MetricKey(name='b'): 3.0,
+        })
+
+  def testDerivedMetricsEvaluatorRaisesErrorForCycle(self):
+    evaluator = computation_graph.DerivedMetricsEvaluator(
+        [_derived('a', reads=['b']),
+         _derived('b', reads=['a'])])
+    with self.assertRaisesRegexp(ValueError, 'cycle'):
+      evaluator({})
+
+
+if __name__ == '__main__':
+  tf.test.main()
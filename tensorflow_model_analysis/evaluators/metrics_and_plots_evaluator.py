@@ -46,7 +46,8 @@ def MetricsAndPlotsEvaluator(  # pylint: disable=invalid-name
     run_after: Text = slice_key_extractor.SLICE_KEY_EXTRACTOR_STAGE_NAME,
     compute_confidence_intervals: Optional[bool] = False,
     k_anonymization_count: int = 1,
-    serialize=False) -> evaluator.Evaluator:
+    serialize=False,
+    hot_key_fanout: Optional[int] = None) -> evaluator.Evaluator:
   """Creates an Evaluator for evaluating metrics and plots.
 
   Args:
@@ -63,6 +64,8 @@ def MetricsAndPlotsEvaluator(  # pylint: disable=invalid-name
       data for smaller number of examples.
     serialize: If true, serialize the metrics to protos as part of the
       evaluation as well.
+    hot_key_fanout: Optional fanout to use when combining the examples of each
+      slice (see slicer.hot_key_fanout_fn).
 
   Returns:
     Evaluator for evaluating metrics and plots. The output will be stored under
@@ -79,7 +82,8 @@ def MetricsAndPlotsEvaluator(  # pylint: disable=invalid-name
           plots_key=plots_key,
           compute_confidence_intervals=compute_confidence_intervals,
           k_anonymization_count=k_anonymization_count,
-          serialize=serialize))
+          serialize=serialize,
+          hot_key_fanout=hot_key_fanout))
 
 
 @beam.ptransform_fn
@@ -91,7 +95,8 @@ def ComputeMetricsAndPlots(  # pylint: disable=invalid-name
     eval_shared_model: types.EvalSharedModel,
     desired_batch_size: Optional[int] = None,
     compute_confidence_intervals: Optional[bool] = False,
-    random_seed_for_testing: Optional[int] = None
+    random_seed_for_testing: Optional[int] = None,
+    hot_key_fanout: Optional[int] = None
 ) -> Tuple[beam.pvalue.DoOutputsTuple, beam.pvalue.PCollection]:
   """Computes metrics and plots using the EvalSavedModel.
 
@@ -108,6 +113,8 @@ def ComputeMetricsAndPlots(  # pylint: disable=invalid-name
     compute_confidence_intervals: Set to True to run metrics analysis over
       multiple bootstrap samples and compute uncertainty intervals.
     random_seed_for_testing: Provide for deterministic tests only.
+    hot_key_fanout: Optional fanout to use when combining the examples of each
+      slice (see slicer.hot_key_fanout_fn).
 
   Returns:
     Tuple of Tuple[PCollection of (slice key, metrics),
@@ -155,7 +162,8 @@ def ComputeMetricsAndPlots(  # pylint: disable=invalid-name
                                  if compute_confidence_intervals else 1),
           random_seed_for_testing=random_seed_for_testing,
           eval_shared_model=eval_shared_model,
-          desired_batch_size=desired_batch_size)
+          desired_batch_size=desired_batch_size,
+          hot_key_fanout=hot_key_fanout)
       | 'SeparateMetricsAndPlots' >> beam.ParDo(
           _SeparateMetricsAndPlotsFn()).with_outputs(
               _SeparateMetricsAndPlotsFn.OUTPUT_TAG_PLOTS,
@@ -175,7 +183,8 @@ def EvaluateMetricsAndPlots(  # pylint: disable=invalid-name
     plots_key: Text = constants.PLOTS_KEY,
     compute_confidence_intervals: Optional[bool] = False,
     k_anonymization_count: int = 1,
-    serialize: bool = False) -> evaluator.Evaluation:
+    serialize: bool = False,
+    hot_key_fanout: Optional[int] = None) -> evaluator.Evaluation:
   """Evaluates metrics and plots using the EvalSavedModel.
 
   Args:
@@ -198,6 +207,8 @@ def EvaluateMetricsAndPlots(  # pylint: disable=invalid-name
       data for smaller number of examples.
     serialize: If true, serialize the metrics to protos as part of the
       evaluation as well.
+    hot_key_fanout: Optional fanout to use when combining the examples of each
+      slice (see slicer.hot_key_fanout_fn).
 
   Returns:
     Evaluation containing metrics and plots dictionaries keyed by 'metrics'
@@ -210,7 +221,8 @@ def EvaluateMetricsAndPlots(  # pylint: disable=invalid-name
       | 'ComputeMetricsAndPlots' >> ComputeMetricsAndPlots(
           eval_shared_model,
           desired_batch_size,
-          compute_confidence_intervals=compute_confidence_intervals))
+          compute_confidence_intervals=compute_confidence_intervals,
+          hot_key_fanout=hot_key_fanout))
 
   if k_anonymization_count > 1:
     metrics = (
@@ -19,22 +19,28 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
+import collections
 import copy
 import datetime
 from typing import Any, Dict, Iterable, List, Optional, Text, Tuple, Type, Union
 
 import apache_beam as beam
 import numpy as np
+from tensorflow_model_analysis import coders
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis import constants
 from tensorflow_model_analysis import types
-from tensorflow_model_analysis import util
+from tensorflow_model_analysis.evaluators import computation_graph
 from tensorflow_model_analysis.evaluators import evaluator
 from tensorflow_model_analysis.evaluators import poisson_bootstrap
+from tensorflow_model_analysis.evaluators import query_grouping
 from tensorflow_model_analysis.extractors import slice_key_extractor
+from tensorflow_model_analysis.metrics import calibration_histogram
 from tensorflow_model_analysis.metrics import metric_specs
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import metric_util
+from tensorflow_model_analysis.metrics import query_ranking
+from tensorflow_model_analysis.post_export_metrics import metric_keys
 from tensorflow_model_analysis.slicer import slicer_lib as slicer
 
 _COMBINER_INPUTS_KEY = '_combiner_inputs'
@@ -124,7 +130,10 @@ def _filter_and_separate_computations(
   order to avoid having to pre-construct and pass around all the dependencies at
   the time the metrics are constructed. Instead, each derived metric creates a
   version of the metric it depends on and then this code de-dups metrics that
-  are identical so only one gets computed.
+  are identical so only one gets computed. Computations whose (private) outputs
+  are never used are removed and the derived computations are ordered so that
+  they run after the derived computations that they depend on (see
+  computation_graph.build).
 
   Args:
     computations: Computations.
@@ -132,69 +141,33 @@ def _filter_and_separate_computations(
   Returns:
     Tuple of (metric computations, derived metric computations).
   """
-  non_derived_computations = []
-  derived_computations = []
-  types_and_keys = {}
-  for c in computations:
-    if isinstance(c, metric_types.MetricComputation):
-      cls = c.__class__.__name__
-      keys = sorted(c.keys)
-      if cls in types_and_keys:
-        # TODO(mdreves): This assumes the user used unique names for all the
-        # keys and classes. This could mask a bug where the same name is
-        # accidently used for different metric configurations. Add support for
-        # creating a dict config for the computations (similar to keras) and
-        # then comparing the configs to ensure the classes are identical.
-        if keys == types_and_keys[cls]:
-          continue
-      types_and_keys[cls] = keys
-      non_derived_computations.append(c)
-    elif isinstance(c, metric_types.DerivedMetricComputation):
-      derived_computations.append(c)
-    else:
-      raise TypeError('Unsupported metric computation type: {}'.format(c))
+  non_derived_computations, derived_computations = computation_graph.build(
+      computations)
+  # Query based ranking metrics for the same model share a single ranking and
+  # histograms for binarized (class_id, k, top_k) metrics share a single pass
+  # over the predictions.
+  non_derived_computations = query_ranking.merge_computations(
+      non_derived_computations)
+  non_derived_computations = calibration_histogram.merge_computations(
+      non_derived_computations)
   return non_derived_computations, derived_computations
 
 
-@beam.ptransform_fn
-@beam.typehints.with_input_types(types.Extracts)
-@beam.typehints.with_output_types(List[types.Extracts])
-def _GroupByQueryKey(  # pylint: disable=invalid-name
-    extracts: beam.pvalue.PCollection,
-    query_key: Text,
-) -> beam.pvalue.PCollection:
-  """PTransform for grouping extracts by a query key.
-
-  Args:
-    extracts: Incoming PCollection consisting of extracts.
-    query_key: Query key to group extracts by. Must be a member of the dict of
-      features stored under tfma.FEATURES_KEY.
-
-  Returns:
-    PCollection of lists of extracts where each list is associated with same
-    query key.
-  """
-  missing_query_key_counter = beam.metrics.Metrics.counter(
-      constants.METRICS_NAMESPACE, 'missing_query_key')
-
-  def key_by_query_key(
-      extracts: types.Extracts,
-      query_key: Text) -> Optional[Tuple[Text, types.Extracts]]:
-    """Extract the query key from the extract and key by that."""
-    value = metric_util.to_scalar(
-        util.get_by_keys(
-            extracts, [constants.FEATURES_KEY, query_key], optional=True),
-        tensor_name=query_key)
-    if value is None:
-      missing_query_key_counter.inc()
-      return ('', extracts)
-    return ('{}'.format(value), extracts)
-
-  # pylint: disable=no-value-for-parameter
-  return (extracts
-          | 'KeyByQueryId' >> beam.Map(key_by_query_key, query_key)
-          | 'GroupByKey' >> beam.CombinePerKey(beam.combiners.ToListCombineFn())
-          | 'DropQueryId' >> beam.Map(lambda kv: kv[1]))
+def _feature_keys_for_grouping(
+    computations: List[metric_types.MetricComputation]) -> Optional[List[Text]]:
+  """Returns feature keys used by computations (None if unknown)."""
+  feature_keys = []
+  for c in computations:
+    if c.preprocessor is None:
+      continue
+    elif isinstance(c.preprocessor, metric_types.FeaturePreprocessor):
+      for k in c.preprocessor.feature_keys:
+        if k not in feature_keys:
+          feature_keys.append(k)
+    else:
+      # Custom preprocessors may depend on any of the extracts.
+      return None
+  return feature_keys
 
 
 class _PreprocessorDoFn(beam.DoFn):
@@ -312,7 +285,11 @@ class _PreprocessorDoFn(beam.DoFn):
 
 
 class _ComputationsCombineFn(beam.combiners.SingleInputTupleCombineFn):
-  """Combine function that computes metric using initial state from extracts."""
+  """Combine function that computes metric using initial state from extracts.
+
+  The output is a tuple of the outputs of the computations' combiners followed
+  by the number of examples that were combined (i.e. the size of the slice).
+  """
 
   def __init__(self,
                computations: List[metric_types.MetricComputation],
@@ -332,38 +309,99 @@ class _ComputationsCombineFn(beam.combiners.SingleInputTupleCombineFn):
     See:
     http://www.unofficialgoogledatascience.com/2015/08/an-introduction-to-poisson-bootstrap26.html
 
+    The example count is not affected by sampling so that k-anonymity is
+    enforced consistently across the bootstrap samples.
+
     Args:
       computations: List of MetricComputations.
       compute_with_sampling: True to compute with sampling.
       random_seed_for_testing: Seed to use for unit testing.
     """
-    super(_ComputationsCombineFn,
-          self).__init__(*[c.combiner for c in computations])
+    super(_ComputationsCombineFn, self).__init__(
+        *([c.combiner for c in computations] +
+          [beam.combiners.CountCombineFn()]))
     self._compute_with_sampling = compute_with_sampling
     self._random_state = np.random.RandomState(random_seed_for_testing)
 
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    # Each computation's accumulator is encoded by its combiner's coder.
+    return beam.coders.TupleCoder(
+        [c.get_accumulator_coder() for c in self._combiners])
+
   def add_input(self, accumulator, element):
-    elements = [element]
+    num_samples = 1
     if self._compute_with_sampling:
-      elements = [element] * int(self._random_state.poisson(1, 1))
-    if not elements:
-      return accumulator
+      num_samples = int(self._random_state.poisson(1, 1))
 
-    def get_combiner_input(element, i):
+    results = []
+    for i, (c, a) in enumerate(zip(self._combiners[:-1], accumulator[:-1])):
       item = element[_COMBINER_INPUTS_KEY][i]
       if item is None:
         item = element[_DEFAULT_COMBINER_INPUT_KEY]
-      return item
+      for _ in range(num_samples):
+        a = c.add_input(a, item)
+      results.append(a)
+    results.append(self._combiners[-1].add_input(accumulator[-1], element))
+    return results
+
+  def add_inputs(self, accumulator, elements):
+    # Each combiner is given all of its inputs at once so that combiners that
+    # override add_inputs can process them as a batch.
+    elements = list(elements)
+    num_samples = [1] * len(elements)
+    if self._compute_with_sampling:
+      num_samples = [
+          int(self._random_state.poisson(1, 1)) for _ in range(len(elements))
+      ]
 
     results = []
-    for i, (c, a) in enumerate(zip(self._combiners, accumulator)):
-      result = c.add_input(a, get_combiner_input(elements[0], i))
-      for e in elements[1:]:
-        result = c.add_input(result, get_combiner_input(e, i))
-      results.append(result)
+    for i, (c, a) in enumerate(zip(self._combiners[:-1], accumulator[:-1])):
+      items = []
+      for element, n in zip(elements, num_samples):
+        item = element[_COMBINER_INPUTS_KEY][i]
+        if item is None:
+          item = element[_DEFAULT_COMBINER_INPUT_KEY]
+        items.extend([item] * n)
+      results.append(c.add_inputs(a, items))
+    results.append(self._combiners[-1].add_inputs(accumulator[-1], elements))
     return results
 
 
+def _add_derived_values(
+    slice_key: slicer.SliceKeyType, outputs: Tuple[Any, ...],
+    add_derived_values: computation_graph.DerivedMetricsEvaluator,
+    k_anonymization_count: int) -> Dict[Any, Any]:
+  """Returns the metrics for a slice given the _ComputationsCombineFn outputs.
+
+  Args:
+    slice_key: Slice key.
+    outputs: Outputs of the _ComputationsCombineFn (the outputs of the
+      computations followed by the number of examples in the slice).
+    add_derived_values: Evaluator for the derived computations.
+    k_anonymization_count: If the number of examples in the slice (other than
+      the overall slice) is less than k_anonymization_count, an error is
+      returned in place of the metrics.
+
+  Returns:
+    Dict of metrics and plots (private metrics are removed).
+  """
+  if slice_key and outputs[-1] < k_anonymization_count:
+    return {
+        metric_keys.ERROR_METRIC:
+            slicer.small_slice_error_message(k_anonymization_count)
+    }
+  result = {}
+  for v in outputs[:-1]:
+    result.update(v)
+  result = add_derived_values(result)
+  # Remove private metrics
+  keys = list(result.keys())
+  for k in keys:
+    if k.name.startswith('_'):
+      result.pop(k)
+  return result
+
+
 @beam.ptransform_fn
 @beam.typehints.with_input_types(Tuple[slicer.SliceKeyType, types.Extracts])
 @beam.typehints.with_output_types(Tuple[slicer.SliceKeyType,
@@ -373,7 +411,9 @@ def _ComputePerSlice(  # pylint: disable=invalid-name
     computations: List[metric_types.MetricComputation],
     derived_computations: List[metric_types.DerivedMetricComputation],
     compute_with_sampling: Optional[bool] = False,
-    random_seed_for_testing: Optional[int] = None) -> beam.pvalue.PCollection:
+    random_seed_for_testing: Optional[int] = None,
+    k_anonymization_count: int = 1,
+    hot_key_fanout: Optional[int] = None) -> beam.pvalue.PCollection:
   """PTransform for computing, aggregating and combining metrics and plots.
 
   Args:
@@ -382,47 +422,117 @@ def _ComputePerSlice(  # pylint: disable=invalid-name
     derived_computations: List of DerivedMetricComputations.
     compute_with_sampling: True to compute with sampling.
     random_seed_for_testing: Seed to use for unit testing.
+    k_anonymization_count: If the number of examples in a slice (other than the
+      overall slice) is less than k_anonymization_count, an error is returned
+      for that slice in place of its metrics and plots.
+    hot_key_fanout: Optional fanout to use when combining the examples of each
+      slice (see slicer.hot_key_fanout_fn).
 
   Returns:
     PCollection of (slice key, dict of metrics).
   """
   # TODO(b/123516222): Remove this workaround per discussions in CL/227944001
-  sliced_extracts.element_type = beam.typehints.Any
+  # The slice keys are typed so that they are encoded by coders.SliceKeyCoder.
+  sliced_extracts.element_type = beam.typehints.KV[coders.SliceKeyTypeHint,
+                                                   beam.typehints.Any]
+
+  num_distinct_slice_keys = beam.metrics.Metrics.counter(
+      constants.METRICS_NAMESPACE, 'num_distinct_slice_keys')
+  num_examples_per_slice = beam.metrics.Metrics.distribution(
+      constants.METRICS_NAMESPACE, 'num_examples_per_slice')
 
   def convert_and_add_derived_values(
-      sliced_results: Tuple[Text, Tuple[Any, ...]],
-      derived_computations: List[metric_types.DerivedMetricComputation],
+      sliced_results: Tuple[Any, Tuple[Any, ...]],
+      add_derived_values: computation_graph.DerivedMetricsEvaluator,
   ) -> Tuple[slicer.SliceKeyType, Dict[metric_types.MetricKey, Any]]:
     """Converts per slice tuple of dicts into single dict and adds derived."""
-    result = {}
-    for v in sliced_results[1]:
-      result.update(v)
-    for c in derived_computations:
-      result.update(c.result(result))
-    # Remove private metrics
-    keys = list(result.keys())
-    for k in keys:
-      if k.name.startswith('_'):
-        result.pop(k)
-    return (sliced_results[0], result)
+    slice_key, outputs = sliced_results
+    # The last output is the number of examples in the slice.
+    if not compute_with_sampling:
+      num_distinct_slice_keys.inc(1)
+      num_examples_per_slice.update(outputs[-1])
+    return (slice_key,
+            _add_derived_values(slice_key, outputs, add_derived_values,
+                                k_anonymization_count))
+
+  combine_per_slice_key = beam.CombinePerKey(
+      _ComputationsCombineFn(
+          computations=computations,
+          compute_with_sampling=compute_with_sampling,
+          random_seed_for_testing=random_seed_for_testing)).with_hot_key_fanout(
+              slicer.hot_key_fanout_fn(hot_key_fanout))
 
   return (sliced_extracts
-          | 'CombinePerSliceKey' >> beam.CombinePerKey(
-              _ComputationsCombineFn(
-                  computations=computations,
-                  compute_with_sampling=compute_with_sampling,
-                  random_seed_for_testing=random_seed_for_testing))
+          | 'CombinePerSliceKey' >> combine_per_slice_key
           | 'ConvertAndAddDerivedValues' >> beam.Map(
-              convert_and_add_derived_values, derived_computations))
+              convert_and_add_derived_values,
+              computation_graph.DerivedMetricsEvaluator(derived_computations)))
+
 
+def compute_per_slice_in_process(
+    extracts: Iterable[types.Extracts],
+    computations: metric_types.MetricComputations,
+    k_anonymization_count: int = 1
+) -> Dict[slicer.SliceKeyType, Dict[Any, Any]]:
+  """Computes the metrics and plots for each slice without a pipeline.
 
-def _filter_by_key_type(
+  This produces the same metrics and plots as the evaluator for the slices in
+  the SLICE_KEY_TYPES_KEY of the extracts. All the inputs of a slice are added
+  to a single accumulator with one add_inputs call per combiner, so combiners
+  that override add_inputs process each slice as a single batch.
+
+  Args:
+    extracts: Extracts for each example (or a list of extracts for each query
+      when the computations are query based).
+    computations: Computations (e.g. from metric_specs.to_computations).
+    k_anonymization_count: If the number of examples in a slice (other than the
+      overall slice) is less than k_anonymization_count, an error is returned
+      for that slice in place of its metrics and plots.
+
+  Returns:
+    Dict of slice key to dict of metrics and plots.
+  """
+  computations, derived_computations = _filter_and_separate_computations(
+      computations)
+  preprocessor = _PreprocessorDoFn(computations)
+  combine_fn = _ComputationsCombineFn(computations)
+
+  inputs_per_slice = collections.OrderedDict()
+  preprocessor.setup()
+  preprocessor.start_bundle()
+  for e in extracts:
+    for combiner_inputs in preprocessor.process(e):
+      for slice_key in combiner_inputs[constants.SLICE_KEY_TYPES_KEY]:
+        inputs_per_slice.setdefault(slice_key, []).append(combiner_inputs)
+  preprocessor.finish_bundle()
+  preprocessor.teardown()
+
+  add_derived_values = computation_graph.DerivedMetricsEvaluator(
+      derived_computations)
+  result = {}
+  if hasattr(combine_fn, 'setup'):
+    combine_fn.setup()
+  for slice_key, inputs in inputs_per_slice.items():
+    accumulator = combine_fn.add_inputs(combine_fn.create_accumulator(), inputs)
+    outputs = combine_fn.extract_output(accumulator)
+    result[slice_key] = _add_derived_values(slice_key, outputs,
+                                            add_derived_values,
+                                            k_anonymization_count)
+  if hasattr(combine_fn, 'teardown'):
+    combine_fn.teardown()
+  return result
+
+
+def filter_by_key_type(
     sliced_metrics_and_plots: Tuple[slicer.SliceKeyType,
                                     Dict[metric_types.MetricKey, Any]],
     key_type: Type[Union[metric_types.MetricKey, metric_types.PlotKey]]
 ) -> Tuple[slicer.SliceKeyType, Dict[Text, Any]]:
   """Filters metrics and plots by key type."""
   slice_value, metrics_and_plots = sliced_metrics_and_plots
+  if metric_keys.ERROR_METRIC in metrics_and_plots:
+    # Errors (e.g. for slices filtered for k-anonymity) apply to both.
+    return (slice_value, metrics_and_plots)
   output = {}
   for k, v in metrics_and_plots.items():
     # PlotKey is a subclass of MetricKey so must check key_type based on PlotKey
@@ -435,8 +545,15 @@ def _filter_by_key_type(
   return (slice_value, output)
 
 
+def _compute_bootstrap_confidence_intervals(
+    eval_config: config.EvalConfig) -> bool:
+  """Returns true if confidence intervals are computed by bootstrapping."""
+  return (eval_config.options.compute_confidence_intervals.value and
+          not metric_util.compute_analytic_confidence_intervals(eval_config))
+
+
 @beam.ptransform_fn
-@beam.typehints.with_input_types(Union[types.Extracts, List[types.Extracts]])
+@beam.typehints.with_input_types(types.Extracts)
 @beam.typehints.with_output_types(evaluator.Evaluation)
 def _ComputeMetricsAndPlots(  # pylint: disable=invalid-name
     extracts: beam.pvalue.PCollection,
@@ -444,12 +561,12 @@ def _ComputeMetricsAndPlots(  # pylint: disable=invalid-name
     metrics_specs: List[config.MetricsSpec],
     eval_shared_models: Optional[List[types.EvalSharedModel]] = None,
     metrics_key: Text = constants.METRICS_KEY,
-    plots_key: Text = constants.PLOTS_KEY) -> evaluator.Evaluation:
+    plots_key: Text = constants.PLOTS_KEY,
+    query_key: Optional[Text] = None) -> evaluator.Evaluation:
   """Computes metrics and plots.
 
   Args:
-    extracts: PCollection of Extracts. If a query_key was used then the
-      PCollection will contain a list of extracts.
+    extracts: PCollection of Extracts.
     eval_config: Eval config.
     metrics_specs: Subset of the metric specs to compute metrics for. If a
       query_key was used all of the metric specs will be for the same query_key.
@@ -457,6 +574,8 @@ def _ComputeMetricsAndPlots(  # pylint: disable=invalid-name
       metrics are derived or computed using the model.
     metrics_key: Name to use for metrics key in Evaluation output.
     plots_key: Name to use for plots key in Evaluation output.
+    query_key: Optional query key. If set, the extracts will be grouped by the
+      query key before the computations are run.
 
   Returns:
     Evaluation containing dict of PCollections of (slice_key, results_dict)
@@ -472,6 +591,16 @@ def _ComputeMetricsAndPlots(  # pylint: disable=invalid-name
 
   # pylint: disable=no-value-for-parameter
 
+  if query_key:
+    # Input: Single extract per example.
+    # Output: List of (projected) extracts per query_key.
+    extracts = (
+        extracts
+        | 'GroupByQueryKey' >> query_grouping.GroupByQueryKey(
+            query_key,
+            eval_config=eval_config,
+            feature_keys=_feature_keys_for_grouping(computations)))
+
   # Input: Single extract per example (or list of extracts if query_key used)
   #        where each item contains slice keys and other extracts from upstream
   #        extractors (e.g. labels, predictions, etc).
@@ -495,19 +624,20 @@ def _ComputeMetricsAndPlots(  # pylint: disable=invalid-name
   #         example (or list or examples if query_key used) input extract turns
   #         into n logical extracts, references to which are replicated once per
   #         applicable slice key.
-  slices = extracts | 'FanoutSlices' >> slicer.FanoutSlices()
-
-  slices_count = (
-      slices
-      | 'ExtractSliceKeys' >> beam.Keys()
-      | 'CountPerSliceKey' >> beam.combiners.Count.PerElement())
+  #
+  # The distinct slice keys are counted after combining (see _ComputePerSlice)
+  # rather than by FanoutSlices which would require an additional shuffle.
+  slices = extracts | 'FanoutSlices' >> slicer.FanoutSlices(
+      track_distinct_slice_keys=False)
 
   # Input: Tuple of (slice key, combiner input extracts).
   # Output: Tuple of (slice key, dict of computed metrics/plots). The dicts will
   #         be keyed by MetricKey/PlotKey and the values will be the result
   #         of the associated computations. A given MetricComputation can
   #         perform computations for multiple keys, but the keys should be
-  #         unique across computations.
+  #         unique across computations. Slices (other than the overall slice)
+  #         with fewer than k_anonymization_count examples are replaced with an
+  #         error instead.
   sliced_metrics_and_plots = (
       slices
       | 'ComputePerSlice' >> poisson_bootstrap.ComputeWithConfidenceIntervals(
@@ -516,21 +646,20 @@ def _ComputeMetricsAndPlots(  # pylint: disable=invalid-name
           derived_computations=derived_computations,
           num_bootstrap_samples=(
               poisson_bootstrap.DEFAULT_NUM_BOOTSTRAP_SAMPLES if
-              eval_config.options.compute_confidence_intervals.value else 1)))
-
-  if eval_config.options.k_anonymization_count.value > 1:
-    sliced_metrics_and_plots = (
-        sliced_metrics_and_plots
-        | 'FilteForSmallSlices' >> slicer.FilterOutSlices(
-            slices_count, eval_config.options.k_anonymization_count.value))
+              _compute_bootstrap_confidence_intervals(eval_config) else 1),
+          k_anonymization_count=(
+              eval_config.options.k_anonymization_count.value),
+          hot_key_fanout=(eval_config.options.hot_key_fanout.value
+                          if eval_config.options.HasField('hot_key_fanout')
+                          else None)))
 
   sliced_metrics = (
       sliced_metrics_and_plots
-      | 'FilterByMetrics' >> beam.Map(_filter_by_key_type,
+      | 'FilterByMetrics' >> beam.Map(filter_by_key_type,
                                       metric_types.MetricKey))
   sliced_plots = (
       sliced_metrics_and_plots
-      | 'FilterByPlots' >> beam.Map(_filter_by_key_type, metric_types.PlotKey))
+      | 'FilterByPlots' >> beam.Map(filter_by_key_type, metric_types.PlotKey))
 
   # pylint: enable=no-value-for-parameter
 
@@ -582,22 +711,16 @@ def _EvaluateMetricsAndPlots(  # pylint: disable=invalid-name
   evaluations = {}
   for query_key, metrics_specs in metrics_specs_by_query_key.items():
     query_key_text = query_key if query_key else ''
-    if query_key:
-      extracts_for_evaluation = (
-          extracts
-          | 'GroupByQueryKey({})'.format(query_key_text) >>
-          _GroupByQueryKey(query_key))
-    else:
-      extracts_for_evaluation = extracts
     evaluation = (
-        extracts_for_evaluation
+        extracts
         | 'ComputeMetricsAndPlots({})'.format(query_key_text) >>
         _ComputeMetricsAndPlots(
             eval_config=eval_config,
             metrics_specs=metrics_specs,
             eval_shared_models=eval_shared_models,
             metrics_key=metrics_key,
-            plots_key=plots_key))
+            plots_key=plots_key,
+            query_key=query_key))
     for k, v in evaluation.items():
       if k not in evaluations:
         evaluations[k] = []
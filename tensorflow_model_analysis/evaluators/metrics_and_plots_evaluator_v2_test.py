@@ -22,6 +22,7 @@ import os
 
 import apache_beam as beam
 from apache_beam.testing import util
+import numpy as np
 import tensorflow as tf
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis import constants
@@ -37,9 +38,11 @@ from tensorflow_model_analysis.extractors import predict_extractor_v2
 from tensorflow_model_analysis.extractors import slice_key_extractor
 from tensorflow_model_analysis.metrics import calibration
 from tensorflow_model_analysis.metrics import calibration_plot
+from tensorflow_model_analysis.metrics import example_count
 from tensorflow_model_analysis.metrics import metric_specs
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import ndcg
+from tensorflow_model_analysis.post_export_metrics import metric_keys
 from tensorflow_model_analysis.slicer import slicer_lib as slicer
 
 
@@ -160,6 +163,110 @@ class MetricsAndPlotsEvaluatorTest(testutil.TensorflowModelAnalysisTest):
         util.assert_that(
             metrics[constants.METRICS_KEY], check_metrics, label='metrics')
 
+  def testEvaluateWithKAnonymization(self):
+    temp_export_dir = self._getExportDir()
+    _, export_dir = (
+        fixed_prediction_estimator_extra_fields
+        .simple_fixed_prediction_estimator_extra_fields(None, temp_export_dir))
+    options = config.Options()
+    options.k_anonymization_count.value = 2
+    eval_config = config.EvalConfig(
+        model_specs=[
+            config.ModelSpec(
+                location=export_dir,
+                label_key='label',
+                example_weight_key='fixed_float')
+        ],
+        slicing_specs=[
+            config.SlicingSpec(),
+            config.SlicingSpec(feature_keys=['fixed_string']),
+        ],
+        metrics_specs=metric_specs.specs_from_metrics(
+            [calibration.MeanLabel('mean_label')]),
+        options=options)
+    eval_shared_model = self.createTestEvalSharedModel(
+        eval_saved_model_path=export_dir)
+    slice_spec = [
+        slicer.SingleSliceSpec(spec=s) for s in eval_config.slicing_specs
+    ]
+    extractors = [
+        predict_extractor.PredictExtractor(eval_shared_model=eval_shared_model),
+        slice_key_extractor.SliceKeyExtractor(slice_spec=slice_spec)
+    ]
+    evaluators = [
+        metrics_and_plots_evaluator_v2.MetricsAndPlotsEvaluator(
+            eval_config=eval_config, eval_shared_models=[eval_shared_model])
+    ]
+
+    examples = [
+        self._makeExample(
+            prediction=0.2,
+            label=1.0,
+            fixed_int=1,
+            fixed_float=1.0,
+            fixed_string='fixed_string1'),
+        self._makeExample(
+            prediction=0.8,
+            label=0.0,
+            fixed_int=1,
+            fixed_float=1.0,
+            fixed_string='fixed_string1'),
+        self._makeExample(
+            prediction=0.5,
+            label=0.0,
+            fixed_int=2,
+            fixed_float=2.0,
+            fixed_string='fixed_string2')
+    ]
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      metrics = (
+          pipeline
+          | 'Create' >> beam.Create([e.SerializeToString() for e in examples])
+          | 'InputsToExtracts' >> model_eval_lib.InputsToExtracts()
+          | 'ExtractAndEvaluate' >> model_eval_lib.ExtractAndEvaluate(
+              extractors=extractors, evaluators=evaluators))
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_metrics(got):
+        try:
+          self.assertLen(got, 3)
+          slices = {}
+          for slice_key, value in got:
+            slices[slice_key] = value
+          fixed_string1_slice = (('fixed_string', b'fixed_string1'),)
+          fixed_string2_slice = (('fixed_string', b'fixed_string2'),)
+          example_count_key = metric_types.MetricKey(name='example_count')
+          self.assertEqual(slices[()][example_count_key], 3)
+          self.assertEqual(slices[fixed_string1_slice][example_count_key], 2)
+          self.assertEqual(
+              slices[fixed_string2_slice], {
+                  metric_keys.ERROR_METRIC:
+                      'Example count for this slice key is lower than the '
+                      'minimum required value: 2. No data is aggregated for '
+                      'this slice.'
+              })
+
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      def check_plots(got):
+        try:
+          self.assertLen(got, 3)
+          slices = dict(got)
+          self.assertIn(metric_keys.ERROR_METRIC,
+                        slices[(('fixed_string', b'fixed_string2'),)])
+
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(
+          metrics[constants.METRICS_KEY], check_metrics, label='metrics')
+      util.assert_that(
+          metrics[constants.PLOTS_KEY], check_plots, label='plots')
+
   def testEvaluateWithConfidenceIntervals(self):
     # NOTE: This test does not actually test that confidence intervals are
     #   accurate it only tests that the proto output by the test is well formed.
@@ -930,6 +1037,75 @@ class MetricsAndPlotsEvaluatorTest(testutil.TensorflowModelAnalysisTest):
       util.assert_that(
           metrics[constants.METRICS_KEY], check_metrics, label='metrics')
 
+  def testComputePerSliceInProcess(self):
+    extracts = []
+    for label, prediction, language in ((0.0, 0.2, 'english'),
+                                        (1.0, 0.8, 'english'),
+                                        (1.0, 0.6, 'chinese')):
+      extracts.append({
+          constants.LABELS_KEY: np.array([label]),
+          constants.PREDICTIONS_KEY: np.array([prediction]),
+          constants.EXAMPLE_WEIGHTS_KEY: np.array([1.0]),
+          constants.FEATURES_KEY: {
+              'language': np.array([language])
+          },
+          constants.SLICE_KEY_TYPES_KEY: [(), (('language', language),)],
+      })
+    computations = metric_specs.to_computations(
+        metric_specs.specs_from_metrics(
+            [example_count.ExampleCount(),
+             calibration.MeanLabel()]),
+        eval_config=config.EvalConfig())
+
+    got = metrics_and_plots_evaluator_v2.compute_per_slice_in_process(
+        extracts, computations, k_anonymization_count=2)
+
+    example_count_key = metric_types.MetricKey(name='example_count')
+    mean_label_key = metric_types.MetricKey(name='mean_label')
+    self.assertCountEqual(
+        got.keys(), [(), (('language', 'english'),),
+                     (('language', 'chinese'),)])
+    self.assertDictElementsAlmostEqual(got[()], {
+        example_count_key: 3,
+        mean_label_key: 2.0 / 3.0
+    })
+    self.assertDictElementsAlmostEqual(got[(('language', 'english'),)], {
+        example_count_key: 2,
+        mean_label_key: 0.5
+    })
+    self.assertIn(metric_keys.ERROR_METRIC,
+                  got[(('language', 'chinese'),)])
+
+  def testComputationsCombineFnAddInputsMatchesAddInput(self):
+    computations = metric_specs.to_computations(
+        metric_specs.specs_from_metrics([calibration.MeanLabel()]),
+        eval_config=config.EvalConfig())
+    computations, _ = (
+        metrics_and_plots_evaluator_v2._filter_and_separate_computations(  # pylint: disable=protected-access
+            computations))
+    preprocessor = metrics_and_plots_evaluator_v2._PreprocessorDoFn(  # pylint: disable=protected-access
+        computations)
+    combine_fn = metrics_and_plots_evaluator_v2._ComputationsCombineFn(  # pylint: disable=protected-access
+        computations)
+    inputs = []
+    for label in (0.0, 1.0, 1.0):
+      inputs.extend(
+          preprocessor.process({
+              constants.LABELS_KEY: np.array([label]),
+              constants.PREDICTIONS_KEY: np.array([0.5]),
+              constants.EXAMPLE_WEIGHTS_KEY: np.array([1.0]),
+              constants.FEATURES_KEY: {},
+              constants.SLICE_KEY_TYPES_KEY: [()],
+          }))
+
+    expected = combine_fn.create_accumulator()
+    for element in inputs:
+      expected = combine_fn.add_input(expected, element)
+    got = combine_fn.add_inputs(combine_fn.create_accumulator(), inputs)
+
+    self.assertEqual(
+        combine_fn.extract_output(got), combine_fn.extract_output(expected))
+
 
 if __name__ == '__main__':
   tf.compat.v1.enable_v2_behavior()
@@ -19,10 +19,13 @@ from __future__ import division
 from __future__ import print_function
 
 # Standard Imports
+import numbers
+
 import apache_beam as beam
 import numpy as np
 
 from tensorflow_model_analysis import types
+from tensorflow_model_analysis.post_export_metrics import metric_keys
 from tensorflow_model_analysis.slicer import slicer_lib as slicer
 from typing import Any, Dict, Generator, Iterable, List, Optional, Text, Tuple, Type, Union
 
@@ -130,6 +133,13 @@ class _MergeBootstrap(beam.DoFn):
       yield slice_key, metrics[0]
       return
 
+    unsampled_metrics_dict = unsampled_results.get(slice_key, {})
+    if metric_keys.ERROR_METRIC in unsampled_metrics_dict:
+      # No metrics were computed for the slice (e.g. it was filtered out for
+      # k-anonymity).
+      yield slice_key, unsampled_metrics_dict
+      return
+
     # Group the same metrics into one list.
     metrics_dict = {}
     for metric in metrics:
@@ -138,8 +148,6 @@ class _MergeBootstrap(beam.DoFn):
           metrics_dict[metrics_name] = []
         metrics_dict[metrics_name].append(metric[metrics_name])
 
-    unsampled_metrics_dict = unsampled_results.get(slice_key, {})
-
     # The key set of the two metrics dicts must be identical.
     if set(metrics_dict.keys()) != set(unsampled_metrics_dict.keys()):
       raise ValueError('Keys of two metrics do not match: sampled_metrics: %s. '
@@ -154,6 +162,46 @@ class _MergeBootstrap(beam.DoFn):
     yield slice_key, metrics_with_confidence
 
 
+def _calculate_t_distribution_array(
+    sampling_data_list: List[np.ndarray],
+    unsampled_data: np.ndarray) -> types.ValueWithTDistributionArray:
+  """Calculates the confidence intervals of the entries of numeric arrays.
+
+  The samples are stacked so that the t-distribution values for all the entries
+  are computed using a few vectorized NumPy operations. NaN samples are ignored
+  (per entry).
+
+  Args:
+    sampling_data_list: A list of numeric np.ndarrays of the same shape.
+    unsampled_data: Numeric np.ndarray with the same shape as the samples.
+
+  Returns:
+    Confidence interval values stored inside types.ValueWithTDistributionArray.
+  """
+  samples = np.stack(sampling_data_list).astype(np.float64)
+  valid = ~np.isnan(samples)
+  n_samples = np.sum(valid, axis=0)
+  samples[~valid] = 0.0
+  with np.errstate(divide='ignore', invalid='ignore'):
+    sample_mean = np.sum(samples, axis=0) / n_samples
+    squared_errors = np.square(samples - sample_mean)
+    squared_errors[~valid] = 0.0
+    sample_std = np.sqrt(np.sum(squared_errors, axis=0) / (n_samples - 1))
+  # Entries without any (non-NaN) samples have undefined values.
+  no_samples = n_samples == 0
+  sample_std[no_samples] = np.nan
+  unsampled_data = np.array(unsampled_data)
+  if np.any(no_samples):
+    unsampled_data = unsampled_data.astype(np.float64)
+    unsampled_data[no_samples] = np.nan
+  return types.ValueWithTDistributionArray(sample_mean, sample_std,
+                                           n_samples - 1, unsampled_data)
+
+
+def _is_numeric_array(value: Any) -> bool:
+  return isinstance(value, np.ndarray) and value.dtype.kind in 'biuf'
+
+
 def _calculate_t_distribution(  # pylint: disable=invalid-name
     sampling_data_list: List[Union[int, float, np.ndarray]],
     unsampled_data: Union[int, float, np.ndarray]):
@@ -166,10 +214,15 @@ def _calculate_t_distribution(  # pylint: disable=invalid-name
       sampling_data_list.
 
   Returns:
-    Confidence Interval value stored inside
-    types.ValueWithTDistribution.
+    Confidence Interval value stored inside types.ValueWithTDistribution (or
+    types.ValueWithTDistributionArray for numeric arrays). Non-numeric values
+    (e.g. plots) are returned unchanged as the unsampled_data.
   """
-  if isinstance(sampling_data_list[0], (np.ndarray, list)):
+  if (_is_numeric_array(unsampled_data) and
+      all(_is_numeric_array(data) and data.shape == unsampled_data.shape
+          for data in sampling_data_list)):
+    return _calculate_t_distribution_array(sampling_data_list, unsampled_data)
+  elif isinstance(sampling_data_list[0], (np.ndarray, list)):
     merged_data = sampling_data_list[0][:]
     if isinstance(sampling_data_list[0], np.ndarray):
       merged_data = merged_data.astype(object)
@@ -177,6 +230,8 @@ def _calculate_t_distribution(  # pylint: disable=invalid-name
       merged_data[index] = _calculate_t_distribution(
           [data[index] for data in sampling_data_list], unsampled_data[index])
     return merged_data
+  elif not isinstance(unsampled_data, (numbers.Number, np.number, np.bool_)):
+    return unsampled_data
   else:
     # Data has to be numeric. That means throw out nan values.
     sampling_data_list = [
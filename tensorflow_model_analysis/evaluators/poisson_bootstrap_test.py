@@ -22,6 +22,7 @@ import numpy as np
 import tensorflow as tf
 from tensorflow_model_analysis import types
 from tensorflow_model_analysis.evaluators import poisson_bootstrap
+from tensorflow_model_analysis.post_export_metrics import metric_keys
 
 
 class PoissonBootstrapTest(tf.test.TestCase):
@@ -52,7 +53,7 @@ class PoissonBootstrapTest(tf.test.TestCase):
     ])
     result = poisson_bootstrap._calculate_t_distribution(
         sampling_data_list, unsampled_data)
-    self.assertIsInstance(result, np.ndarray)
+    self.assertIsInstance(result, types.ValueWithTDistributionArray)
     self.assertEqual(result.shape, (5, 6))
     self.assertAlmostEqual(result[0][0].sample_mean, 3.5, delta=0.1)
     self.assertAlmostEqual(
@@ -72,7 +73,7 @@ class PoissonBootstrapTest(tf.test.TestCase):
     unsampled_data = np.array([1, 2])
     result = poisson_bootstrap._calculate_t_distribution(
         sampling_data_list, unsampled_data)
-    self.assertIsInstance(result, np.ndarray)
+    self.assertIsInstance(result, types.ValueWithTDistributionArray)
     self.assertEqual(result.tolist(), [
         types.ValueWithTDistribution(
             sample_mean=1.0,
@@ -86,6 +87,33 @@ class PoissonBootstrapTest(tf.test.TestCase):
             unsampled_value=2)
     ])
 
+  def testCalculateConfidenceIntervalMatchesScalarValues(self):
+    random_state = np.random.RandomState(0)
+    sampling_data_list = [random_state.rand(3, 4) for _ in range(5)]
+    sampling_data_list[0][0, 0] = float('nan')
+    for data in sampling_data_list:
+      data[1, 1] = float('nan')
+    unsampled_data = random_state.rand(3, 4)
+    result = poisson_bootstrap._calculate_t_distribution(
+        sampling_data_list, unsampled_data)
+    self.assertEqual(result.shape, (3, 4))
+    for i in range(3):
+      for j in range(4):
+        expected = poisson_bootstrap._calculate_t_distribution(
+            [data[i, j] for data in sampling_data_list], unsampled_data[i, j])
+        self.assertAllClose(result[i, j], expected)
+
+  def testCalculateConfidenceIntervalReturnsUnsampledNonNumericValues(self):
+    self.assertEqual(
+        poisson_bootstrap._calculate_t_distribution([b'a', b'b'], b'c'), b'c')
+
+  def testMergeBootstrapReturnsUnsampledErrors(self):
+    slice_key = (('slice', 1),)
+    error = {metric_keys.ERROR_METRIC: 'error'}
+    result = list(poisson_bootstrap._MergeBootstrap().process(
+        (slice_key, [error, error]), {slice_key: error}))
+    self.assertEqual(result, [(slice_key, error)])
+
 
 if __name__ == '__main__':
   tf.test.main()
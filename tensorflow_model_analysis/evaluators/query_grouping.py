@@ -0,0 +1,442 @@
+# Lint as: python3
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Grouping of extracts by query key for query based metrics."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import os
+import uuid
+
+from typing import Any, Iterator, List, Optional, Text, Tuple, Union
+
+import apache_beam as beam
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis import coders
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import constants
+from tensorflow_model_analysis import types
+from tensorflow_model_analysis import util
+from tensorflow_model_analysis.metrics import metric_util
+
+# Extracts that are always kept when projecting extracts prior to grouping.
+_PROJECTED_KEYS = (constants.LABELS_KEY, constants.PREDICTIONS_KEY,
+                   constants.EXAMPLE_WEIGHTS_KEY, constants.SLICE_KEY_TYPES_KEY)
+
+_SPILL_DIR_NAME = 'tfma_query_grouping'
+
+# Number of examples that are compacted together when the examples held in
+# memory per query are not bounded.
+_COMPACT_BATCH_SIZE = 1000
+
+# Compacted extracts consisting of the key paths of the leaf values shared by
+# all the extracts and a column per path. Columns are stacked NumPy arrays if
+# the leaves of the path are arrays of the same shape and dtype and lists
+# otherwise.
+_CompactExtracts = Tuple[Tuple[Tuple[Text, ...], ...], Tuple[Any, ...]]
+
+# Block of extracts that are compacted if possible. Extracts that do not share
+# the same structure are kept as a list.
+_ExtractsBlock = Union[_CompactExtracts, List[types.Extracts]]
+
+
+def project_extracts(extracts: types.Extracts,
+                     feature_keys: Optional[List[Text]]) -> types.Extracts:
+  """Returns a copy of extracts with only the fields used by ranking metrics.
+
+  Args:
+    extracts: Extracts to project.
+    feature_keys: Keys of the features to keep (e.g. the query key and any gain
+      keys). If None, the extracts are returned unchanged.
+
+  Returns:
+    Extracts containing only the labels, predictions, example weights, slice
+    keys and requested features.
+  """
+  if feature_keys is None:
+    return extracts
+  projected = {}
+  for key in _PROJECTED_KEYS:
+    if key in extracts:
+      projected[key] = extracts[key]
+  features = extracts.get(constants.FEATURES_KEY)
+  if features is not None:
+    projected[constants.FEATURES_KEY] = {
+        k: features[k] for k in feature_keys if k in features
+    }
+  return projected
+
+
+def ranking_score(extracts: types.Extracts,
+                  eval_config: Optional[config.EvalConfig] = None) -> float:
+  """Returns the score used to rank an example within its query.
+
+  The score is the (max) prediction of the candidate model. Multi-output models
+  are not supported.
+
+  Args:
+    extracts: Extracts containing predictions.
+    eval_config: Eval config.
+
+  Raises:
+    ValueError: If predictions for multiple outputs are found.
+  """
+  model_name = ''
+  prediction_key = ''
+  if eval_config and eval_config.model_specs:
+    candidates = [s for s in eval_config.model_specs if not s.is_baseline]
+    spec = candidates[0] if candidates else eval_config.model_specs[0]
+    if len(eval_config.model_specs) > 1:
+      model_name = spec.name
+    prediction_key = spec.prediction_key
+  predictions = extracts.get(constants.PREDICTIONS_KEY)
+  if model_name:
+    predictions = util.get_by_keys(predictions, [model_name])
+  _, predictions = metric_util.prepare_labels_and_predictions(
+      None, predictions, prediction_key)
+  if predictions is None or not predictions.size:
+    return float('-inf')
+  return float(np.max(predictions))
+
+
+def _flatten(value: Any,
+             path: Tuple[Text, ...] = ()) -> Iterator[Tuple[Tuple[Text, ...],
+                                                            Any]]:
+  """Yields the (key path, leaf value) pairs of a nested dict in key order."""
+  if isinstance(value, dict) and value:
+    for key in sorted(value):
+      for item in _flatten(value[key], path + (key,)):
+        yield item
+  else:
+    yield path, value
+
+
+def _stack(values: List[Any]) -> Any:
+  """Returns values stacked into one array if possible else the values."""
+  first = values[0]
+  if (isinstance(first, np.ndarray) and not first.dtype.hasobject and all(
+      isinstance(v, np.ndarray) and v.dtype == first.dtype and
+      v.shape == first.shape for v in values)):
+    return np.stack(values)
+  return values
+
+
+def _compact(extracts: List[types.Extracts]) -> _ExtractsBlock:
+  """Compacts extracts into an array per key path.
+
+  Args:
+    extracts: Extracts to compact.
+
+  Returns:
+    Compacted extracts or the extracts themselves if they are empty or do not
+    share the same structure.
+  """
+  paths = None
+  columns = None
+  for e in extracts:
+    items = list(_flatten(e))
+    row_paths = tuple(path for path, _ in items)
+    if paths is None:
+      if not row_paths or not all(row_paths):
+        return extracts
+      paths = row_paths
+      columns = [[] for _ in paths]
+    elif row_paths != paths:
+      return extracts
+    for column, (_, value) in zip(columns, items):
+      column.append(value)
+  if paths is None:
+    return extracts
+  return (paths, tuple(_stack(column) for column in columns))
+
+
+def _expand(block: _ExtractsBlock) -> List[types.Extracts]:
+  """Returns the extracts stored in a block.
+
+  The values of the returned extracts are views into the block's arrays.
+
+  Args:
+    block: Block of extracts as returned by _compact.
+  """
+  if isinstance(block, list):
+    return block
+  paths, columns = block
+  result = []
+  for i in range(len(columns[0])):
+    extracts = {}
+    for path, column in zip(paths, columns):
+      parent = extracts
+      for key in path[:-1]:
+        parent = parent.setdefault(key, {})
+      parent[path[-1]] = column[i]
+    result.append(extracts)
+  return result
+
+
+class _QueryAccumulator(object):
+  """Accumulator for the examples associated with a single query.
+
+  Recently added examples are held as extracts. When truncating, these are the
+  only examples held. Otherwise, they are periodically compacted into blocks
+  that are either held in memory or written to spill files whose paths are kept
+  in the accumulator.
+  """
+
+  __slots__ = ['extracts', 'scores', 'blocks', 'spill_files', 'num_truncated']
+
+  def __init__(self):
+    self.extracts = []  # type: List[types.Extracts]
+    self.scores = []  # type: List[float]
+    self.blocks = []  # type: List[_ExtractsBlock]
+    self.spill_files = []  # type: List[Text]
+    self.num_truncated = 0
+
+
+class _QueryExamplesCombineFn(beam.CombineFn):
+  """Combines the (projected) extracts for a query into a list.
+
+  Without max_examples_in_memory, the extracts are compacted into blocks of
+  stacked NumPy arrays (one per key path) as they are added so that large
+  queries are not held as one dict of small arrays per example.
+
+  With max_examples_in_memory, the examples held per query are bounded. When
+  truncating, the extracts are reduced to the top scoring
+  max_examples_in_memory examples whenever twice that many are held (so the
+  partition is not recomputed for every added example). Otherwise, each
+  max_examples_in_memory extracts are compacted and written to a spill file
+  under spill_dir.
+
+  The output is a tuple of the extracts of the query and the paths of the
+  spill files they were read from. extract_output does not delete the spill
+  files (so that it can be retried), they are deleted by GroupByQueryKey once
+  the grouped queries have been committed.
+
+  Ranking metrics are computed over all the examples of a query, so the output
+  for a query is materialized in full (as views into the compacted arrays) and
+  the memory used for a single query is only bounded when truncating. Spilling
+  bounds the memory of the accumulators, which matters because the precombine
+  phase may hold accumulators for many queries at once. Accumulators and spill
+  files are encoded using an ExtractsCoder for the given feature_keys.
+  """
+
+  def __init__(self,
+               eval_config: Optional[config.EvalConfig] = None,
+               max_examples_in_memory: Optional[int] = None,
+               truncate: bool = False,
+               spill_dir: Optional[Text] = None,
+               feature_keys: Optional[List[Text]] = None):
+    if max_examples_in_memory and not truncate and not spill_dir:
+      raise ValueError(
+          'spill_dir is required when max_examples_in_memory is set and '
+          'truncate is False')
+    self._eval_config = eval_config
+    self._feature_keys = feature_keys
+    self._max_examples_in_memory = max_examples_in_memory
+    self._truncate = truncate
+    self._spill_dir = spill_dir
+    self._spill_coder = coders.ExtractsCoder(feature_keys)
+    self._query_size = beam.metrics.Metrics.distribution(
+        constants.METRICS_NAMESPACE, 'query_size')
+    self._num_spilled_examples = beam.metrics.Metrics.counter(
+        constants.METRICS_NAMESPACE, 'num_spilled_query_examples')
+    self._num_truncated_examples = beam.metrics.Metrics.counter(
+        constants.METRICS_NAMESPACE, 'num_truncated_query_examples')
+
+  def _maybe_reduce(self, accumulator: _QueryAccumulator):
+    """Truncates, compacts or spills the extracts if there are too many."""
+    if self._truncate:
+      if (self._max_examples_in_memory and
+          len(accumulator.extracts) >= 2 * self._max_examples_in_memory):
+        self._truncate_extracts(accumulator)
+      return
+    batch_size = self._max_examples_in_memory or _COMPACT_BATCH_SIZE
+    if len(accumulator.extracts) < batch_size:
+      return
+    block = _compact(accumulator.extracts)
+    if self._max_examples_in_memory:
+      accumulator.spill_files.append(self._spill(block))
+      self._num_spilled_examples.inc(len(accumulator.extracts))
+    else:
+      accumulator.blocks.append(block)
+    accumulator.extracts = []
+
+  def _truncate_extracts(self, accumulator: _QueryAccumulator):
+    """Keeps the top max_examples_in_memory scoring extracts."""
+    if len(accumulator.extracts) <= self._max_examples_in_memory:
+      return
+    scores = np.array(accumulator.scores)
+    keep = np.argpartition(-scores, self._max_examples_in_memory -
+                           1)[:self._max_examples_in_memory]
+    keep.sort()  # Preserve arrival order.
+    num_truncated = len(accumulator.extracts) - len(keep)
+    accumulator.extracts = [accumulator.extracts[i] for i in keep]
+    accumulator.scores = scores[keep].tolist()
+    accumulator.num_truncated += num_truncated
+    self._num_truncated_examples.inc(num_truncated)
+
+  def _spill(self, block: _ExtractsBlock) -> Text:
+    """Writes a block of extracts to a new spill file and returns its path."""
+    spill_dir = os.path.join(self._spill_dir, _SPILL_DIR_NAME)
+    if not tf.io.gfile.exists(spill_dir):
+      tf.io.gfile.makedirs(spill_dir)
+    path = os.path.join(spill_dir, uuid.uuid4().hex)
+    with tf.io.gfile.GFile(path, 'wb') as f:
+      f.write(self._spill_coder.encode(block))
+    return path
+
+  def _read_spill_file(self, path: Text) -> _ExtractsBlock:
+    with tf.io.gfile.GFile(path, 'rb') as f:
+      return self._spill_coder.decode(f.read())
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return coders.AccumulatorCoder(_QueryAccumulator, self._spill_coder)
+
+  def create_accumulator(self) -> _QueryAccumulator:
+    return _QueryAccumulator()
+
+  def add_input(self, accumulator: _QueryAccumulator,
+                extracts: types.Extracts) -> _QueryAccumulator:
+    accumulator.extracts.append(extracts)
+    if self._truncate:
+      accumulator.scores.append(ranking_score(extracts, self._eval_config))
+    self._maybe_reduce(accumulator)
+    return accumulator
+
+  def merge_accumulators(
+      self, accumulators: List[_QueryAccumulator]) -> _QueryAccumulator:
+    result = self.create_accumulator()
+    for accumulator in accumulators:
+      result.extracts.extend(accumulator.extracts)
+      result.scores.extend(accumulator.scores)
+      result.blocks.extend(accumulator.blocks)
+      result.spill_files.extend(accumulator.spill_files)
+      result.num_truncated += accumulator.num_truncated
+      # Reduce within the loop to avoid holding all the merged examples.
+      self._maybe_reduce(result)
+    return result
+
+  def extract_output(
+      self, accumulator: _QueryAccumulator
+  ) -> Tuple[List[types.Extracts], List[Text]]:
+    if self._truncate and self._max_examples_in_memory:
+      self._truncate_extracts(accumulator)
+    result = []
+    for block in accumulator.blocks:
+      result.extend(_expand(block))
+    for path in accumulator.spill_files:
+      result.extend(_expand(self._read_spill_file(path)))
+    result.extend(accumulator.extracts)
+    self._query_size.update(len(result) + accumulator.num_truncated)
+    return (result, list(accumulator.spill_files))
+
+
+def _delete_spill_file(path: Text):
+  """Deletes a spill file (if not already deleted by a previous attempt)."""
+  try:
+    tf.io.gfile.remove(path)
+  except tf.errors.NotFoundError:
+    pass
+
+
+@beam.ptransform_fn
+@beam.typehints.with_input_types(types.Extracts)
+@beam.typehints.with_output_types(List[types.Extracts])
+def GroupByQueryKey(  # pylint: disable=invalid-name
+    extracts: beam.pvalue.PCollection,
+    query_key: Text,
+    eval_config: Optional[config.EvalConfig] = None,
+    feature_keys: Optional[List[Text]] = None) -> beam.pvalue.PCollection:
+  """PTransform for grouping extracts by a query key.
+
+  Prior to grouping, the extracts are projected down to the labels,
+  predictions, example weights, slice keys and the features given by
+  feature_keys so that only the data needed by the metrics is held per query.
+  The memory used per query during grouping can be bounded using the
+  query_grouping options in eval_config.options.
+
+  Args:
+    extracts: Incoming PCollection consisting of extracts.
+    query_key: Query key to group extracts by. Must be a member of the dict of
+      features stored under tfma.FEATURES_KEY.
+    eval_config: Eval config.
+    feature_keys: Keys of the features to keep when projecting the extracts
+      (the query_key is always kept). If None, the extracts are not projected.
+
+  Returns:
+    PCollection of lists of extracts where each list is associated with same
+    query key.
+  """
+  missing_query_key_counter = beam.metrics.Metrics.counter(
+      constants.METRICS_NAMESPACE, 'missing_query_key')
+
+  def key_by_query_key(extracts: types.Extracts,
+                       query_key: Text) -> Tuple[Text, types.Extracts]:
+    """Extract the query key from the extract and key by that."""
+    value = metric_util.to_scalar(
+        util.get_by_keys(
+            extracts, [constants.FEATURES_KEY, query_key], optional=True),
+        tensor_name=query_key)
+    if value is None:
+      missing_query_key_counter.inc()
+      return ('', extracts)
+    return ('{}'.format(value), extracts)
+
+  if feature_keys is not None and query_key not in feature_keys:
+    feature_keys = [query_key] + list(feature_keys)
+
+  max_examples_in_memory = None
+  truncate = False
+  spill_dir = None
+  if eval_config is not None:
+    options = eval_config.options
+    if options.query_grouping.HasField('max_examples_in_memory'):
+      max_examples_in_memory = (
+          options.query_grouping.max_examples_in_memory.value)
+    truncate = options.query_grouping.truncate
+    spill_dir = options.tmp_dir or None
+    if max_examples_in_memory and not truncate and spill_dir is None:
+      raise ValueError(
+          'options.tmp_dir must be set to spill the examples of large queries '
+          'when options.query_grouping.max_examples_in_memory is set without '
+          'options.query_grouping.truncate: eval_config={}'.format(eval_config))
+
+  # pylint: disable=no-value-for-parameter
+  queries = (
+      extracts
+      | 'ProjectExtracts' >> beam.Map(project_extracts, feature_keys)
+      | 'KeyByQueryId' >> beam.Map(key_by_query_key, query_key)
+      | 'GroupByKey' >> beam.CombinePerKey(
+          _QueryExamplesCombineFn(
+              eval_config=eval_config,
+              max_examples_in_memory=max_examples_in_memory,
+              truncate=truncate,
+              spill_dir=spill_dir,
+              feature_keys=feature_keys))
+      | 'DropQueryId' >> beam.Map(lambda kv: kv[1]))
+
+  if max_examples_in_memory and not truncate:
+    # The spill files are deleted after a reshuffle so that they are only
+    # deleted once the queries read from them have been committed (a retry of
+    # the grouping can still read them).
+    _ = (
+        queries
+        | 'GetSpillFiles' >> beam.FlatMap(lambda query: query[1])
+        | 'ReshuffleSpillFiles' >> beam.Reshuffle()
+        | 'DeleteSpillFiles' >> beam.Map(_delete_spill_file))
+
+  return queries | 'DropSpillFiles' >> beam.Map(lambda query: query[0])
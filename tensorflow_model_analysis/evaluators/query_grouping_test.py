@@ -0,0 +1,233 @@
+# Lint as: python3
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for query grouping."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import apache_beam as beam
+from apache_beam.testing import util
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import constants
+from tensorflow_model_analysis.eval_saved_model import testutil
+from tensorflow_model_analysis.evaluators import query_grouping
+
+
+def _make_extracts(query, prediction, gain=1.0):
+  return {
+      constants.INPUT_KEY: b'serialized example',
+      constants.LABELS_KEY: np.array([1.0]),
+      constants.PREDICTIONS_KEY: np.array([prediction]),
+      constants.EXAMPLE_WEIGHTS_KEY: np.array([1.0]),
+      constants.SLICE_KEY_TYPES_KEY: [()],
+      constants.FEATURES_KEY: {
+          'query': np.array([query]),
+          'gain': np.array([gain]),
+          'unused': np.array(['large feature'])
+      }
+  }
+
+
+class QueryGroupingTest(testutil.TensorflowModelAnalysisTest):
+
+  def testProjectExtracts(self):
+    extracts = _make_extracts('query1', 0.5)
+    projected = query_grouping.project_extracts(extracts, ['query', 'gain'])
+    self.assertCountEqual(projected.keys(), [
+        constants.LABELS_KEY, constants.PREDICTIONS_KEY,
+        constants.EXAMPLE_WEIGHTS_KEY, constants.SLICE_KEY_TYPES_KEY,
+        constants.FEATURES_KEY
+    ])
+    self.assertCountEqual(projected[constants.FEATURES_KEY].keys(),
+                          ['query', 'gain'])
+    self.assertIs(
+        query_grouping.project_extracts(extracts, None), extracts)
+
+  def testRankingScore(self):
+    eval_config = config.EvalConfig(model_specs=[
+        config.ModelSpec(name='baseline', is_baseline=True),
+        config.ModelSpec(name='candidate')
+    ])
+    extracts = {
+        constants.PREDICTIONS_KEY: {
+            'baseline': np.array([0.1]),
+            'candidate': np.array([0.7])
+        }
+    }
+    self.assertAlmostEqual(
+        query_grouping.ranking_score(extracts, eval_config), 0.7)
+
+  def testCompactAndExpand(self):
+    extracts = [_make_extracts('query1', p, gain=p) for p in (0.1, 0.2, 0.3)]
+    block = query_grouping._compact(extracts)
+    self.assertIsInstance(block, tuple)
+    paths, columns = block
+    predictions = columns[paths.index((constants.PREDICTIONS_KEY,))]
+    self.assertIsInstance(predictions, np.ndarray)
+    self.assertEqual(predictions.shape, (3, 1))
+    expanded = query_grouping._expand(block)
+    self.assertLen(expanded, 3)
+    for got, expected in zip(expanded, extracts):
+      self.assertCountEqual(got.keys(), expected.keys())
+      self.assertEqual(got[constants.INPUT_KEY], expected[constants.INPUT_KEY])
+      self.assertEqual(got[constants.SLICE_KEY_TYPES_KEY],
+                       expected[constants.SLICE_KEY_TYPES_KEY])
+      for key in (constants.LABELS_KEY, constants.PREDICTIONS_KEY):
+        self.assertAllClose(got[key], expected[key])
+      for key in ('query', 'gain', 'unused'):
+        self.assertAllEqual(got[constants.FEATURES_KEY][key],
+                            expected[constants.FEATURES_KEY][key])
+
+  def testCompactKeepsHeterogeneousExtracts(self):
+    extracts = [
+        _make_extracts('query1', 0.1), {
+            constants.PREDICTIONS_KEY: np.array([0.2])
+        }
+    ]
+    self.assertIs(query_grouping._compact(extracts), extracts)
+    self.assertIs(query_grouping._expand(extracts), extracts)
+
+  def testCombinerTruncatesToTopScoringExamples(self):
+    combiner = query_grouping._QueryExamplesCombineFn(
+        max_examples_in_memory=2, truncate=True)
+    accumulators = []
+    for predictions in ([0.1, 0.9, 0.5], [0.7, 0.2, 0.3, 0.4]):
+      accumulator = combiner.create_accumulator()
+      for p in predictions:
+        accumulator = combiner.add_input(accumulator,
+                                         _make_extracts('query1', p))
+      # Extracts are only truncated once twice the max is held.
+      self.assertLess(len(accumulator.extracts), 4)
+      accumulators.append(accumulator)
+    self.assertLen(accumulators[0].extracts, 3)
+    self.assertLen(accumulators[1].extracts, 2)
+    result, spill_files = combiner.extract_output(
+        combiner.merge_accumulators(accumulators))
+    self.assertCountEqual(
+        [e[constants.PREDICTIONS_KEY][0] for e in result], [0.9, 0.7])
+    self.assertEmpty(spill_files)
+
+  def testCombinerCompactsExtracts(self):
+    combiner = query_grouping._QueryExamplesCombineFn()
+    accumulator = combiner.create_accumulator()
+    num_examples = query_grouping._COMPACT_BATCH_SIZE + 1
+    for i in range(num_examples):
+      accumulator = combiner.add_input(accumulator,
+                                       _make_extracts('query1', float(i)))
+    self.assertLen(accumulator.blocks, 1)
+    self.assertLen(accumulator.extracts, 1)
+    result, _ = combiner.extract_output(
+        combiner.merge_accumulators([accumulator]))
+    self.assertEqual([e[constants.PREDICTIONS_KEY][0] for e in result],
+                     [float(i) for i in range(num_examples)])
+
+  def testCombinerSpillsToDisk(self):
+    combiner = query_grouping._QueryExamplesCombineFn(
+        max_examples_in_memory=2, spill_dir=self._getTempDir())
+    accumulator = combiner.create_accumulator()
+    for p in (0.1, 0.2, 0.3, 0.4, 0.5):
+      accumulator = combiner.add_input(accumulator, _make_extracts('query1', p))
+    self.assertLess(len(accumulator.extracts), 2)
+    self.assertLen(accumulator.spill_files, 2)
+    accumulator = combiner.merge_accumulators([accumulator])
+    result, spill_files = combiner.extract_output(accumulator)
+    self.assertCountEqual([e[constants.PREDICTIONS_KEY][0] for e in result],
+                          [0.1, 0.2, 0.3, 0.4, 0.5])
+    self.assertCountEqual(spill_files, accumulator.spill_files)
+    # The spill files are kept so that extract_output can be retried.
+    retried_result, _ = combiner.extract_output(accumulator)
+    self.assertCountEqual(
+        [e[constants.PREDICTIONS_KEY][0] for e in retried_result],
+        [0.1, 0.2, 0.3, 0.4, 0.5])
+
+  def testCombinerRequiresSpillDir(self):
+    with self.assertRaisesRegex(ValueError, 'spill_dir is required'):
+      query_grouping._QueryExamplesCombineFn(max_examples_in_memory=2)
+
+  def testGroupByQueryKey(self):
+    extracts = [
+        _make_extracts('query1', 0.1),
+        _make_extracts('query2', 0.2),
+        _make_extracts('query1', 0.3),
+    ]
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create(extracts)
+          | 'GroupByQueryKey' >> query_grouping.GroupByQueryKey(
+              'query', feature_keys=['gain']))
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 2)
+          by_query = {}
+          for query_extracts in got:
+            query = query_extracts[0][constants.FEATURES_KEY]['query'][0]
+            by_query[query] = query_extracts
+            for e in query_extracts:
+              self.assertNotIn(constants.INPUT_KEY, e)
+              self.assertCountEqual(e[constants.FEATURES_KEY].keys(),
+                                    ['query', 'gain'])
+          self.assertCountEqual(
+              [e[constants.PREDICTIONS_KEY][0] for e in by_query['query1']],
+              [0.1, 0.3])
+          self.assertCountEqual(
+              [e[constants.PREDICTIONS_KEY][0] for e in by_query['query2']],
+              [0.2])
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result)
+
+  def testGroupByQueryKeyDeletesSpillFiles(self):
+    tmp_dir = self._getTempDir()
+    eval_config = config.EvalConfig()
+    eval_config.options.tmp_dir = tmp_dir
+    eval_config.options.query_grouping.max_examples_in_memory.value = 1
+    extracts = [_make_extracts('query1', p) for p in (0.1, 0.2, 0.3)]
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create(extracts)
+          | 'GroupByQueryKey' >> query_grouping.GroupByQueryKey(
+              'query', eval_config=eval_config, feature_keys=['gain']))
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          self.assertCountEqual(
+              [e[constants.PREDICTIONS_KEY][0] for e in got[0]],
+              [0.1, 0.2, 0.3])
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result)
+
+    spill_files = []
+    for _, _, filenames in tf.io.gfile.walk(tmp_dir):
+      spill_files.extend(filenames)
+    self.assertEmpty(spill_files)
+
+
+if __name__ == '__main__':
+  tf.test.main()
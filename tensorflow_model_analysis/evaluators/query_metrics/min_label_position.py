@@ -25,9 +25,11 @@ from __future__ import division
 from __future__ import print_function
 
 import apache_beam as beam
+import numpy as np
 from tensorflow_model_analysis.eval_saved_model import constants as eval_saved_model_constants
 from tensorflow_model_analysis.eval_saved_model import util as eval_saved_model_util
 from tensorflow_model_analysis.evaluators.query_metrics import query_types
+from tensorflow_model_analysis.metrics import query_ranking
 from tensorflow_model_analysis.post_export_metrics import metric_keys
 
 from typing import Any, Dict, List, NamedTuple, Text
@@ -109,11 +111,9 @@ class MinLabelPositionCombineFn(beam.CombineFn):
                            (query_fpl.query_id, weights))
         weight = weights[0]
 
-    min_label_pos = None
-    for pos, fpl in enumerate(query_fpl.fpls):
-      if self._get_label(fpl) > 0:
-        min_label_pos = pos + 1  # Use 1-indexed positions
-        break
+    # The fpls are already sorted by prediction.
+    min_label_pos = query_ranking.min_label_position(
+        np.array([np.any(self._get_label(fpl) > 0) for fpl in query_fpl.fpls]))
 
     state_to_add = _State(min_pos_sum=0.0, weight_sum=0.0)
     if min_label_pos:
@@ -31,9 +31,10 @@ from __future__ import print_function
 import apache_beam as beam
 import numpy as np
 from tensorflow_model_analysis.evaluators.query_metrics import query_types
+from tensorflow_model_analysis.metrics import query_ranking
 from tensorflow_model_analysis.post_export_metrics import metric_keys
 
-from typing import Any, Dict, List, NamedTuple, Text, Tuple
+from typing import Any, Dict, List, NamedTuple, Text
 
 _State = NamedTuple('_State', [('ndcg', Dict[int, float]), ('weight', float)])
 
@@ -78,44 +79,6 @@ class NdcgMetricCombineFn(beam.CombineFn):
     self._gain_key = gain_key
     self._weight_key = weight_key
 
-  def _calculate_dcg_at_k(self, k: int, sorted_values: List[float]) -> float:
-    """Calculate the value of DCG@k.
-
-    Args:
-      k: The last position to consider.
-      sorted_values: A list of gain values assumed to be sorted in the desired
-        ranking order.
-
-    Returns:
-      The value of DCG@k.
-    """
-    return np.sum(
-        np.array(sorted_values)[:k] / np.log2(np.array(range(2, k + 2))))
-
-  def _calculate_ndcg(self, values: List[Tuple[int, float]], k: int) -> float:
-    """Calculate nDCG@k, based on given rank and gain values.
-
-    Args:
-      values: A list of tuples representing rank order and gain values.
-      k: The maximum position to consider in calculating nDCG
-
-    Returns:
-      The value of nDCG@k, for the given list of values.
-    """
-    max_rank = min(k, len(values))
-    ranked_values = [
-        gain for _, gain in sorted(values, key=lambda x: x[0], reverse=False)
-    ]
-    optimal_values = [
-        gain for _, gain in sorted(values, key=lambda x: x[1], reverse=True)
-    ]
-    dcg = self._calculate_dcg_at_k(max_rank, ranked_values)
-    optimal_dcg = self._calculate_dcg_at_k(max_rank, optimal_values)
-    if optimal_dcg > 0:
-      return dcg / optimal_dcg
-    else:
-      return 0
-
   def _new_ndcg_dict(self):
     return dict.fromkeys(self._at_vals, 0)
 
@@ -143,11 +106,13 @@ class NdcgMetricCombineFn(beam.CombineFn):
                            (query_fpl.query_id, weights))
         weight = weights[0]
 
-    ndcg_dict = {}
-    for at in self._at_vals:
-      rank_gain = [(pos + 1, float(_get_feature_value(fpl, self._gain_key)))
-                   for pos, fpl in enumerate(query_fpl.fpls)]
-      ndcg_dict[at] = self._calculate_ndcg(rank_gain, at) * weight
+    # The fpls are already sorted by prediction.
+    gains = np.array([
+        float(_get_feature_value(fpl, self._gain_key))
+        for fpl in query_fpl.fpls
+    ])
+    ndcg_values = query_ranking.ndcg_at_top_ks(gains, self._at_vals) * weight
+    ndcg_dict = dict(zip(self._at_vals, ndcg_values.tolist()))
 
     return self._add_states(accumulator, _State(ndcg=ndcg_dict, weight=weight))
 
@@ -0,0 +1,372 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Evaluator for discovering problem slices.
+
+Rather than computing metrics for every slice in the cartesian product of the
+candidate columns, the slices are explored level by level (slices crossing one
+column, then two columns, etc). Each slice is only expanded further if it has
+at least a minimum number of examples and its metric diverges significantly
+from the metric of its parent slice. A slice with columns c_1 < ... < c_n
+(ordered as in feature_keys) is expanded only by columns that come after c_n,
+so each slice has a single parent: the slice without its column c_n.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import copy
+import math
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+import apache_beam as beam
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import constants
+from tensorflow_model_analysis import types
+from tensorflow_model_analysis.evaluators import evaluator
+from tensorflow_model_analysis.evaluators import metrics_and_plots_evaluator_v2
+from tensorflow_model_analysis.extractors import slice_key_extractor
+from tensorflow_model_analysis.metrics import metric_specs
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.slicer import slicer_lib as slicer
+
+DEFAULT_MAX_DEPTH = 2
+DEFAULT_MIN_NUM_EXAMPLES = 100
+
+
+def SliceDiscoveryEvaluator(  # pylint: disable=invalid-name
+    eval_config: config.EvalConfig,
+    feature_keys: List[Text],
+    metric_key: metric_types.MetricKey,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    min_num_examples: int = DEFAULT_MIN_NUM_EXAMPLES,
+    min_divergence: float = 0.0,
+    higher_is_better: Optional[bool] = None,
+    eval_shared_models: Optional[List[types.EvalSharedModel]] = None,
+    key: Text = constants.SLICE_DISCOVERY_KEY,
+    run_after: Text = slice_key_extractor.SLICE_KEY_EXTRACTOR_STAGE_NAME
+) -> evaluator.Evaluator:
+  """Creates an Evaluator for discovering problem slices.
+
+  The metrics in eval_config.metrics_specs are computed for every candidate
+  slice, so the metrics specs should be limited to the target metric (e.g.
+  tfma.metrics.specs_from_metrics([tfma.metrics.MeanLabel()])). The slicing
+  specs in the eval_config are ignored. Confidence intervals are always
+  computed using the ANALYTIC method: a slice diverges significantly from its
+  parent if the value of the parent lies outside of the confidence interval of
+  the slice. Metrics without analytic confidence intervals only use the
+  min_divergence criterion.
+
+  Args:
+    eval_config: Eval config.
+    feature_keys: Candidate columns to cross. The slices are expanded by the
+      columns in this order.
+    metric_key: Key of the (scalar) metric used to decide which slices diverge
+      from their parent.
+    max_depth: Maximum number of columns crossed by a slice. This is also the
+      number of passes over the extracts in addition to the pass computing the
+      overall slice.
+    min_num_examples: Slices with fewer (unweighted) examples are pruned.
+    min_divergence: Slices whose metric differs from the metric of their parent
+      by at most min_divergence are pruned.
+    higher_is_better: If True (False), only slices whose metric is lower
+      (higher) than the metric of their parent are kept. If None, divergence in
+      either direction is kept.
+    eval_shared_models: Optional shared model instances. Required if any of the
+      metrics are derived or computed using the model.
+    key: Name to use for key in Evaluation output.
+    run_after: Extractor to run after (None means before any extractors).
+
+  Returns:
+    Evaluator for discovering problem slices. The output is stored under the
+    key 'slice_discovery' as a PCollection of (slice_key, dict of metrics)
+    tuples for the overall slice and each of the slices that were kept.
+
+  Raises:
+    ValueError: If the arguments are invalid.
+  """
+  if not feature_keys:
+    raise ValueError('feature_keys must not be empty')
+  if len(set(feature_keys)) != len(feature_keys):
+    raise ValueError('feature_keys must be unique: {}'.format(feature_keys))
+  if max_depth < 1:
+    raise ValueError('max_depth must be positive, got {}'.format(max_depth))
+  if any(spec.query_key for spec in eval_config.metrics_specs):
+    raise ValueError('query based metrics are not supported by the '
+                     'SliceDiscoveryEvaluator')
+  # pylint: disable=no-value-for-parameter
+  return evaluator.Evaluator(
+      stage_name='DiscoverSlices',
+      run_after=run_after,
+      ptransform=_DiscoverSlices(
+          eval_config=eval_config,
+          feature_keys=feature_keys,
+          metric_key=metric_key,
+          max_depth=max_depth,
+          min_num_examples=min_num_examples,
+          min_divergence=min_divergence,
+          higher_is_better=higher_is_better,
+          eval_shared_models=eval_shared_models,
+          key=key))
+  # pylint: enable=no-value-for-parameter
+
+
+def _parent_slice_key(slice_key: slicer.SliceKeyType,
+                      key_index: Dict[Text, int]) -> slicer.SliceKeyType:
+  """Returns the slice key without its last column (in feature_keys order)."""
+  last = max(slice_key, key=lambda x: key_index[x[0]])
+  return tuple(x for x in slice_key if x != last)
+
+
+def _child_slice_keys(
+    slice_key: slicer.SliceKeyType,
+    single_slice_keys: Dict[Text, List[slicer.SliceKeyType]],
+    feature_keys: List[Text],
+    key_index: Dict[Text, int]) -> Iterable[slicer.SliceKeyType]:
+  """Yields the children of slice key that apply to an example.
+
+  Args:
+    slice_key: Slice key to expand.
+    single_slice_keys: Single column slice keys that apply to the example keyed
+      by column.
+    feature_keys: Candidate columns.
+    key_index: Index of each column in feature_keys.
+  """
+  start = 0
+  if slice_key:
+    start = max(key_index[column] for column, _ in slice_key) + 1
+  for column in feature_keys[start:]:
+    for single_slice_key in single_slice_keys.get(column, []):
+      yield tuple(sorted(slice_key + single_slice_key))
+
+
+def _candidate_slice_keys(
+    single_slice_keys: Dict[Text, List[slicer.SliceKeyType]],
+    kept_slice_keys: Dict[slicer.SliceKeyType, Any], depth: int,
+    feature_keys: List[Text],
+    key_index: Dict[Text, int]) -> List[slicer.SliceKeyType]:
+  """Returns the slice keys crossing depth columns to compute for an example.
+
+  Args:
+    single_slice_keys: Single column slice keys that apply to the example keyed
+      by column.
+    kept_slice_keys: Slice keys that were kept at the previous depths.
+    depth: Number of columns crossed by the candidate slices.
+    feature_keys: Candidate columns.
+    key_index: Index of each column in feature_keys.
+  """
+  parents = [()]
+  for _ in range(depth - 1):
+    parents = [
+        child for parent in parents for child in _child_slice_keys(
+            parent, single_slice_keys, feature_keys, key_index)
+        if child in kept_slice_keys
+    ]
+  return [
+      child for parent in parents for child in _child_slice_keys(
+          parent, single_slice_keys, feature_keys, key_index)
+  ]
+
+
+def _point_value(value: Any) -> float:
+  if isinstance(value, types.ValueWithConfidenceInterval):
+    return float(value.value)
+  return float(value)
+
+
+def _diverges(value: Any, parent_value: float, min_divergence: float,
+              higher_is_better: Optional[bool]) -> bool:
+  """Returns true if value diverges significantly from the parent value.
+
+  Args:
+    value: Value of the metric for a slice. If the value has a confidence
+      interval the parent value must lie outside of it.
+    parent_value: Value of the metric for the parent slice.
+    min_divergence: Minimum absolute difference between the values.
+    higher_is_better: If True (False), only lower (higher) values diverge. If
+      None, the direction is ignored.
+  """
+  difference = _point_value(value) - parent_value
+  if math.isnan(difference) or abs(difference) <= min_divergence:
+    return False
+  if higher_is_better is not None and (difference > 0) == higher_is_better:
+    return False
+  if isinstance(value, types.ValueWithConfidenceInterval):
+    return not value.lower_bound <= parent_value <= value.upper_bound
+  return True
+
+
+@beam.ptransform_fn
+@beam.typehints.with_input_types(types.Extracts)
+@beam.typehints.with_output_types(evaluator.Evaluation)
+def _DiscoverSlices(  # pylint: disable=invalid-name
+    extracts: beam.pvalue.PCollection,
+    eval_config: config.EvalConfig,
+    feature_keys: List[Text],
+    metric_key: metric_types.MetricKey,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    min_num_examples: int = DEFAULT_MIN_NUM_EXAMPLES,
+    min_divergence: float = 0.0,
+    higher_is_better: Optional[bool] = None,
+    eval_shared_models: Optional[List[types.EvalSharedModel]] = None,
+    key: Text = constants.SLICE_DISCOVERY_KEY) -> evaluator.Evaluation:
+  """Discovers problem slices.
+
+  Args:
+    extracts: PCollection of Extracts. The extracts must contain the features
+      keyed by tfma.FEATURES_KEY as well as any extracts required by the metric
+      implementations (typically labels, predictions and example weights).
+    eval_config: Eval config.
+    feature_keys: Candidate columns to cross.
+    metric_key: Key of the metric used to decide which slices diverge.
+    max_depth: Maximum number of columns crossed by a slice.
+    min_num_examples: Slices with fewer (unweighted) examples are pruned.
+    min_divergence: Slices whose metric differs from the metric of their parent
+      by at most min_divergence are pruned.
+    higher_is_better: If set, only slices that are worse than their parent are
+      kept.
+    eval_shared_models: Optional shared model instances.
+    key: Name to use for key in Evaluation output.
+
+  Returns:
+    Evaluation containing a PCollection of (slice_key, dict of metrics) tuples
+    for the overall slice and the slices that were kept.
+
+  Raises:
+    ValueError: If the metric_key is not computed by the metrics specs.
+  """
+  eval_config_copy = config.EvalConfig()
+  eval_config_copy.CopyFrom(eval_config)
+  eval_config = eval_config_copy
+  eval_config.options.compute_confidence_intervals.value = True
+  eval_config.options.confidence_intervals.method = (
+      config.ConfidenceIntervalOptions.ANALYTIC)
+  eval_config.options.k_anonymization_count.value = max(
+      eval_config.options.k_anonymization_count.value, min_num_examples)
+
+  model_loaders = None
+  if eval_shared_models:
+    model_loaders = {m.model_path: m.model_loader for m in eval_shared_models}
+  # pylint: disable=protected-access
+  computations, derived_computations = (
+      metrics_and_plots_evaluator_v2._filter_and_separate_computations(
+          metric_specs.to_computations(
+              eval_config.metrics_specs,
+              eval_config=eval_config,
+              model_loaders=model_loaders)))
+  # pylint: enable=protected-access
+  if not any(metric_key in c.keys
+             for c in list(computations) + list(derived_computations)):
+    raise ValueError(
+        'metric_key {} is not computed by the metrics_specs'.format(metric_key))
+
+  key_index = {column: i for i, column in enumerate(feature_keys)}
+  single_slice_specs = [
+      slicer.SingleSliceSpec(columns=[column]) for column in feature_keys
+  ]
+
+  def add_single_slice_keys(extracts: types.Extracts) -> types.Extracts:
+    # The single column slices are stored under the slice keys so that they
+    # are passed through preprocessing.
+    extracts = copy.copy(extracts)
+    extracts[constants.SLICE_KEY_TYPES_KEY] = list(
+        slicer.get_slices_for_features_dict(extracts[constants.FEATURES_KEY],
+                                            single_slice_specs))
+    return extracts
+
+  def add_overall_slice_key(extracts: types.Extracts) -> types.Extracts:
+    extracts = copy.copy(extracts)
+    extracts[constants.SLICE_KEY_TYPES_KEY] = [()]
+    return extracts
+
+  def add_candidate_slice_keys(
+      extracts: types.Extracts, depth: int,
+      kept_slice_keys: Dict[slicer.SliceKeyType, Any]) -> types.Extracts:
+    single_slice_keys = {}
+    for slice_key in extracts[constants.SLICE_KEY_TYPES_KEY]:
+      single_slice_keys.setdefault(slice_key[0][0], []).append(slice_key)
+    extracts = copy.copy(extracts)
+    extracts[constants.SLICE_KEY_TYPES_KEY] = _candidate_slice_keys(
+        single_slice_keys, kept_slice_keys, depth, feature_keys, key_index)
+    return extracts
+
+  def is_kept(sliced_metrics: Tuple[slicer.SliceKeyType, Dict[Any, Any]],
+              kept_values: Dict[slicer.SliceKeyType, float]) -> bool:
+    slice_key, metrics = sliced_metrics
+    # Slices with too few examples only contain an error.
+    if metric_key not in metrics:
+      return False
+    return _diverges(metrics[metric_key],
+                     kept_values[_parent_slice_key(slice_key, key_index)],
+                     min_divergence, higher_is_better)
+
+  def to_kept_value(
+      sliced_metrics: Tuple[slicer.SliceKeyType, Dict[Any, Any]]
+  ) -> Tuple[slicer.SliceKeyType, float]:
+    slice_key, metrics = sliced_metrics
+    return (slice_key, _point_value(metrics[metric_key]))
+
+  # pylint: disable=no-value-for-parameter,protected-access
+
+  # The preprocessing (e.g. conversion to StandardMetricInputs or model
+  # inference) is done once and its outputs are re-used for every depth. Each
+  # depth is then a fanout and combine over the preprocessed extracts.
+  preprocessed = (
+      extracts
+      | 'AddSingleSliceKeys' >> beam.Map(add_single_slice_keys)
+      | 'Preprocess' >> beam.ParDo(
+          metrics_and_plots_evaluator_v2._PreprocessorDoFn(computations)))
+
+  sliced_metrics = []
+  kept_values = []
+  for depth in range(max_depth + 1):
+    if depth == 0:
+      candidates = (
+          preprocessed
+          | 'AddOverallSliceKey' >> beam.Map(add_overall_slice_key))
+    else:
+      all_kept_values = (
+          kept_values
+          | 'FlattenKeptValues[{}]'.format(depth) >> beam.Flatten())
+      candidates = (
+          preprocessed
+          | 'AddCandidateSliceKeys[{}]'.format(depth) >> beam.Map(
+              add_candidate_slice_keys,
+              depth=depth,
+              kept_slice_keys=beam.pvalue.AsDict(all_kept_values)))
+    computed = (
+        candidates
+        | 'FanoutSlices[{}]'.format(depth) >> slicer.FanoutSlices(
+            track_distinct_slice_keys=False)
+        | 'ComputePerSlice[{}]'.format(depth) >>
+        metrics_and_plots_evaluator_v2._ComputePerSlice(
+            computations=computations,
+            derived_computations=derived_computations,
+            k_anonymization_count=(
+                eval_config.options.k_anonymization_count.value)))
+    if depth > 0:
+      computed = (
+          computed
+          | 'FilterDivergentSlices[{}]'.format(depth) >> beam.Filter(
+              is_kept, kept_values=beam.pvalue.AsDict(all_kept_values)))
+    sliced_metrics.append(computed)
+    kept_values.append(
+        computed
+        | 'ToKeptValues[{}]'.format(depth) >> beam.Map(to_kept_value))
+
+  # pylint: enable=no-value-for-parameter,protected-access
+
+  return {key: sliced_metrics | 'FlattenSlices' >> beam.Flatten()}
@@ -0,0 +1,203 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for slice discovery evaluator."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import apache_beam as beam
+from apache_beam.testing import util
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import constants
+from tensorflow_model_analysis import types
+from tensorflow_model_analysis.eval_saved_model import testutil
+from tensorflow_model_analysis.evaluators import slice_discovery_evaluator
+from tensorflow_model_analysis.metrics import calibration
+from tensorflow_model_analysis.metrics import metric_specs
+from tensorflow_model_analysis.metrics import metric_types
+
+_MEAN_LABEL_KEY = metric_types.MetricKey(name=calibration.MEAN_LABEL_NAME)
+
+
+def _extracts():
+  # 100 examples for each (country, device) with a mean label of 0.5 except
+  # for ('ca', 'desktop') which has a mean label of 0.1.
+  result = []
+  for country, device, num_positives in [('us', 'phone', 50),
+                                         ('us', 'desktop', 50),
+                                         ('ca', 'phone', 50),
+                                         ('ca', 'desktop', 10)]:
+    for i in range(100):
+      result.append({
+          constants.FEATURES_KEY: {
+              'country': np.array([country]),
+              'device': np.array([device]),
+          },
+          constants.LABELS_KEY: np.array([1.0 if i < num_positives else 0.0]),
+          constants.PREDICTIONS_KEY: np.array([0.5]),
+          constants.EXAMPLE_WEIGHTS_KEY: np.array([1.0]),
+      })
+  return result
+
+
+def _eval_config():
+  return config.EvalConfig(
+      model_specs=[config.ModelSpec()],
+      metrics_specs=metric_specs.specs_from_metrics([calibration.MeanLabel()]))
+
+
+class SliceDiscoveryEvaluatorTest(testutil.TensorflowModelAnalysisTest):
+
+  def _assert_discovered(self, expected_mean_labels, **kwargs):
+    evaluator = slice_discovery_evaluator.SliceDiscoveryEvaluator(
+        eval_config=_eval_config(),
+        feature_keys=['country', 'device'],
+        metric_key=_MEAN_LABEL_KEY,
+        **kwargs)
+
+    with beam.Pipeline() as pipeline:
+      evaluation = (
+          pipeline
+          | 'Create' >> beam.Create(_extracts())
+          | 'DiscoverSlices' >> evaluator.ptransform)
+
+      def check_result(got):
+        try:
+          got_mean_labels = {}
+          for slice_key, metrics in got:
+            value = metrics[_MEAN_LABEL_KEY]
+            self.assertIsInstance(value, types.ValueWithConfidenceInterval)
+            got_mean_labels[slice_key] = value.value
+          self.assertCountEqual(got_mean_labels.keys(),
+                                expected_mean_labels.keys())
+          self.assertDictElementsAlmostEqual(got_mean_labels,
+                                             expected_mean_labels)
+
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(
+          evaluation[constants.SLICE_DISCOVERY_KEY],
+          check_result,
+          label='result')
+
+  def testDiscoverSlices(self):
+    # ('us', 'phone') and ('us', 'desktop') do not diverge from ('us',) and
+    # the slices crossed with 'device' are not expanded by 'country'.
+    self._assert_discovered({
+        (): 0.4,
+        (('country', 'us'),): 0.5,
+        (('country', 'ca'),): 0.3,
+        (('device', 'phone'),): 0.5,
+        (('device', 'desktop'),): 0.3,
+        (('country', 'ca'), ('device', 'phone')): 0.5,
+        (('country', 'ca'), ('device', 'desktop')): 0.1,
+    })
+
+  def testDiscoverSlicesWorseThanParent(self):
+    self._assert_discovered(
+        {
+            (): 0.4,
+            (('country', 'ca'),): 0.3,
+            (('device', 'desktop'),): 0.3,
+            (('country', 'ca'), ('device', 'desktop')): 0.1,
+        },
+        higher_is_better=True)
+
+  def testDiscoverSlicesPrunesSmallSlices(self):
+    self._assert_discovered(
+        {
+            (): 0.4,
+            (('country', 'us'),): 0.5,
+            (('country', 'ca'),): 0.3,
+            (('device', 'phone'),): 0.5,
+            (('device', 'desktop'),): 0.3,
+        },
+        min_num_examples=150)
+
+  def testDiscoverSlicesWithMinDivergence(self):
+    self._assert_discovered({(): 0.4}, min_divergence=0.15)
+
+  def testDiscoverSlicesRaisesErrorForUnknownMetricKey(self):
+    evaluator = slice_discovery_evaluator.SliceDiscoveryEvaluator(
+        eval_config=_eval_config(),
+        feature_keys=['country'],
+        metric_key=metric_types.MetricKey(name='unknown'))
+    with self.assertRaisesRegexp(ValueError, 'metric_key'):
+      with beam.Pipeline() as pipeline:
+        _ = (
+            pipeline
+            | 'Create' >> beam.Create(_extracts())
+            | 'DiscoverSlices' >> evaluator.ptransform)
+
+  def testSliceDiscoveryEvaluatorRaisesErrorForInvalidArguments(self):
+    with self.assertRaisesRegexp(ValueError, 'feature_keys must not be empty'):
+      slice_discovery_evaluator.SliceDiscoveryEvaluator(
+          eval_config=_eval_config(),
+          feature_keys=[],
+          metric_key=_MEAN_LABEL_KEY)
+    with self.assertRaisesRegexp(ValueError, 'max_depth must be positive'):
+      slice_discovery_evaluator.SliceDiscoveryEvaluator(
+          eval_config=_eval_config(),
+          feature_keys=['country'],
+          metric_key=_MEAN_LABEL_KEY,
+          max_depth=0)
+
+  def testCandidateSliceKeys(self):
+    feature_keys = ['a', 'b', 'c']
+    key_index = {'a': 0, 'b': 1, 'c': 2}
+    single_slice_keys = {
+        'a': [(('a', 1),)],
+        'b': [(('b', 1),), (('b', 2),)],
+        'c': [(('c', 1),)],
+    }
+    self.assertCountEqual(
+        slice_discovery_evaluator._candidate_slice_keys(
+            single_slice_keys, {(): 0.0}, 1, feature_keys, key_index),
+        [(('a', 1),), (('b', 1),), (('b', 2),), (('c', 1),)])
+    # Only the children of the kept slices are candidates and slices are only
+    # expanded by the columns after their last column.
+    kept_slice_keys = {(): 0.0, (('a', 1),): 0.0, (('b', 2),): 0.0}
+    self.assertCountEqual(
+        slice_discovery_evaluator._candidate_slice_keys(
+            single_slice_keys, kept_slice_keys, 2, feature_keys, key_index),
+        [(('a', 1), ('b', 1)), (('a', 1), ('b', 2)), (('a', 1), ('c', 1)),
+         (('b', 2), ('c', 1))])
+    self.assertEqual(
+        slice_discovery_evaluator._parent_slice_key((('a', 1), ('c', 1)),
+                                                    key_index), (('a', 1),))
+
+  def testDiverges(self):
+    value = types.ValueWithConfidenceInterval(0.3, 0.25, 0.35)
+    self.assertTrue(slice_discovery_evaluator._diverges(value, 0.4, 0.0, None))
+    self.assertTrue(slice_discovery_evaluator._diverges(value, 0.4, 0.0, True))
+    self.assertFalse(
+        slice_discovery_evaluator._diverges(value, 0.4, 0.0, False))
+    self.assertFalse(slice_discovery_evaluator._diverges(value, 0.4, 0.2, None))
+    # The parent value is within the confidence interval.
+    self.assertFalse(
+        slice_discovery_evaluator._diverges(value, 0.33, 0.0, None))
+    # Without a confidence interval only min_divergence is used.
+    self.assertTrue(slice_discovery_evaluator._diverges(0.3, 0.33, 0.0, None))
+    self.assertFalse(
+        slice_discovery_evaluator._diverges(float('nan'), 0.4, 0.0, None))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -17,10 +17,17 @@ from __future__ import absolute_import
 from __future__ import division
 # Standard __future__ imports
 
+import numpy as np
 from scipy import stats
 from tensorflow_model_analysis import types
 
 
+def divide_no_nan(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+  """Returns x / y with 0.0 where y is 0 (NumPy version of tf.divide_no_nan)."""
+  x = np.asarray(x, dtype=np.float64)
+  return np.divide(x, y, out=np.zeros_like(x), where=np.asarray(y) != 0)
+
+
 def calculate_confidence_interval(
     t_distribution_value: types.ValueWithTDistribution):
   """Caculate confidence intervals based 95% confidence level."""
@@ -31,3 +38,30 @@ def calculate_confidence_interval(
   upper_bound = t_distribution_value.sample_mean + t_stat * std_err
   lower_bound = t_distribution_value.sample_mean - t_stat * std_err
   return t_distribution_value.sample_mean, lower_bound, upper_bound
+
+
+def calculate_delta_method_confidence_interval(
+    value: float, gradient: np.ndarray,
+    second_moments: np.ndarray) -> types.ValueWithConfidenceInterval:
+  """Calculates a 95% confidence interval using the delta method.
+
+  The value is assumed to be a function f of sums S = sum_i a_i over the
+  examples. The variance of S under Poisson resampling of the examples (i.e.
+  the variance estimated by the Poisson bootstrap) is sum_i a_i a_i^T, so the
+  variance of f(S) is approximately grad(f)^T (sum_i a_i a_i^T) grad(f).
+
+  Args:
+    value: Value f(S).
+    gradient: Gradient of f at S with shape (n,).
+    second_moments: Sum of the outer products a_i a_i^T with shape (n, n).
+
+  Returns:
+    Value with its confidence interval (NaN bounds if the value is NaN).
+  """
+  alpha = 0.05
+  variance = float(np.dot(gradient, np.dot(second_moments, gradient)))
+  # Rounding errors can make the variance slightly negative (NaN propagates).
+  std_err = float(np.sqrt(np.maximum(variance, 0.0)))
+  z_stat = stats.norm.ppf(1 - (alpha / 2.0))
+  return types.ValueWithConfidenceInterval(value, value - z_stat * std_err,
+                                           value + z_stat * std_err)
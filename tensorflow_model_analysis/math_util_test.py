@@ -37,6 +37,22 @@ class MathUtilTest(tf.test.TestCase):
     self.assertTrue(math.isnan(lb))
     self.assertTrue(math.isnan(ub))
 
+  def testDivideNoNan(self):
+    self.assertAllClose(
+        math_util.divide_no_nan(np.array([1.0, 1.0, 0.0]),
+                                np.array([2.0, 0.0, 0.0])), [0.5, 0.0, 0.0])
+
+  def testCalculateDeltaMethodConfidenceInterval(self):
+    got = math_util.calculate_delta_method_confidence_interval(
+        0.5, np.array([1.0, 0.0]), np.array([[0.04, 0.0], [0.0, 1.0]]))
+    self.assertIsInstance(got, types.ValueWithConfidenceInterval)
+    np.testing.assert_almost_equal(
+        got, (0.5, 0.5 - 1.959964 * 0.2, 0.5 + 1.959964 * 0.2))
+    got = math_util.calculate_delta_method_confidence_interval(
+        float('nan'), np.array([np.nan]), np.array([[1.0]]))
+    self.assertTrue(math.isnan(got.lower_bound))
+    self.assertTrue(math.isnan(got.upper_bound))
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -45,6 +45,10 @@ from tensorflow_model_analysis.metrics.multi_class_confusion_matrix_plot import
 from tensorflow_model_analysis.metrics.multi_label_confusion_matrix_plot import MultiLabelConfusionMatrixPlot
 from tensorflow_model_analysis.metrics.ndcg import NDCG
 from tensorflow_model_analysis.metrics.query_statistics import QueryStatistics
+from tensorflow_model_analysis.metrics.sketch_metrics import SketchAUC
+from tensorflow_model_analysis.metrics.sketch_metrics import SketchAUCPrecisionRecall
+from tensorflow_model_analysis.metrics.sketch_metrics import SketchCalibrationPlot
+from tensorflow_model_analysis.metrics.sketch_metrics import SketchConfusionMatrixAtThresholds
 from tensorflow_model_analysis.metrics.squared_pearson_correlation import SquaredPearsonCorrelation
 from tensorflow_model_analysis.metrics.tjur_discrimination import CoefficientOfDiscrimination
 from tensorflow_model_analysis.metrics.tjur_discrimination import RelativeCoefficientOfDiscrimination
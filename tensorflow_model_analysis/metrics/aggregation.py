@@ -197,19 +197,18 @@ class _ClassWeightsFromLabelsCombiner(beam.CombineFn):
     self._key = key
     self._eval_config = eval_config
     self._class_ids = class_ids
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        output_name=key.output_name,
+        flatten=False,
+        allow_none=True)
 
   def create_accumulator(self) -> Dict[int, float]:
     return {i: 0.0 for i in self._class_ids}
 
   def add_input(self, accumulator: Dict[int, float],
                 element: metric_types.StandardMetricInputs) -> Dict[int, float]:
-    for label, _, example_weight in (
-        metric_util.to_label_prediction_example_weight(
-            element,
-            eval_config=self._eval_config,
-            output_name=self._key.output_name,
-            flatten=False,
-            allow_none=True)):
+    for label, _, example_weight in self._adapter(element):
       if example_weight is None:
         example_weight = 1.0
       else:
@@ -21,6 +21,7 @@ from __future__ import print_function
 import apache_beam as beam
 import numpy as np
 from tensorflow_model_analysis import config
+from tensorflow_model_analysis import math_util
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import metric_util
 from typing import Any, Dict, List, Optional, Text
@@ -80,9 +81,11 @@ def _mean_label(
     metric = metrics[weighted_labels_predictions_key]
     if np.isclose(metric.total_weighted_examples, 0.0):
       value = float('nan')
+      gradient = np.full(3, np.nan)
     else:
       value = metric.total_weighted_labels / metric.total_weighted_examples
-    return {key: value}
+      gradient = np.array([1.0, 0.0, -value]) / metric.total_weighted_examples
+    return {key: _maybe_with_confidence_interval(value, gradient, metric)}
 
   derived_computation = metric_types.DerivedMetricComputation(
       keys=[key], result=result)
@@ -137,9 +140,11 @@ def _mean_prediction(
     metric = metrics[weighted_labels_predictions_key]
     if np.isclose(metric.total_weighted_examples, 0.0):
       value = float('nan')
+      gradient = np.full(3, np.nan)
     else:
       value = metric.total_weighted_predictions / metric.total_weighted_examples
-    return {key: value}
+      gradient = np.array([0.0, 1.0, -value]) / metric.total_weighted_examples
+    return {key: _maybe_with_confidence_interval(value, gradient, metric)}
 
   derived_computation = metric_types.DerivedMetricComputation(
       keys=[key], result=result)
@@ -198,10 +203,12 @@ def _calibration(
     metric = metrics[weighted_labels_predictions_key]
     if np.isclose(metric.total_weighted_labels, 0.0):
       value = float('nan')
+      gradient = np.full(3, np.nan)
     else:
       value = metric.total_weighted_predictions / metric.total_weighted_labels
+      gradient = np.array([-value, 1.0, 0.0]) / metric.total_weighted_labels
 
-    return {key: value}
+    return {key: _maybe_with_confidence_interval(value, gradient, metric)}
 
   derived_computation = metric_types.DerivedMetricComputation(
       keys=[key], result=result)
@@ -209,6 +216,26 @@ def _calibration(
   return computations
 
 
+def _maybe_with_confidence_interval(
+    value: float, gradient: np.ndarray,
+    metric: '_WeightedLabelsPredictionsExamples') -> Any:
+  """Adds a confidence interval to value if the second moments were tracked.
+
+  Args:
+    value: Value computed from the totals of the metric.
+    gradient: Gradient of the value with respect to the total weighted labels,
+      predictions and examples.
+    metric: Weighted labels, predictions and examples.
+
+  Returns:
+    The value or a types.ValueWithConfidenceInterval.
+  """
+  if metric.second_moments is None:
+    return value
+  return math_util.calculate_delta_method_confidence_interval(
+      value, gradient, metric.second_moments)
+
+
 def _weighted_labels_predictions_examples(
     name: Text = _WEIGHTED_LABELS_PREDICTIONS_EXAMPLES_NAME,
     eval_config: Optional[config.EvalConfig] = None,
@@ -243,17 +270,25 @@ def _weighted_labels_predictions_examples(
 
 
 class _WeightedLabelsPredictionsExamples(object):
-  """Total weighted labels, predictions, and examples."""
+  """Total weighted labels, predictions, and examples.
+
+  If analytic confidence intervals are computed, second_moments holds the sum
+  over the examples of the outer product of each example's (weighted labels,
+  weighted predictions, weighted examples) with itself.
+  """
   __slots__ = [
       'total_weighted_labels', 'total_weighted_predictions',
-      'total_weighted_examples'
+      'total_weighted_examples', 'second_moments'
   ]
 
-  def __init__(self):
+  def __init__(self, compute_confidence_intervals: bool = False):
     """Initializes accumulator."""
     self.total_weighted_labels = 0.0
     self.total_weighted_predictions = 0.0
     self.total_weighted_examples = 0.0
+    self.second_moments = None
+    if compute_confidence_intervals:
+      self.second_moments = np.zeros((3, 3))
 
 
 class _WeightedLabelsPredictionsExamplesCombiner(beam.CombineFn):
@@ -265,38 +300,51 @@ class _WeightedLabelsPredictionsExamplesCombiner(beam.CombineFn):
     self._key = key
     self._eval_config = eval_config
     self._class_weights = class_weights
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        output_name=key.output_name,
+        sub_key=key.sub_key,
+        class_weights=class_weights,
+        allow_none=True)
+    self._compute_confidence_intervals = (
+        metric_util.compute_analytic_confidence_intervals(eval_config))
 
   def create_accumulator(self) -> _WeightedLabelsPredictionsExamples:
-    return _WeightedLabelsPredictionsExamples()
+    return _WeightedLabelsPredictionsExamples(
+        self._compute_confidence_intervals)
 
   def add_input(
       self, accumulator: _WeightedLabelsPredictionsExamples,
       element: metric_types.StandardMetricInputs
   ) -> _WeightedLabelsPredictionsExamples:
-    for label, prediction, example_weight in (
-        metric_util.to_label_prediction_example_weight(
-            element,
-            eval_config=self._eval_config,
-            output_name=self._key.output_name,
-            sub_key=self._key.sub_key,
-            class_weights=self._class_weights,
-            allow_none=True)):
+    # Totals for this example.
+    weighted_labels = 0.0
+    weighted_predictions = 0.0
+    weighted_examples = 0.0
+    for label, prediction, example_weight in self._adapter(element):
       example_weight = float(example_weight)
-      accumulator.total_weighted_examples += example_weight
+      weighted_examples += example_weight
       if label is not None:
         if self._key.sub_key and self._key.sub_key.top_k is not None:
           for i in range(self._key.sub_key.top_k):
             weighted_label = label[i] * example_weight
         else:
           weighted_label = float(label) * example_weight
-        accumulator.total_weighted_labels += weighted_label
+        weighted_labels += weighted_label
       if prediction is not None:
         if self._key.sub_key and self._key.sub_key.top_k is not None:
           for i in range(self._key.sub_key.top_k):
             weighted_prediction = prediction[i] * example_weight
         else:
           weighted_prediction = float(prediction) * example_weight
-        accumulator.total_weighted_predictions += weighted_prediction
+        weighted_predictions += weighted_prediction
+    accumulator.total_weighted_labels += weighted_labels
+    accumulator.total_weighted_predictions += weighted_predictions
+    accumulator.total_weighted_examples += weighted_examples
+    if accumulator.second_moments is not None:
+      totals = np.array(
+          [weighted_labels, weighted_predictions, weighted_examples])
+      accumulator.second_moments += np.outer(totals, totals)
     return accumulator
 
   def merge_accumulators(
@@ -308,6 +356,8 @@ class _WeightedLabelsPredictionsExamplesCombiner(beam.CombineFn):
       result.total_weighted_predictions += (
           accumulator.total_weighted_predictions)
       result.total_weighted_examples += accumulator.total_weighted_examples
+      if result.second_moments is not None:
+        result.second_moments += accumulator.second_moments
     return result
 
   def extract_output(
@@ -18,16 +18,18 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
-import bisect
 import heapq
 import itertools
 import operator
+import struct
 
 import apache_beam as beam
+import numpy as np
+from tensorflow_model_analysis import coders
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import metric_util
-from typing import Dict, List, Optional, NamedTuple, Text
+from typing import Dict, Iterable, List, Optional, NamedTuple, Text, Tuple
 
 CALIBRATION_HISTOGRAM_NAME = '_calibration_histogram'
 
@@ -96,6 +98,37 @@ def calibration_histogram(
   ]
 
 
+class _HistogramCoder(beam.coders.Coder):
+  """Coder for histograms using a fixed layout binary encoding.
+
+  The number of buckets is followed by the bucket IDs (int64) and an array of
+  (weighted_labels, weighted_predictions, weighted_examples) per bucket
+  (float64).
+  """
+
+  def encode(self, histogram: Histogram) -> bytes:
+    bucket_ids = np.array([b.bucket_id for b in histogram], dtype='<i8')
+    values = np.array([b[1:] for b in histogram], dtype='<f8')
+    return (struct.pack('<q', len(histogram)) + bucket_ids.tobytes() +
+            values.tobytes())
+
+  def decode(self, encoded: bytes) -> Histogram:
+    num_buckets = struct.unpack_from('<q', encoded)[0]
+    bucket_ids = np.frombuffer(
+        encoded, dtype='<i8', count=num_buckets, offset=8)
+    values = np.frombuffer(
+        encoded, dtype='<f8', count=num_buckets * 3,
+        offset=8 * (num_buckets + 1)).reshape((num_buckets, 3))
+    return [
+        Bucket(bucket_id, *bucket_values)
+        for bucket_id, bucket_values in zip(bucket_ids.tolist(),
+                                            values.tolist())
+    ]
+
+  def is_deterministic(self) -> bool:
+    return False
+
+
 class _CalibrationHistogramCombiner(beam.CombineFn):
   """Creates histogram from labels, predictions, and example weights."""
 
@@ -109,16 +142,22 @@ class _CalibrationHistogramCombiner(beam.CombineFn):
     self._num_buckets = num_buckets
     self._left = left
     self._range = right - left
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        model_name=key.model_name,
+        output_name=key.output_name,
+        sub_key=key.sub_key,
+        class_weights=class_weights,
+        flatten=True)
 
-  def _bucket_index(self, prediction: float) -> int:
-    """Returns bucket index given prediction value. Values are truncated."""
-    bucket_index = int(
-        (prediction - self._left) / self._range * self._num_buckets) + 1
-    if bucket_index < 0:
-      return 0
-    if bucket_index >= self._num_buckets + 1:
-      return self._num_buckets + 1
-    return bucket_index
+  def _bucket_indices(self, predictions: np.ndarray) -> np.ndarray:
+    """Returns bucket indices given prediction values. Values are truncated."""
+    bucket_indices = np.trunc(
+        (predictions - self._left) / self._range * self._num_buckets) + 1
+    return np.clip(bucket_indices, 0, self._num_buckets + 1).astype(np.int64)
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return _HistogramCoder()
 
   def create_accumulator(self) -> Histogram:
     # The number of accumulator (histogram) buckets is variable and depends on
@@ -129,37 +168,32 @@ class _CalibrationHistogramCombiner(beam.CombineFn):
 
   def add_input(self, accumulator: Histogram,
                 element: metric_types.StandardMetricInputs) -> Histogram:
-    for label, prediction, example_weight in (
-        metric_util.to_label_prediction_example_weight(
-            element,
-            eval_config=self._eval_config,
-            model_name=self._key.model_name,
-            output_name=self._key.output_name,
-            sub_key=self._key.sub_key,
-            flatten=True,
-            class_weights=self._class_weights)):
-      example_weight = float(example_weight)
-      label = float(label)
-      prediction = float(prediction)
-      weighted_label = label * example_weight
-      weighted_prediction = prediction * example_weight
-      bucket_index = self._bucket_index(prediction)
-      # Check if bucket exists, all bucket values are > 0, so -1 are always less
-      insert_index = bisect.bisect_left(accumulator,
-                                        Bucket(bucket_index, -1, -1, -1))
-      if (insert_index == len(accumulator) or
-          accumulator[insert_index].bucket_id != bucket_index):
-        accumulator.insert(
-            insert_index,
-            Bucket(bucket_index, weighted_label, weighted_prediction,
-                   example_weight))
-      else:
-        existing_bucket = accumulator[insert_index]
-        accumulator[insert_index] = Bucket(
-            bucket_index, existing_bucket.weighted_labels + weighted_label,
-            existing_bucket.weighted_predictions + weighted_prediction,
-            existing_bucket.weighted_examples + example_weight)
-    return accumulator
+    return self.add_inputs(accumulator, [element])
+
+  def add_inputs(
+      self, accumulator: Histogram,
+      elements: Iterable[metric_types.StandardMetricInputs]) -> Histogram:
+    labels, predictions, example_weights = self._adapter.batch(elements)
+    if not predictions.size:
+      return accumulator
+    labels = labels.astype(np.float64)
+    predictions = predictions.astype(np.float64)
+    example_weights = example_weights.astype(np.float64)
+    bucket_ids, totals = _reduce_by_code(
+        self._bucket_indices(predictions),
+        np.stack([
+            labels * example_weights, predictions * example_weights,
+            example_weights
+        ],
+                 axis=1))
+    histogram = [
+        Bucket(bucket_id, *bucket_values)
+        for bucket_id, bucket_values in zip(bucket_ids.tolist(),
+                                            totals.tolist())
+    ]
+    if not accumulator:
+      return histogram
+    return self.merge_accumulators([accumulator, histogram])
 
   def merge_accumulators(self, accumulators: List[Histogram]) -> Histogram:
     result = []
@@ -182,6 +216,272 @@ class _CalibrationHistogramCombiner(beam.CombineFn):
     return {self._key: accumulator}
 
 
+# Number of examples buffered before they are added to the multi sub key
+# histograms.
+_DEFAULT_DESIRED_BATCH_SIZE = 1000
+
+
+class _MultiSubKeyHistogramAccumulator(object):
+  """Accumulator for the histograms of multiple sub keys.
+
+  Buckets are stored sparsely as sorted codes (sub key index * number of
+  buckets + bucket index) with an array of (weighted_labels,
+  weighted_predictions, weighted_examples) values per code.
+  """
+  __slots__ = ['codes', 'values', 'buffered_codes', 'buffered_values',
+               'num_buffered']
+
+  def __init__(self):
+    self.codes = np.zeros(0, dtype=np.int64)
+    self.values = np.zeros((0, 3))
+    self.buffered_codes = []  # type: List[np.ndarray]
+    self.buffered_values = []  # type: List[np.ndarray]
+    self.num_buffered = 0
+
+
+def _reduce_by_code(codes: np.ndarray,
+                    values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  """Returns sorted unique codes and the sum of the values for each code."""
+  unique_codes, inverse = np.unique(codes, return_inverse=True)
+  inverse = inverse.ravel()
+  totals = np.stack([
+      np.bincount(inverse, weights=values[:, i], minlength=len(unique_codes))
+      for i in range(values.shape[1])
+  ],
+                    axis=1)
+  return unique_codes, totals.reshape((-1, values.shape[1]))
+
+
+class _MultiSubKeyCalibrationHistogramCombiner(beam.CombineFn):
+  """Creates histograms for multiple sub keys from one pass over each example.
+
+  The labels, predictions, and example weights are extracted once per example
+  and the values for every class_id, k, and top_k sub key are selected from the
+  same arrays. This produces the same outputs as a separate
+  _CalibrationHistogramCombiner per sub key.
+  """
+
+  def __init__(self,
+               keys: List[metric_types.PlotKey],
+               eval_config: Optional[config.EvalConfig],
+               num_buckets: int,
+               left: float,
+               right: float,
+               desired_batch_size: Optional[int] = None):
+    self._keys = keys
+    self._eval_config = eval_config
+    self._num_buckets = num_buckets
+    self._left = left
+    self._range = right - left
+    self._model_name = keys[0].model_name
+    self._output_name = keys[0].output_name
+    self._class_id_indices = [
+        i for i, k in enumerate(keys) if k.sub_key.class_id is not None
+    ]
+    self._class_ids = np.array(
+        [keys[i].sub_key.class_id for i in self._class_id_indices],
+        dtype=np.int64)
+    self._top_k_indices = [
+        i for i, k in enumerate(keys) if k.sub_key.class_id is None
+    ]
+    self._max_top_k = max([
+        keys[i].sub_key.k or keys[i].sub_key.top_k for i in self._top_k_indices
+    ] or [0])
+    if desired_batch_size and desired_batch_size > 0:
+      self._desired_batch_size = desired_batch_size
+    else:
+      self._desired_batch_size = _DEFAULT_DESIRED_BATCH_SIZE
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        model_name=self._model_name,
+        output_name=self._output_name,
+        flatten=False)
+
+  def _bucket_indices(self, predictions: np.ndarray) -> np.ndarray:
+    """Returns bucket indices given prediction values. Values are truncated."""
+    # np.trunc (rather than floor) matches _CalibrationHistogramCombiner.
+    bucket_indices = np.trunc(
+        (predictions - self._left) / self._range * self._num_buckets) + 1
+    return np.clip(bucket_indices, 0, self._num_buckets + 1).astype(np.int64)
+
+  def _select_class_ids(self, labels: np.ndarray,
+                        predictions: np.ndarray) -> Tuple[np.ndarray,
+                                                          np.ndarray]:
+    """Returns labels and predictions of shape (-1, len(class_ids))."""
+    if not labels.shape:
+      labels = labels.reshape((1,))
+    if not predictions.shape:
+      predictions = predictions.reshape((1,))
+    num_classes = predictions.shape[-1]
+    if self._class_ids.size and (self._class_ids.min() < 0 or
+                                 self._class_ids.max() >= num_classes):
+      raise ValueError('class_ids "{}" out of range of predictions: {}'.format(
+          self._class_ids, predictions))
+    sparse_labels = (
+        len(labels.shape) != len(predictions.shape) or
+        labels.shape[-1] != num_classes)
+    predictions = predictions.reshape((-1, num_classes))
+    if sparse_labels:
+      # Labels of the form [class_id1, ...].
+      labels = metric_util.one_hot(
+          labels.reshape((-1, 1)).astype(np.int64), predictions)
+    else:
+      labels = labels.reshape((-1, num_classes))
+    return labels[:, self._class_ids], predictions[:, self._class_ids]
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return coders.AccumulatorCoder(_MultiSubKeyHistogramAccumulator)
+
+  def create_accumulator(self) -> _MultiSubKeyHistogramAccumulator:
+    return _MultiSubKeyHistogramAccumulator()
+
+  def add_input(
+      self, accumulator: _MultiSubKeyHistogramAccumulator,
+      element: metric_types.StandardMetricInputs
+  ) -> _MultiSubKeyHistogramAccumulator:
+    label, prediction, example_weight = next(self._adapter(element))
+    example_weight = float(example_weight)
+    sub_key_indices = []
+    labels = []
+    predictions = []
+    if self._class_id_indices:
+      class_labels, class_predictions = self._select_class_ids(
+          label, prediction)
+      sub_key_indices.append(
+          np.broadcast_to(self._class_id_indices, class_labels.shape).ravel())
+      labels.append(class_labels.ravel())
+      predictions.append(class_predictions.ravel())
+    if self._top_k_indices:
+      top_labels, top_predictions = metric_util.select_top_k(
+          self._max_top_k, label, prediction)
+      top_labels = top_labels.reshape((-1, self._max_top_k))
+      top_predictions = top_predictions.reshape((-1, self._max_top_k))
+      for i in self._top_k_indices:
+        sub_key = self._keys[i].sub_key
+        if sub_key.k is not None:
+          columns = slice(sub_key.k - 1, sub_key.k)
+        else:
+          columns = slice(0, sub_key.top_k)
+        selected_labels = top_labels[:, columns].ravel()
+        sub_key_indices.append(np.full(selected_labels.shape, i))
+        labels.append(selected_labels)
+        predictions.append(top_predictions[:, columns].ravel())
+    labels = np.concatenate(labels).astype(np.float64)
+    predictions = np.concatenate(predictions).astype(np.float64)
+    codes = (
+        np.concatenate(sub_key_indices) * (self._num_buckets + 2) +
+        self._bucket_indices(predictions))
+    accumulator.buffered_codes.append(codes)
+    accumulator.buffered_values.append(
+        np.stack([
+            labels * example_weight, predictions * example_weight,
+            np.full(labels.shape, example_weight)
+        ],
+                 axis=1))
+    accumulator.num_buffered += 1
+    if accumulator.num_buffered >= self._desired_batch_size:
+      self._add_buffered(accumulator)
+    return accumulator
+
+  def _add_buffered(self, accumulator: _MultiSubKeyHistogramAccumulator):
+    """Adds the buffered bucket values to the histograms."""
+    if not accumulator.buffered_codes:
+      return
+    accumulator.codes, accumulator.values = _reduce_by_code(
+        np.concatenate([accumulator.codes] + accumulator.buffered_codes),
+        np.concatenate([accumulator.values] + accumulator.buffered_values))
+    accumulator.buffered_codes = []
+    accumulator.buffered_values = []
+    accumulator.num_buffered = 0
+
+  def merge_accumulators(
+      self, accumulators: List[_MultiSubKeyHistogramAccumulator]
+  ) -> _MultiSubKeyHistogramAccumulator:
+    result = self.create_accumulator()
+    for accumulator in accumulators:
+      result.buffered_codes.append(accumulator.codes)
+      result.buffered_values.append(accumulator.values)
+      result.buffered_codes.extend(accumulator.buffered_codes)
+      result.buffered_values.extend(accumulator.buffered_values)
+    self._add_buffered(result)
+    return result
+
+  def extract_output(
+      self, accumulator: _MultiSubKeyHistogramAccumulator
+  ) -> Dict[metric_types.PlotKey, Histogram]:
+    self._add_buffered(accumulator)
+    sub_key_indices, bucket_ids = np.divmod(accumulator.codes,
+                                            self._num_buckets + 2)
+    output = {key: [] for key in self._keys}
+    for i, bucket_id, values in zip(sub_key_indices.tolist(),
+                                    bucket_ids.tolist(),
+                                    accumulator.values.tolist()):
+      output[self._keys[i]].append(Bucket(bucket_id, *values))
+    return output
+
+
+def merge_computations(
+    computations: List[metric_types.MetricComputation]
+) -> List[metric_types.MetricComputation]:
+  """Merges histogram computations that only differ by sub key.
+
+  Binarized metrics (class_id, k, and top_k sub keys) each create their own
+  histogram computation. Computations for the same model, output and bucket
+  configuration are merged into one computation so that each example is only
+  processed once for all of the sub keys. Other computations are returned
+  unchanged.
+
+  Args:
+    computations: Metric computations.
+
+  Returns:
+    Metric computations with the histograms for multiple sub keys merged.
+  """
+  groups = []  # (group key, eval_config, index into result)
+  result = []
+  for c in computations:
+    combiner = c.combiner
+    # pylint: disable=protected-access
+    if (isinstance(combiner, _CalibrationHistogramCombiner) and
+        c.preprocessor is None and not combiner._class_weights and
+        combiner._key.sub_key is not None):
+      group = (combiner._key.name, combiner._key.model_name,
+               combiner._key.output_name, combiner._num_buckets,
+               combiner._left, combiner._range)
+      for group_key, eval_config, index in groups:
+        if group_key == group and eval_config == combiner._eval_config:
+          result[index].append(c)
+          break
+      else:
+        groups.append((group, combiner._eval_config, len(result)))
+        result.append([c])
+      # pylint: enable=protected-access
+    else:
+      result.append(c)
+  merged = []
+  for c in result:
+    if not isinstance(c, list):
+      merged.append(c)
+    elif len(c) == 1:
+      merged.append(c[0])
+    else:
+      keys = [computation.keys[0] for computation in c]
+      # pylint: disable=protected-access
+      combiner = c[0].combiner
+      merged.append(
+          metric_types.MetricComputation(
+              keys=keys,
+              preprocessor=None,
+              combiner=_MultiSubKeyCalibrationHistogramCombiner(
+                  keys=keys,
+                  eval_config=combiner._eval_config,
+                  num_buckets=combiner._num_buckets,
+                  left=combiner._left,
+                  right=combiner._left + combiner._range)))
+      # pylint: enable=protected-access
+  return merged
+
+
 def rebin(thresholds: List[float],
           histogram: Histogram,
           num_buckets: int = DEFAULT_NUM_BUCKETS,
@@ -340,6 +340,97 @@ class CalibrationHistogramTest(testutil.TensorflowModelAnalysisTest):
 
       util.assert_that(result, check_result, label='result')
 
+  def testMergeComputationsForSubKeys(self):
+    sub_keys = [
+        metric_types.SubKey(class_id=0),
+        metric_types.SubKey(class_id=2),
+        metric_types.SubKey(k=2),
+        metric_types.SubKey(top_k=2)
+    ]
+    computations = []
+    for sub_key in sub_keys:
+      computations.extend(
+          calibration_histogram.calibration_histogram(sub_key=sub_key))
+    # Histograms without sub keys are not merged.
+    computations.extend(calibration_histogram.calibration_histogram())
+    merged = calibration_histogram.merge_computations(computations)
+    self.assertLen(merged, 2)
+    self.assertCountEqual(merged[0].keys,
+                          [c.keys[0] for c in computations[:len(sub_keys)]])
+
+    examples = [
+        metric_util.to_standard_metric_inputs(e) for e in [{
+            'labels': np.array([2]),
+            'predictions': np.array([0.2, 0.05, 0.5, 0.05]),
+            'example_weights': np.array([1.0])
+        }, {
+            'labels': np.array([2]),
+            'predictions': np.array([0.8, 0.1, 0.8, 0.5]),
+            'example_weights': np.array([2.0])
+        }, {
+            'labels': np.array([3]),
+            'predictions': np.array([0.2, 0.5, 0.1, 0.1]),
+            'example_weights': np.array([3.0])
+        }, {
+            'labels': np.array([0]),
+            'predictions': np.array([-0.1, 1.1, -0.7, -0.4]),
+            'example_weights': np.array([4.0])
+        }]
+    ]
+
+    def compute(combiner):
+      accumulators = []
+      for batch in (examples[:1], examples[1:]):
+        accumulator = combiner.create_accumulator()
+        for example in batch:
+          accumulator = combiner.add_input(accumulator, example)
+        accumulators.append(accumulator)
+      return combiner.extract_output(combiner.merge_accumulators(accumulators))
+
+    got = compute(merged[0].combiner)
+    for computation in computations[:len(sub_keys)]:
+      key = computation.keys[0]
+      expected = compute(computation.combiner)[key]
+      self.assertLen(got[key], len(expected))
+      for got_bucket, expected_bucket in zip(got[key], expected):
+        self.assertEqual(got_bucket.bucket_id, expected_bucket.bucket_id)
+        self.assertAllClose(got_bucket, expected_bucket)
+
+  def testAddInputsMatchesAddInput(self):
+    combiner = calibration_histogram.calibration_histogram(
+        num_buckets=10)[0].combiner
+    inputs = [
+        metric_util.to_standard_metric_inputs({
+            'labels': np.array([label]),
+            'predictions': np.array([prediction]),
+            'example_weights': np.array([weight]),
+        }) for label, prediction, weight in [(0.0, -0.2, 1.0), (
+            1.0, 0.35, 0.5), (0.0, 0.31, 2.0), (1.0, 1.0, 1.5), (1.0, 1.3, 1.0)]
+    ]
+
+    expected = combiner.create_accumulator()
+    for element in inputs:
+      expected = combiner.add_input(expected, element)
+    got = combiner.add_inputs(
+        combiner.add_input(combiner.create_accumulator(), inputs[0]),
+        inputs[1:])
+
+    self.assertLen(got, len(expected))
+    for got_bucket, expected_bucket in zip(got, expected):
+      self.assertEqual(got_bucket.bucket_id, expected_bucket.bucket_id)
+      self.assertAllClose(got_bucket, expected_bucket)
+
+  def testHistogramCoder(self):
+    histogram = [
+        calibration_histogram.Bucket(0, 0.0, 0.25, 1.0),
+        calibration_histogram.Bucket(5, 2.0, 1.5, 3.0)
+    ]
+    combiner = calibration_histogram.calibration_histogram(
+        num_buckets=10)[0].combiner
+    coder = combiner.get_accumulator_coder()
+    self.assertEqual(coder.decode(coder.encode(histogram)), histogram)
+    self.assertEqual(coder.decode(coder.encode([])), [])
+
   def testRebin(self):
     # [Bucket(0, -1, -0.01), Bucket(1, 0, 0) ... Bucket(101, 101, 1.01)]
     histogram = [calibration_histogram.Bucket(0, -1, -.01, 1.0)]
@@ -18,11 +18,15 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
+import math
+
 from absl.testing import parameterized
 import apache_beam as beam
 from apache_beam.testing import util
 import numpy as np
 import tensorflow as tf
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import types
 from tensorflow_model_analysis.eval_saved_model import testutil
 from tensorflow_model_analysis.metrics import calibration
 from tensorflow_model_analysis.metrics import metric_util
@@ -137,6 +141,69 @@ class CalibrationMetricsTest(testutil.TensorflowModelAnalysisTest,
 
       util.assert_that(result, check_result, label='result')
 
+  # Per example (weighted label, weighted prediction, weighted example) totals
+  # are (0, 0, 1), (1, 0.3, 1) and (1, 0.9, 1) so the sums of their products
+  # are: label * label = 2, label * prediction = 1.2, label * example = 2,
+  # prediction * prediction = 0.9, prediction * example = 1.2 and
+  # example * example = 3. The variances by the delta method are:
+  #   mean_label: (2 - 2 * 2/3 * 2 + (2/3)^2 * 3) / 3^2 = 2 / 27
+  #   mean_prediction: (0.9 - 2 * 0.4 * 1.2 + 0.4^2 * 3) / 3^2 = 0.42 / 9
+  #   calibration: (0.9 - 2 * 0.6 * 1.2 + 0.6^2 * 2) / 2^2 = 0.18 / 4
+  @parameterized.named_parameters(
+      ('mean_label', calibration.MeanLabel(), 2.0 / 3.0, math.sqrt(2.0 / 27.0)),
+      ('mean_prediction', calibration.MeanPrediction(), 0.4,
+       math.sqrt(0.42 / 9.0)),
+      ('calibration', calibration.Calibration(), 0.6, math.sqrt(0.18 / 4.0)))
+  def testCalibrationMetricsWithAnalyticConfidenceIntervals(
+      self, metric, expected_value, expected_std_err):
+    eval_config = config.EvalConfig()
+    eval_config.options.compute_confidence_intervals.value = True
+    eval_config.options.confidence_intervals.method = (
+        config.ConfidenceIntervalOptions.ANALYTIC)
+    computations = metric.computations(eval_config=eval_config)
+    weighted_totals = computations[0]
+    metric = computations[1]
+
+    examples = [{
+        'labels': np.array([label]),
+        'predictions': np.array([prediction]),
+        'example_weights': np.array([1.0]),
+    } for label, prediction in [(0.0, 0.0), (1.0, 0.3), (1.0, 0.9)]]
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create(examples)
+          | 'Process' >> beam.Map(metric_util.to_standard_metric_inputs)
+          | 'AddSlice' >> beam.Map(lambda x: ((), x))
+          | 'ComputeWeightedTotals' >> beam.CombinePerKey(
+              weighted_totals.combiner)
+          | 'ComputeMetric' >> beam.Map(lambda x: (x[0], metric.result(x[1]))))
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          _, got_metrics = got[0]
+          got_value = got_metrics[metric.keys[0]]
+          self.assertIsInstance(got_value, types.ValueWithConfidenceInterval)
+          self.assertAlmostEqual(got_value.value, expected_value, places=5)
+          self.assertAlmostEqual(
+              got_value.lower_bound,
+              expected_value - 1.959964 * expected_std_err,
+              places=5)
+          self.assertAlmostEqual(
+              got_value.upper_bound,
+              expected_value + 1.959964 * expected_std_err,
+              places=5)
+
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result, label='result')
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -19,9 +19,13 @@ from __future__ import division
 from __future__ import print_function
 
 import apache_beam as beam
+import numpy as np
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import math_util
 from tensorflow_model_analysis import types
 from tensorflow_model_analysis.metrics import metric_types
-from typing import Dict, Iterable, List, Text
+from tensorflow_model_analysis.metrics import metric_util
+from typing import Any, Dict, Iterable, List, Optional, Text
 
 EXAMPLE_COUNT_NAME = 'example_count'
 
@@ -42,14 +46,20 @@ metric_types.register_metric(ExampleCount)
 
 
 def _example_count(
-    name: Text = EXAMPLE_COUNT_NAME) -> metric_types.MetricComputations:
+    name: Text = EXAMPLE_COUNT_NAME,
+    eval_config: Optional[config.EvalConfig] = None
+) -> metric_types.MetricComputations:
   """Returns metric computations for computing example counts."""
   key = metric_types.MetricKey(name=name)
   return [
       metric_types.MetricComputation(
           keys=[key],
           preprocessor=_ExampleCountPreprocessor(),
-          combiner=_ExampleCountCombiner(key))
+          combiner=_ExampleCountCombiner(
+              key,
+              compute_confidence_intervals=(
+                  metric_util.compute_analytic_confidence_intervals(
+                      eval_config))))
   ]
 
 
@@ -63,8 +73,11 @@ class _ExampleCountPreprocessor(beam.DoFn):
 class _ExampleCountCombiner(beam.CombineFn):
   """Computes example count."""
 
-  def __init__(self, metric_key: metric_types.MetricKey):
+  def __init__(self,
+               metric_key: metric_types.MetricKey,
+               compute_confidence_intervals: bool = False):
     self._metric_key = metric_key
+    self._compute_confidence_intervals = compute_confidence_intervals
 
   def create_accumulator(self) -> int:
     return 0
@@ -79,5 +92,13 @@ class _ExampleCountCombiner(beam.CombineFn):
     return result
 
   def extract_output(self,
-                     accumulator: int) -> Dict[metric_types.MetricKey, int]:
+                     accumulator: int) -> Dict[metric_types.MetricKey, Any]:
+    if self._compute_confidence_intervals:
+      # Each example contributes 1 to the count so the second moment of the
+      # count is the count itself.
+      return {
+          self._metric_key:
+              math_util.calculate_delta_method_confidence_interval(
+                  accumulator, np.array([1.0]), np.array([[accumulator]]))
+      }
     return {self._metric_key: accumulator}
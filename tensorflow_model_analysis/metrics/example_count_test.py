@@ -18,9 +18,13 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
+import math
+
 import apache_beam as beam
 from apache_beam.testing import util
 import tensorflow as tf
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import types
 from tensorflow_model_analysis.eval_saved_model import testutil
 from tensorflow_model_analysis.metrics import example_count
 from tensorflow_model_analysis.metrics import metric_types
@@ -59,6 +63,43 @@ class ExampleCountTest(testutil.TensorflowModelAnalysisTest):
 
       util.assert_that(result, check_result, label='result')
 
+  def testExampleCountWithAnalyticConfidenceIntervals(self):
+    eval_config = config.EvalConfig()
+    eval_config.options.compute_confidence_intervals.value = True
+    eval_config.options.confidence_intervals.method = (
+        config.ConfidenceIntervalOptions.ANALYTIC)
+    metric = example_count.ExampleCount().computations(
+        eval_config=eval_config)[0]
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create([{}, {}, {}])
+          | 'Process' >> beam.ParDo(metric.preprocessor)
+          | 'AddSlice' >> beam.Map(lambda x: ((), x))
+          | 'ComputeMetric' >> beam.CombinePerKey(metric.combiner))
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          _, got_metrics = got[0]
+          got_value = got_metrics[metric_types.MetricKey(name='example_count')]
+          self.assertIsInstance(got_value, types.ValueWithConfidenceInterval)
+          # The variance of a (Poisson resampled) count is the count.
+          self.assertAlmostEqual(got_value.value, 3.0)
+          self.assertAlmostEqual(got_value.lower_bound,
+                                 3.0 - 1.959964 * math.sqrt(3.0), places=5)
+          self.assertAlmostEqual(got_value.upper_bound,
+                                 3.0 + 1.959964 * math.sqrt(3.0), places=5)
+
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result, label='result')
+
 
 if __name__ == '__main__':
   tf.test.main()
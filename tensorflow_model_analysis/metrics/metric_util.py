@@ -173,126 +173,274 @@ def to_label_prediction_example_weight(
     Tuple of (label, prediction, example_weight).
   """
 
-  def optionally_get_by_keys(value: Any, keys: List[Text]) -> Any:
-    if isinstance(value, dict):
-      new_value = util.get_by_keys(value, keys, optional=True)
-      if new_value is not None:
-        return new_value
-    return value
-
-  label = inputs.label
-  prediction = inputs.prediction
-  example_weight = inputs.example_weight
-  if example_weight is None:
-    example_weight = np.array(1.0)
-  if model_name:
-    prediction = util.get_by_keys(prediction, [model_name])
-    # Labels and weights can optionally be keyed by model name.
-    label = optionally_get_by_keys(label, [model_name])
-    example_weight = optionally_get_by_keys(example_weight, [model_name])
-  if output_name:
-    prediction = util.get_by_keys(prediction, [output_name])
-    # Labels and example weights can optionally be keyed by output name.
-    label = optionally_get_by_keys(label, [output_name])
-    example_weight = optionally_get_by_keys(example_weight, [output_name])
-  prediction_key = ''
-  if eval_config and eval_config.model_specs:
-    for spec in eval_config.model_specs:
-      if spec.name == model_name:
-        prediction_key = spec.prediction_key
-        break
-  label, prediction = prepare_labels_and_predictions(label, prediction,
-                                                     prediction_key)
-
-  if not allow_none:
-    for txt, value in zip(('label', 'prediction'), (label, prediction)):
-      if value is None:
-        raise ValueError(
-            'no value provided for {}: model_name={}, output_name={}, '
-            'sub_key={}, StandardMetricInputs={}\n\n'
-            'This may be caused by a configuration error (i.e. label, '
-            'and/or prediction keys were not specified) or an '
-            'error in the pipeline.'.format(txt, model_name, output_name,
-                                            sub_key, inputs))
-
-  example_weight = to_numpy(example_weight)
+  adapter = LabelPredictionExampleWeightAdapter(
+      eval_config=eval_config,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key,
+      class_weights=class_weights,
+      flatten=flatten,
+      allow_none=allow_none)
+  for value in adapter(inputs):
+    yield value
+
+
+def _optionally_get_by_keys(value: Any, keys: List[Text]) -> Any:
+  if isinstance(value, dict):
+    new_value = util.get_by_keys(value, keys, optional=True)
+    if new_value is not None:
+      return new_value
+  return value
+
+
+class LabelPredictionExampleWeightAdapter(object):
+  """Converts inputs to label, prediction, and example weights.
+
+  The adapter performs the same conversions as
+  to_label_prediction_example_weight, but everything that only depends on the
+  configuration (the model and output name lookup path, the prediction key and
+  the class weights) is resolved once when the adapter is created. Combiners
+  should create their adapters at construction time and either call the adapter
+  per input or use batch to convert a list of inputs at once.
+  """
 
-  if example_weight.size != 1:
-    raise ValueError(
-        'expected example weight to be size = 1, but instead it has '
-        'size = {}: example_weight={}, model_name={}, output_name={}, '
-        'sub_key={}, StandardMetricInputs={}\n\nThis is most likely a '
-        'configuration error.'.format(example_weight.size, example_weight,
-                                      model_name, output_name, sub_key, inputs))
-
-  if sub_key is not None:
-    if sub_key.class_id is not None:
-      label, prediction = select_class_id(sub_key.class_id, label, prediction)
-    elif sub_key.k is not None:
-      label, prediction = select_top_k(sub_key.k, label, prediction)
-      label = np.array([label[sub_key.k - 1]])
-      prediction = np.array([prediction[sub_key.k - 1]])
-    elif sub_key.top_k is not None:
-      label, prediction = select_top_k(sub_key.top_k, label, prediction)
-
-  # For consistency, make sure all outputs are arrays (i.e. convert scalars)
-  if label is not None and not label.shape:
-    label = label.reshape((1,))
-  if prediction is not None and not prediction.shape:
-    prediction = prediction.reshape((1,))
-  if example_weight is not None and not example_weight.shape:
-    example_weight = example_weight.reshape((1,))
-
-  if class_weights:
-    if not flatten:
+  def __init__(self,
+               eval_config: Optional[config.EvalConfig] = None,
+               model_name: Text = '',
+               output_name: Text = '',
+               sub_key: Optional[metric_types.SubKey] = None,
+               class_weights: Optional[Dict[int, float]] = None,
+               flatten: bool = True,
+               allow_none: bool = False):
+    """Initializes adapter.
+
+    Args:
+      eval_config: Eval config
+      model_name: Optional model name (if multi-model evaluation).
+      output_name: Optional output name (if multi-output model type).
+      sub_key: Optional sub key.
+      class_weights: Optional class weights to apply to multi-class /
+        multi-label labels and predictions. If used, flatten must also be True.
+      flatten: True to flatten the final label and prediction outputs so that
+        the values are always arrays of size 1.
+      allow_none: True to allow labels or predictions with None values to be
+        returned. The example weight will always be non-None.
+    """
+    self._model_name = model_name
+    self._output_name = output_name
+    self._sub_key = sub_key
+    self._class_weights = class_weights
+    self._flatten = flatten
+    self._allow_none = allow_none
+    self._lookup_path = [name for name in (model_name, output_name) if name]
+    self._prediction_key = ''
+    if eval_config and eval_config.model_specs:
+      for spec in eval_config.model_specs:
+        if spec.name == model_name:
+          self._prediction_key = spec.prediction_key
+          break
+    self._label_vocabulary_index = LabelVocabularyIndex()
+    # Class weight (mask, multipliers) arrays keyed by number of classes.
+    self._class_weight_arrays = {}  # type: Dict[int, Tuple[np.ndarray, np.ndarray]]
+
+  @property
+  def flatten(self) -> bool:
+    return self._flatten
+
+  def _class_weight_arrays_for(self,
+                               num_classes: int) -> Tuple[np.ndarray, np.ndarray]:
+    if num_classes not in self._class_weight_arrays:
+      mask = np.array([i in self._class_weights for i in range(num_classes)],
+                      dtype=bool)
+      multipliers = np.array(
+          [self._class_weights.get(i, 1.0) for i in range(num_classes)],
+          dtype=np.float64)
+      self._class_weight_arrays[num_classes] = (mask, multipliers)
+    return self._class_weight_arrays[num_classes]
+
+  def _convert(
+      self, inputs: metric_types.StandardMetricInputs
+  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the (unflattened) label, prediction and example weight."""
+    label = inputs.label
+    prediction = inputs.prediction
+    example_weight = inputs.example_weight
+    if example_weight is None:
+      example_weight = np.array(1.0)
+    for name in self._lookup_path:
+      prediction = util.get_by_keys(prediction, [name])
+      # Labels and weights can optionally be keyed by model and output name.
+      label = _optionally_get_by_keys(label, [name])
+      example_weight = _optionally_get_by_keys(example_weight, [name])
+    label, prediction = prepare_labels_and_predictions(
+        label,
+        prediction,
+        self._prediction_key,
+        label_vocabulary_index=self._label_vocabulary_index)
+
+    if not self._allow_none:
+      for txt, value in zip(('label', 'prediction'), (label, prediction)):
+        if value is None:
+          raise ValueError(
+              'no value provided for {}: model_name={}, output_name={}, '
+              'sub_key={}, StandardMetricInputs={}\n\n'
+              'This may be caused by a configuration error (i.e. label, '
+              'and/or prediction keys were not specified) or an '
+              'error in the pipeline.'.format(txt, self._model_name,
+                                              self._output_name, self._sub_key,
+                                              inputs))
+
+    example_weight = to_numpy(example_weight)
+
+    if example_weight.size != 1:
       raise ValueError(
-          'class_weights can only be used when flatten is also used. This is '
-          'likely caused by a configuration error (i.e. micro averaging being '
-          "applied to metrics that don't support micro averaging): "
-          'class_weights={}, flatten={}, StandardMetricInputs={}'.format(
-              class_weights, flatten, inputs))
-    example_weight = np.array([
-        float(example_weight) * class_weights[i] if i in class_weights else 1.0
-        for i in range(prediction.shape[-1] or label.shape[-1])
-    ])
-  elif flatten:
-    example_weight = np.array([
-        float(example_weight)
-        for i in range(prediction.shape[-1] or label.shape[-1])
-    ])
-
-  if (not flatten or (label is None and prediction is None) or
-      (label is not None and prediction is not None and label.size == 1 and
-       prediction.size == 1)):
-    yield label, prediction, example_weight
-  elif label is None:
-    for p, w in (prediction.flatten(), example_weight.flatten()):
-      yield label, np.array([p]), np.array([w])
-  elif prediction is None:
-    for l, w in (label.flatten(), example_weight.flatten()):
-      yield np.array([l]), prediction, np.array([w])
-  elif label.size == prediction.size:
-    for l, p, w in zip(label.flatten(), prediction.flatten(),
-                       example_weight.flatten()):
-      yield np.array([l]), np.array([p]), np.array([w])
-  elif label.shape[-1] == 1:
-    label = one_hot(label, prediction)
-    for l, p, w in zip(label.flatten(), prediction.flatten(),
-                       example_weight.flatten()):
-      yield np.array([l]), np.array([p]), np.array([w])
-  else:
-    raise ValueError(
-        'unable to pair labels with predictions: labels={}, predictions={}, '
-        'model_name={}, output_name={}, sub_key={}, StandardMetricInputs={} '
-        '\n\nThis is most likely a configuration error.'.format(
-            label, prediction, model_name, output_name, sub_key, inputs))
+          'expected example weight to be size = 1, but instead it has '
+          'size = {}: example_weight={}, model_name={}, output_name={}, '
+          'sub_key={}, StandardMetricInputs={}\n\nThis is most likely a '
+          'configuration error.'.format(example_weight.size, example_weight,
+                                        self._model_name, self._output_name,
+                                        self._sub_key, inputs))
+
+    sub_key = self._sub_key
+    if sub_key is not None:
+      if sub_key.class_id is not None:
+        label, prediction = select_class_id(sub_key.class_id, label, prediction)
+      elif sub_key.k is not None:
+        label, prediction = select_top_k(sub_key.k, label, prediction)
+        label = np.array([label[sub_key.k - 1]])
+        prediction = np.array([prediction[sub_key.k - 1]])
+      elif sub_key.top_k is not None:
+        label, prediction = select_top_k(sub_key.top_k, label, prediction)
+
+    # For consistency, make sure all outputs are arrays (i.e. convert scalars)
+    if label is not None and not label.shape:
+      label = label.reshape((1,))
+    if prediction is not None and not prediction.shape:
+      prediction = prediction.reshape((1,))
+    if not example_weight.shape:
+      example_weight = example_weight.reshape((1,))
+
+    if self._class_weights:
+      if not self._flatten:
+        raise ValueError(
+            'class_weights can only be used when flatten is also used. This '
+            'is likely caused by a configuration error (i.e. micro averaging '
+            "being applied to metrics that don't support micro averaging): "
+            'class_weights={}, flatten={}, StandardMetricInputs={}'.format(
+                self._class_weights, self._flatten, inputs))
+      mask, multipliers = self._class_weight_arrays_for(
+          prediction.shape[-1] or label.shape[-1])
+      example_weight = np.where(mask, example_weight.item() * multipliers, 1.0)
+    elif self._flatten:
+      example_weight = np.full(prediction.shape[-1] or label.shape[-1],
+                               float(example_weight.item()))
+
+    return label, prediction, example_weight
+
+  def _pair(
+      self, label: np.ndarray, prediction: np.ndarray,
+      inputs: metric_types.StandardMetricInputs
+  ) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns flattened labels and predictions with one value per class."""
+    if label.size == prediction.size:
+      return label.flatten(), prediction.flatten()
+    elif label.shape[-1] == 1:
+      return one_hot(label, prediction).flatten(), prediction.flatten()
+    else:
+      raise ValueError(
+          'unable to pair labels with predictions: labels={}, predictions={}, '
+          'model_name={}, output_name={}, sub_key={}, StandardMetricInputs={} '
+          '\n\nThis is most likely a configuration error.'.format(
+              label, prediction, self._model_name, self._output_name,
+              self._sub_key, inputs))
+
+  def __call__(
+      self, inputs: metric_types.StandardMetricInputs
+  ) -> Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Yields label, prediction, and example weights for the given inputs.
+
+    See to_label_prediction_example_weight for details.
+
+    Args:
+      inputs: Standard metric inputs.
+
+    Yields:
+      Tuple of (label, prediction, example_weight).
+    """
+    label, prediction, example_weight = self._convert(inputs)
+    if (not self._flatten or (label is None and prediction is None) or
+        (label is not None and prediction is not None and label.size == 1 and
+         prediction.size == 1)):
+      yield label, prediction, example_weight
+    elif label is None:
+      for p, w in zip(prediction.flatten(), example_weight.flatten()):
+        yield label, np.array([p]), np.array([w])
+    elif prediction is None:
+      for l, w in zip(label.flatten(), example_weight.flatten()):
+        yield np.array([l]), prediction, np.array([w])
+    else:
+      labels, predictions = self._pair(label, prediction, inputs)
+      for l, p, w in zip(labels, predictions, example_weight.flatten()):
+        yield np.array([l]), np.array([p]), np.array([w])
+
+  def batch(self,
+            inputs: Iterable[metric_types.StandardMetricInputs],
+            with_example_indices: bool = False) -> Tuple[np.ndarray, ...]:
+    """Returns flattened labels, predictions, and example weights for a batch.
+
+    The result is equivalent to concatenating all the values yielded when
+    calling the adapter on each of the inputs, but no per class arrays are
+    created. Only supported when flatten is True and allow_none is False.
+
+    Args:
+      inputs: Standard metric inputs to convert.
+      with_example_indices: True to also return the position within inputs of
+        the example each entry was taken from.
+
+    Returns:
+      Tuple of 1-D arrays (labels, predictions, example_weights) with one entry
+      per (example, class) pair. If with_example_indices is True, an array of
+      example indices is appended to the tuple.
+
+    Raises:
+      ValueError: If flatten is False or allow_none is True.
+    """
+    if not self._flatten or self._allow_none:
+      raise ValueError(
+          'batch conversion requires flatten=True and allow_none=False: '
+          'flatten={}, allow_none={}'.format(self._flatten, self._allow_none))
+    labels = []
+    predictions = []
+    example_weights = []
+    sizes = []
+    for element in inputs:
+      label, prediction, example_weight = self._convert(element)
+      if label.size != 1 or prediction.size != 1:
+        label, prediction = self._pair(label, prediction, element)
+      example_weight = example_weight.flatten()
+      size = min(label.size, prediction.size, example_weight.size)
+      labels.append(label.reshape(-1)[:size])
+      predictions.append(prediction.reshape(-1)[:size])
+      example_weights.append(example_weight[:size])
+      sizes.append(size)
+    if not labels:
+      result = (np.empty(0), np.empty(0), np.empty(0))
+    elif len(labels) == 1:
+      result = (labels[0], predictions[0], example_weights[0])
+    else:
+      result = (np.concatenate(labels), np.concatenate(predictions),
+                np.concatenate(example_weights))
+    if with_example_indices:
+      result += (np.repeat(np.arange(len(sizes), dtype=np.int64), sizes),)
+    return result
 
 
 def prepare_labels_and_predictions(
     labels: Any,
     predictions: Any,
     prediction_key: Optional[Text] = None,
-    label_vocabulary: Optional[Union[np.ndarray, List[Text]]] = None
+    label_vocabulary: Optional[Union[np.ndarray, List[Text]]] = None,
+    label_vocabulary_index: Optional['LabelVocabularyIndex'] = None
 ) -> Tuple[np.ndarray, np.ndarray]:
   """Prepares labels and predictions for use in calculations.
 
@@ -316,6 +464,10 @@ def prepare_labels_and_predictions(
     label_vocabulary: Optional label vocabulary to convert label values to ints
       (if prediction is a dict containing an 'all_classes' key that will be used
       if label_vocabulary is None).
+    label_vocabulary_index: Optional index used to convert labels to class IDs.
+      Callers that prepare many examples (e.g. adapters) should pass the same
+      index for each call so that the index is only rebuilt when the
+      vocabulary changes.
 
   Returns:
     A (labels, predictions) tuple suitable for metric calculations.
@@ -373,7 +525,9 @@ def prepare_labels_and_predictions(
     return (labels, predictions)
 
   if label_vocabulary is not None and labels.dtype.kind in ('U', 'S'):
-    labels = _string_labels_to_class_ids(label_vocabulary, labels)
+    if label_vocabulary_index is None:
+      label_vocabulary_index = LabelVocabularyIndex()
+    labels = label_vocabulary_index.class_ids(label_vocabulary, labels)
 
   # Classify scores contain two values intead of one for binary classification
   # problems, choose top prediction.
@@ -384,17 +538,36 @@ def prepare_labels_and_predictions(
   return (labels, predictions)
 
 
-def _string_labels_to_class_ids(label_vocabulary: Union[np.ndarray, List[Text]],
-                                labels: np.ndarray) -> np.ndarray:
-  """Returns class ID for given string label using given classes or -1."""
+class LabelVocabularyIndex(object):
+  """Converts string labels to class IDs using a label vocabulary.
 
-  def lookup(label):
-    for i, c in enumerate(label_vocabulary):
-      if c == label:
-        return i
-    return -1
+  The vocabulary is usually the same for every example (e.g. the all_classes
+  output of an estimator), so the index of the most recently used vocabulary
+  is kept and only rebuilt when the vocabulary changes. Checking for a change
+  is a single array comparison, so the per example cost does not include
+  building the index.
+  """
 
-  return np.array([lookup(l) for l in labels.flatten()]).reshape(labels.shape)
+  def __init__(self):
+    self._vocabulary = None  # type: Optional[np.ndarray]
+    self._index = {}  # type: Dict[Any, int]
+
+  def class_ids(self, label_vocabulary: Union[np.ndarray, List[Text]],
+                labels: np.ndarray) -> np.ndarray:
+    """Returns the class ID of each label (or -1 if not in the vocabulary)."""
+    vocabulary = np.asarray(label_vocabulary)
+    if (self._vocabulary is None or
+        vocabulary.shape != self._vocabulary.shape or
+        not np.array_equal(vocabulary, self._vocabulary)):
+      self._vocabulary = vocabulary.copy()
+      # Index in reverse so that the first occurrence of duplicates wins.
+      size = len(vocabulary)
+      self._index = dict(
+          zip(reversed(vocabulary.tolist()), range(size - 1, -1, -1)))
+    index = self._index
+    return np.fromiter((index.get(l, -1) for l in labels.flatten().tolist()),
+                       dtype=np.int64,
+                       count=labels.size).reshape(labels.shape)
 
 
 def select_class_id(
@@ -427,10 +600,10 @@ def select_class_id(
     return (labels, predictions)
 
   def lookup(arr, target):
-    if class_id < 0 or class_id >= len(arr):
+    if class_id < 0 or class_id >= arr.shape[-1]:
       raise ValueError('class_id "{}" out of range of {}: {}'.format(
           class_id, target, arr))
-    return arr[class_id]
+    return arr[:, class_id]
 
   # Convert scalars to arrays
   if not labels.shape:
@@ -462,11 +635,11 @@ def select_class_id(
 
   if sparse_labels:
     # Labels are of the form [[class_id1], [class_id2], ...]
-    labels = np.array([int(l[0] == class_id) for l in labels])
+    labels = (labels[:, 0] == class_id).astype(np.int64)
   else:
     # Labels are of the form [[0, 0, 1, ...], [0, 0, 0, ...], ...]
-    labels = np.array([lookup(l, 'labels') for l in labels])
-  predictions = np.array([lookup(p, 'predictions') for p in predictions])
+    labels = lookup(labels, 'labels')
+  predictions = lookup(predictions, 'predictions')
 
   return (labels.reshape(labels_out_shape),
           predictions.reshape(predictions_out_shape))
@@ -588,15 +761,12 @@ def select_top_k(top_k: int,
     return (labels[indices], predictions[indices])
   elif len(predictions.shape) == 2:
     # Batched 2D data
-    out_shape = predictions.shape[:-1] + (top_k,)
-    out_labels = np.empty(out_shape)
-    out_predictions = np.empty(out_shape)
     indices = np.argpartition(scores, -top_k, axis=-1)[:, -top_k:]
-    for i in range(predictions.shape[0]):
-      for j, idx in enumerate(indices[i][np.argsort(-scores[i][indices[i]])]):
-        out_labels[i][j] = labels[i][idx]
-        out_predictions[i][j] = predictions[i][idx]
-    return (out_labels, out_predictions)
+    order = np.argsort(-np.take_along_axis(scores, indices, axis=-1), axis=-1)
+    indices = np.take_along_axis(indices, order, axis=-1)
+    out_labels = np.take_along_axis(labels, indices, axis=-1)
+    out_predictions = np.take_along_axis(predictions, indices, axis=-1)
+    return (out_labels.astype(np.float64), out_predictions.astype(np.float64))
   else:
     raise NotImplementedError(
         'select_top_k not supported for shapes > 2: predictions = {}'.format(
@@ -623,6 +793,23 @@ def one_hot(tensor: np.ndarray, target: np.ndarray) -> np.ndarray:
   return tensor.reshape(target.shape)
 
 
+def compute_analytic_confidence_intervals(
+    eval_config: Optional[config.EvalConfig]) -> bool:
+  """Returns true if confidence intervals should be computed analytically.
+
+  Metrics that support analytic confidence intervals track the additional
+  moments they need in their accumulators (only) when this is true and output
+  types.ValueWithConfidenceInterval values.
+
+  Args:
+    eval_config: Eval config.
+  """
+  return bool(eval_config and
+              eval_config.options.compute_confidence_intervals.value and
+              eval_config.options.confidence_intervals.method ==
+              config.ConfidenceIntervalOptions.ANALYTIC)
+
+
 def merge_per_key_computations(
     create_computations_fn: Callable[..., metric_types.MetricComputations],
 ) -> metric_types.MetricComputations:
@@ -21,6 +21,7 @@ from __future__ import print_function
 
 import numpy as np
 import tensorflow as tf
+from tensorflow_model_analysis import config
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import metric_util
 
@@ -35,6 +36,21 @@ class UtilTest(tf.test.TestCase):
         indices=np.array([0]), values=np.array([1]), dense_shape=(1,))
     self.assertEqual(1, metric_util.to_scalar(sparse_tensor))
 
+  def testComputeAnalyticConfidenceIntervals(self):
+    self.assertFalse(metric_util.compute_analytic_confidence_intervals(None))
+    eval_config = config.EvalConfig()
+    eval_config.options.confidence_intervals.method = (
+        config.ConfidenceIntervalOptions.ANALYTIC)
+    self.assertFalse(
+        metric_util.compute_analytic_confidence_intervals(eval_config))
+    eval_config.options.compute_confidence_intervals.value = True
+    self.assertTrue(
+        metric_util.compute_analytic_confidence_intervals(eval_config))
+    eval_config.options.confidence_intervals.method = (
+        config.ConfidenceIntervalOptions.POISSON_BOOTSTRAP)
+    self.assertFalse(
+        metric_util.compute_analytic_confidence_intervals(eval_config))
+
   def testStandardMetricInputsToNumpy(self):
     example = metric_types.StandardMetricInputs(
         label={'output_name': np.array([2])},
@@ -179,6 +195,69 @@ class UtilTest(tf.test.TestCase):
                   2: 0.25
               }, flatten=False))
 
+  def testLabelPredictionExampleWeightAdapter(self):
+    example = metric_types.StandardMetricInputs(
+        label={'output_name': np.array([2])},
+        prediction={'output_name': np.array([0, 0.5, 0.3, 0.9])},
+        example_weight={'output_name': np.array([2.0])})
+    adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        output_name='output_name', class_weights={1: 0.5, 2: 0.25})
+    expected = list(
+        metric_util.to_label_prediction_example_weight(
+            example,
+            output_name='output_name',
+            class_weights={
+                1: 0.5,
+                2: 0.25
+            }))
+    got = list(adapter(example))
+    self.assertLen(got, len(expected))
+    for (got_label, got_pred, got_weight), (label, pred, weight) in zip(
+        got, expected):
+      self.assertAllClose(got_label, label)
+      self.assertAllClose(got_pred, pred)
+      self.assertAllClose(got_weight, weight)
+
+  def testLabelPredictionExampleWeightAdapterBatch(self):
+    examples = [
+        metric_types.StandardMetricInputs(
+            np.array([2]), np.array([0, 0.5, 0.3, 0.9]), np.array([2.0])),
+        metric_types.StandardMetricInputs(
+            np.array([0, 1, 0, 0]), np.array([0.1, 0.6, 0.2, 0.1]), None),
+    ]
+    adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        class_weights={
+            1: 0.5,
+            2: 0.25
+        })
+    labels, predictions, example_weights = adapter.batch(examples)
+    self.assertAllClose(labels, [0, 0, 1, 0, 0, 1, 0, 0])
+    self.assertAllClose(predictions,
+                        [0, 0.5, 0.3, 0.9, 0.1, 0.6, 0.2, 0.1])
+    self.assertAllClose(example_weights,
+                        [1.0, 1.0, 0.5, 1.0, 1.0, 0.5, 0.25, 1.0])
+
+  def testLabelPredictionExampleWeightAdapterBatchWithExampleIndices(self):
+    examples = [
+        metric_types.StandardMetricInputs(
+            np.array([1]), np.array([0.2, 0.8]), np.array([2.0])),
+        metric_types.StandardMetricInputs(
+            np.array([0]), np.array([0.3]), np.array([1.0])),
+    ]
+    adapter = metric_util.LabelPredictionExampleWeightAdapter()
+    labels, predictions, example_weights, example_indices = adapter.batch(
+        examples, with_example_indices=True)
+    self.assertAllClose(labels, [0, 1, 0])
+    self.assertAllClose(predictions, [0.2, 0.8, 0.3])
+    self.assertAllClose(example_weights, [2.0, 2.0, 1.0])
+    self.assertAllEqual(example_indices, [0, 0, 1])
+
+  def testLabelPredictionExampleWeightAdapterBatchRaisesErrorWithoutFlatten(
+      self):
+    adapter = metric_util.LabelPredictionExampleWeightAdapter(flatten=False)
+    with self.assertRaises(ValueError):
+      adapter.batch([])
+
   def testPrepareLabelsAndPredictions(self):
     labels = [0]
     preds = {
@@ -261,6 +340,33 @@ class UtilTest(tf.test.TestCase):
     self.assertAllClose(got_labels, np.array([0, 1]))
     self.assertAllClose(got_preds, np.array([0.2, 0.8]))
 
+  def testPrepareLabelsAndPredictionsWithVocabBatched(self):
+    labels = np.array([['f'], ['x'], ['e']])
+    preds = np.array([[0.2, 0.8], [0.6, 0.4], [0.3, 0.7]])
+    got_labels, got_preds = metric_util.prepare_labels_and_predictions(
+        labels, preds, label_vocabulary=['e', 'f', 'f'])
+
+    # Out of vocabulary labels are mapped to -1.
+    self.assertAllEqual(got_labels, np.array([[1], [-1], [0]]))
+    self.assertAllClose(got_preds, preds)
+
+  def testLabelVocabularyIndexIsReusedForSameVocabulary(self):
+    index = metric_util.LabelVocabularyIndex()
+    preds = {'probabilities': [0.2, 0.8], 'all_classes': [b'a', b'b']}
+    got_labels, _ = metric_util.prepare_labels_and_predictions(
+        np.array([b'b']), preds, label_vocabulary_index=index)
+    self.assertAllEqual(got_labels, [1])
+    vocabulary_index = index._index  # pylint: disable=protected-access
+    got_labels, _ = metric_util.prepare_labels_and_predictions(
+        np.array([b'a']), dict(preds), label_vocabulary_index=index)
+    self.assertAllEqual(got_labels, [0])
+    self.assertIs(index._index, vocabulary_index)  # pylint: disable=protected-access
+    # The index is rebuilt when the vocabulary changes.
+    preds['all_classes'] = [b'b', b'a']
+    got_labels, _ = metric_util.prepare_labels_and_predictions(
+        np.array([b'a']), preds, label_vocabulary_index=index)
+    self.assertAllEqual(got_labels, [1])
+
   def testSelectClassIDSparse(self):
     labels = np.array([2])
     preds = np.array([0.2, 0.7, 0.1])
@@ -369,6 +475,19 @@ class UtilTest(tf.test.TestCase):
     self.assertAllClose(got_labels, np.array([[0, 0], [1, 0]]))
     self.assertAllClose(got_preds, np.array([[0.4, 0.3], [0.6, 0.2]]))
 
+  def testSelectTopKBatchedMatchesUnbatched(self):
+    labels = np.array([[0], [5], [9]])
+    preds = np.array([[0.05, 0.1, 0.2, 0.0, 0.15, 0.1, 0.1, 0.1, 0.1, 0.1],
+                      [0.0, 0.0, 0.1, 0.2, 0.3, 0.05, 0.05, 0.1, 0.1, 0.1],
+                      [0.3, 0.2, 0.1, 0.1, 0.05, 0.05, 0.0, 0.0, 0.0, 0.25]])
+    got_labels, got_preds = metric_util.select_top_k(3, labels, preds)
+
+    for i in range(labels.shape[0]):
+      expected_labels, expected_preds = metric_util.select_top_k(
+          3, labels[i], preds[i])
+      self.assertAllClose(got_labels[i], expected_labels)
+      self.assertAllClose(got_preds[i], expected_preds)
+
   def testSelectTopKUsingSeparateScores(self):
     labels = np.array(['', '', '', 'c'])
     preds = np.array(['b', 'c', 'a', 'd'])
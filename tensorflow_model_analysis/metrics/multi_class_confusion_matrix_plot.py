@@ -19,10 +19,11 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
-from typing import Dict, List, Optional, NamedTuple, Text
+from typing import Dict, List, Optional, Text, Tuple
 
 import apache_beam as beam
 import numpy as np
+from tensorflow_model_analysis import coders
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import metric_util
@@ -48,7 +49,8 @@ class MultiClassConfusionMatrixPlot(metric_types.Metric):
 
   def __init__(self,
                thresholds: Optional[List[float]] = None,
-               name: Text = MULTI_CLASS_CONFUSION_MATRIX_PLOT_NAME):
+               name: Text = MULTI_CLASS_CONFUSION_MATRIX_PLOT_NAME,
+               max_dense_matrix_size: Optional[int] = None):
     """Initializes multi-class confusion matrix.
 
     Args:
@@ -57,12 +59,18 @@ class MultiClassConfusionMatrixPlot(metric_types.Metric):
         prediction associated with it (the predicted_class_id will be set to
         NO_PREDICTED_CLASS_ID). Defaults to [0.0].
       name: Metric name.
+      max_dense_matrix_size: Optional maximum number of entries
+        (num_thresholds * num_classes * (num_classes + 1)) for which the
+        matrices are accumulated in a dense array. Larger matrices are
+        accumulated sparsely. Defaults to 20M entries (enough for 1000 classes
+        at 10 thresholds).
     """
     super(MultiClassConfusionMatrixPlot, self).__init__(
         metric_util.merge_per_key_computations(
             _multi_class_confusion_matrix_plot),
         thresholds=thresholds,
-        name=name)
+        name=name,
+        max_dense_matrix_size=max_dense_matrix_size)
 
 
 metric_types.register_metric(MultiClassConfusionMatrixPlot)
@@ -74,6 +82,7 @@ def _multi_class_confusion_matrix_plot(
     eval_config: Optional[config.EvalConfig] = None,
     model_name: Text = '',
     output_name: Text = '',
+    max_dense_matrix_size: Optional[int] = None,
 ) -> metric_types.MetricComputations:
   """Returns computations for multi-class confusion matrix at thresholds."""
   key = metric_types.PlotKey(
@@ -83,37 +92,177 @@ def _multi_class_confusion_matrix_plot(
           keys=[key],
           preprocessor=None,
           combiner=_MultiClassConfusionMatrixPlotCombiner(
-              key=key, eval_config=eval_config, thresholds=thresholds))
+              key=key,
+              eval_config=eval_config,
+              thresholds=thresholds,
+              max_dense_matrix_size=max_dense_matrix_size))
   ]
 
 
-_MatrixEntryKey = NamedTuple('_MatrixEntryKey', [('actual_class_id', int),
-                                                 ('predicted_class_id', int)])
-# Thresholds -> entry -> example_weights
-_Matrices = Dict[float, Dict[_MatrixEntryKey, float]]
+# Matrices larger than this (num_thresholds * num_classes * (num_classes + 1)
+# entries) are accumulated sparsely by default to bound the memory used per
+# accumulator (about 180MB for the weights and observed mask). This keeps 1000
+# classes at 10 thresholds dense.
+_MAX_DENSE_MATRIX_SIZE = 20000000
+
+# Number of examples buffered before they are added to the matrices.
+_DEFAULT_DESIRED_BATCH_SIZE = 1000
+
+# (threshold index, actual_class_id, predicted_class_id) -> example_weights
+_SparseMatrices = Dict[Tuple[int, int, int], float]
+
+
+class _MultiClassConfusionMatrixAccumulator(object):
+  """Multi-class confusion matrix accumulator.
+
+  The matrices are stored in a dense array of shape (num_thresholds,
+  num_classes, num_classes + 1) indexed by threshold, actual class ID and
+  predicted class ID + 1 (index 0 is used for NO_PREDICTED_CLASS_ID). A boolean
+  array of the same shape records which entries were observed so that entries
+  whose examples all have zero weight are still output. If the dense arrays
+  would be too large, a dict keyed by (threshold index, actual class ID,
+  predicted class ID) is used instead.
+  """
+  __slots__ = [
+      'matrices', 'observed', 'sparse_matrices', 'actual_class_ids',
+      'predicted_class_ids', 'top_predictions', 'example_weights',
+      'num_examples'
+  ]
+
+  def __init__(self):
+    self.matrices = None  # type: Optional[np.ndarray]
+    self.observed = None  # type: Optional[np.ndarray]
+    self.sparse_matrices = None  # type: Optional[_SparseMatrices]
+    # Inputs buffered until the next batch is added to the matrices.
+    self.actual_class_ids = []  # type: List[int]
+    self.predicted_class_ids = []  # type: List[int]
+    self.top_predictions = []  # type: List[float]
+    self.example_weights = []  # type: List[float]
+    self.num_examples = 0
+
+  @property
+  def num_classes(self) -> int:
+    if self.matrices is None:
+      return 0
+    return self.matrices.shape[1]
 
 
 class _MultiClassConfusionMatrixPlotCombiner(beam.CombineFn):
   """Creates multi-class confusion matrix at thresholds from standard inputs."""
 
-  def __init__(self, key: metric_types.PlotKey,
+  def __init__(self,
+               key: metric_types.PlotKey,
                eval_config: Optional[config.EvalConfig],
-               thresholds: List[float]):
+               thresholds: List[float],
+               desired_batch_size: Optional[int] = None,
+               max_dense_matrix_size: Optional[int] = None):
     self._key = key
     self._eval_config = eval_config
-    self._thresholds = thresholds if thresholds else [0.0]
-
-  def create_accumulator(self) -> _Matrices:
-    return {}
-
-  def add_input(self, accumulator: _Matrices,
-                element: metric_types.StandardMetricInputs) -> _Matrices:
-    label, predictions, example_weight = next(
-        metric_util.to_label_prediction_example_weight(
-            element,
-            eval_config=self._eval_config,
-            output_name=self._key.output_name,
-            flatten=False))
+    self._thresholds = sorted(set(thresholds)) if thresholds else [0.0]
+    if desired_batch_size and desired_batch_size > 0:
+      self._desired_batch_size = desired_batch_size
+    else:
+      self._desired_batch_size = _DEFAULT_DESIRED_BATCH_SIZE
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config, output_name=key.output_name, flatten=False)
+    if max_dense_matrix_size is None:
+      max_dense_matrix_size = _MAX_DENSE_MATRIX_SIZE
+    self._max_dense_matrix_size = max_dense_matrix_size
+
+  def _is_dense(self, num_classes: int) -> bool:
+    return (len(self._thresholds) * num_classes *
+            (num_classes + 1)) <= self._max_dense_matrix_size
+
+  def _resize(self, accumulator: _MultiClassConfusionMatrixAccumulator,
+              num_classes: int):
+    """Grows the dense matrices (or switches to sparse) for num_classes."""
+    if accumulator.sparse_matrices is not None:
+      return
+    if num_classes <= accumulator.num_classes:
+      return
+    if not self._is_dense(num_classes):
+      self._make_sparse(accumulator)
+      return
+    shape = (len(self._thresholds), num_classes, num_classes + 1)
+    matrices = np.zeros(shape)
+    observed = np.zeros(shape, dtype=bool)
+    if accumulator.matrices is not None:
+      n = accumulator.num_classes
+      matrices[:, :n, :n + 1] = accumulator.matrices
+      observed[:, :n, :n + 1] = accumulator.observed
+    accumulator.matrices = matrices
+    accumulator.observed = observed
+
+  def _make_sparse(self, accumulator: _MultiClassConfusionMatrixAccumulator):
+    accumulator.sparse_matrices = self._to_sparse(accumulator)
+    accumulator.matrices = None
+    accumulator.observed = None
+
+  def _to_sparse(
+      self,
+      accumulator: _MultiClassConfusionMatrixAccumulator) -> _SparseMatrices:
+    """Returns the observed entries of the dense matrices as a dict."""
+    result = {}
+    if accumulator.matrices is None:
+      return result
+    matrices = accumulator.matrices
+    for t, actual, predicted in zip(*np.nonzero(accumulator.observed)):
+      result[(int(t), int(actual),
+              int(predicted) - 1)] = float(matrices[t, actual, predicted])
+    return result
+
+  def _add_batch(self, accumulator: _MultiClassConfusionMatrixAccumulator):
+    """Adds the buffered inputs to the matrices."""
+    if not accumulator.example_weights:
+      return
+    actual = np.array(accumulator.actual_class_ids, dtype=np.int64)
+    predicted = np.array(accumulator.predicted_class_ids, dtype=np.int64)
+    top_predictions = np.array(accumulator.top_predictions)
+    weights = np.array(accumulator.example_weights)
+    accumulator.actual_class_ids = []
+    accumulator.predicted_class_ids = []
+    accumulator.top_predictions = []
+    accumulator.example_weights = []
+
+    num_thresholds = len(self._thresholds)
+    # Predicted class IDs per (threshold, example).
+    thresholds = np.array(self._thresholds)[:, np.newaxis]
+    predicted = np.where(top_predictions[np.newaxis, :] < thresholds,
+                         NO_PREDICTED_CLASS_ID, predicted[np.newaxis, :])
+    threshold_indices = np.repeat(np.arange(num_thresholds), len(weights))
+    actual = np.tile(actual, num_thresholds)
+    predicted = predicted.ravel()
+    weights = np.tile(weights, num_thresholds)
+
+    self._resize(accumulator,
+                 max(int(actual.max()), int(predicted.max())) + 1)
+    if accumulator.sparse_matrices is None:
+      indices = (threshold_indices, actual, predicted + 1)
+      np.add.at(accumulator.matrices, indices, weights)
+      accumulator.observed[indices] = True
+    else:
+      # Reduce the batch to one weight per distinct entry before updating the
+      # dict so that only one key is created per entry.
+      entries = np.stack([threshold_indices, actual, predicted], axis=1)
+      unique_entries, inverse = np.unique(
+          entries, axis=0, return_inverse=True)
+      totals = np.bincount(inverse.ravel(), weights=weights)
+      sparse_matrices = accumulator.sparse_matrices
+      for entry, total in zip(unique_entries.tolist(), totals.tolist()):
+        entry = tuple(entry)
+        sparse_matrices[entry] = sparse_matrices.get(entry, 0.0) + total
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return coders.AccumulatorCoder(_MultiClassConfusionMatrixAccumulator)
+
+  def create_accumulator(self) -> _MultiClassConfusionMatrixAccumulator:
+    return _MultiClassConfusionMatrixAccumulator()
+
+  def add_input(
+      self, accumulator: _MultiClassConfusionMatrixAccumulator,
+      element: metric_types.StandardMetricInputs
+  ) -> _MultiClassConfusionMatrixAccumulator:
+    label, predictions, example_weight = next(self._adapter(element))
     if not label.shape:
       raise ValueError(
           'Label missing from example: StandardMetricInputs={}'.format(element))
@@ -127,42 +276,61 @@ class _MultiClassConfusionMatrixPlotCombiner(beam.CombineFn):
     else:
       actual_class_id = int(label)
     predicted_class_id = np.argmax(predictions)
-    example_weight = float(example_weight)
-    for threshold in self._thresholds:
-      if threshold not in accumulator:
-        accumulator[threshold] = {}
-      if predictions[predicted_class_id] < threshold:
-        predicted_class_id = NO_PREDICTED_CLASS_ID
-      matrix_key = _MatrixEntryKey(actual_class_id, predicted_class_id)
-      if matrix_key in accumulator[threshold]:
-        accumulator[threshold][matrix_key] += example_weight
-      else:
-        accumulator[threshold][matrix_key] = example_weight
+    accumulator.actual_class_ids.append(int(actual_class_id))
+    accumulator.predicted_class_ids.append(int(predicted_class_id))
+    accumulator.top_predictions.append(float(predictions[predicted_class_id]))
+    accumulator.example_weights.append(float(example_weight))
+    accumulator.num_examples += 1
+    if len(accumulator.example_weights) >= self._desired_batch_size:
+      self._add_batch(accumulator)
     return accumulator
 
-  def merge_accumulators(self, accumulators: List[_Matrices]) -> _Matrices:
-    result = {}
+  def merge_accumulators(
+      self, accumulators: List[_MultiClassConfusionMatrixAccumulator]
+  ) -> _MultiClassConfusionMatrixAccumulator:
+    result = self.create_accumulator()
     for accumulator in accumulators:
-      for threshold, matrix in accumulator.items():
-        if threshold not in result:
-          result[threshold] = {}
-        for k, v in matrix.items():
-          if k in result[threshold]:
-            result[threshold][k] += v
-          else:
-            result[threshold][k] = v
+      self._add_batch(accumulator)
+      result.num_examples += accumulator.num_examples
+      if accumulator.matrices is None and accumulator.sparse_matrices is None:
+        continue
+      if accumulator.sparse_matrices is not None:
+        if result.sparse_matrices is None:
+          self._make_sparse(result)
+        for entry, weight in accumulator.sparse_matrices.items():
+          result.sparse_matrices[entry] = (
+              result.sparse_matrices.get(entry, 0.0) + weight)
+        continue
+      self._resize(result, accumulator.num_classes)
+      if result.sparse_matrices is not None:
+        for entry, weight in self._to_sparse(accumulator).items():
+          result.sparse_matrices[entry] = (
+              result.sparse_matrices.get(entry, 0.0) + weight)
+      else:
+        n = accumulator.num_classes
+        result.matrices[:, :n, :n + 1] += accumulator.matrices
+        result.observed[:, :n, :n + 1] |= accumulator.observed
     return result
 
   def extract_output(
-      self, accumulator: _Matrices
+      self, accumulator: _MultiClassConfusionMatrixAccumulator
   ) -> Dict[metric_types.PlotKey,
             metrics_for_slice_pb2.MultiClassConfusionMatrixAtThresholds]:
+    self._add_batch(accumulator)
     pb = metrics_for_slice_pb2.MultiClassConfusionMatrixAtThresholds()
-    for threshold in sorted(accumulator.keys()):
-      matrix = pb.matrices.add(threshold=threshold)
-      for k in sorted(accumulator[threshold].keys()):
-        matrix.entries.add(
-            actual_class_id=k.actual_class_id,
-            predicted_class_id=k.predicted_class_id,
-            num_weighted_examples=accumulator[threshold][k])
+    if not accumulator.num_examples:
+      return {self._key: pb}
+    if accumulator.sparse_matrices is not None:
+      entries = accumulator.sparse_matrices
+    else:
+      entries = self._to_sparse(accumulator)
+    matrices = [
+        pb.matrices.add(threshold=threshold) for threshold in self._thresholds
+    ]
+    for t, actual_class_id, predicted_class_id in sorted(entries.keys()):
+      matrices[t].entries.add(
+          actual_class_id=actual_class_id,
+          predicted_class_id=predicted_class_id,
+          num_weighted_examples=entries[(t, actual_class_id,
+                                         predicted_class_id)])
     return {self._key: pb}
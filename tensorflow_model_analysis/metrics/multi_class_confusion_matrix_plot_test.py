@@ -231,5 +231,133 @@ class MultiClassConfusionMatrixPlotTest(testutil.TensorflowModelAnalysisTest):
       util.assert_that(result, check_result, label='result')
 
 
+  def testMultiClassConfusionMatrixPlotDenseAndSparseAgree(self):
+    key = metric_types.PlotKey(name='multi_class_confusion_matrix_plot')
+    examples = [
+        metric_util.to_standard_metric_inputs(e) for e in [{
+            'labels': np.array([2.0]),
+            'predictions': np.array([0.2, 0.35, 0.45]),
+            'example_weights': np.array([1.0])
+        }, {
+            'labels': np.array([0.0]),
+            'predictions': np.array([0.1, 0.35, 0.55]),
+            'example_weights': np.array([0.5])
+        }, {
+            'labels': np.array([1.0]),
+            'predictions': np.array([0.3, 0.25, 0.45]),
+            'example_weights': np.array([1.0])
+        }, {
+            'labels': np.array([1.0]),
+            'predictions': np.array([0.1, 0.9, 0.0]),
+            'example_weights': np.array([2.0])
+        }]
+    ]
+
+    def compute(combiner):
+      accumulators = []
+      for batch in (examples[:1], examples[1:]):
+        accumulator = combiner.create_accumulator()
+        for example in batch:
+          accumulator = combiner.add_input(accumulator, example)
+        accumulators.append(accumulator)
+      return combiner.extract_output(
+          combiner.merge_accumulators(accumulators))[key]
+
+    plot_lib = multi_class_confusion_matrix_plot
+    combiner_cls = plot_lib._MultiClassConfusionMatrixPlotCombiner  # pylint: disable=protected-access
+    dense = compute(
+        combiner_cls(
+            key=key,
+            eval_config=None,
+            thresholds=[0.0, 0.5],
+            desired_batch_size=2))
+    # Two thresholds and three classes require 24 entries when dense.
+    sparse = compute(
+        combiner_cls(
+            key=key,
+            eval_config=None,
+            thresholds=[0.0, 0.5],
+            desired_batch_size=2,
+            max_dense_matrix_size=10))
+    self.assertProtoEquals(dense, sparse)
+    self.assertLen(dense.matrices, 2)
+    self.assertLen(dense.matrices[1].entries, 4)
+
+  def testMultiClassConfusionMatrixPlotKeepsZeroWeightEntries(self):
+    key = metric_types.PlotKey(name='multi_class_confusion_matrix_plot')
+    examples = [
+        metric_util.to_standard_metric_inputs(e) for e in [{
+            'labels': np.array([2.0]),
+            'predictions': np.array([0.2, 0.35, 0.45]),
+            'example_weights': np.array([0.0])
+        }, {
+            'labels': np.array([1.0]),
+            'predictions': np.array([0.1, 0.9, 0.0]),
+            'example_weights': np.array([1.0])
+        }]
+    ]
+    plot_lib = multi_class_confusion_matrix_plot
+    combiner_cls = plot_lib._MultiClassConfusionMatrixPlotCombiner  # pylint: disable=protected-access
+    for max_dense_matrix_size in (None, 1):
+      combiner = combiner_cls(
+          key=key,
+          eval_config=None,
+          thresholds=[0.0],
+          max_dense_matrix_size=max_dense_matrix_size)
+      accumulator = combiner.create_accumulator()
+      for example in examples:
+        accumulator = combiner.add_input(accumulator, example)
+      got = combiner.extract_output(
+          combiner.merge_accumulators([accumulator]))[key]
+      self.assertProtoEquals(
+          """
+          matrices {
+            threshold: 0.0
+            entries {
+              actual_class_id: 1
+              predicted_class_id: 1
+              num_weighted_examples: 1.0
+            }
+            entries {
+              actual_class_id: 2
+              predicted_class_id: 2
+              num_weighted_examples: 0.0
+            }
+          }
+          """, got)
+
+  def testMultiClassConfusionMatrixPlotIsDenseForThousandClasses(self):
+    key = metric_types.PlotKey(name='multi_class_confusion_matrix_plot')
+    num_classes = 1000
+    thresholds = [i / 10.0 for i in range(10)]
+    examples = []
+    for class_id in (0, 500, num_classes - 1):
+      predictions = np.zeros(num_classes)
+      predictions[class_id] = 0.55
+      examples.append(
+          metric_util.to_standard_metric_inputs({
+              'labels': np.array([float(class_id)]),
+              'predictions': predictions,
+              'example_weights': np.array([1.0])
+          }))
+    plot_lib = multi_class_confusion_matrix_plot
+    combiner = plot_lib._MultiClassConfusionMatrixPlotCombiner(  # pylint: disable=protected-access
+        key=key, eval_config=None, thresholds=thresholds)
+    accumulator = combiner.create_accumulator()
+    for example in examples:
+      accumulator = combiner.add_input(accumulator, example)
+    accumulator = combiner.merge_accumulators([accumulator])
+    self.assertIsNone(accumulator.sparse_matrices)
+    self.assertEqual(accumulator.matrices.shape,
+                     (10, num_classes, num_classes + 1))
+    got = combiner.extract_output(accumulator)[key]
+    self.assertLen(got.matrices, 10)
+    for matrix in got.matrices:
+      predicted_class_ids = [e.predicted_class_id for e in matrix.entries]
+      if matrix.threshold <= 0.55:
+        self.assertEqual(predicted_class_ids, [0, 500, num_classes - 1])
+      else:
+        self.assertEqual(predicted_class_ids, [-1, -1, -1])
+
 if __name__ == '__main__':
   tf.test.main()
@@ -19,9 +19,11 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
-from typing import Dict, List, Optional, NamedTuple, Text
+from typing import Dict, List, Optional, Text
 
 import apache_beam as beam
+import numpy as np
+from tensorflow_model_analysis import coders
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import metric_util
@@ -112,48 +114,119 @@ def _multi_label_confusion_matrix_plot(
   ]
 
 
-_MatrixEntryKey = NamedTuple('_MatrixEntryKey', [('actual_class_id', int),
-                                                 ('predicted_class_id', int)])
+# Number of examples buffered before they are added to the matrices.
+_DEFAULT_DESIRED_BATCH_SIZE = 1000
 
+# Indices of the confusion matrix values in the last axis of the matrices.
+_FALSE_NEGATIVES = 0
+_TRUE_NEGATIVES = 1
+_FALSE_POSITIVES = 2
+_TRUE_POSITIVES = 3
 
-class _ConfusionMatrix(object):
-  """Confusion matrix."""
-  __slots__ = [
-      'false_negatives', 'true_negatives', 'false_positives', 'true_positives'
-  ]
 
-  def __init__(self):
-    self.false_negatives = 0.0
-    self.true_negatives = 0.0
-    self.false_positives = 0.0
-    self.true_positives = 0.0
+class _MultiLabelConfusionMatrixAccumulator(object):
+  """Multi-label confusion matrix accumulator.
+
+  The matrices are stored in a dense array of shape (num_thresholds,
+  num_classes, num_classes, 4) indexed by threshold, actual class ID, predicted
+  class ID and confusion matrix value (FN, TN, FP, TP). The number of examples
+  in which each class was an actual (positive) class is tracked separately so
+  that only the entries for actual classes that were seen are output.
+  """
+  __slots__ = ['matrices', 'actual_class_counts', 'labels', 'predictions',
+               'example_weights', 'num_examples']
 
+  def __init__(self):
+    self.matrices = None  # type: Optional[np.ndarray]
+    self.actual_class_counts = None  # type: Optional[np.ndarray]
+    # Inputs buffered until the next batch is added to the matrices.
+    self.labels = []  # type: List[np.ndarray]
+    self.predictions = []  # type: List[np.ndarray]
+    self.example_weights = []  # type: List[float]
+    self.num_examples = 0
 
-# Thresholds -> entry -> confusion matrix
-_Matrices = Dict[float, Dict[_MatrixEntryKey, _ConfusionMatrix]]
+  @property
+  def num_classes(self) -> int:
+    if self.matrices is None:
+      return 0
+    return self.matrices.shape[1]
 
 
 class _MultiLabelConfusionMatrixPlotCombiner(beam.CombineFn):
   """Creates multi-label confusion matrix at thresholds from standard inputs."""
 
-  def __init__(self, key: metric_types.PlotKey,
+  def __init__(self,
+               key: metric_types.PlotKey,
                eval_config: Optional[config.EvalConfig],
-               thresholds: List[float]):
+               thresholds: List[float],
+               desired_batch_size: Optional[int] = None):
     self._key = key
     self._eval_config = eval_config
-    self._thresholds = thresholds if thresholds else [0.5]
-
-  def create_accumulator(self) -> _Matrices:
-    return {}
-
-  def add_input(self, accumulator: _Matrices,
-                element: metric_types.StandardMetricInputs) -> _Matrices:
-    labels, predictions, example_weight = next(
-        metric_util.to_label_prediction_example_weight(
-            element,
-            eval_config=self._eval_config,
-            output_name=self._key.output_name,
-            flatten=False))
+    self._thresholds = sorted(set(thresholds)) if thresholds else [0.5]
+    if desired_batch_size and desired_batch_size > 0:
+      self._desired_batch_size = desired_batch_size
+    else:
+      self._desired_batch_size = _DEFAULT_DESIRED_BATCH_SIZE
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config, output_name=key.output_name, flatten=False)
+
+  def _resize(self, accumulator: _MultiLabelConfusionMatrixAccumulator,
+              num_classes: int):
+    """Grows the matrices to hold num_classes."""
+    if num_classes <= accumulator.num_classes:
+      return
+    matrices = np.zeros((len(self._thresholds), num_classes, num_classes, 4))
+    actual_class_counts = np.zeros(num_classes, dtype=np.int64)
+    if accumulator.matrices is not None:
+      n = accumulator.num_classes
+      matrices[:, :n, :n, :] = accumulator.matrices
+      actual_class_counts[:n] = accumulator.actual_class_counts
+    accumulator.matrices = matrices
+    accumulator.actual_class_counts = actual_class_counts
+
+  def _add_batch(self, accumulator: _MultiLabelConfusionMatrixAccumulator):
+    """Adds the buffered inputs to the matrices."""
+    if not accumulator.example_weights:
+      return
+    labels = np.stack(accumulator.labels).astype(np.float64)
+    predictions = np.stack(accumulator.predictions)
+    weights = np.array(accumulator.example_weights)
+    accumulator.labels = []
+    accumulator.predictions = []
+    accumulator.example_weights = []
+
+    num_classes = labels.shape[1]
+    self._resize(accumulator, num_classes)
+    n = num_classes
+    accumulator.actual_class_counts[:n] += (labels > 0).sum(axis=0)
+    negative_labels = 1.0 - labels
+    # Each row contributes to the matrices of the classes that are actual
+    # (positive) classes for the example: sum_i w_i * label_i[actual] * x_i.
+    weighted_labels = (labels * weights[:, np.newaxis]).T
+    for i, threshold in enumerate(self._thresholds):
+      positive_predictions = (predictions > threshold).astype(np.float64)
+      negative_predictions = 1.0 - positive_predictions
+      matrices = accumulator.matrices[i, :n, :n, :]
+      matrices[:, :, _FALSE_NEGATIVES] += np.dot(
+          weighted_labels, labels * negative_predictions)
+      matrices[:, :, _TRUE_NEGATIVES] += np.dot(
+          weighted_labels, negative_labels * negative_predictions)
+      matrices[:, :, _FALSE_POSITIVES] += np.dot(
+          weighted_labels, negative_labels * positive_predictions)
+      matrices[:, :, _TRUE_POSITIVES] += np.dot(
+          weighted_labels, labels * positive_predictions)
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return coders.AccumulatorCoder(_MultiLabelConfusionMatrixAccumulator)
+
+  def create_accumulator(self) -> _MultiLabelConfusionMatrixAccumulator:
+    return _MultiLabelConfusionMatrixAccumulator()
+
+  def add_input(
+      self, accumulator: _MultiLabelConfusionMatrixAccumulator,
+      element: metric_types.StandardMetricInputs
+  ) -> _MultiLabelConfusionMatrixAccumulator:
+    labels, predictions, example_weight = next(self._adapter(element))
     if not labels.shape:
       raise ValueError(
           'Labels missing from example: StandardMetricInputs={}'.format(
@@ -168,64 +241,57 @@ class _MultiLabelConfusionMatrixPlotCombiner(beam.CombineFn):
     if (len(labels.shape) != len(predictions.shape) or
         labels.shape[-1] != predictions.shape[-1]):
       labels = metric_util.one_hot(labels, predictions)
-    example_weight = float(example_weight)
-    for threshold in self._thresholds:
-      if threshold not in accumulator:
-        accumulator[threshold] = {}
-      for actual_class_id, label in enumerate(labels):
-        if not label:
-          continue
-        for class_id, prediction in enumerate(predictions):
-          matrix_key = _MatrixEntryKey(actual_class_id, class_id)
-          fn = (labels[class_id] and prediction <= threshold) * example_weight
-          fp = (not labels[class_id] and
-                prediction > threshold) * example_weight
-          tn = ((not labels[class_id] and prediction <= threshold) *
-                example_weight)
-          tp = (labels[class_id] and prediction > threshold) * example_weight
-          if matrix_key in accumulator[threshold]:
-            accumulator[threshold][matrix_key].false_negatives += fn
-            accumulator[threshold][matrix_key].true_negatives += tn
-            accumulator[threshold][matrix_key].false_positives += fp
-            accumulator[threshold][matrix_key].true_positives += tp
-          else:
-            matrix = _ConfusionMatrix()
-            matrix.false_negatives = fn
-            matrix.true_negatives = tn
-            matrix.false_positives = fp
-            matrix.true_positives = tp
-            accumulator[threshold][matrix_key] = matrix
+    # Inputs with a different number of classes cannot be stacked in the same
+    # batch.
+    if (accumulator.predictions and
+        accumulator.predictions[0].shape != predictions.shape):
+      self._add_batch(accumulator)
+    accumulator.labels.append((labels != 0).astype(np.float64))
+    accumulator.predictions.append(predictions)
+    accumulator.example_weights.append(float(example_weight))
+    accumulator.num_examples += 1
+    if len(accumulator.example_weights) >= self._desired_batch_size:
+      self._add_batch(accumulator)
     return accumulator
 
-  def merge_accumulators(self, accumulators: List[_Matrices]) -> _Matrices:
-    result = {}
+  def merge_accumulators(
+      self, accumulators: List[_MultiLabelConfusionMatrixAccumulator]
+  ) -> _MultiLabelConfusionMatrixAccumulator:
+    result = self.create_accumulator()
     for accumulator in accumulators:
-      for threshold, matrix in accumulator.items():
-        if threshold not in result:
-          result[threshold] = {}
-        for k, v in matrix.items():
-          if k in result[threshold]:
-            result[threshold][k].false_negatives += v.false_negatives
-            result[threshold][k].true_negatives += v.true_negatives
-            result[threshold][k].false_positives += v.false_positives
-            result[threshold][k].true_positives += v.true_positives
-          else:
-            result[threshold][k] = v
+      self._add_batch(accumulator)
+      result.num_examples += accumulator.num_examples
+      if accumulator.matrices is None:
+        continue
+      self._resize(result, accumulator.num_classes)
+      n = accumulator.num_classes
+      result.matrices[:, :n, :n, :] += accumulator.matrices
+      result.actual_class_counts[:n] += accumulator.actual_class_counts
     return result
 
   def extract_output(
-      self, accumulator: _Matrices
+      self, accumulator: _MultiLabelConfusionMatrixAccumulator
   ) -> Dict[metric_types.PlotKey,
             metrics_for_slice_pb2.MultiLabelConfusionMatrixAtThresholds]:
+    self._add_batch(accumulator)
     pb = metrics_for_slice_pb2.MultiLabelConfusionMatrixAtThresholds()
-    for threshold in sorted(accumulator.keys()):
+    if not accumulator.num_examples:
+      return {self._key: pb}
+    num_classes = accumulator.num_classes
+    actual_class_ids = []
+    if accumulator.actual_class_counts is not None:
+      actual_class_ids = np.flatnonzero(accumulator.actual_class_counts)
+    for i, threshold in enumerate(self._thresholds):
       matrix = pb.matrices.add(threshold=threshold)
-      for k in sorted(accumulator[threshold].keys()):
-        matrix.entries.add(
-            actual_class_id=k.actual_class_id,
-            predicted_class_id=k.predicted_class_id,
-            false_negatives=accumulator[threshold][k].false_negatives,
-            true_negatives=accumulator[threshold][k].true_negatives,
-            false_positives=accumulator[threshold][k].false_positives,
-            true_positives=accumulator[threshold][k].true_positives)
+      for actual_class_id in actual_class_ids:
+        values = accumulator.matrices[i, actual_class_id]
+        for predicted_class_id in range(num_classes):
+          fn, tn, fp, tp = values[predicted_class_id].tolist()
+          matrix.entries.add(
+              actual_class_id=int(actual_class_id),
+              predicted_class_id=predicted_class_id,
+              false_negatives=fn,
+              true_negatives=tn,
+              false_positives=fp,
+              true_positives=tp)
     return {self._key: pb}
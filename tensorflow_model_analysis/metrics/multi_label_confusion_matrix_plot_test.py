@@ -293,5 +293,48 @@ class MultiLabelConfusionMatrixPlotTest(testutil.TensorflowModelAnalysisTest):
       util.assert_that(result, check_result, label='result')
 
 
+  def testMultiLabelConfusionMatrixPlotBatchSizesAgree(self):
+    key = metric_types.PlotKey(name='multi_label_confusion_matrix_plot')
+    examples = [
+        metric_util.to_standard_metric_inputs(e) for e in [{
+            'labels': np.array([1.0, 1.0, 0.0]),
+            'predictions': np.array([0.7, 0.5, 0.2]),
+            'example_weights': np.array([1.0])
+        }, {
+            'labels': np.array([0.0, 1.0, 0.0]),
+            'predictions': np.array([0.3, 0.6, 0.1]),
+            'example_weights': np.array([2.0])
+        }, {
+            'labels': np.array([0.0, 0.0, 0.0]),
+            'predictions': np.array([0.2, 0.4, 0.5]),
+            'example_weights': np.array([1.0])
+        }, {
+            'labels': np.array([1.0, 0.0, 0.0]),
+            'predictions': np.array([1.0, 0.4, 0.1]),
+            'example_weights': np.array([0.5])
+        }]
+    ]
+
+    def compute(desired_batch_size):
+      plot_lib = multi_label_confusion_matrix_plot
+      combiner = plot_lib._MultiLabelConfusionMatrixPlotCombiner(  # pylint: disable=protected-access
+          key=key,
+          eval_config=None,
+          thresholds=[0.5],
+          desired_batch_size=desired_batch_size)
+      accumulators = []
+      for batch in (examples[:1], examples[1:]):
+        accumulator = combiner.create_accumulator()
+        for example in batch:
+          accumulator = combiner.add_input(accumulator, example)
+        accumulators.append(accumulator)
+      return combiner.extract_output(
+          combiner.merge_accumulators(accumulators))[key]
+
+    got = compute(desired_batch_size=1)
+    self.assertProtoEquals(got, compute(desired_batch_size=None))
+    # Entries are only output for the actual classes 0 and 1.
+    self.assertLen(got.matrices[0].entries, 6)
+
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,449 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Quantile sketch of weighted predictions split by label.
+
+Unlike the calibration histogram which uses fixed linear buckets over [0, 1],
+the sketch adapts to the distribution of the predictions: the predictions are
+summarized by centroids that each cover at most epsilon of the total example
+weight. This gives the same resolution for skewed predictions as for uniform
+ones, supports predictions of any range (e.g. regression outputs) and keeps the
+accumulator size constant (at most 2 / epsilon + 1 centroids).
+
+Each centroid stores the range [min, max] of the predictions it summarizes and
+their total weighted labels, weighted predictions and weighted examples. The
+predictions are assumed to be uniformly distributed within each centroid when
+the weights above or below a threshold are computed. The error of the weights
+at a threshold is therefore bounded by the weight of the centroids whose range
+contains the threshold (predictions of centroids that do not contain the
+threshold are counted exactly).
+
+Optionally, the raw predictions of up to num_exact_examples examples can be
+kept before the sketch is compressed (the accumulator then holds up to
+num_exact_examples rows). Values derived from a sketch that was never
+compressed (e.g. the AUC of a small slice) are exact and cost a single sort of
+the predictions.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import math
+
+from typing import Dict, Iterable, List, Optional, Text
+
+import apache_beam as beam
+import numpy as np
+from tensorflow_model_analysis import coders
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis.metrics import binary_confusion_matrices
+from tensorflow_model_analysis.metrics import calibration_histogram
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+
+PREDICTION_SKETCH_NAME = '_prediction_sketch'
+
+DEFAULT_EPSILON = 0.001
+
+# Columns of the centroids array.
+_MIN = 0
+_MAX = 1
+_WEIGHTED_LABELS = 2
+_WEIGHTED_PREDICTIONS = 3
+_WEIGHTED_EXAMPLES = 4
+_NUM_COLUMNS = 5
+
+# Minimum number of predictions buffered before the sketch is compressed.
+_MIN_BUFFER_SIZE = 1000
+
+
+def prediction_sketch(
+    epsilon: Optional[float] = None,
+    num_exact_examples: Optional[int] = None,
+    name: Optional[Text] = None,
+    eval_config: Optional[config.EvalConfig] = None,
+    model_name: Text = '',
+    output_name: Text = '',
+    sub_key: Optional[metric_types.SubKey] = None,
+    class_weights: Optional[Dict[int, float]] = None
+) -> metric_types.MetricComputations:
+  """Returns metric computations for the prediction sketch.
+
+  The output is an np.ndarray of centroids of shape (num_centroids, 5) where
+  the columns are the min prediction, max prediction, weighted labels, weighted
+  predictions and weighted examples of each centroid. Use the functions in this
+  module (e.g. to_binary_confusion_matrices) to derive values from it.
+
+  Args:
+    epsilon: Maximum fraction of the total example weight in each centroid.
+      Defaults to 0.001.
+    num_exact_examples: Number of (flattened) examples up to which the raw
+      predictions are kept. Defaults to 0 (i.e. the sketch is always
+      compressed).
+    name: Metric name.
+    eval_config: Eval config.
+    model_name: Optional model name (if multi-model evaluation).
+    output_name: Optional output name (if multi-output model type).
+    sub_key: Optional sub key.
+    class_weights: Optional class weights to apply to multi-class / multi-label
+      labels and predictions prior to flattening (when micro averaging is used).
+
+  Returns:
+    MetricComputations for computing the sketch.
+
+  Raises:
+    ValueError: If epsilon is not in (0, 1) or num_exact_examples is negative.
+  """
+  if epsilon is None:
+    epsilon = DEFAULT_EPSILON
+  if not 0.0 < epsilon < 1.0:
+    raise ValueError('epsilon must be in (0, 1): epsilon={}'.format(epsilon))
+  if num_exact_examples is None:
+    num_exact_examples = 0
+  if num_exact_examples < 0:
+    raise ValueError('num_exact_examples must be non-negative: '
+                     'num_exact_examples={}'.format(num_exact_examples))
+  if name is None:
+    name = '{}_{}'.format(PREDICTION_SKETCH_NAME, epsilon)
+    if num_exact_examples:
+      name = '{}_{}'.format(name, num_exact_examples)
+  key = metric_types.PlotKey(
+      name=name,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key)
+  return [
+      metric_types.MetricComputation(
+          keys=[key],
+          preprocessor=None,
+          combiner=_PredictionSketchCombiner(
+              key=key,
+              eval_config=eval_config,
+              class_weights=class_weights,
+              epsilon=epsilon,
+              num_exact_examples=num_exact_examples))
+  ]
+
+
+class _PredictionSketchAccumulator(object):
+  """Accumulator for the prediction sketch."""
+  __slots__ = ['centroids', 'buffered', 'num_buffered']
+
+  def __init__(self):
+    self.centroids = np.zeros((0, _NUM_COLUMNS))
+    self.buffered = []  # type: List[np.ndarray]
+    self.num_buffered = 0
+
+
+def _compress(centroids: np.ndarray, epsilon: float) -> np.ndarray:
+  """Merges adjacent centroids that together hold at most epsilon of weight."""
+  if not centroids.size:
+    return centroids
+  centroids = centroids[np.argsort(
+      centroids[:, _MIN] + centroids[:, _MAX], kind='mergesort')]
+  weights = centroids[:, _WEIGHTED_EXAMPLES]
+  limit = epsilon * max(weights.sum(), 0.0)
+  if (weights < 0.0).any():
+    return _compress_sequential(centroids, limit)
+  # With non-negative weights the cumulative weights are sorted, so the end of
+  # each group of merged centroids can be found with a binary search. There are
+  # at most 2 / epsilon + 1 groups.
+  cumulative_weights = np.cumsum(weights)
+  starts = []
+  start = 0
+  while start < len(centroids):
+    starts.append(start)
+    offset = cumulative_weights[start - 1] if start else 0.0
+    start = max(
+        start + 1,
+        int(np.searchsorted(cumulative_weights, offset + limit, side='right')))
+  starts = np.array(starts, dtype=np.int64)
+  result = np.add.reduceat(centroids, starts, axis=0)
+  result[:, _MIN] = np.minimum.reduceat(centroids[:, _MIN], starts)
+  result[:, _MAX] = np.maximum.reduceat(centroids[:, _MAX], starts)
+  return result
+
+
+def _compress_sequential(centroids: np.ndarray, limit: float) -> np.ndarray:
+  """Greedily merges sorted centroids while their weight is at most limit."""
+  result = []
+  current = None
+  for centroid in centroids.tolist():
+    if (current is not None and current[_WEIGHTED_EXAMPLES] +
+        centroid[_WEIGHTED_EXAMPLES] <= limit):
+      current[_MIN] = min(current[_MIN], centroid[_MIN])
+      current[_MAX] = max(current[_MAX], centroid[_MAX])
+      current[_WEIGHTED_LABELS] += centroid[_WEIGHTED_LABELS]
+      current[_WEIGHTED_PREDICTIONS] += centroid[_WEIGHTED_PREDICTIONS]
+      current[_WEIGHTED_EXAMPLES] += centroid[_WEIGHTED_EXAMPLES]
+    else:
+      current = centroid
+      result.append(current)
+  return np.array(result, dtype=np.float64).reshape((-1, _NUM_COLUMNS))
+
+
+class _PredictionSketchCombiner(beam.CombineFn):
+  """Creates a prediction sketch from labels, predictions and weights."""
+
+  def __init__(self, key: metric_types.PlotKey,
+               eval_config: Optional[config.EvalConfig],
+               class_weights: Optional[Dict[int, float]], epsilon: float,
+               num_exact_examples: int):
+    self._key = key
+    self._eval_config = eval_config
+    self._class_weights = class_weights
+    self._epsilon = epsilon
+    self._num_exact_examples = num_exact_examples
+    self._buffer_size = max(
+        _MIN_BUFFER_SIZE, int(math.ceil(2.0 / epsilon)) + 1)
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        model_name=key.model_name,
+        output_name=key.output_name,
+        sub_key=key.sub_key,
+        class_weights=class_weights,
+        flatten=True)
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return coders.AccumulatorCoder(_PredictionSketchAccumulator)
+
+  def create_accumulator(self) -> _PredictionSketchAccumulator:
+    return _PredictionSketchAccumulator()
+
+  def add_input(
+      self, accumulator: _PredictionSketchAccumulator,
+      element: metric_types.StandardMetricInputs
+  ) -> _PredictionSketchAccumulator:
+    return self.add_inputs(accumulator, [element])
+
+  def add_inputs(
+      self, accumulator: _PredictionSketchAccumulator,
+      elements: Iterable[metric_types.StandardMetricInputs]
+  ) -> _PredictionSketchAccumulator:
+    labels, predictions, example_weights = self._adapter.batch(elements)
+    labels = np.asarray(labels, dtype=np.float64).ravel()
+    predictions = np.asarray(predictions, dtype=np.float64).ravel()
+    example_weights = np.asarray(example_weights, dtype=np.float64).ravel()
+    accumulator.buffered.append(
+        np.stack([
+            predictions, predictions, labels * example_weights,
+            predictions * example_weights, example_weights
+        ],
+                 axis=1))
+    accumulator.num_buffered += len(predictions)
+    if accumulator.num_buffered >= self._buffer_size:
+      self._add_buffered(accumulator)
+    return accumulator
+
+  def _add_buffered(self, accumulator: _PredictionSketchAccumulator):
+    """Adds the buffered predictions to the centroids.
+
+    The centroids are only compressed once there are more than
+    num_exact_examples of them, so the raw predictions are kept as long as
+    there are at most num_exact_examples in total.
+
+    Args:
+      accumulator: Accumulator.
+    """
+    if not accumulator.buffered:
+      return
+    centroids = np.concatenate([accumulator.centroids] + accumulator.buffered)
+    if len(centroids) > self._num_exact_examples:
+      centroids = _compress(centroids, self._epsilon)
+    accumulator.centroids = centroids
+    accumulator.buffered = []
+    accumulator.num_buffered = 0
+
+  def merge_accumulators(
+      self, accumulators: List[_PredictionSketchAccumulator]
+  ) -> _PredictionSketchAccumulator:
+    result = self.create_accumulator()
+    for accumulator in accumulators:
+      result.buffered.append(accumulator.centroids)
+      result.buffered.extend(accumulator.buffered)
+    self._add_buffered(result)
+    return result
+
+  def extract_output(
+      self, accumulator: _PredictionSketchAccumulator
+  ) -> Dict[metric_types.PlotKey, np.ndarray]:
+    self._add_buffered(accumulator)
+    return {self._key: accumulator.centroids}
+
+
+def _cumulative_weights(centroids: np.ndarray, thresholds: np.ndarray,
+                        inclusive: bool) -> np.ndarray:
+  """Returns the weights of the predictions below the thresholds.
+
+  Args:
+    centroids: Sketch centroids.
+    thresholds: Thresholds of shape (n,).
+    inclusive: True to include predictions equal to the thresholds (this only
+      affects centroids holding a single prediction value).
+
+  Returns:
+    Array of shape (n, 3) of the weighted labels, weighted predictions and
+    weighted examples of the predictions below (or at) each threshold.
+  """
+  values = centroids[:, _WEIGHTED_LABELS:]
+  side = 'right' if inclusive else 'left'
+  result = np.zeros((len(thresholds), values.shape[1]))
+  if not centroids.size:
+    return result
+  # Infinite thresholds are moved just outside of the range of the predictions
+  # (which does not change the weights below them) to avoid inf * 0.
+  thresholds = np.clip(thresholds, centroids[:, _MIN].min() - 1.0,
+                       centroids[:, _MAX].max() + 1.0)
+
+  # Centroids holding a single prediction value.
+  points = centroids[:, _MIN] == centroids[:, _MAX]
+  order = np.argsort(centroids[points, _MIN])
+  point_values = centroids[points, _MIN][order]
+  point_cumsum = np.concatenate(
+      [np.zeros((1, values.shape[1])),
+       np.cumsum(values[points][order], axis=0)])
+  result += point_cumsum[np.searchsorted(point_values, thresholds, side=side)]
+
+  # The weights of the other centroids increase linearly from their min to
+  # their max. The weight below t is the sum over the centroids with min < t of
+  # (t - min) / width minus the sum over the centroids with max < t of
+  # (t - max) / width (which cancel out to 1 when t > max).
+  intervals = ~points
+  width = (centroids[intervals, _MAX] - centroids[intervals, _MIN])[:, None]
+  density = values[intervals] / width
+  for column, sign in ((_MIN, 1.0), (_MAX, -1.0)):
+    edges = centroids[intervals, column]
+    order = np.argsort(edges)
+    edges = edges[order]
+    slope = np.concatenate(
+        [np.zeros((1, values.shape[1])),
+         np.cumsum(density[order], axis=0)])
+    offset = np.concatenate([
+        np.zeros((1, values.shape[1])),
+        np.cumsum(density[order] * edges[:, None], axis=0)
+    ])
+    indices = np.searchsorted(edges, thresholds, side='left')
+    result += sign * (thresholds[:, None] * slope[indices] - offset[indices])
+  return result
+
+
+def to_binary_confusion_matrices(
+    centroids: np.ndarray,
+    thresholds: List[float]) -> binary_confusion_matrices.Matrices:
+  """Returns the binary confusion matrices at the given thresholds.
+
+  As with binary_confusion_matrices, predictions above a threshold are
+  positive.
+
+  Args:
+    centroids: Sketch centroids.
+    thresholds: Thresholds (any values, not necessarily in [0, 1]).
+
+  Returns:
+    Confusion matrices.
+  """
+  below = _cumulative_weights(
+      centroids, np.asarray(thresholds, dtype=np.float64), inclusive=True)
+  total_labels = centroids[:, _WEIGHTED_LABELS].sum()
+  total_examples = centroids[:, _WEIGHTED_EXAMPLES].sum()
+  # The columns of below are the weighted labels, predictions and examples.
+  below_labels = below[:, 0]
+  below_examples = below[:, 2]
+  tp = total_labels - below_labels
+  fp = (total_examples - total_labels) - (below_examples - below_labels)
+  fn = below_labels
+  tn = below_examples - below_labels
+  # Clip the rounding errors of the cumulative sums.
+  return binary_confusion_matrices.Matrices(
+      thresholds=list(thresholds),
+      tp=np.maximum(tp, 0.0).tolist(),
+      tn=np.maximum(tn, 0.0).tolist(),
+      fp=np.maximum(fp, 0.0).tolist(),
+      fn=np.maximum(fn, 0.0).tolist())
+
+
+def to_histogram(centroids: np.ndarray,
+                 thresholds: List[float]) -> calibration_histogram.Histogram:
+  """Returns a histogram with buckets for the given thresholds.
+
+  Args:
+    centroids: Sketch centroids.
+    thresholds: Thresholds in sorted order.
+
+  Returns:
+    A histogram of len(thresholds) buckets in the same format as returned by
+    calibration_histogram.rebin (i.e. bucket i holds the predictions in
+    [thresholds[i], thresholds[i+1]), the first and last bucket also hold the
+    predictions below and above the thresholds).
+  """
+  below = _cumulative_weights(
+      centroids, np.asarray(thresholds[1:], dtype=np.float64), inclusive=False)
+  edges = np.concatenate([
+      np.zeros((1, below.shape[1])), below,
+      centroids[:, _WEIGHTED_LABELS:].sum(axis=0, keepdims=True)
+  ])
+  values = np.diff(edges, axis=0)
+  return [
+      calibration_histogram.Bucket(i, *bucket_values)
+      for i, bucket_values in enumerate(values.tolist())
+  ]
+
+
+def _breakpoints(centroids: np.ndarray) -> List[float]:
+  """Returns the thresholds at which the curves derived from the sketch bend."""
+  return [float('-inf')] + np.unique(centroids[:, _MIN:_MAX + 1]).tolist()
+
+
+def auc(centroids: np.ndarray, curve: Text = 'ROC') -> float:
+  """Returns the area under the ROC or precision-recall curve.
+
+  The curve is evaluated at the edges of the centroids and integrated using
+  the trapezoidal rule. The ROC curve is linear between the edges so the ROC
+  AUC is exact for predictions distributed uniformly within the centroids.
+
+  Args:
+    centroids: Sketch centroids.
+    curve: 'ROC' or 'PR'.
+
+  Returns:
+    Area under the curve (NaN if there are no positive or no negative labels).
+
+  Raises:
+    ValueError: If the curve is not supported.
+  """
+  if curve not in ('ROC', 'PR'):
+    raise ValueError('curve must be ROC or PR: curve={}'.format(curve))
+  matrices = to_binary_confusion_matrices(centroids, _breakpoints(centroids))
+  tp = np.array(matrices.tp)
+  fp = np.array(matrices.fp)
+  positives = tp[0] + np.array(matrices.fn)[0]
+  negatives = fp[0] + np.array(matrices.tn)[0]
+  if positives <= 0.0 or (curve == 'ROC' and negatives <= 0.0):
+    return float('nan')
+  recall = tp / positives
+  if curve == 'ROC':
+    x = fp / negatives
+    y = recall
+  else:
+    predicted_positives = tp + fp
+    defined = predicted_positives > 0.0
+    x = recall[defined]
+    y = tp[defined] / predicted_positives[defined]
+    # Extend the curve to a recall of 0 at the highest threshold's precision.
+    x = np.append(x, 0.0)
+    y = np.append(y, y[-1])
+  # The thresholds are increasing so x is decreasing.
+  return float(np.sum((x[:-1] - x[1:]) * (y[:-1] + y[1:]) / 2.0))
@@ -0,0 +1,260 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for prediction sketch."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import apache_beam as beam
+from apache_beam.testing import util
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis.eval_saved_model import testutil
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+from tensorflow_model_analysis.metrics import prediction_sketch
+
+
+def _centroids(labels, predictions, example_weights=None):
+  if example_weights is None:
+    example_weights = np.ones(len(labels))
+  labels = np.asarray(labels, dtype=np.float64)
+  predictions = np.asarray(predictions, dtype=np.float64)
+  example_weights = np.asarray(example_weights, dtype=np.float64)
+  return np.stack([
+      predictions, predictions, labels * example_weights,
+      predictions * example_weights, example_weights
+  ],
+                  axis=1)
+
+
+class PredictionSketchTest(testutil.TensorflowModelAnalysisTest):
+
+  def testCompress(self):
+    np.random.seed(0)
+    centroids = _centroids(
+        np.random.randint(2, size=10000), np.random.rand(10000))
+    compressed = prediction_sketch._compress(centroids, epsilon=0.01)
+    # Every pair of adjacent centroids holds more than epsilon of the weight.
+    self.assertLessEqual(len(compressed), 2.0 / 0.01 + 1)
+    self.assertTrue(np.all(compressed[:, 4] <= 0.01 * 10000))
+    self.assertTrue(np.all(compressed[1:, 0] >= compressed[:-1, 1]))
+    self.assertAllClose(compressed[:, 2:].sum(axis=0),
+                        centroids[:, 2:].sum(axis=0))
+
+  def testCompressMatchesSequentialCompress(self):
+    np.random.seed(0)
+    centroids = _centroids(
+        np.random.randint(2, size=1000), np.random.rand(1000),
+        np.random.choice([0.0, 0.5, 1.0], size=1000))
+    compressed = prediction_sketch._compress(centroids, epsilon=0.01)
+    centroids = centroids[np.argsort(centroids[:, 0], kind='mergesort')]
+    expected = prediction_sketch._compress_sequential(
+        centroids, limit=0.01 * centroids[:, 4].sum())
+    self.assertAllClose(compressed, expected)
+
+  def testCompressWithNegativeWeights(self):
+    centroids = _centroids([0, 1, 1, 0], [0.1, 0.2, 0.3, 0.4],
+                           [1.0, -1.0, 2.0, 3.0])
+    compressed = prediction_sketch._compress(centroids, epsilon=0.5)
+    self.assertAllClose(compressed, [[0.1, 0.3, 1.0, 0.5, 2.0],
+                                     [0.4, 0.4, 0.0, 1.2, 3.0]])
+
+  def testAddInputsMatchesAddInput(self):
+    combiner = prediction_sketch.prediction_sketch(
+        num_exact_examples=10)[0].combiner
+    inputs = [
+        metric_util.to_standard_metric_inputs({
+            'labels': np.array([label]),
+            'predictions': np.array([prediction]),
+            'example_weights': np.array([weight]),
+        }) for label, prediction, weight in [(0.0, 0.2, 1.0), (
+            1.0, 0.7, 0.5), (0.0, 0.4, 2.0), (1.0, 0.9, 1.5)]
+    ]
+
+    expected = combiner.create_accumulator()
+    for element in inputs:
+      expected = combiner.add_input(expected, element)
+    got = combiner.add_inputs(combiner.create_accumulator(), inputs)
+
+    got_output = combiner.extract_output(got)
+    expected_output = combiner.extract_output(expected)
+    self.assertEqual(got_output.keys(), expected_output.keys())
+    for key in expected_output:
+      self.assertAllClose(got_output[key], expected_output[key])
+
+  def testToBinaryConfusionMatricesIsExactForUncompressedSketch(self):
+    centroids = _centroids(
+        labels=[0.0, 1.0, 0.0, 1.0],
+        predictions=[0.2, 0.8, 0.5, 0.5],
+        example_weights=[1.0, 2.0, 3.0, 4.0])
+    got = prediction_sketch.to_binary_confusion_matrices(
+        centroids, [-1.0, 0.2, 0.5, 0.9])
+    self.assertAllClose(got.tp, [6.0, 6.0, 2.0, 0.0])
+    self.assertAllClose(got.fp, [4.0, 3.0, 0.0, 0.0])
+    self.assertAllClose(got.tn, [0.0, 1.0, 4.0, 4.0])
+    self.assertAllClose(got.fn, [0.0, 0.0, 4.0, 6.0])
+
+  def testToHistogram(self):
+    centroids = _centroids(
+        labels=[0.0, 1.0, 0.0, 1.0],
+        predictions=[0.2, 0.8, 0.5, 0.5],
+        example_weights=[1.0, 2.0, 3.0, 4.0])
+    got = prediction_sketch.to_histogram(centroids,
+                                         [float('-inf'), 0.0, 0.5, 1.0])
+    self.assertLen(got, 4)
+    self.assertAllClose([b.weighted_examples for b in got],
+                        [0.0, 1.0, 9.0, 0.0])
+    self.assertAllClose([b.weighted_labels for b in got], [0.0, 0.0, 6.0, 0.0])
+    self.assertAllClose([b.weighted_predictions for b in got],
+                        [0.0, 0.2, 5.1, 0.0])
+
+  def testAUCIsCloseToExactAUC(self):
+    np.random.seed(0)
+    labels = np.random.randint(2, size=20000)
+    predictions = np.clip(np.random.normal(0.4 + 0.2 * labels, 0.2), 0.0, 1.0)
+    compressed = prediction_sketch._compress(
+        _centroids(labels, predictions), epsilon=0.001)
+    positives = predictions[labels == 1]
+    negatives = predictions[labels == 0]
+    expected = np.mean(positives[:, None] > negatives[None, :]) + 0.5 * np.mean(
+        positives[:, None] == negatives[None, :])
+    self.assertAlmostEqual(
+        prediction_sketch.auc(compressed, curve='ROC'), expected, places=3)
+    self.assertAlmostEqual(
+        prediction_sketch.auc(compressed, curve='PR'),
+        prediction_sketch.auc(
+            _centroids(labels, predictions), curve='PR'),
+        places=2)
+
+  def testAUCWithoutNegativesIsNaN(self):
+    centroids = _centroids(labels=[1.0, 1.0], predictions=[0.2, 0.8])
+    self.assertTrue(np.isnan(prediction_sketch.auc(centroids, curve='ROC')))
+    self.assertAlmostEqual(prediction_sketch.auc(centroids, curve='PR'), 1.0)
+
+  def testPredictionSketchRaisesErrorForInvalidEpsilon(self):
+    with self.assertRaisesRegexp(ValueError, 'epsilon must be in'):
+      prediction_sketch.prediction_sketch(epsilon=1.5)
+
+  def testPredictionSketchMergesAccumulators(self):
+    np.random.seed(0)
+    labels = np.random.randint(2, size=3000)
+    predictions = np.random.rand(3000)
+    computation = prediction_sketch.prediction_sketch(epsilon=0.01)[0]
+    combiner = computation.combiner
+    accumulators = []
+    for i in range(3):
+      accumulator = combiner.create_accumulator()
+      for j in range(i * 1000, (i + 1) * 1000):
+        accumulator = combiner.add_input(
+            accumulator,
+            metric_util.to_standard_metric_inputs({
+                'labels': np.array([labels[j]]),
+                'predictions': np.array([predictions[j]]),
+                'example_weights': np.array([1.0])
+            }))
+      accumulators.append(accumulator)
+    merged = combiner.merge_accumulators(accumulators)
+    got = combiner.extract_output(merged)[computation.keys[0]]
+    self.assertLessEqual(len(got), 2.0 / 0.01 + 1)
+    self.assertAllClose(got[:, 2:].sum(axis=0),
+                        [labels.sum(), predictions.sum(), 3000.0])
+
+  def testPredictionSketchKeepsExactExamples(self):
+    np.random.seed(0)
+    labels = np.random.randint(2, size=3000)
+    predictions = np.random.rand(3000)
+    computation = prediction_sketch.prediction_sketch(
+        epsilon=0.01, num_exact_examples=2000)[0]
+    self.assertEqual(computation.keys[0].name, '_prediction_sketch_0.01_2000')
+    combiner = computation.combiner
+
+    def sketch(start, end):
+      accumulator = combiner.create_accumulator()
+      for i in range(start, end):
+        accumulator = combiner.add_input(
+            accumulator,
+            metric_util.to_standard_metric_inputs({
+                'labels': np.array([labels[i]]),
+                'predictions': np.array([predictions[i]]),
+                'example_weights': np.array([1.0])
+            }))
+      return accumulator
+
+    exact = combiner.extract_output(
+        combiner.merge_accumulators([sketch(0, 1000),
+                                     sketch(1000, 2000)]))[computation.keys[0]]
+    self.assertLen(exact, 2000)
+    positives = predictions[:2000][labels[:2000] == 1]
+    negatives = predictions[:2000][labels[:2000] == 0]
+    self.assertAlmostEqual(
+        prediction_sketch.auc(exact),
+        np.mean(positives[:, None] > negatives[None, :]),
+        places=10)
+
+    compressed = combiner.extract_output(
+        combiner.merge_accumulators([sketch(0, 1500),
+                                     sketch(1500, 3000)]))[computation.keys[0]]
+    self.assertLessEqual(len(compressed), 2.0 / 0.01 + 1)
+
+  def testPredictionSketchRaisesErrorForNegativeNumExactExamples(self):
+    with self.assertRaisesRegexp(ValueError, 'num_exact_examples must be'):
+      prediction_sketch.prediction_sketch(num_exact_examples=-1)
+
+  def testPredictionSketchInPipeline(self):
+    computation = prediction_sketch.prediction_sketch()[0]
+
+    examples = [{
+        'labels': np.array([label]),
+        'predictions': np.array([prediction]),
+        'example_weights': np.array([weight])
+    } for label, prediction, weight in [(0.0, 0.2, 1.0), (1.0, 0.8, 2.0),
+                                        (0.0, 0.5, 3.0), (1.0, 0.5, 4.0)]]
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create(examples)
+          | 'Process' >> beam.Map(metric_util.to_standard_metric_inputs)
+          | 'AddSlice' >> beam.Map(lambda x: ((), x))
+          | 'ComputeSketch' >> beam.CombinePerKey(computation.combiner))
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          got_slice_key, got_plots = got[0]
+          self.assertEqual(got_slice_key, ())
+          key = metric_types.PlotKey(name='_prediction_sketch_0.001')
+          self.assertIn(key, got_plots)
+          got_matrices = prediction_sketch.to_binary_confusion_matrices(
+              got_plots[key], [0.3])
+          self.assertAllClose(got_matrices.tp, [6.0])
+          self.assertAllClose(got_matrices.fp, [3.0])
+          self.assertAllClose(got_matrices.tn, [1.0])
+          self.assertAllClose(got_matrices.fn, [0.0])
+
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result, label='result')
+
+
+if __name__ == '__main__':
+  tf.test.main()
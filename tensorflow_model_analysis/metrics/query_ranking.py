@@ -0,0 +1,460 @@
+# Lint as: python3
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared ranking kernel for query based metrics.
+
+Each query is ranked once (a single argsort of its predictions) and the
+NDCG@k values for all requested top_k values, the min label position and the
+query statistics are computed from that ranking. DCG values are computed from
+one cumulative sum over a precomputed table of discounts.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Text, Union
+
+import apache_beam as beam
+import numpy as np
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import util
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+
+# Discount table (1 / log2(rank + 1) for ranks indexed from 1). The table is
+# grown by doubling as larger queries are seen.
+_discounts = 1.0 / np.log2(np.arange(2, 1026, dtype=np.float64))
+
+
+def discounts(size: int) -> np.ndarray:
+  """Returns the DCG discounts for the first size ranks."""
+  global _discounts
+  if size > len(_discounts):
+    new_size = len(_discounts)
+    while new_size < size:
+      new_size *= 2
+    _discounts = 1.0 / np.log2(np.arange(2, new_size + 2, dtype=np.float64))
+  return _discounts[:size]
+
+
+def dcg_at_top_ks(sorted_gains: np.ndarray,
+                  top_ks: Sequence[int]) -> np.ndarray:
+  """Returns DCG@k for each k in top_ks.
+
+  Args:
+    sorted_gains: Gain values sorted in ranking order.
+    top_ks: Positions to compute DCG at.
+
+  Returns:
+    Array of DCG values (one per top_k).
+  """
+  top_ks = np.asarray(top_ks, dtype=np.int64)
+  size = min(int(np.max(top_ks)), len(sorted_gains)) if len(top_ks) else 0
+  if not size:
+    return np.zeros(len(top_ks))
+  cumulative = np.concatenate(
+      [[0.0], np.cumsum(sorted_gains[:size] * discounts(size))])
+  return cumulative[np.clip(top_ks, 0, size)]
+
+
+def ndcg_at_top_ks(ranked_gains: np.ndarray,
+                   top_ks: Sequence[int]) -> np.ndarray:
+  """Returns NDCG@k for each k in top_ks.
+
+  Args:
+    ranked_gains: Gain values sorted in ranking order.
+    top_ks: Positions to compute NDCG at.
+
+  Returns:
+    Array of NDCG values (one per top_k). Values are 0 when the ideal DCG is 0.
+  """
+  ranked_gains = np.asarray(ranked_gains, dtype=np.float64)
+  dcg = dcg_at_top_ks(ranked_gains, top_ks)
+  ideal_dcg = dcg_at_top_ks(-np.sort(-ranked_gains), top_ks)
+  result = np.zeros(len(dcg))
+  positive = ideal_dcg > 0
+  result[positive] = dcg[positive] / ideal_dcg[positive]
+  return result
+
+
+def min_label_position(ranked_labels: np.ndarray) -> Optional[int]:
+  """Returns the (1-indexed) position of the first positive label or None."""
+  positions = np.flatnonzero(np.asarray(ranked_labels) > 0)
+  if positions.size:
+    return int(positions[0]) + 1
+  return None
+
+
+def _reduce_per_example(values: List[Optional[np.ndarray]],
+                        reduce_fn: Callable[..., np.ndarray],
+                        default: float) -> np.ndarray:
+  """Returns reduce_fn applied to the value of each example.
+
+  When all the values have the same (non-zero) size, they are concatenated into
+  one (num_examples, size) array and reduced along the last axis in a single
+  call. Otherwise the values are reduced one at a time.
+
+  Args:
+    values: Value (or None) per example.
+    reduce_fn: NumPy reduction (e.g. np.max) taking an axis argument.
+    default: Result for examples with a None or empty value.
+  """
+  size = np.size(values[0]) if values and values[0] is not None else 0
+  if size and all(v is not None and np.size(v) == size for v in values):
+    flat = np.concatenate([np.ravel(v) for v in values]).astype(np.float64)
+    return reduce_fn(flat.reshape(len(values), size), axis=1)
+  reduced = [
+      default if v is None or not np.size(v) else reduce_fn(v) for v in values
+  ]
+  return np.array(reduced, dtype=np.float64)
+
+
+RankedQuery = NamedTuple('RankedQuery', [('labels', np.ndarray),
+                                         ('gains', Optional[np.ndarray]),
+                                         ('example_weight', float)])
+
+
+def rank_query(elements: List[metric_types.StandardMetricInputs],
+               eval_config: Optional[config.EvalConfig] = None,
+               model_name: Text = '',
+               output_name: Text = '',
+               gain_key: Optional[Text] = None,
+               adapter: Optional[
+                   metric_util.LabelPredictionExampleWeightAdapter] = None
+              ) -> RankedQuery:
+  """Ranks the examples of a query by prediction.
+
+  Only the per example lookups (via the adapter) are done per element. The
+  labels, scores, gains and example weights of the query are then built as
+  arrays with one vectorized NumPy call each.
+
+  Args:
+    elements: Standard metric inputs for the examples in the query.
+    eval_config: Eval config.
+    model_name: Model name.
+    output_name: Output name.
+    gain_key: Key of feature in features dictionary that holds gain values. If
+      None, gains are not returned.
+    adapter: Optional adapter to use for converting the inputs. If None, an
+      adapter is created from the eval_config, model_name, and output_name.
+
+  Returns:
+    RankedQuery with labels (and gains) sorted by decreasing prediction and
+    the query's example weight.
+
+  Raises:
+    ValueError: If the example weights within the query differ or a gain is not
+      a scalar.
+  """
+  if adapter is None:
+    adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        model_name=model_name,
+        output_name=output_name,
+        flatten=False,
+        allow_none=gain_key is None)
+  if not elements:
+    return RankedQuery(
+        labels=np.empty(0),
+        gains=np.empty(0) if gain_key is not None else None,
+        example_weight=1.0)
+  converted = [next(adapter(element)) for element in elements]
+  labels = _reduce_per_example([c[0] for c in converted], np.sum, 0.0)
+  scores = _reduce_per_example([c[1] for c in converted], np.max,
+                               float('-inf'))
+  # Example weights are always of size 1.
+  weights = np.concatenate([np.ravel(c[2]) for c in converted]).astype(
+      np.float64)
+  mismatched = np.flatnonzero(weights != weights[0])
+  if mismatched.size:
+    i = int(mismatched[0])
+    raise ValueError(
+        'all example weights for the same query value must use the '
+        'same value {} != {}: StandardMetricInputs={}'.format(
+            weights[i], weights[0], elements[i]))
+  gains = _gains(elements, gain_key) if gain_key is not None else None
+  sort_indices = np.argsort(scores)[::-1]
+  return RankedQuery(
+      labels=labels[sort_indices],
+      gains=gains[sort_indices] if gains is not None else None,
+      example_weight=float(weights[0]))
+
+
+def _gains(elements: List[metric_types.StandardMetricInputs],
+           gain_key: Text) -> np.ndarray:
+  """Returns the (scalar) gain of each element as an array."""
+  values = [util.get_by_keys(e.features, [gain_key]) for e in elements]
+  sizes = np.array([np.size(v) for v in values])
+  invalid = np.flatnonzero(sizes != 1)
+  if invalid.size:
+    i = int(invalid[0])
+    raise ValueError('expected {} to be scalar, but instead it has size = {}: '
+                     'value={}, StandardMetricInputs={}'.format(
+                         gain_key, sizes[i], values[i], elements[i]))
+  return np.concatenate([np.ravel(v) for v in values]).astype(np.float64)
+
+
+class QueryStatisticsKeys(
+    NamedTuple('QueryStatisticsKeys',
+               [('total_queries', metric_types.MetricKey),
+                ('total_documents', metric_types.MetricKey),
+                ('min_documents', metric_types.MetricKey),
+                ('max_documents', metric_types.MetricKey)])):
+  """Keys for the query statistics metrics."""
+
+
+class _QueryRankingAccumulator(object):
+  """Query ranking accumulator."""
+  __slots__ = [
+      'ndcg', 'total_ndcg_weighted_examples', 'total_min_position',
+      'total_min_position_weighted_examples', 'total_queries',
+      'total_documents', 'min_documents', 'max_documents'
+  ]
+
+  LARGE_INT = 1000000000
+
+  def __init__(self, num_top_ks: int):
+    self.ndcg = np.zeros(num_top_ks)
+    self.total_ndcg_weighted_examples = 0.0
+    self.total_min_position = 0.0
+    self.total_min_position_weighted_examples = 0.0
+    self.total_queries = 0
+    self.total_documents = 0
+    self.min_documents = self.LARGE_INT
+    self.max_documents = 0
+
+
+class QueryRankingCombiner(beam.CombineFn):
+  """Computes query based ranking metrics from a single ranking per query.
+
+  The combiner computes any of NDCG (for all top_k sub keys), min label
+  position and query statistics depending on which keys are provided.
+  Computations using this combiner for the same model and output are merged by
+  merge_computations so that each query is only ranked once.
+  """
+
+  def __init__(self,
+               eval_config: Optional[config.EvalConfig] = None,
+               model_name: Text = '',
+               output_name: Text = '',
+               ndcg_keys: Optional[List[metric_types.MetricKey]] = None,
+               gain_key: Optional[Text] = None,
+               min_label_position_key: Optional[metric_types.MetricKey] = None,
+               query_statistics_keys: Optional[QueryStatisticsKeys] = None):
+    """Initialize.
+
+    Args:
+      eval_config: Eval config.
+      model_name: Model name.
+      output_name: Output name.
+      ndcg_keys: NDCG metric keys (with top_k sub keys).
+      gain_key: Key of feature in features dictionary that holds gain values.
+        Required if ndcg_keys are used.
+      min_label_position_key: Min label position metric key.
+      query_statistics_keys: Query statistics metric keys.
+    """
+    if ndcg_keys and not gain_key:
+      raise ValueError('a gain_key is required to compute NDCG')
+    self._eval_config = eval_config
+    self._model_name = model_name
+    self._output_name = output_name
+    self._ndcg_keys = list(ndcg_keys or [])
+    self._gain_key = gain_key if self._ndcg_keys else None
+    self._top_ks = [key.sub_key.top_k for key in self._ndcg_keys]
+    self._min_label_position_key = min_label_position_key
+    self._query_statistics_keys = query_statistics_keys
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        model_name=model_name,
+        output_name=output_name,
+        flatten=False,
+        allow_none=self._gain_key is None)
+
+  @property
+  def metric_keys(self) -> List[metric_types.MetricKey]:
+    keys = list(self._ndcg_keys)
+    if self._min_label_position_key is not None:
+      keys.append(self._min_label_position_key)
+    if self._query_statistics_keys is not None:
+      keys.extend(self._query_statistics_keys)
+    return keys
+
+  def _requires_ranking(self) -> bool:
+    return bool(self._ndcg_keys) or self._min_label_position_key is not None
+
+  def create_accumulator(self) -> _QueryRankingAccumulator:
+    return _QueryRankingAccumulator(len(self._top_ks))
+
+  def add_input(
+      self, accumulator: _QueryRankingAccumulator,
+      elements: List[metric_types.StandardMetricInputs]
+  ) -> _QueryRankingAccumulator:
+    size = len(elements)
+    accumulator.total_queries += 1
+    accumulator.total_documents += size
+    accumulator.min_documents = min(accumulator.min_documents, size)
+    accumulator.max_documents = max(accumulator.max_documents, size)
+    if not self._requires_ranking():
+      return accumulator
+    ranked = rank_query(
+        elements,
+        eval_config=self._eval_config,
+        model_name=self._model_name,
+        output_name=self._output_name,
+        gain_key=self._gain_key,
+        adapter=self._adapter)
+    if self._ndcg_keys:
+      accumulator.ndcg += (
+          ndcg_at_top_ks(ranked.gains, self._top_ks) * ranked.example_weight)
+      accumulator.total_ndcg_weighted_examples += ranked.example_weight
+    if self._min_label_position_key is not None:
+      position = min_label_position(ranked.labels)
+      if position:
+        accumulator.total_min_position += position
+        accumulator.total_min_position_weighted_examples += (
+            ranked.example_weight)
+    return accumulator
+
+  def merge_accumulators(
+      self, accumulators: List[_QueryRankingAccumulator]
+  ) -> _QueryRankingAccumulator:
+    result = self.create_accumulator()
+    for accumulator in accumulators:
+      result.ndcg += accumulator.ndcg
+      result.total_ndcg_weighted_examples += (
+          accumulator.total_ndcg_weighted_examples)
+      result.total_min_position += accumulator.total_min_position
+      result.total_min_position_weighted_examples += (
+          accumulator.total_min_position_weighted_examples)
+      result.total_queries += accumulator.total_queries
+      result.total_documents += accumulator.total_documents
+      result.min_documents = min(result.min_documents,
+                                 accumulator.min_documents)
+      result.max_documents = max(result.max_documents,
+                                 accumulator.max_documents)
+    return result
+
+  def extract_output(
+      self, accumulator: _QueryRankingAccumulator
+  ) -> Dict[metric_types.MetricKey, Union[float, int]]:
+    output = {}
+    for i, key in enumerate(self._ndcg_keys):
+      if accumulator.total_ndcg_weighted_examples > 0:
+        output[key] = float(accumulator.ndcg[i] /
+                            accumulator.total_ndcg_weighted_examples)
+      else:
+        output[key] = float('nan')
+    if self._min_label_position_key is not None:
+      if accumulator.total_min_position_weighted_examples > 0:
+        value = (
+            accumulator.total_min_position /
+            accumulator.total_min_position_weighted_examples)
+      else:
+        value = float('nan')
+      output[self._min_label_position_key] = value
+    if self._query_statistics_keys is not None:
+      keys = self._query_statistics_keys
+      output[keys.total_queries] = accumulator.total_queries
+      output[keys.total_documents] = accumulator.total_documents
+      output[keys.min_documents] = accumulator.min_documents
+      output[keys.max_documents] = accumulator.max_documents
+    return output
+
+
+def _merge_combiners(
+    left: QueryRankingCombiner,
+    right: QueryRankingCombiner) -> Optional[QueryRankingCombiner]:
+  """Returns a combiner computing the outputs of both or None if not possible."""
+  # pylint: disable=protected-access
+  if ((left._ndcg_keys and right._ndcg_keys) or
+      (left._min_label_position_key is not None and
+       right._min_label_position_key is not None) or
+      (left._query_statistics_keys is not None and
+       right._query_statistics_keys is not None)):
+    return None
+  if left._requires_ranking() and right._requires_ranking():
+    if (left._model_name != right._model_name or
+        left._output_name != right._output_name or
+        left._eval_config != right._eval_config):
+      return None
+  # Query statistics do not depend on the model so they can be merged with the
+  # ranking for any model and output.
+  ranking = left if left._requires_ranking() else right
+  ndcg = left if left._ndcg_keys else right
+  return QueryRankingCombiner(
+      eval_config=ranking._eval_config,
+      model_name=ranking._model_name,
+      output_name=ranking._output_name,
+      ndcg_keys=ndcg._ndcg_keys,
+      gain_key=ndcg._gain_key,
+      min_label_position_key=(left._min_label_position_key or
+                              right._min_label_position_key),
+      query_statistics_keys=(left._query_statistics_keys or
+                             right._query_statistics_keys))
+  # pylint: enable=protected-access
+
+
+def _merge_preprocessors(left: Optional[beam.DoFn],
+                         right: Optional[beam.DoFn]) -> Optional[beam.DoFn]:
+  if left is None:
+    return right
+  if right is None:
+    return left
+  feature_keys = list(left.feature_keys)
+  for k in right.feature_keys:
+    if k not in feature_keys:
+      feature_keys.append(k)
+  return metric_types.FeaturePreprocessor(feature_keys=feature_keys)
+
+
+def merge_computations(
+    computations: List[metric_types.MetricComputation]
+) -> List[metric_types.MetricComputation]:
+  """Merges computations using QueryRankingCombiners where possible.
+
+  NDCG, MinLabelPosition and QueryStatistics computations for the same model
+  and output are merged into a single computation so that each query is only
+  ranked once. Other computations are returned unchanged (and in order).
+
+  Args:
+    computations: Metric computations.
+
+  Returns:
+    Metric computations with the ranking computations merged.
+  """
+  result = []
+  for c in computations:
+    if (isinstance(c.combiner, QueryRankingCombiner) and
+        (c.preprocessor is None or
+         isinstance(c.preprocessor, metric_types.FeaturePreprocessor))):
+      merged = False
+      for i, other in enumerate(result):
+        if not isinstance(other.combiner, QueryRankingCombiner):
+          continue
+        combiner = _merge_combiners(other.combiner, c.combiner)
+        if combiner is None:
+          continue
+        result[i] = metric_types.MetricComputation(
+            keys=combiner.metric_keys,
+            preprocessor=_merge_preprocessors(other.preprocessor,
+                                              c.preprocessor),
+            combiner=combiner)
+        merged = True
+        break
+      if merged:
+        continue
+    result.append(c)
+  return result
@@ -0,0 +1,218 @@
+# Lint as: python3
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for query ranking kernel."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import apache_beam as beam
+from apache_beam.testing import util
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis.eval_saved_model import testutil
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+from tensorflow_model_analysis.metrics import min_label_position
+from tensorflow_model_analysis.metrics import ndcg
+from tensorflow_model_analysis.metrics import query_ranking
+from tensorflow_model_analysis.metrics import query_statistics
+
+
+def _make_example(query, label, prediction, weight, gain):
+  return {
+      'labels': np.array([label]),
+      'predictions': np.array([prediction]),
+      'example_weights': np.array([weight]),
+      'features': {
+          'query': np.array([query]),
+          'gain': np.array([gain])
+      }
+  }
+
+
+class QueryRankingTest(testutil.TensorflowModelAnalysisTest):
+
+  def testDiscounts(self):
+    self.assertAllClose(
+        query_ranking.discounts(3), 1.0 / np.log2(np.array([2, 3, 4])))
+    # Larger than the initial table.
+    discounts = query_ranking.discounts(5000)
+    self.assertLen(discounts, 5000)
+    self.assertAlmostEqual(discounts[-1], 1.0 / np.log2(5001))
+
+  def testNDCGAtTopKs(self):
+    # DCG@1 = 0.5, DCG@2 = 0.5 + 1.0/log2(3)
+    # IDCG@1 = 1.0, IDCG@2 = 1.0 + 0.5/log2(3)
+    self.assertAllClose(
+        query_ranking.ndcg_at_top_ks(np.array([0.5, 1.0]), [1, 2, 3]),
+        [0.5, 0.85972, 0.85972],
+        atol=1e-5)
+
+  def testNDCGAtTopKsWithZeroGains(self):
+    self.assertAllClose(
+        query_ranking.ndcg_at_top_ks(np.array([0.0, 0.0]), [1, 2]), [0.0, 0.0])
+
+  def testMinLabelPosition(self):
+    self.assertEqual(
+        query_ranking.min_label_position(np.array([0.0, 0.0, 1.0])), 3)
+    self.assertIsNone(query_ranking.min_label_position(np.array([0.0, 0.0])))
+
+  def testRankQuery(self):
+    elements = [
+        metric_util.to_standard_metric_inputs(e, True) for e in [
+            _make_example('query1', 0.0, 0.2, 2.0, 0.1),
+            _make_example('query1', 1.0, 0.9, 2.0, 0.7),
+            _make_example('query1', 0.0, 0.5, 2.0, 0.3),
+        ]
+    ]
+    ranked = query_ranking.rank_query(elements, gain_key='gain')
+    self.assertAllClose(ranked.labels, [1.0, 0.0, 0.0])
+    self.assertAllClose(ranked.gains, [0.7, 0.3, 0.1])
+    self.assertEqual(ranked.example_weight, 2.0)
+
+  def testRankQueryWithMultiValuedLabelsAndPredictions(self):
+    examples = [
+        _make_example('query1', 0.0, 0.2, 1.0, 0.1),
+        _make_example('query1', 1.0, 0.9, 1.0, 0.7),
+    ]
+    # Predictions are ranked by their max and labels are summed.
+    examples[0]['labels'] = np.array([1.0, 1.0])
+    examples[0]['predictions'] = np.array([0.2, 0.95])
+    examples[1]['labels'] = np.array([1.0, 0.0])
+    examples[1]['predictions'] = np.array([0.9, 0.1])
+    elements = [
+        metric_util.to_standard_metric_inputs(e, True) for e in examples
+    ]
+    ranked = query_ranking.rank_query(elements, gain_key='gain')
+    self.assertAllClose(ranked.labels, [2.0, 1.0])
+    self.assertAllClose(ranked.gains, [0.1, 0.7])
+
+  def testRankQueryRaisesForDifferentExampleWeights(self):
+    elements = [
+        metric_util.to_standard_metric_inputs(e, True) for e in [
+            _make_example('query1', 0.0, 0.2, 2.0, 0.1),
+            _make_example('query1', 1.0, 0.9, 1.0, 0.7),
+        ]
+    ]
+    with self.assertRaisesRegex(ValueError, 'same value 1.0 != 2.0'):
+      query_ranking.rank_query(elements, gain_key='gain')
+
+  def testMergeComputations(self):
+    computations = (
+        ndcg.NDCG(gain_key='gain').computations(
+            sub_keys=[metric_types.SubKey(top_k=1)], query_key='query') +
+        min_label_position.MinLabelPosition().computations(
+            query_key='query') +
+        query_statistics.QueryStatistics().computations(query_key='query'))
+    merged = query_ranking.merge_computations(computations)
+    self.assertLen(merged, 1)
+    self.assertCountEqual(merged[0].keys,
+                          [k for c in computations for k in c.keys])
+    self.assertCountEqual(merged[0].preprocessor.feature_keys,
+                          ['query', 'gain'])
+
+  def testDoesNotMergeComputationsForDifferentModels(self):
+    computations = (
+        ndcg.NDCG(gain_key='gain').computations(
+            model_names=['model1'],
+            sub_keys=[metric_types.SubKey(top_k=1)],
+            query_key='query') +
+        min_label_position.MinLabelPosition().computations(
+            model_names=['model2'], query_key='query'))
+    self.assertLen(query_ranking.merge_computations(computations), 2)
+
+  def testMergedComputation(self):
+    computations = query_ranking.merge_computations(
+        ndcg.NDCG(gain_key='gain').computations(
+            sub_keys=[
+                metric_types.SubKey(top_k=1),
+                metric_types.SubKey(top_k=2)
+            ],
+            query_key='query') +
+        min_label_position.MinLabelPosition().computations(
+            query_key='query') +
+        query_statistics.QueryStatistics().computations(query_key='query'))
+    self.assertLen(computations, 1)
+    computation = computations[0]
+
+    examples = [[
+        _make_example('query1', 1.0, 0.2, 1.0, 1.0),
+        _make_example('query1', 0.0, 0.8, 1.0, 0.5)
+    ],
+                [
+                    _make_example('query2', 0.0, 0.5, 2.0, 0.5),
+                    _make_example('query2', 1.0, 0.9, 2.0, 1.0),
+                    _make_example('query2', 0.0, 0.1, 2.0, 0.1)
+                ], [_make_example('query3', 1.0, 0.9, 3.0, 1.0)]]
+
+    def to_standard_metric_inputs_list(list_of_extracts):
+      return [
+          metric_util.to_standard_metric_inputs(e, True)
+          for e in list_of_extracts
+      ]
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create(examples)
+          | 'Process' >> beam.Map(to_standard_metric_inputs_list)
+          | 'AddSlice' >> beam.Map(lambda x: ((), x))
+          | 'Combine' >> beam.CombinePerKey(computation.combiner))
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          got_slice_key, got_metrics = got[0]
+          self.assertEqual(got_slice_key, ())
+          # Ranked by prediction:
+          #   Query1 (weight=1): labels (0, 1), gains (0.5, 1.0)
+          #   Query2 (weight=2): labels (1, 0, 0), gains (1.0, 0.5, 0.1)
+          #   Query3 (weight=3): labels (1), gains (1.0)
+          #
+          # Min label position: (2 + 1 + 1) / (1 + 2 + 3)
+          self.assertDictElementsAlmostEqual(
+              got_metrics, {
+                  metric_types.MetricKey(
+                      name='ndcg', sub_key=metric_types.SubKey(top_k=1)):
+                      0.9166667,
+                  metric_types.MetricKey(
+                      name='ndcg', sub_key=metric_types.SubKey(top_k=2)):
+                      0.9766198,
+                  metric_types.MetricKey(name='min_label_position'):
+                      0.66667,
+                  metric_types.MetricKey(name='total_queries'):
+                      3,
+                  metric_types.MetricKey(name='total_documents'):
+                      6,
+                  metric_types.MetricKey(name='min_documents'):
+                      1,
+                  metric_types.MetricKey(name='max_documents'):
+                      3,
+              },
+              places=5)
+
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result, label='result')
+
+
+if __name__ == '__main__':
+  tf.test.main()
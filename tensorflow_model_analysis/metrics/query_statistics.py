@@ -19,9 +19,9 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
-from typing import Dict, List, Text
-import apache_beam as beam
+from typing import Text
 from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import query_ranking
 
 TOTAL_QUERIES_NAME = 'total_queries'
 TOTAL_DOCUMENTS_NAME = 'total_documents'
@@ -74,79 +74,15 @@ def _query_statistics(total_queries_name=TOTAL_QUERIES_NAME,
   min_documents_key = metric_types.MetricKey(name=min_documents_name)
   max_documents_key = metric_types.MetricKey(name=max_documents_name)
 
+  keys = query_ranking.QueryStatisticsKeys(
+      total_queries=total_queries_key,
+      total_documents=total_documents_key,
+      min_documents=min_documents_key,
+      max_documents=max_documents_key)
   return [
       metric_types.MetricComputation(
-          keys=[
-              total_queries_key, total_documents_key, min_documents_key,
-              max_documents_key
-          ],
+          keys=list(keys),
           preprocessor=None,
-          combiner=_QueryStatisticsCombiner(total_queries_key,
-                                            total_documents_key,
-                                            min_documents_key,
-                                            max_documents_key))
+          combiner=query_ranking.QueryRankingCombiner(
+              query_statistics_keys=keys))
   ]
-
-
-class _QueryStatisticsAccumulator(object):
-  """Query statistics accumulator."""
-  __slots__ = [
-      'total_queries', 'total_documents', 'min_documents', 'max_documents'
-  ]
-
-  LARGE_INT = 1000000000
-
-  def __init__(self):
-    self.total_queries = 0
-    self.total_documents = 0
-    self.min_documents = self.LARGE_INT
-    self.max_documents = 0
-
-
-class _QueryStatisticsCombiner(beam.CombineFn):
-  """Computes query statistics metrics."""
-
-  def __init__(self, total_queries_key: metric_types.MetricKey,
-               total_documents_key: metric_types.MetricKey,
-               min_documents_key: metric_types.MetricKey,
-               max_documents_key: metric_types.MetricKey):
-    self._total_queries_key = total_queries_key
-    self._total_documents_key = total_documents_key
-    self._min_documents_key = min_documents_key
-    self._max_documents_key = max_documents_key
-
-  def create_accumulator(self) -> _QueryStatisticsAccumulator:
-    return _QueryStatisticsAccumulator()
-
-  def add_input(
-      self, accumulator: _QueryStatisticsAccumulator,
-      elements: List[metric_types.StandardMetricInputs]
-  ) -> _QueryStatisticsAccumulator:
-    accumulator.total_queries += 1
-    accumulator.total_documents += len(elements)
-    accumulator.min_documents = min(accumulator.min_documents, len(elements))
-    accumulator.max_documents = max(accumulator.max_documents, len(elements))
-    return accumulator
-
-  def merge_accumulators(
-      self, accumulators: List[_QueryStatisticsAccumulator]
-  ) -> _QueryStatisticsAccumulator:
-    result = self.create_accumulator()
-    for accumulator in accumulators:
-      result.total_queries += accumulator.total_queries
-      result.total_documents += accumulator.total_documents
-      result.min_documents = min(result.min_documents,
-                                 accumulator.min_documents)
-      result.max_documents = max(result.max_documents,
-                                 accumulator.max_documents)
-    return result
-
-  def extract_output(
-      self, accumulator: _QueryStatisticsAccumulator
-  ) -> Dict[metric_types.MetricKey, int]:
-    return {
-        self._total_queries_key: accumulator.total_queries,
-        self._total_documents_key: accumulator.total_documents,
-        self._min_documents_key: accumulator.min_documents,
-        self._max_documents_key: accumulator.max_documents
-    }
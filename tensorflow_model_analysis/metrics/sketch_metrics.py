@@ -0,0 +1,285 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Metrics and plots derived from the prediction sketch.
+
+All of the metrics for the same model, output, sub key and epsilon share a
+single prediction sketch (see prediction_sketch).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+from typing import Any, Dict, List, Optional, Text
+
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis.metrics import calibration_plot
+from tensorflow_model_analysis.metrics import confusion_matrix_metrics
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+from tensorflow_model_analysis.metrics import prediction_sketch
+
+SKETCH_AUC_NAME = 'sketch_auc'
+SKETCH_AUC_PRECISION_RECALL_NAME = 'sketch_auc_precision_recall'
+SKETCH_CALIBRATION_PLOT_NAME = 'sketch_calibration_plot'
+SKETCH_CONFUSION_MATRIX_AT_THRESHOLDS_NAME = (
+    'sketch_confusion_matrix_at_thresholds')
+
+
+class SketchAUC(metric_types.Metric):
+  """Approximate area under the ROC curve computed from a prediction sketch."""
+
+  def __init__(self,
+               epsilon: Optional[float] = None,
+               num_exact_examples: Optional[int] = None,
+               name: Text = SKETCH_AUC_NAME):
+    """Initializes sketch AUC.
+
+    Args:
+      epsilon: Maximum fraction of the total example weight summarized by each
+        centroid of the sketch. Defaults to 0.001.
+      num_exact_examples: Number of examples up to which the raw predictions
+        are kept, in which case the result is exact. Defaults to 0.
+      name: Metric name.
+    """
+    super(SketchAUC, self).__init__(
+        metric_util.merge_per_key_computations(_sketch_auc),
+        epsilon=epsilon,
+        num_exact_examples=num_exact_examples,
+        name=name)
+
+
+metric_types.register_metric(SketchAUC)
+
+
+class SketchAUCPrecisionRecall(metric_types.Metric):
+  """Approximate area under the precision-recall curve from a sketch."""
+
+  def __init__(self,
+               epsilon: Optional[float] = None,
+               num_exact_examples: Optional[int] = None,
+               name: Text = SKETCH_AUC_PRECISION_RECALL_NAME):
+    """Initializes sketch AUC precision-recall.
+
+    Args:
+      epsilon: Maximum fraction of the total example weight summarized by each
+        centroid of the sketch. Defaults to 0.001.
+      num_exact_examples: Number of examples up to which the raw predictions
+        are kept, in which case the result is exact. Defaults to 0.
+      name: Metric name.
+    """
+    super(SketchAUCPrecisionRecall, self).__init__(
+        metric_util.merge_per_key_computations(_sketch_auc),
+        epsilon=epsilon,
+        num_exact_examples=num_exact_examples,
+        curve='PR',
+        name=name)
+
+
+metric_types.register_metric(SketchAUCPrecisionRecall)
+
+
+def _sketch_auc(
+    epsilon: Optional[float] = None,
+    num_exact_examples: Optional[int] = None,
+    curve: Text = 'ROC',
+    name: Text = SKETCH_AUC_NAME,
+    eval_config: Optional[config.EvalConfig] = None,
+    model_name: Text = '',
+    output_name: Text = '',
+    sub_key: Optional[metric_types.SubKey] = None,
+    class_weights: Optional[Dict[int, float]] = None
+) -> metric_types.MetricComputations:
+  """Returns metric computations for sketch AUC."""
+  key = metric_types.MetricKey(
+      name=name,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key)
+
+  computations = prediction_sketch.prediction_sketch(
+      epsilon=epsilon,
+      num_exact_examples=num_exact_examples,
+      eval_config=eval_config,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key,
+      class_weights=class_weights)
+  sketch_key = computations[-1].keys[-1]
+
+  def result(
+      metrics: Dict[metric_types.MetricKey, Any]
+  ) -> Dict[metric_types.MetricKey, float]:
+    return {key: prediction_sketch.auc(metrics[sketch_key], curve=curve)}
+
+  derived_computation = metric_types.DerivedMetricComputation(
+      keys=[key], result=result)
+  computations.append(derived_computation)
+  return computations
+
+
+class SketchCalibrationPlot(metric_types.Metric):
+  """Calibration plot computed from a prediction sketch."""
+
+  def __init__(self,
+               num_buckets: int = calibration_plot.DEFAULT_NUM_BUCKETS,
+               left: float = 0.0,
+               right: float = 1.0,
+               epsilon: Optional[float] = None,
+               num_exact_examples: Optional[int] = None,
+               name: Text = SKETCH_CALIBRATION_PLOT_NAME):
+    """Initializes sketch calibration plot.
+
+    Args:
+      num_buckets: Number of buckets to use when creating the plot. Defaults to
+        1000.
+      left: Left boundary of plot. Defaults to 0.0.
+      right: Right boundary of plot. Defaults to 1.0.
+      epsilon: Maximum fraction of the total example weight summarized by each
+        centroid of the sketch. Defaults to 0.001.
+      num_exact_examples: Number of examples up to which the raw predictions
+        are kept, in which case the result is exact. Defaults to 0.
+      name: Plot name.
+    """
+    super(SketchCalibrationPlot, self).__init__(
+        metric_util.merge_per_key_computations(_sketch_calibration_plot),
+        num_buckets=num_buckets,
+        left=left,
+        right=right,
+        epsilon=epsilon,
+        num_exact_examples=num_exact_examples,
+        name=name)
+
+
+metric_types.register_metric(SketchCalibrationPlot)
+
+
+def _sketch_calibration_plot(
+    num_buckets: int = calibration_plot.DEFAULT_NUM_BUCKETS,
+    left: float = 0.0,
+    right: float = 1.0,
+    epsilon: Optional[float] = None,
+    num_exact_examples: Optional[int] = None,
+    name: Text = SKETCH_CALIBRATION_PLOT_NAME,
+    eval_config: Optional[config.EvalConfig] = None,
+    model_name: Text = '',
+    output_name: Text = '',
+    sub_key: Optional[metric_types.SubKey] = None,
+    class_weights: Optional[Dict[int, float]] = None
+) -> metric_types.MetricComputations:
+  """Returns metric computations for sketch calibration plot."""
+  key = metric_types.PlotKey(
+      name=name,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key)
+
+  computations = prediction_sketch.prediction_sketch(
+      epsilon=epsilon,
+      num_exact_examples=num_exact_examples,
+      eval_config=eval_config,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key,
+      class_weights=class_weights)
+  sketch_key = computations[-1].keys[-1]
+
+  def result(
+      metrics: Dict[metric_types.MetricKey, Any]
+  ) -> Dict[metric_types.MetricKey, Any]:
+    thresholds = [
+        left + i * (right - left) / num_buckets for i in range(num_buckets + 1)
+    ]
+    thresholds = [float('-inf')] + thresholds
+    histogram = prediction_sketch.to_histogram(metrics[sketch_key], thresholds)
+    return {key: calibration_plot._to_proto(thresholds, histogram)}  # pylint: disable=protected-access
+
+  derived_computation = metric_types.DerivedMetricComputation(
+      keys=[key], result=result)
+  computations.append(derived_computation)
+  return computations
+
+
+class SketchConfusionMatrixAtThresholds(metric_types.Metric):
+  """Confusion matrix at thresholds computed from a prediction sketch."""
+
+  def __init__(self,
+               thresholds: List[float],
+               epsilon: Optional[float] = None,
+               num_exact_examples: Optional[int] = None,
+               name: Text = SKETCH_CONFUSION_MATRIX_AT_THRESHOLDS_NAME):
+    """Initializes sketch confusion matrix at thresholds.
+
+    Args:
+      thresholds: Thresholds to use for confusion matrix. Unlike
+        ConfusionMatrixAtThresholds, the thresholds need not be in [0, 1].
+      epsilon: Maximum fraction of the total example weight summarized by each
+        centroid of the sketch. Defaults to 0.001.
+      num_exact_examples: Number of examples up to which the raw predictions
+        are kept, in which case the result is exact. Defaults to 0.
+      name: Metric name.
+    """
+    super(SketchConfusionMatrixAtThresholds, self).__init__(
+        metric_util.merge_per_key_computations(
+            _sketch_confusion_matrix_at_thresholds),
+        thresholds=thresholds,
+        epsilon=epsilon,
+        num_exact_examples=num_exact_examples,
+        name=name)
+
+
+metric_types.register_metric(SketchConfusionMatrixAtThresholds)
+
+
+def _sketch_confusion_matrix_at_thresholds(
+    thresholds: List[float],
+    epsilon: Optional[float] = None,
+    num_exact_examples: Optional[int] = None,
+    name: Text = SKETCH_CONFUSION_MATRIX_AT_THRESHOLDS_NAME,
+    eval_config: Optional[config.EvalConfig] = None,
+    model_name: Text = '',
+    output_name: Text = '',
+    sub_key: Optional[metric_types.SubKey] = None,
+    class_weights: Optional[Dict[int, float]] = None
+) -> metric_types.MetricComputations:
+  """Returns metric computations for sketch confusion matrix at thresholds."""
+  key = metric_types.MetricKey(
+      name=name,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key)
+
+  computations = prediction_sketch.prediction_sketch(
+      epsilon=epsilon,
+      num_exact_examples=num_exact_examples,
+      eval_config=eval_config,
+      model_name=model_name,
+      output_name=output_name,
+      sub_key=sub_key,
+      class_weights=class_weights)
+  sketch_key = computations[-1].keys[-1]
+
+  def result(
+      metrics: Dict[metric_types.MetricKey, Any]
+  ) -> Dict[metric_types.MetricKey, Any]:
+    matrices = prediction_sketch.to_binary_confusion_matrices(
+        metrics[sketch_key], thresholds)
+    return {key: confusion_matrix_metrics.to_proto(thresholds, matrices)}
+
+  derived_computation = metric_types.DerivedMetricComputation(
+      keys=[key], result=result)
+  computations.append(derived_computation)
+  return computations
@@ -0,0 +1,163 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for sketch metrics."""
+
+from __future__ import absolute_import
+from __future__ import division
+# Standard __future__ imports
+from __future__ import print_function
+
+import apache_beam as beam
+from apache_beam.testing import util
+import numpy as np
+import tensorflow as tf
+from tensorflow_model_analysis.eval_saved_model import testutil
+from tensorflow_model_analysis.metrics import metric_types
+from tensorflow_model_analysis.metrics import metric_util
+from tensorflow_model_analysis.metrics import sketch_metrics
+
+
+def _examples():
+  return [{
+      'labels': np.array([label]),
+      'predictions': np.array([prediction]),
+      'example_weights': np.array([weight])
+  } for label, prediction, weight in [(0.0, 0.2, 1.0), (1.0, 0.8, 2.0),
+                                      (0.0, 0.5, 3.0), (1.0, 0.5, 4.0)]]
+
+
+class SketchMetricsTest(testutil.TensorflowModelAnalysisTest):
+
+  def _assert_result(self, metric, check_result):
+    computations = metric.computations()
+    sketch = computations[0]
+    derived = computations[1]
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create(_examples())
+          | 'Process' >> beam.Map(metric_util.to_standard_metric_inputs)
+          | 'AddSlice' >> beam.Map(lambda x: ((), x))
+          | 'ComputeSketch' >> beam.CombinePerKey(sketch.combiner)
+          | 'ComputeMetric' >> beam.Map(lambda x: (x[0], derived.result(x[1]))))
+      # pylint: enable=no-value-for-parameter
+
+      util.assert_that(result, check_result, label='result')
+
+  def testSketchAUC(self):
+
+    def check_result(got):
+      try:
+        self.assertLen(got, 1)
+        got_slice_key, got_metrics = got[0]
+        self.assertEqual(got_slice_key, ())
+        key = metric_types.MetricKey(name='sketch_auc')
+        self.assertIn(key, got_metrics)
+        # Weighted pairs (positive, negative): 0.8 beats both negatives, 0.5
+        # beats 0.2 and ties 0.5.
+        self.assertAlmostEqual(got_metrics[key],
+                               (2.0 * 4.0 + 4.0 * 1.0 + 0.5 * 4.0 * 3.0) /
+                               (6.0 * 4.0))
+
+      except AssertionError as err:
+        raise util.BeamAssertException(err)
+
+    self._assert_result(sketch_metrics.SketchAUC(), check_result)
+
+  def testSketchAUCPrecisionRecall(self):
+
+    def check_result(got):
+      try:
+        self.assertLen(got, 1)
+        _, got_metrics = got[0]
+        key = metric_types.MetricKey(name='sketch_auc_precision_recall')
+        self.assertIn(key, got_metrics)
+        # (recall, precision): (1, 0.6), (1, 6/9), (1/3, 1), (0, 1).
+        self.assertAlmostEqual(got_metrics[key],
+                               (2.0 / 3.0) * (6.0 / 9.0 + 1.0) / 2.0 +
+                               (1.0 / 3.0))
+
+      except AssertionError as err:
+        raise util.BeamAssertException(err)
+
+    self._assert_result(sketch_metrics.SketchAUCPrecisionRecall(),
+                        check_result)
+
+  def testSketchCalibrationPlot(self):
+
+    def check_result(got):
+      try:
+        self.assertLen(got, 1)
+        _, got_plots = got[0]
+        key = metric_types.PlotKey(name='sketch_calibration_plot')
+        self.assertIn(key, got_plots)
+        got_plot = got_plots[key]
+        self.assertLen(got_plot.buckets, 4)
+        self.assertAlmostEqual(
+            got_plot.buckets[1].total_weighted_refined_prediction.value, 0.2)
+        self.assertAlmostEqual(
+            got_plot.buckets[2].total_weighted_label.value, 6.0)
+        self.assertAlmostEqual(
+            got_plot.buckets[2].num_weighted_examples.value, 9.0)
+
+      except AssertionError as err:
+        raise util.BeamAssertException(err)
+
+    self._assert_result(
+        sketch_metrics.SketchCalibrationPlot(num_buckets=2), check_result)
+
+  def testSketchConfusionMatrixAtThresholds(self):
+
+    def check_result(got):
+      try:
+        self.assertLen(got, 1)
+        _, got_metrics = got[0]
+        key = metric_types.MetricKey(
+            name='sketch_confusion_matrix_at_thresholds')
+        self.assertIn(key, got_metrics)
+        self.assertProtoEquals(
+            """
+            matrices {
+              threshold: 0.3
+              false_negatives: 0.0
+              true_negatives: 1.0
+              false_positives: 3.0
+              true_positives: 6.0
+              precision: 0.6666667
+              recall: 1.0
+            }
+            matrices {
+              threshold: 0.6
+              false_negatives: 4.0
+              true_negatives: 4.0
+              false_positives: 0.0
+              true_positives: 2.0
+              precision: 1.0
+              recall: 0.3333333
+            }
+            """, got_metrics[key])
+
+      except AssertionError as err:
+        raise util.BeamAssertException(err)
+
+    self._assert_result(
+        sketch_metrics.SketchConfusionMatrixAtThresholds(thresholds=[0.3, 0.6]),
+        check_result)
+
+
+if __name__ == '__main__':
+  tf.test.main()
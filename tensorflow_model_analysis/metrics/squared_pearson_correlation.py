@@ -19,9 +19,11 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
-from typing import Dict, List, Optional, Text
+from typing import Any, Dict, Iterable, List, Optional, Text
 import apache_beam as beam
+import numpy as np
 from tensorflow_model_analysis import config
+from tensorflow_model_analysis import math_util
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import metric_util
 
@@ -65,20 +67,39 @@ def _squared_pearson_correlation(
 
 
 class _SquaredPearsonCorrelationAccumulator(object):
-  """Squared pearson correlation (r^2) accumulator."""
+  """Squared pearson correlation (r^2) accumulator.
+
+  If analytic confidence intervals are computed, second_moments holds the sum
+  over the examples of the outer product of each example's contribution to
+  the totals (in the order returned by _totals) with itself.
+  """
   __slots__ = [
       'total_weighted_labels', 'total_weighted_predictions',
       'total_weighted_squared_labels', 'total_weighted_squared_predictions',
-      'total_weighted_labels_times_predictions', 'total_weighted_examples'
+      'total_weighted_labels_times_predictions', 'total_weighted_examples',
+      'second_moments'
   ]
 
-  def __init__(self):
+  def __init__(self, compute_confidence_intervals: bool = False):
     self.total_weighted_labels = 0.0
     self.total_weighted_predictions = 0.0
     self.total_weighted_squared_labels = 0.0
     self.total_weighted_squared_predictions = 0.0
     self.total_weighted_labels_times_predictions = 0.0
     self.total_weighted_examples = 0.0
+    self.second_moments = None
+    if compute_confidence_intervals:
+      self.second_moments = np.zeros((6, 6))
+
+
+def _totals(accumulator: _SquaredPearsonCorrelationAccumulator) -> np.ndarray:
+  return np.array([
+      accumulator.total_weighted_examples, accumulator.total_weighted_labels,
+      accumulator.total_weighted_predictions,
+      accumulator.total_weighted_squared_labels,
+      accumulator.total_weighted_squared_predictions,
+      accumulator.total_weighted_labels_times_predictions
+  ])
 
 
 class _SquaredPearsonCorrelationCombiner(beam.CombineFn):
@@ -90,32 +111,58 @@ class _SquaredPearsonCorrelationCombiner(beam.CombineFn):
     self._key = key
     self._eval_config = eval_config
     self._class_weights = class_weights
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        model_name=key.model_name,
+        output_name=key.output_name,
+        class_weights=class_weights)
+    self._compute_confidence_intervals = (
+        metric_util.compute_analytic_confidence_intervals(eval_config))
 
   def create_accumulator(self) -> _SquaredPearsonCorrelationAccumulator:
-    return _SquaredPearsonCorrelationAccumulator()
+    return _SquaredPearsonCorrelationAccumulator(
+        self._compute_confidence_intervals)
 
   def add_input(
       self, accumulator: _SquaredPearsonCorrelationAccumulator,
       element: metric_types.StandardMetricInputs
   ) -> _SquaredPearsonCorrelationAccumulator:
-    for label, prediction, example_weight in (
-        metric_util.to_label_prediction_example_weight(
-            element,
-            eval_config=self._eval_config,
-            model_name=self._key.model_name,
-            output_name=self._key.output_name,
-            class_weights=self._class_weights)):
-      example_weight = float(example_weight)
-      label = float(label)
-      prediction = float(prediction)
-      accumulator.total_weighted_labels += example_weight * label
-      accumulator.total_weighted_predictions += example_weight * prediction
-      accumulator.total_weighted_squared_labels += example_weight * label**2
-      accumulator.total_weighted_squared_predictions += (
-          example_weight * prediction**2)
-      accumulator.total_weighted_labels_times_predictions += (
-          example_weight * label * prediction)
-      accumulator.total_weighted_examples += example_weight
+    return self.add_inputs(accumulator, [element])
+
+  def add_inputs(
+      self, accumulator: _SquaredPearsonCorrelationAccumulator,
+      elements: Iterable[metric_types.StandardMetricInputs]
+  ) -> _SquaredPearsonCorrelationAccumulator:
+    labels, predictions, example_weights, example_indices = (
+        self._adapter.batch(elements, with_example_indices=True))
+    labels = labels.astype(np.float64)
+    predictions = predictions.astype(np.float64)
+    example_weights = example_weights.astype(np.float64)
+    weighted_labels = example_weights * labels
+    weighted_predictions = example_weights * predictions
+    terms = np.stack([
+        example_weights, weighted_labels, weighted_predictions,
+        weighted_labels * labels, weighted_predictions * predictions,
+        weighted_labels * predictions
+    ],
+                     axis=1)
+    totals = terms.sum(axis=0)
+    accumulator.total_weighted_examples += float(totals[0])
+    accumulator.total_weighted_labels += float(totals[1])
+    accumulator.total_weighted_predictions += float(totals[2])
+    accumulator.total_weighted_squared_labels += float(totals[3])
+    accumulator.total_weighted_squared_predictions += float(totals[4])
+    accumulator.total_weighted_labels_times_predictions += float(totals[5])
+    if accumulator.second_moments is not None and example_indices.size:
+      # The second moments are computed from the totals of each example.
+      num_examples = int(example_indices[-1]) + 1
+      example_totals = np.stack([
+          np.bincount(
+              example_indices, weights=terms[:, i], minlength=num_examples)
+          for i in range(terms.shape[1])
+      ],
+                                axis=1)
+      accumulator.second_moments += np.dot(example_totals.T, example_totals)
     return accumulator
 
   def merge_accumulators(
@@ -133,11 +180,13 @@ class _SquaredPearsonCorrelationCombiner(beam.CombineFn):
       result.total_weighted_labels_times_predictions += (
           accumulator.total_weighted_labels_times_predictions)
       result.total_weighted_examples += accumulator.total_weighted_examples
+      if result.second_moments is not None:
+        result.second_moments += accumulator.second_moments
     return result
 
   def extract_output(
       self, accumulator: _SquaredPearsonCorrelationAccumulator
-  ) -> Dict[metric_types.MetricKey, float]:
+  ) -> Dict[metric_types.MetricKey, Any]:
     result = float('nan')
 
     if accumulator.total_weighted_examples > 0.0:
@@ -179,4 +228,26 @@ class _SquaredPearsonCorrelationCombiner(beam.CombineFn):
       if denominator > 0.0:
         result = numerator / denominator
 
+    if accumulator.second_moments is not None:
+      result = math_util.calculate_delta_method_confidence_interval(
+          result, _gradient(accumulator, result), accumulator.second_moments)
     return {self._key: result}
+
+
+def _gradient(accumulator: _SquaredPearsonCorrelationAccumulator,
+              result: float) -> np.ndarray:
+  """Returns the gradient of r^2 with respect to the totals (see _totals)."""
+  if np.isnan(result):
+    return np.full(6, np.nan)
+  n, x, y, xx, yy, xy = _totals(accumulator).tolist()
+  # r^2 = (n*SUM(xy) - SUM(x)*SUM(y))^2 /
+  #         ((n*SUM(x^2) - SUM(x)^2) * (n*SUM(y^2) - SUM(y)^2))
+  #     = covariance^2 / (variance_x * variance_y)
+  covariance = n * xy - x * y
+  variance_x = n * xx - x**2
+  variance_y = n * yy - y**2
+  d_covariance = np.array([xy, -y, -x, 0.0, 0.0, n])
+  d_variance_x = np.array([xx, -2.0 * x, 0.0, n, 0.0, 0.0])
+  d_variance_y = np.array([yy, 0.0, -2.0 * y, 0.0, n, 0.0])
+  return (2.0 * covariance * d_covariance / (variance_x * variance_y) -
+          result * (d_variance_x / variance_x + d_variance_y / variance_y))
@@ -24,6 +24,8 @@ import apache_beam as beam
 from apache_beam.testing import util
 import numpy as np
 import tensorflow as tf
+from tensorflow_model_analysis import config
+from tensorflow_model_analysis import types
 from tensorflow_model_analysis.eval_saved_model import testutil
 from tensorflow_model_analysis.metrics import metric_util
 from tensorflow_model_analysis.metrics import squared_pearson_correlation
@@ -196,6 +198,81 @@ class SquaredPearsonCorrelationTest(testutil.TensorflowModelAnalysisTest):
 
       util.assert_that(result, check_result, label='result')
 
+  def testSquaredPearsonCorrelationWithAnalyticConfidenceIntervals(self):
+    eval_config = config.EvalConfig()
+    eval_config.options.compute_confidence_intervals.value = True
+    eval_config.options.confidence_intervals.method = (
+        config.ConfidenceIntervalOptions.ANALYTIC)
+    computations = (
+        squared_pearson_correlation.SquaredPearsonCorrelation().computations(
+            eval_config=eval_config))
+    metric = computations[0]
+
+    examples = [{
+        'labels': np.array([label]),
+        'predictions': np.array([prediction]),
+        'example_weights': np.array([1.0]),
+    } for label, prediction in [(2.0, 1.0), (1.0, 2.0), (2.0, 3.0), (3.0, 4.0)]]
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create(examples)
+          | 'Process' >> beam.Map(metric_util.to_standard_metric_inputs)
+          | 'AddSlice' >> beam.Map(lambda x: ((), x))
+          | 'ComputeMetric' >> beam.CombinePerKey(metric.combiner))
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          _, got_metrics = got[0]
+          got_value = got_metrics[metric.keys[0]]
+          self.assertIsInstance(got_value, types.ValueWithConfidenceInterval)
+          # cov = 4 * 22 - 8 * 10 = 8, var(labels) = 4 * 18 - 8^2 = 8 and
+          # var(predictions) = 4 * 30 - 10^2 = 20 so r^2 = 8^2 / (8 * 20) = 0.4.
+          # The gradient of r^2 with respect to the totals (examples, labels,
+          # predictions, labels^2, predictions^2, labels * predictions) is
+          # (0.7, -0.2, -0.4, -0.2, -0.08, 0.4), giving a variance of 0.0816.
+          std_err = math.sqrt(0.0816)
+          self.assertAlmostEqual(got_value.value, 0.4, places=5)
+          self.assertAlmostEqual(
+              got_value.lower_bound, 0.4 - 1.959964 * std_err, places=5)
+          self.assertAlmostEqual(
+              got_value.upper_bound, 0.4 + 1.959964 * std_err, places=5)
+
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result, label='result')
+
+  def testAddInputsMatchesAddInput(self):
+    eval_config = config.EvalConfig()
+    eval_config.options.compute_confidence_intervals.value = True
+    eval_config.options.confidence_intervals.method = (
+        config.ConfidenceIntervalOptions.ANALYTIC)
+    combiner = squared_pearson_correlation.SquaredPearsonCorrelation(
+    ).computations(eval_config=eval_config)[0].combiner
+    inputs = [
+        metric_util.to_standard_metric_inputs({
+            'labels': np.array([label]),
+            'predictions': np.array([prediction]),
+            'example_weights': np.array([weight]),
+        }) for label, prediction, weight in [(2.0, 1.0, 1.0), (
+            1.0, 2.0, 0.5), (2.0, 3.0, 2.0), (3.0, 4.0, 1.5)]
+    ]
+
+    expected = combiner.create_accumulator()
+    for element in inputs:
+      expected = combiner.add_input(expected, element)
+    got = combiner.add_inputs(combiner.create_accumulator(), inputs)
+
+    totals = squared_pearson_correlation._totals  # pylint: disable=protected-access
+    self.assertAllClose(totals(got), totals(expected))
+    self.assertAllClose(got.second_moments, expected.second_moments)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -19,13 +19,16 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
+import collections
 import importlib
+import threading
 
-from typing import Any, Dict, List, Optional, Text, Type, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Text, Type, Tuple, Union
 
 import apache_beam as beam
 import numpy as np
 import tensorflow as tf
+from tensorflow_model_analysis import coders
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis import model_util
 from tensorflow_model_analysis import types
@@ -44,6 +47,10 @@ _DEFAULT_NUM_THRESHOLDS_IN_KERAS = 200
 
 _TFMetricOrLoss = Union[tf.keras.metrics.Metric, tf.keras.losses.Loss]
 
+# Non-compilable metrics are attached to a model shared by all the combiners in
+# the process. This lock guards their updates.
+_MODEL_METRICS_LOCK = threading.Lock()
+
 
 def tf_metric_computations(
     metrics: Union[List[_TFMetricOrLoss], Dict[Text, List[_TFMetricOrLoss]]],
@@ -149,12 +156,20 @@ def tf_metric_computations(
                                                 desired_batch_size)))
 
   if non_compilable_metrics:
+    if model_loader is None:
+      raise ValueError(
+          'a model_loader is required for computing non-compilable metrics '
+          '(i.e. metrics that cannot be re-created from their configs): '
+          'metrics={}'.format(non_compilable_metrics))
+    metric_keys, metric_names, loss_names = _metric_keys_and_names(
+        non_compilable_metrics, model_name, sub_key)
     computations.append(
         metric_types.MetricComputation(
-            keys=metric_keys,
+            keys=[k for keys in metric_keys.values() for k in keys],
             preprocessor=None,
-            combiner=_NonCompilableMetricsCombiner(model_loader, sub_key,
-                                                   desired_batch_size)))
+            combiner=_NonCompilableMetricsCombiner(
+                model_loader, metric_keys, metric_names, loss_names, sub_key,
+                class_weights, desired_batch_size)))
 
   return computations
 
@@ -243,8 +258,137 @@ def _separate_compilable_metrics(
 ) -> Tuple[Dict[Optional[Text], List[_TFMetricOrLoss]], Dict[
     Optional[Text], List[_TFMetricOrLoss]]]:
   """Separates the compilable metrics from non-compilable metrics."""
-  # TODO(mdreves): Add support once compilable flag added to keras metrics
-  return metrics, {}
+  compilable_metrics = {}
+  non_compilable_metrics = {}
+  for output_name, metrics_list in metrics.items():
+    for metric in metrics_list:
+      if _is_compilable(metric):
+        separated = compilable_metrics
+      else:
+        separated = non_compilable_metrics
+      if output_name not in separated:
+        separated[output_name] = []
+      separated[output_name].append(metric)
+  return compilable_metrics, non_compilable_metrics
+
+
+def _is_compilable(metric: _TFMetricOrLoss) -> bool:
+  """Returns true if the metric can be re-created from its config.
+
+  Metrics are re-created (on the workers) by deserializing their configs, so
+  custom metric classes must be able to re-create the metric from the config
+  returned by get_config (e.g. they cannot have constructor args that are not
+  part of the config). Custom classes that cannot be imported on the workers
+  are passed along with the configs (see _custom_objects).
+
+  Args:
+    metric: Metric or loss.
+  """
+  cls = metric.__class__
+  if (cls.__module__.endswith('keras.metrics') or
+      cls.__module__.endswith('keras.losses')):
+    return True
+  try:
+    cls.from_config(metric.get_config())
+  except Exception:  # pylint: disable=broad-except
+    return False
+  return True
+
+
+def _is_importable(cls: Type[Any]) -> bool:
+  """Returns true if the class can be imported by name on the workers."""
+  # The __main__ module of the workers is not the module the class was defined
+  # in.
+  if cls.__module__ == '__main__':
+    return False
+  try:
+    return getattr(importlib.import_module(cls.__module__), cls.__name__,
+                   None) is cls
+  except ImportError:
+    return False
+
+
+def _loss_name(loss: Any) -> Text:
+  return getattr(loss, 'name', None) or getattr(loss, '__name__', '')
+
+
+def _find_model_metrics(model: tf.keras.models.Model, output_name: Text,
+                        names: List[Text]) -> List[tf.keras.metrics.Metric]:
+  """Returns the metrics attached to the model with the given names.
+
+  Keras prefixes the names of the metrics of multi-output models with the name
+  of their output (e.g. '<output_name>_<name>') so that metrics attached to
+  different outputs can share a name. The prefixed name is looked up first.
+
+  Args:
+    model: Keras model.
+    output_name: Output name.
+    names: Names of the metrics.
+
+  Raises:
+    ValueError: If a metric is not attached to the model or if more than one
+      metric attached to the model matches its name.
+  """
+  model_metrics = model.metrics
+  if isinstance(model_metrics, dict):
+    model_metrics = model_metrics.get(output_name, [])
+  by_name = collections.defaultdict(list)
+  for metric in model_metrics:
+    by_name[metric.name].append(metric)
+  found = []
+  missing = []
+  for name in names:
+    matches = None
+    if output_name:
+      matches = by_name.get('{}_{}'.format(output_name, name))
+    matches = matches or by_name.get(name)
+    if not matches:
+      missing.append(name)
+    elif len(matches) > 1:
+      raise ValueError(
+          'more than one metric named "{}" is attached to the model and it is '
+          'ambiguous which one belongs to output_name "{}": metrics={}'.format(
+              name, output_name, matches))
+    else:
+      found.append(matches[0])
+  if missing:
+    raise ValueError(
+        'non-compilable metrics must be attached to the model: metrics {} '
+        'not found in model.metrics for output_name "{}"'.format(
+            missing, output_name))
+  return found
+
+
+def _model_losses(model: tf.keras.models.Model, output_name: Text) -> List[Any]:
+  """Returns the losses passed to model.compile for the given output."""
+  losses = getattr(model, 'loss', None)
+  if losses is None:
+    return []
+  if isinstance(losses, dict):
+    losses = losses.get(output_name, [])
+  elif isinstance(losses, (list, tuple)) and output_name:
+    # Lists of losses are ordered the same as the model outputs.
+    output_names = list(getattr(model, 'output_names', None) or [])
+    if output_name in output_names and len(losses) == len(output_names):
+      losses = [losses[output_names.index(output_name)]]
+    else:
+      losses = []
+  if not isinstance(losses, (list, tuple)):
+    losses = [losses]
+  return [tf.keras.losses.get(l) if isinstance(l, str) else l for l in losses]
+
+
+def _find_model_losses(model: tf.keras.models.Model, output_name: Text,
+                       names: List[Text]) -> List[Any]:
+  """Returns the loss functions attached to the model with the given names."""
+  by_name = {_loss_name(l): l for l in _model_losses(model, output_name)}
+  missing = [n for n in names if n not in by_name]
+  if missing:
+    raise ValueError(
+        'non-compilable losses must be attached to the model: losses {} not '
+        'found in model.loss for output_name "{}"'.format(
+            missing, output_name))
+  return [by_name[n] for n in names]
 
 
 def _separate_confusion_matrix_metrics(
@@ -331,6 +475,53 @@ def _metric_keys_and_configs(
   return metric_keys, metric_configs, loss_configs
 
 
+def _metric_keys_and_names(
+    metrics: Dict[Text, List[_TFMetricOrLoss]], model_name: Text,
+    sub_key: Optional[metric_types.SubKey]
+) -> Tuple[Dict[Text, List[metric_types.MetricKey]], Dict[Text, List[Text]],
+           Dict[Text, List[Text]]]:
+  """Returns the metric keys, metric names, and loss names for metrics.
+
+  Args:
+    metrics: Metrics and losses keyed by output name.
+    model_name: Model name.
+    sub_key: Sub key.
+
+  Returns:
+    Tuple of (metric_keys, metric_names, loss_names) keyed by output name. The
+    metric keys for an output are ordered with the keys for the metrics first
+    followed by the keys for the losses.
+  """
+  metric_keys = {}
+  metric_names = {}
+  loss_names = {}
+  for output_name, metrics_list in metrics.items():
+    metric_names[output_name] = []
+    loss_names[output_name] = []
+    loss_keys = []
+    metric_keys[output_name] = []
+    for metric in metrics_list:
+      if isinstance(metric, tf.keras.metrics.Metric):
+        metric_names[output_name].append(metric.name)
+        metric_keys[output_name].append(
+            metric_types.MetricKey(
+                name=metric.name,
+                model_name=model_name,
+                output_name=output_name,
+                sub_key=_verify_and_update_sub_key(model_name, output_name,
+                                                   sub_key, metric)))
+      else:
+        loss_names[output_name].append(_loss_name(metric))
+        loss_keys.append(
+            metric_types.MetricKey(
+                name=_loss_name(metric),
+                model_name=model_name,
+                output_name=output_name,
+                sub_key=sub_key))
+    metric_keys[output_name].extend(loss_keys)
+  return metric_keys, metric_names, loss_names
+
+
 def _deserialize_metrics(
     metric_configs: List[Dict[Text, Any]]) -> List[tf.keras.metrics.Metric]:
   return [tf.keras.metrics.deserialize(c) for c in metric_configs]
@@ -342,23 +533,40 @@ def _deserialize_losses(
 
 
 def _custom_objects(
-    metrics: Dict[Text, List[tf.keras.metrics.Metric]]) -> Dict[Text, Any]:
+    metrics: Dict[Text, List[tf.keras.metrics.Metric]]
+) -> Dict[Text, Union[Text, Type[Any]]]:
+  """Returns the custom metric classes keyed by class name.
+
+  Classes that can be imported by name are stored as the name of their module
+  and are imported on the workers. Other classes (e.g. classes defined in
+  __main__ or within functions) are stored as is and are pickled along with the
+  combiner.
+
+  Args:
+    metrics: Metrics keyed by output name.
+  """
   custom_objects = {}
   for metric_list in metrics.values():
     for metric in metric_list:
-      if (not metric.__class__.__module__.endswith('keras.metrics') and
-          not metric.__class__.__module__.endswith('keras.losses')):
-        custom_objects[metric.__class__.__module__] = metric.__class__.__name__
+      cls = metric.__class__
+      if (not cls.__module__.endswith('keras.metrics') and
+          not cls.__module__.endswith('keras.losses')):
+        custom_objects[cls.__name__] = (
+            cls.__module__ if _is_importable(cls) else cls)
   return custom_objects
 
 
 def _load_custom_objects(
-    custom_objects: Dict[Text, Text]) -> Dict[Text, Type[Any]]:
+    custom_objects: Dict[Text, Union[Text, Type[Any]]]
+) -> Dict[Text, Type[Any]]:
   """Loads custom metric options."""
   loaded_custom_objects = {}
-  for module_name, class_name in custom_objects.items():
-    module = importlib.import_module(module_name)
-    loaded_custom_objects[class_name] = getattr(module, class_name)
+  for class_name, module_name_or_class in custom_objects.items():
+    if isinstance(module_name_or_class, type):
+      loaded_custom_objects[class_name] = module_name_or_class
+    else:
+      module = importlib.import_module(module_name_or_class)
+      loaded_custom_objects[class_name] = getattr(module, class_name)
   return loaded_custom_objects
 
 
@@ -488,49 +696,93 @@ class _CompilableMetricsAccumulator(object):
   """Accumulator for compilable metrics.
 
   Attributes:
-    inputs: Accumulated batch of inputs (max size of desired_batch_size). The
-      inputs are stored in a multi-dimensional list. The first dimension is used
-      to index the associated output (for single-output models this will only
-      have one item). The second dimension is used to store the args passed to
-      update_state (i.e. (y_true, y_pred, example_weight)). Batching is done on
-      the last dimension.
+    inputs: Preallocated buffers for the accumulated batch of inputs. The
+      buffers are stored in a list indexed by the associated output (for
+      single-output models this will only have one item). Each item is either
+      None (no buffers allocated yet) or a tuple of the arrays used to store the
+      args passed to update_state (i.e. (y_true, y_pred, example_weight)).
+      Batching is done on the first dimension which has a size equal to the
+      buffer capacity. Buffers are reused once the batch has been processed.
+    input_counts: Number of inputs stored in the buffers for each output.
     weights: Accumulated weights. The weights are stored in a multi-dimensional
       list where the first dimension is used to index the associated output (for
       single-output models this will only have one item). The second dimension
       is used to store the accumulated weights for each metric associated with
       the output dimension.
+    capacity: Number of inputs that can be stored per output.
   """
-  __slots__ = ['inputs', 'weights']
+  __slots__ = ['inputs', 'input_counts', 'weights', 'capacity']
 
-  def __init__(self, metric_counts: List[int]):
+  def __init__(self, metric_counts: List[int], capacity: int):
     """Initializes accumulator using a list of metric counts per output."""
-    # Inputs have shape (num_outputs, num_metrics, num_accumulated_inputs)
     self.inputs = [
-    ]  # type: List[Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]]
+    ]  # type: List[Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]]
+    self.input_counts = []  # type: List[int]
     # Weights have shape (num_outputs, num_metrics)
     self.weights = []  # type: List[List[Optional[np.ndarray]]]
+    self.capacity = capacity
     for output_metric_count in metric_counts:
-      self.inputs.append(([], [], []))
+      self.inputs.append(None)
+      self.input_counts.append(0)
       self.weights.append([None] * output_metric_count)
 
-  def len_inputs(self):
-    return len(self.inputs[0][0])
+  def __getstate__(self):
+    # Only the part of the buffers that is in use is serialized.
+    inputs = []
+    for buffers, count in zip(self.inputs, self.input_counts):
+      inputs.append(None if buffers is None else tuple(
+          b[:count] for b in buffers))
+    return (inputs, self.input_counts, self.weights, self.capacity)
+
+  def __setstate__(self, state):
+    self.inputs, self.input_counts, self.weights, self.capacity = state
+
+  def len_inputs(self) -> int:
+    return max(self.input_counts) if self.input_counts else 0
 
   def add_input(self, output_index: int, label: np.ndarray,
-                prediction: np.ndarray, example_weight: np.ndarray):
-    for i, v in enumerate((label, prediction, example_weight)):
-      self.inputs[output_index][i].append(v)
+                prediction: np.ndarray, example_weight: np.ndarray) -> bool:
+    """Adds input to the buffers for the given output.
+
+    Args:
+      output_index: Index of output.
+      label: Label.
+      prediction: Prediction.
+      example_weight: Example weight.
+
+    Returns:
+      False if the input was not added because the buffers are full or they
+      store values of a different shape or type. The inputs must be processed
+      and cleared before trying again.
+    """
+    values = (np.asarray(label), np.asarray(prediction),
+              np.asarray(example_weight))
+    count = self.input_counts[output_index]
+    buffers = self.inputs[output_index]
+    if buffers is None or not all(
+        b.shape[1:] == v.shape and b.dtype == v.dtype
+        for b, v in zip(buffers, values)) or len(buffers[0]) < self.capacity:
+      if count:
+        return False
+      buffers = tuple(
+          np.empty((self.capacity,) + v.shape, dtype=v.dtype) for v in values)
+      self.inputs[output_index] = buffers
+    elif count >= len(buffers[0]):
+      return False
+    for b, v in zip(buffers, values):
+      b[count] = v
+    self.input_counts[output_index] = count + 1
+    return True
 
   def get_inputs(
       self, output_index: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    return (np.array(self.inputs[output_index][0]),
-            np.array(self.inputs[output_index][1]),
-            np.array(self.inputs[output_index][2]))
+    count = self.input_counts[output_index]
+    labels, predictions, example_weights = self.inputs[output_index]
+    return (labels[:count], predictions[:count], example_weights[:count])
 
   def clear_inputs(self):
     for output_index in range(len(self.inputs)):
-      for i in (0, 1, 2):
-        del self.inputs[output_index][i][:]
+      self.input_counts[output_index] = 0
 
   def add_weights(self, output_index: int, metric_index: int,
                   weights: np.ndarray):
@@ -538,21 +790,90 @@ class _CompilableMetricsAccumulator(object):
     if cur_weights is None:
       self.weights[output_index][metric_index] = weights
     else:
-      self.weights[output_index][metric_index] = np.add(cur_weights, weights)
+      self.weights[output_index][metric_index] = [
+          np.add(c, w) for c, w in zip(cur_weights, weights)
+      ]
 
   def get_weights(self, output_index: int,
                   metric_index: int) -> Optional[np.ndarray]:
     return self.weights[output_index][metric_index]
 
 
+def _compiled_update_fn(
+    metrics: List[tf.keras.metrics.Metric]
+) -> Callable[[np.ndarray, np.ndarray, np.ndarray], List[List[tf.Tensor]]]:
+  """Returns tf.function that computes the weights of metrics for a batch.
+
+  The function resets each metric (keras metrics reset all their weights to
+  zero), updates it with the batch and returns the resulting weights. All the
+  metrics are updated by a single call to avoid dispatching the ops of each
+  metric eagerly.
+
+  Args:
+    metrics: Metrics to update.
+  """
+
+  def update(labels, predictions, example_weights):
+    weights = []
+    for metric in metrics:
+      for weight in metric.weights:
+        weight.assign(tf.zeros_like(weight))
+      metric.update_state(labels, predictions, example_weights)
+      weights.append([tf.identity(weight) for weight in metric.weights])
+    return weights
+
+  return tf.function(update, experimental_relax_shapes=True)
+
+
+def _batch_weights(
+    metrics: List[tf.keras.metrics.Metric],
+    update_fns: Dict[Text, Optional[Callable]], output_name: Text,
+    inputs: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> List[List[np.ndarray]]:
+  """Returns the weights of each metric computed from a batch of inputs.
+
+  Args:
+    metrics: Metrics associated with the output.
+    update_fns: Compiled update functions keyed by output name. If the compiled
+      function fails, it is replaced by None and the metrics are updated
+      eagerly from then on.
+    output_name: Output name.
+    inputs: Batch of (labels, predictions, example_weights).
+  """
+  update_fn = update_fns[output_name]
+  if update_fn is not None:
+    try:
+      return [[w.numpy() for w in weights] for weights in update_fn(*inputs)]
+    except Exception as e:  # pylint: disable=broad-except
+      tf.compat.v1.logging.warning(
+          'unable to compile the update of metrics for output "%s", the '
+          'metrics will be updated eagerly instead: %s', output_name, e)
+      update_fns[output_name] = None
+  weights = []
+  for metric in metrics:
+    metric.reset_states()
+    metric.update_state(*inputs)
+    weights.append(metric.get_weights())
+  return weights
+
+
 class _CompilableMetricsCombiner(beam.CombineFn):
-  """Combines compilable metric weights and computes result."""
+  """Combines compilable metric weights and computes result.
+
+  Inputs are stored in preallocated buffers (one set per output) and processed
+  once batch_size inputs have been added. By default the metrics associated with
+  an output are updated using a single compiled tf.function call per batch. If
+  the metrics cannot be compiled, the metrics for that output are updated
+  eagerly one at a time instead.
+  """
 
-  def __init__(self, metric_configs: Dict[Text, List[Dict[Text, Any]]],
+  def __init__(self,
+               metric_configs: Dict[Text, List[Dict[Text, Any]]],
                loss_configs: Dict[Text, List[Dict[Text, Any]]],
-               custom_objects: Dict[Text, Type[Any]],
+               custom_objects: Dict[Text, Union[Text, Type[Any]]],
                sub_key: Optional[metric_types.SubKey],
-               class_weights: Dict[int, float], batch_size: int):
+               class_weights: Dict[int, float],
+               batch_size: int,
+               compile_update: bool = True):
     # Use parallel lists to store output_names and configs to guarantee
     # consistent ordering and for natural alignment with the accumulator where
     # lists are used instead of dicts for efficency.
@@ -563,11 +884,26 @@ class _CompilableMetricsCombiner(beam.CombineFn):
     self._sub_key = sub_key
     self._class_weights = class_weights
     self._batch_size = batch_size
+    # The use of class_weights means that micro averaging is being used. When
+    # micro averaging is being used, flatten should be set to True so that
+    # each class is treated as though it was an independent example.
+    self._adapters = [
+        metric_util.LabelPredictionExampleWeightAdapter(
+            output_name=output_name,
+            sub_key=sub_key,
+            class_weights=class_weights,
+            flatten=class_weights is not None)
+        for output_name in self._output_names
+    ]
+    self._compile_update = compile_update
     self._metrics = None  # type: Dict[Text, List[tf.keras.metrics.Metric]]
+    # Compiled update functions per output (None if updates are done eagerly).
+    self._update_fns = None  # type: Dict[Text, Optional[Callable]]
 
   def _setup_if_needed(self):
     if self._metrics is None:
       self._metrics = {}
+      self._update_fns = {}
       with tf.keras.utils.custom_object_scope(
           _load_custom_objects(self._custom_objects)):
         for i, output_name in enumerate(self._output_names):
@@ -575,40 +911,41 @@ class _CompilableMetricsCombiner(beam.CombineFn):
               _deserialize_metrics(self._metric_configs[i]))
           for loss in _deserialize_losses(self._loss_configs[i]):
             self._metrics[output_name].append(_LossMetric(loss))
+          self._update_fns[output_name] = (
+              _compiled_update_fn(self._metrics[output_name])
+              if self._compile_update else None)
 
   def _process_batch(self, accumulator: _CompilableMetricsAccumulator):
     self._setup_if_needed()
     if accumulator.len_inputs() == 0:
       return
     for output_index, output_name in enumerate(self._output_names):
+      if not accumulator.input_counts[output_index]:
+        continue
       inputs = accumulator.get_inputs(output_index)
-      for metric_index, metric in enumerate(self._metrics[output_name]):
-        metric.reset_states()
-        metric.update_state(*inputs)
-        accumulator.add_weights(output_index, metric_index,
-                                metric.get_weights())
+      for metric_index, weights in enumerate(
+          _batch_weights(self._metrics[output_name], self._update_fns,
+                         output_name, inputs)):
+        accumulator.add_weights(output_index, metric_index, weights)
     accumulator.clear_inputs()
 
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return coders.AccumulatorCoder(_CompilableMetricsAccumulator)
+
   def create_accumulator(self) -> _CompilableMetricsAccumulator:
     configs = zip(self._metric_configs, self._loss_configs)
-    return _CompilableMetricsAccumulator([len(m) + len(l) for m, l in configs])
+    return _CompilableMetricsAccumulator([len(m) + len(l) for m, l in configs],
+                                         self._batch_size)
 
   def add_input(
       self, accumulator: _CompilableMetricsAccumulator,
       element: metric_types.StandardMetricInputs
   ) -> _CompilableMetricsAccumulator:
-    for i, output_name in enumerate(self._output_names):
-      # The use of class_weights means that micro averaging is being used. When
-      # micro averaging is being used, flatten should be set to True so that
-      # each class is treated as though it was an independent example.
-      for label, prediction, example_weight in (
-          metric_util.to_label_prediction_example_weight(
-              element,
-              output_name=output_name,
-              sub_key=self._sub_key,
-              class_weights=self._class_weights,
-              flatten=self._class_weights is not None)):
-        accumulator.add_input(i, label, prediction, example_weight)
+    for i, adapter in enumerate(self._adapters):
+      for label, prediction, example_weight in adapter(element):
+        if not accumulator.add_input(i, label, prediction, example_weight):
+          self._process_batch(accumulator)
+          accumulator.add_input(i, label, prediction, example_weight)
     if accumulator.len_inputs() >= self._batch_size:
       self._process_batch(accumulator)
     return accumulator
@@ -622,7 +959,7 @@ class _CompilableMetricsCombiner(beam.CombineFn):
       self._process_batch(accumulator)
       # Merge the weights
       for output_index in range(len(self._output_names)):
-        for metric_index in range(len(self._metric_configs[output_index])):
+        for metric_index in range(len(accumulator.weights[output_index])):
           weights = accumulator.get_weights(output_index, metric_index)
           if weights is None:
             # It is possible for beam to create an accumulator but pass no
@@ -650,39 +987,141 @@ class _CompilableMetricsCombiner(beam.CombineFn):
     return result
 
 
-class _NonCompilableMetricsAccumulator(object):
-  pass
+class _NonCompilableMetricsAccumulator(_CompilableMetricsAccumulator):
+  """Accumulator for non-compilable metrics.
+
+  The inputs and weights are stored the same way as for compilable metrics.
+  """
+  __slots__ = []
 
 
 class _NonCompilableMetricsCombiner(model_util.CombineFnWithModels):
-  """Combines non-compilable metric weights and computes result."""
+  """Combines non-compilable metric weights and computes result.
 
-  def __init__(self, model_loader: types.ModelLoader,
-               sub_key: Optional[metric_types.SubKey], batch_size: int):
+  Non-compilable metrics (and losses) cannot be re-created from their configs
+  so the metric objects attached to the keras model loaded via the model_loader
+  are used instead. The model is shared by all the combiners in the process so
+  the metrics are only updated while holding a lock. Other than that, inputs
+  are batched and weights are merged the same way as for compilable metrics.
+  """
+
+  def __init__(self,
+               model_loader: types.ModelLoader,
+               metric_keys: Dict[Text, List[metric_types.MetricKey]],
+               metric_names: Dict[Text, List[Text]],
+               loss_names: Dict[Text, List[Text]],
+               sub_key: Optional[metric_types.SubKey],
+               class_weights: Optional[Dict[int, float]],
+               batch_size: int,
+               compile_update: bool = True):
     super(_NonCompilableMetricsCombiner, self).__init__({'': model_loader})
+    # Use parallel lists to store output_names, keys, and names for natural
+    # alignment with the accumulator.
+    self._output_names = sorted(metric_names.keys())
+    self._metric_keys = [metric_keys[n] for n in self._output_names]
+    self._metric_names = [metric_names[n] for n in self._output_names]
+    self._loss_names = [loss_names[n] for n in self._output_names]
     self._sub_key = sub_key
     self._batch_size = batch_size
+    self._adapters = [
+        metric_util.LabelPredictionExampleWeightAdapter(
+            output_name=output_name,
+            sub_key=sub_key,
+            class_weights=class_weights,
+            flatten=class_weights is not None)
+        for output_name in self._output_names
+    ]
+    self._compile_update = compile_update
+    self._metrics = None  # type: Dict[Text, List[tf.keras.metrics.Metric]]
+    self._update_fns = None  # type: Dict[Text, Optional[Callable]]
 
   def _setup_if_needed(self):
     super(_NonCompilableMetricsCombiner, self)._setup_if_needed()
-    raise NotImplementedError('not implemented')
+    if self._metrics is None:
+      model = self._loaded_models[''].keras_model
+      if model is None:
+        raise ValueError('non-compilable metrics can only be computed using a '
+                         'keras model: metric_names={}'.format(
+                             self._metric_names))
+      metrics = {}
+      update_fns = {}
+      for i, output_name in enumerate(self._output_names):
+        metrics[output_name] = (
+            _find_model_metrics(model, output_name, self._metric_names[i]) + [
+                _LossMetric(loss) for loss in _find_model_losses(
+                    model, output_name, self._loss_names[i])
+            ])
+        update_fns[output_name] = (
+            _compiled_update_fn(metrics[output_name])
+            if self._compile_update else None)
+      self._update_fns = update_fns
+      self._metrics = metrics
 
   def _process_batch(self, accumulator: _NonCompilableMetricsAccumulator):
     self._setup_if_needed()
-    raise NotImplementedError('not implemented')
+    if accumulator.len_inputs() == 0:
+      return
+    with _MODEL_METRICS_LOCK:
+      for output_index, output_name in enumerate(self._output_names):
+        if not accumulator.input_counts[output_index]:
+          continue
+        inputs = accumulator.get_inputs(output_index)
+        for metric_index, weights in enumerate(
+            _batch_weights(self._metrics[output_name], self._update_fns,
+                           output_name, inputs)):
+          accumulator.add_weights(output_index, metric_index, weights)
+    accumulator.clear_inputs()
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return coders.AccumulatorCoder(_NonCompilableMetricsAccumulator)
 
   def create_accumulator(self) -> _NonCompilableMetricsAccumulator:
-    raise NotImplementedError('not implemented')
+    names = zip(self._metric_names, self._loss_names)
+    return _NonCompilableMetricsAccumulator([len(m) + len(l) for m, l in names],
+                                            self._batch_size)
 
-  def add_input(self, accumulator: _NonCompilableMetricsAccumulator,
-                element: Any) -> _NonCompilableMetricsAccumulator:
-    raise NotImplementedError('not implemented')
+  def add_input(
+      self, accumulator: _NonCompilableMetricsAccumulator,
+      element: metric_types.StandardMetricInputs
+  ) -> _NonCompilableMetricsAccumulator:
+    for i, adapter in enumerate(self._adapters):
+      for label, prediction, example_weight in adapter(element):
+        if not accumulator.add_input(i, label, prediction, example_weight):
+          self._process_batch(accumulator)
+          accumulator.add_input(i, label, prediction, example_weight)
+    if accumulator.len_inputs() >= self._batch_size:
+      self._process_batch(accumulator)
+    return accumulator
 
   def merge_accumulators(
       self, accumulators: List[_NonCompilableMetricsAccumulator]
   ) -> _NonCompilableMetricsAccumulator:
-    raise NotImplementedError('not implemented')
+    result = self.create_accumulator()
+    for accumulator in accumulators:
+      # Finish processing last batch
+      self._process_batch(accumulator)
+      # Merge the weights
+      for output_index in range(len(self._output_names)):
+        for metric_index in range(len(accumulator.weights[output_index])):
+          weights = accumulator.get_weights(output_index, metric_index)
+          if weights is None:
+            continue
+          result.add_weights(output_index, metric_index, weights)
+    return result
 
-  def extract_output(self,
-                     accumulator: _NonCompilableMetricsAccumulator) -> Any:
-    raise NotImplementedError('not implemented')
+  def extract_output(
+      self, accumulator: _NonCompilableMetricsAccumulator
+  ) -> Dict[metric_types.MetricKey, Any]:
+    self._process_batch(accumulator)
+    result = {}
+    with _MODEL_METRICS_LOCK:
+      for output_index, output_name in enumerate(self._output_names):
+        for metric_index, metric in enumerate(self._metrics[output_name]):
+          key = self._metric_keys[output_index][metric_index]
+          weights = accumulator.get_weights(output_index, metric_index)
+          if weights is not None:
+            metric.set_weights(weights)
+          else:
+            metric.reset_states()
+          result[key] = metric.result().numpy()
+    return result
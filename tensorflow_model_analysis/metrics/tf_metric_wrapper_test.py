@@ -20,9 +20,11 @@ from __future__ import division
 from __future__ import print_function
 
 import os.path
+import pickle
 
 from absl.testing import parameterized
 import apache_beam as beam
+from apache_beam.internal import pickler
 from apache_beam.testing import util
 import numpy as np
 import tensorflow as tf
@@ -621,6 +623,206 @@ class NonConfusionMatrixMetricsTest(testutil.TensorflowModelAnalysisTest):
     mse_key = metric_types.MetricKey(name='mse')
     self.assertDictElementsAlmostEqual(got_metrics, {mse_key: 0.1875})
 
+  def testCompiledAndEagerUpdatesAgree(self):
+    examples = []
+    for label, prediction, example_weight in ((0.0, 0.0, 1.0), (0.0, 0.5, 2.0),
+                                              (1.0, 0.3, 1.0), (1.0, 0.9, 0.5),
+                                              (1.0, 0.5, 0.0)):
+      examples.append(
+          metric_types.StandardMetricInputs(
+              np.array([label]), np.array([prediction]),
+              np.array([example_weight])))
+
+    results = []
+    for compile_update in (True, False):
+      combiner = tf_metric_wrapper._CompilableMetricsCombiner(
+          metric_configs={
+              '': [
+                  tf.keras.metrics.serialize(
+                      tf.keras.metrics.MeanSquaredError(name='mse')),
+                  tf.keras.metrics.serialize(
+                      tf.keras.metrics.BinaryAccuracy(name='accuracy'))
+              ]
+          },
+          loss_configs={
+              '': [
+                  tf.keras.losses.serialize(
+                      tf.keras.losses.BinaryCrossentropy(name='loss'))
+              ]
+          },
+          custom_objects={},
+          sub_key=None,
+          class_weights=None,
+          batch_size=2,
+          compile_update=compile_update)
+      accumulator = combiner.create_accumulator()
+      for example in examples:
+        accumulator = combiner.add_input(accumulator, example)
+      results.append(
+          combiner.extract_output(combiner.merge_accumulators([accumulator])))
+
+    self.assertLen(results[0], 3)
+    self.assertDictElementsAlmostEqual(results[0], results[1])
+
+  def testAccumulatorOnlySerializesBufferedInputs(self):
+    accumulator = tf_metric_wrapper._CompilableMetricsAccumulator([1],
+                                                                  capacity=10)
+    self.assertTrue(
+        accumulator.add_input(0, np.array([1.0]), np.array([0.5]),
+                              np.array([1.0])))
+    # Inputs with a different shape require the batch to be processed first.
+    self.assertFalse(
+        accumulator.add_input(0, np.array([1.0, 0.0]), np.array([0.5, 0.5]),
+                              np.array([1.0])))
+    self.assertEqual(accumulator.len_inputs(), 1)
+
+    copied = pickle.loads(pickle.dumps(accumulator))
+    self.assertEqual(copied.len_inputs(), 1)
+    labels, predictions, example_weights = copied.get_inputs(0)
+    self.assertAllClose(labels, np.array([[1.0]]))
+    self.assertAllClose(predictions, np.array([[0.5]]))
+    self.assertAllClose(example_weights, np.array([[1.0]]))
+
+
+class NonCompilableMetricsTest(testutil.TensorflowModelAnalysisTest):
+
+  def testMetricAttachedToModel(self):
+
+    # The scale is not part of the config so the metric cannot be re-created
+    # from its config.
+    class _LocalMetric(tf.keras.metrics.Mean):
+
+      def __init__(self, scale, name='local', dtype=None):
+        super(_LocalMetric, self).__init__(name=name, dtype=dtype)
+        self.scale = scale
+
+      def update_state(self, y_true, y_pred, sample_weight):
+        return super(_LocalMetric, self).update_state(
+            y_pred * self.scale, sample_weight=sample_weight)
+
+    dummy_layer = tf.keras.layers.Input(shape=(1,))
+    model = tf.keras.models.Model([dummy_layer], [dummy_layer])
+    model.compile(
+        loss=tf.keras.losses.BinaryCrossentropy(),
+        metrics=[_LocalMetric(scale=1.0)])
+    model_loader = types.ModelLoader(
+        construct_fn=lambda _: lambda: types.ModelTypes(keras_model=model))
+
+    options = config.Options()
+    options.desired_batch_size.value = 2
+    computations = tf_metric_wrapper.tf_metric_computations(
+        [_LocalMetric(scale=1.0)],
+        config.EvalConfig(options=options),
+        model_loader=model_loader)
+    non_compilable = [
+        c for c in computations if isinstance(
+            c.combiner, tf_metric_wrapper._NonCompilableMetricsCombiner)
+    ]
+    self.assertLen(non_compilable, 1)
+    computation = non_compilable[0]
+    local_key = metric_types.MetricKey(name='local')
+    self.assertEqual(computation.keys, [local_key])
+
+    combiner_inputs = []
+    for prediction, example_weight in ((0.0, 1.0), (0.5, 1.0), (0.3, 2.0),
+                                       (0.9, 1.0), (0.5, 0.0)):
+      combiner_inputs.append(
+          metric_types.StandardMetricInputs(
+              np.array([1.0]), np.array([prediction]),
+              np.array([example_weight])))
+    acc1 = computation.combiner.create_accumulator()
+    for combiner_input in combiner_inputs[:3]:
+      acc1 = computation.combiner.add_input(acc1, combiner_input)
+    acc2 = computation.combiner.create_accumulator()
+    for combiner_input in combiner_inputs[3:]:
+      acc2 = computation.combiner.add_input(acc2, combiner_input)
+    acc = computation.combiner.merge_accumulators([acc1, acc2])
+
+    got_metrics = computation.combiner.extract_output(acc)
+    self.assertDictElementsAlmostEqual(
+        got_metrics,
+        {local_key: (0.0 + 0.5 + 0.3 * 2.0 + 0.9) / (1.0 + 1.0 + 2.0 + 1.0)})
+
+  def testRaisesErrorWithoutModelLoader(self):
+
+    class _LocalMetric(tf.keras.metrics.Mean):
+
+      def __init__(self, scale, name='local', dtype=None):
+        super(_LocalMetric, self).__init__(name=name, dtype=dtype)
+        self.scale = scale
+
+    with self.assertRaises(ValueError):
+      tf_metric_wrapper.tf_metric_computations([_LocalMetric(scale=1.0)])
+
+  def testLocalMetricWithConfigIsCompilable(self):
+
+    # Classes that cannot be imported by name are pickled with the combiner.
+    class _LocalMetric(tf.keras.metrics.Mean):
+      pass
+
+    computations = tf_metric_wrapper.tf_metric_computations(
+        [_LocalMetric(name='local')])
+    self.assertLen(computations, 1)
+    combiner = pickler.loads(pickler.dumps(computations[0].combiner))
+    self.assertIsInstance(combiner,
+                          tf_metric_wrapper._CompilableMetricsCombiner)
+
+    accumulator = combiner.create_accumulator()
+    for prediction, example_weight in ((0.2, 1.0), (0.8, 1.0), (0.5, 2.0)):
+      accumulator = combiner.add_input(
+          accumulator,
+          metric_types.StandardMetricInputs(
+              np.array([0.0]), np.array([prediction]),
+              np.array([example_weight])))
+    got_metrics = combiner.extract_output(accumulator)
+    self.assertDictElementsAlmostEqual(
+        got_metrics, {
+            metric_types.MetricKey(name='local'):
+                (0.2 + 0.8 + 2 * 0.5) / (1.0 + 1.0 + 2.0)
+        })
+
+  def testFindModelMetricsForOutputsWithSameMetricName(self):
+
+    class _Model(object):
+      metrics = [
+          tf.keras.metrics.Mean(name='output_1_local'),
+          tf.keras.metrics.Mean(name='output_2_local'),
+      ]
+
+    model = _Model()
+    self.assertEqual(
+        tf_metric_wrapper._find_model_metrics(model, 'output_1', ['local']),
+        model.metrics[:1])
+    self.assertEqual(
+        tf_metric_wrapper._find_model_metrics(model, 'output_2', ['local']),
+        model.metrics[1:])
+
+    # Metrics with the same name that are not prefixed are ambiguous.
+    model.metrics = [
+        tf.keras.metrics.Mean(name='local'),
+        tf.keras.metrics.Mean(name='local'),
+    ]
+    with self.assertRaises(ValueError):
+      tf_metric_wrapper._find_model_metrics(model, 'output_1', ['local'])
+
+  def testFindModelLosses(self):
+    loss = tf.keras.losses.BinaryCrossentropy(name='bce')
+
+    class _Model(object):
+      output_names = ['output_1', 'output_2']
+
+    model = _Model()
+    model.loss = {'output_1': loss, 'output_2': 'mse'}
+    self.assertEqual(
+        tf_metric_wrapper._find_model_losses(model, 'output_1', ['bce']),
+        [loss])
+    model.loss = ['mse', loss]
+    self.assertEqual(
+        tf_metric_wrapper._find_model_losses(model, 'output_2', ['bce']),
+        [loss])
+    with self.assertRaises(ValueError):
+      tf_metric_wrapper._find_model_losses(model, 'output_1', ['bce'])
+
 
 class MixedMetricsTest(testutil.TensorflowModelAnalysisTest):
 
@@ -23,8 +23,9 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
-from typing import Any, Dict, List, Optional, Text
+from typing import Any, Dict, Iterable, List, Optional, Text
 import apache_beam as beam
+import numpy as np
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis.metrics import metric_types
 from tensorflow_model_analysis.metrics import metric_util
@@ -216,6 +217,11 @@ class _TJURDiscriminationCombiner(beam.CombineFn):
     self._key = key
     self._eval_config = eval_config
     self._class_weights = class_weights
+    self._adapter = metric_util.LabelPredictionExampleWeightAdapter(
+        eval_config=eval_config,
+        model_name=key.model_name,
+        output_name=key.output_name,
+        class_weights=class_weights)
 
   def create_accumulator(self) -> _TJURDiscriminationAccumulator:
     return _TJURDiscriminationAccumulator()
@@ -224,23 +230,23 @@ class _TJURDiscriminationCombiner(beam.CombineFn):
       self, accumulator: _TJURDiscriminationAccumulator,
       element: metric_types.StandardMetricInputs
   ) -> _TJURDiscriminationAccumulator:
-    for label, prediction, example_weight in (
-        metric_util.to_label_prediction_example_weight(
-            element,
-            eval_config=self._eval_config,
-            model_name=self._key.model_name,
-            output_name=self._key.output_name,
-            class_weights=self._class_weights)):
-      label = float(label)
-      prediction = float(prediction)
-      example_weight = float(example_weight)
-      accumulator.total_negative_weighted_labels += ((1.0 - label) *
-                                                     example_weight)
-      accumulator.total_positive_weighted_labels += label * example_weight
-      accumulator.total_negative_weighted_predictions += ((1.0 - prediction) *
-                                                          example_weight)
-      accumulator.total_positive_weighted_predictions += (
-          prediction * example_weight)
+    return self.add_inputs(accumulator, [element])
+
+  def add_inputs(
+      self, accumulator: _TJURDiscriminationAccumulator,
+      elements: Iterable[metric_types.StandardMetricInputs]
+  ) -> _TJURDiscriminationAccumulator:
+    labels, predictions, example_weights = self._adapter.batch(elements)
+    labels = labels.astype(np.float64)
+    predictions = predictions.astype(np.float64)
+    accumulator.total_negative_weighted_labels += float(
+        np.dot(1.0 - labels, example_weights))
+    accumulator.total_positive_weighted_labels += float(
+        np.dot(labels, example_weights))
+    accumulator.total_negative_weighted_predictions += float(
+        np.dot(1.0 - predictions, example_weights))
+    accumulator.total_positive_weighted_predictions += float(
+        np.dot(predictions, example_weights))
     return accumulator
 
   def merge_accumulators(
@@ -17,6 +17,12 @@
 
 import collections
 import datetime
+import hashlib
+import os
+import threading
+import uuid
+import weakref
+
 import apache_beam as beam
 import tensorflow as tf
 from tensorflow_model_analysis import config
@@ -29,6 +35,22 @@ from typing import Any, Callable, Dict, List, Optional, Sequence, Text
 
 KERAS_INPUT_SUFFIX = '_input'
 
+# Names of the counters for the process-wide model registry and the on-disk
+# model cache.
+_MODEL_REGISTRY_HITS = 'model_registry_hits'
+_MODEL_REGISTRY_MISSES = 'model_registry_misses'
+_MODEL_DISK_CACHE_HITS = 'model_disk_cache_hits'
+_MODEL_DISK_CACHE_MISSES = 'model_disk_cache_misses'
+_MODEL_CACHE_EVENTS = (_MODEL_REGISTRY_HITS, _MODEL_REGISTRY_MISSES,
+                       _MODEL_DISK_CACHE_HITS, _MODEL_DISK_CACHE_MISSES)
+
+# Number of the most recently used models that the model registry keeps alive
+# when they are no longer referenced (e.g. between pipelines run in the same
+# process).
+_NUM_MODELS_TO_KEEP_ALIVE = 2
+
+_PREDICT_SIGNATURE_DEF_KEY = 'predict'
+
 
 def get_baseline_model_spec(
     eval_config: config.EvalConfig) -> Optional[config.ModelSpec]:
@@ -114,23 +136,256 @@ def rebatch_by_input_names(
   return inputs
 
 
+class _ModelRegistry(object):
+  """Process-wide registry of loaded models.
+
+  Models are keyed by their path, tags and load options. Stages that use
+  different shared handles for the same model (and pipelines run in the same
+  process) reuse the model loaded by the first of them instead of loading it
+  again. Models are held using weak references except for the most recently
+  used ones which are kept alive.
+  """
+
+  def __init__(self, num_models_to_keep_alive: int):
+    self._lock = threading.Lock()
+    self._models = weakref.WeakValueDictionary()
+    self._load_locks = {}
+    self._keep_alive = collections.deque(maxlen=num_models_to_keep_alive)
+    self._events = collections.Counter()
+
+  def get_or_load(
+      self, key: Any,
+      load_fn: Callable[[], types.ModelTypes]) -> types.ModelTypes:
+    """Returns the model registered under key, loading it if needed."""
+    with self._lock:
+      load_lock = self._load_locks.setdefault(key, threading.Lock())
+    # Loads of the same model are serialized so that concurrent callers wait
+    # for the first load to finish instead of loading the model again.
+    try:
+      with load_lock:
+        model = self._models.get(key)
+        if model is None:
+          self.record_event(_MODEL_REGISTRY_MISSES)
+          model = load_fn()
+          self._models[key] = model
+        else:
+          self.record_event(_MODEL_REGISTRY_HITS)
+    finally:
+      # Callers waiting on the lock already hold a reference to it and later
+      # callers find the loaded model, so the lock is only needed while
+      # loading.
+      with self._lock:
+        if self._load_locks.get(key) is load_lock:
+          del self._load_locks[key]
+    with self._lock:
+      for i, kept_alive in enumerate(self._keep_alive):
+        if kept_alive is model:
+          del self._keep_alive[i]
+          break
+      self._keep_alive.append(model)
+    return model
+
+  def record_event(self, name: Text) -> None:
+    with self._lock:
+      self._events[name] += 1
+
+  def pop_events(self) -> Dict[Text, int]:
+    """Returns the events recorded since the last call."""
+    with self._lock:
+      events = dict(self._events)
+      self._events.clear()
+    return events
+
+  def clear(self) -> None:
+    with self._lock:
+      self._models.clear()
+      self._load_locks.clear()
+      self._keep_alive.clear()
+      self._events.clear()
+
+
+_MODEL_REGISTRY = _ModelRegistry(_NUM_MODELS_TO_KEEP_ALIVE)
+
+
+def clear_model_registry() -> None:
+  """Clears the process-wide registry of loaded models."""
+  _MODEL_REGISTRY.clear()
+
+
+def _model_cache_counters() -> Dict[Text, Any]:
+  return {
+      name: beam.metrics.Metrics.counter(constants.METRICS_NAMESPACE, name)
+      for name in _MODEL_CACHE_EVENTS
+  }
+
+
+def _update_model_cache_counters(counters: Dict[Text, Any]) -> None:
+  # Events are recorded per process (Beam metrics are not supported during
+  # model loading), whichever DoFn runs next publishes them.
+  for name, count in _MODEL_REGISTRY.pop_events().items():
+    counters[name].inc(count)
+
+
+def _is_remote_path(path: Text) -> bool:
+  return '://' in path
+
+
+def _copy_dir(src: Text, dst: Text) -> None:
+  """Recursively copies directory src to dst."""
+  for dirname, _, filenames in tf.io.gfile.walk(src):
+    dst_dirname = os.path.join(dst, dirname[len(src):].lstrip('/'))
+    tf.io.gfile.makedirs(dst_dirname)
+    for filename in filenames:
+      tf.io.gfile.copy(
+          os.path.join(dirname, filename),
+          os.path.join(dst_dirname, filename),
+          overwrite=True)
+
+
+def _cached_model_path(model_path: Text, model_cache_dir: Text) -> Text:
+  """Returns path of a local copy of a remote model, copying it if needed.
+
+  The copy is keyed by the model path and the modification time of its saved
+  model proto so that a model overwritten in place is copied again. Local
+  model paths are returned as is.
+
+  Args:
+    model_path: Path to model.
+    model_cache_dir: Local directory to store copies of remote models in.
+  """
+  if not _is_remote_path(model_path) or _is_remote_path(model_cache_dir):
+    return model_path
+  fingerprint = model_path
+  for filename in ('saved_model.pb', 'saved_model.pbtxt'):
+    saved_model_file = os.path.join(model_path, filename)
+    if tf.io.gfile.exists(saved_model_file):
+      fingerprint += ':{}'.format(tf.io.gfile.stat(saved_model_file).mtime_nsec)
+      break
+  local_path = os.path.join(
+      model_cache_dir,
+      hashlib.sha256(fingerprint.encode('utf-8')).hexdigest())
+  if tf.io.gfile.exists(local_path):
+    _MODEL_REGISTRY.record_event(_MODEL_DISK_CACHE_HITS)
+    return local_path
+  _MODEL_REGISTRY.record_event(_MODEL_DISK_CACHE_MISSES)
+  # The model is copied to a temporary directory first so that other processes
+  # never see a partial copy.
+  tmp_path = '{}.tmp-{}'.format(local_path, uuid.uuid4().hex)
+  try:
+    _copy_dir(model_path, tmp_path)
+  except Exception:
+    if tf.io.gfile.exists(tmp_path):
+      tf.io.gfile.rmtree(tmp_path)
+    raise
+  try:
+    tf.io.gfile.rename(tmp_path, local_path)
+  except tf.errors.OpError:
+    if not tf.io.gfile.exists(local_path):
+      raise
+    # Another process finished copying the model first.
+    tf.io.gfile.rmtree(tmp_path)
+  return local_path
+
+
+def _synthetic_input(spec: tf.TensorSpec) -> tf.Tensor:
+  """Returns a synthetic input (batch of size 1) matching spec."""
+  if spec.shape.rank is None:
+    shape = [1]
+  else:
+    shape = [1 if dim is None else dim for dim in spec.shape.as_list()]
+  if spec.dtype == tf.string:
+    return tf.fill(shape, tf.train.Example().SerializeToString())
+  return tf.zeros(shape, dtype=spec.dtype)
+
+
+def _warmup_model(model: types.ModelTypes) -> None:
+  """Runs inference on synthetic inputs to warm up a loaded model.
+
+  String inputs are fed empty serialized tf.Examples and other inputs are fed
+  zeros. Warm-up is best effort, failures (e.g. for models that require
+  features to be set) are logged and ignored.
+
+  Args:
+    model: Loaded model.
+  """
+  try:
+    if model.eval_saved_model is not None:
+      model.eval_saved_model.predict_list(
+          [tf.train.Example().SerializeToString()])
+      return
+    signatures = None
+    if model.keras_model is not None:
+      signatures = getattr(model.keras_model, 'signatures', None)
+    elif model.saved_model is not None:
+      signatures = model.saved_model.signatures
+    if not signatures:
+      return
+    signature_key = tf.saved_model.DEFAULT_SERVING_SIGNATURE_DEF_KEY
+    if _PREDICT_SIGNATURE_DEF_KEY in signatures:
+      signature_key = _PREDICT_SIGNATURE_DEF_KEY
+    if signature_key not in signatures:
+      return
+    signature = signatures[signature_key]
+    args, kwargs = signature.structured_input_signature
+    signature(*[_synthetic_input(spec) for spec in args],
+              **{k: _synthetic_input(spec) for k, spec in kwargs.items()})
+  except Exception as e:  # pylint: disable=broad-except
+    tf.compat.v1.logging.warning('model warm-up failed: %s', e)
+
+
 def model_construct_fn(  # pylint: disable=invalid-name
     eval_saved_model_path: Optional[Text] = None,
     add_metrics_callbacks: Optional[List[types.AddMetricsCallbackType]] = None,
     include_default_metrics: Optional[bool] = None,
     additional_fetches: Optional[List[Text]] = None,
     blacklist_feature_fetches: Optional[List[Text]] = None,
-    tags: Optional[List[Text]] = None):
-  """Returns function for constructing shared ModelTypes."""
+    tags: Optional[List[Text]] = None,
+    warmup_model: bool = False,
+    model_cache_dir: Optional[Text] = None):
+  """Returns function for constructing shared ModelTypes.
+
+  Models are loaded through a process-wide registry so that all the stages
+  using the returned function (even with different shared handles) share the
+  same in-memory model.
+
+  Args:
+    eval_saved_model_path: Path to model.
+    add_metrics_callbacks: Optional callbacks for adding additional metrics to
+      the graph (EvalSavedModel only).
+    include_default_metrics: True to include the default metrics that are part
+      of the saved model graph (EvalSavedModel only).
+    additional_fetches: Prefixes of additional tensors to fetch
+      (EvalSavedModel only).
+    blacklist_feature_fetches: Features to exclude from the fetches
+      (EvalSavedModel only).
+    tags: Model tags (e.g. 'serve' for serving or 'eval' for EvalSavedModel).
+    warmup_model: True to run inference on synthetic inputs after the model is
+      loaded so that the first batch is not slowed down by lazy
+      initialization.
+    model_cache_dir: Optional local directory to copy remote models (e.g. on
+      GCS) into before loading them. Copies are reused by later loads,
+      including loads by other processes on the same machine.
+  """
   if tags is None:
     tags = [eval_constants.EVAL_TAG]
 
+  registry_key = (eval_saved_model_path, tuple(tags))
+  if eval_constants.EVAL_TAG in tags:
+    # The metric callbacks are added to the graph of the EvalSavedModel so the
+    # model is only shared by users passing the same callback objects.
+    registry_key += (include_default_metrics, tuple(additional_fetches or []),
+                     tuple(blacklist_feature_fetches or []),
+                     tuple(add_metrics_callbacks or []))
+
   def construct_fn(model_load_seconds_callback: Callable[[int], None]):
     """Thin wrapper for the actual construct to allow for load time metrics."""
 
-    def construct():  # pylint: disable=invalid-name
-      """Function for constructing shared ModelTypes."""
+    def load_model() -> types.ModelTypes:
+      """Loads ModelTypes."""
       start_time = datetime.datetime.now()
+      model_path = eval_saved_model_path
+      if model_cache_dir:
+        model_path = _cached_model_path(model_path, model_cache_dir)
       saved_model = None
       keras_model = None
       eval_saved_model = None
@@ -140,7 +395,7 @@ def model_construct_fn(  # pylint: disable=invalid-name
         tf.tpu.experimental.initialize_tpu_system()
       if eval_constants.EVAL_TAG in tags:
         eval_saved_model = load.EvalSavedModel(
-            eval_saved_model_path,
+            model_path,
             include_default_metrics,
             additional_fetches=additional_fetches,
             blacklist_feature_fetches=blacklist_feature_fetches,
@@ -152,7 +407,7 @@ def model_construct_fn(  # pylint: disable=invalid-name
         # TODO(b/141524386, b/141566408): TPU Inference is not supported
         # for Keras saved_model yet.
         try:
-          keras_model = tf.keras.models.load_model(eval_saved_model_path)
+          keras_model = tf.keras.models.load_model(model_path)
           # In some cases, tf.keras.models.load_model can successfully load a
           # saved_model but it won't actually be a keras model.
           if not isinstance(keras_model, tf.keras.models.Model):
@@ -161,13 +416,20 @@ def model_construct_fn(  # pylint: disable=invalid-name
           keras_model = None
         if keras_model is None:
           saved_model = tf.compat.v1.saved_model.load_v2(
-              eval_saved_model_path, tags=tags)
+              model_path, tags=tags)
       end_time = datetime.datetime.now()
       model_load_seconds_callback(int((end_time - start_time).total_seconds()))
-      return types.ModelTypes(
+      model = types.ModelTypes(
           saved_model=saved_model,
           keras_model=keras_model,
           eval_saved_model=eval_saved_model)
+      if warmup_model:
+        _warmup_model(model)
+      return model
+
+    def construct():  # pylint: disable=invalid-name
+      """Function for constructing shared ModelTypes."""
+      return _MODEL_REGISTRY.get_or_load(registry_key, load_model)
 
     return construct
 
@@ -184,6 +446,7 @@ class DoFnWithModels(beam.DoFn):
     self._model_load_seconds = None
     self._model_load_seconds_distribution = beam.metrics.Metrics.distribution(
         constants.METRICS_NAMESPACE, 'model_load_seconds')
+    self._model_cache_counters = _model_cache_counters()
 
   def _set_model_load_seconds(self, model_load_seconds):
     self._model_load_seconds = model_load_seconds
@@ -203,6 +466,7 @@ class DoFnWithModels(beam.DoFn):
     if self._model_load_seconds is not None:
       self._model_load_seconds_distribution.update(self._model_load_seconds)
       self._model_load_seconds = None
+    _update_model_cache_counters(self._model_cache_counters)
 
 
 @beam.typehints.with_input_types(beam.typehints.List[types.Extracts])
@@ -264,6 +528,7 @@ class CombineFnWithModels(beam.CombineFn):
     self._model_load_seconds = None
     self._model_load_seconds_distribution = beam.metrics.Metrics.distribution(
         constants.METRICS_NAMESPACE, 'model_load_seconds')
+    self._model_cache_counters = _model_cache_counters()
 
   def _set_model_load_seconds(self, model_load_seconds):
     self._model_load_seconds = model_load_seconds
@@ -280,3 +545,4 @@ class CombineFnWithModels(beam.CombineFn):
       if self._model_load_seconds is not None:
         self._model_load_seconds_distribution.update(self._model_load_seconds)
         self._model_load_seconds = None
+      _update_model_cache_counters(self._model_cache_counters)
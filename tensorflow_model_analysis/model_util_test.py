@@ -18,9 +18,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
 import numpy as np
 import tensorflow as tf
 from tensorflow_model_analysis import model_util
+from tensorflow_model_analysis import types
 
 
 class ModelUtilTest(tf.test.TestCase):
@@ -66,6 +69,110 @@ class ModelUtilTest(tf.test.TestCase):
     self.assertEqual(expected, got)
     self.assertNotIsInstance(got['a'][0], np.ndarray)
 
+  def testModelRegistryReusesModels(self):
+    registry = model_util._ModelRegistry(num_models_to_keep_alive=1)
+    loaded = []
+
+    def load_fn():
+      loaded.append(types.ModelTypes())
+      return loaded[-1]
+
+    model1 = registry.get_or_load(('path1', ('serve',)), load_fn)
+    model2 = registry.get_or_load(('path1', ('serve',)), load_fn)
+    model3 = registry.get_or_load(('path2', ('serve',)), load_fn)
+    self.assertIs(model1, model2)
+    self.assertIsNot(model1, model3)
+    self.assertLen(loaded, 2)
+    self.assertEqual(
+        registry.pop_events(), {
+            model_util._MODEL_REGISTRY_HITS: 1,
+            model_util._MODEL_REGISTRY_MISSES: 2
+        })
+    self.assertEqual(registry.pop_events(), {})
+    # Load locks are released once the models are loaded.
+    self.assertEmpty(registry._load_locks)
+
+    # Only model3 is kept alive once all the other references are gone.
+    del loaded[:], model1, model2
+    registry.get_or_load(('path1', ('serve',)), load_fn)
+    self.assertLen(loaded, 1)
+
+  def testModelConstructFnSharesModelsAcrossHandles(self):
+    model_util.clear_model_registry()
+    inputs = tf.keras.layers.Input(shape=(1,), name='input')
+    outputs = tf.keras.layers.Dense(1, activation=tf.nn.sigmoid)(inputs)
+    model = tf.keras.models.Model(inputs, outputs)
+    export_dir = self.get_temp_dir()
+    model.save(export_dir, save_format='tf')
+
+    load_seconds = []
+    loader1 = types.ModelLoader(
+        construct_fn=model_util.model_construct_fn(
+            eval_saved_model_path=export_dir,
+            tags=[tf.saved_model.SERVING],
+            warmup_model=True))
+    loader2 = types.ModelLoader(
+        construct_fn=model_util.model_construct_fn(
+            eval_saved_model_path=export_dir, tags=[tf.saved_model.SERVING]))
+    model1 = loader1.shared_handle.acquire(
+        loader1.construct_fn(load_seconds.append))
+    model2 = loader2.shared_handle.acquire(
+        loader2.construct_fn(load_seconds.append))
+    self.assertIsNotNone(model1.keras_model)
+    self.assertIs(model1, model2)
+    self.assertLen(load_seconds, 1)
+    self.assertEqual(
+        model_util._MODEL_REGISTRY.pop_events(), {
+            model_util._MODEL_REGISTRY_HITS: 1,
+            model_util._MODEL_REGISTRY_MISSES: 1
+        })
+    model_util.clear_model_registry()
+
+  def testModelRegistryReleasesLoadLockOnFailure(self):
+    registry = model_util._ModelRegistry(num_models_to_keep_alive=1)
+
+    def load_fn():
+      raise ValueError('load failed')
+
+    with self.assertRaises(ValueError):
+      registry.get_or_load(('path1', ('serve',)), load_fn)
+    self.assertEmpty(registry._load_locks)
+
+  def testCachedModelPath(self):
+    model_dir = os.path.join(self.get_temp_dir(), 'model')
+    tf.io.gfile.makedirs(os.path.join(model_dir, 'variables'))
+    for filename in ('saved_model.pb', 'variables/variables.index'):
+      with tf.io.gfile.GFile(os.path.join(model_dir, filename), 'w') as f:
+        f.write(filename)
+    cache_dir = os.path.join(self.get_temp_dir(), 'cache')
+    # Local models are not copied.
+    self.assertEqual(
+        model_util._cached_model_path(model_dir, cache_dir), model_dir)
+
+    copy_dir = os.path.join(cache_dir, 'copy')
+    model_util._copy_dir(model_dir, copy_dir)
+    with tf.io.gfile.GFile(
+        os.path.join(copy_dir, 'variables', 'variables.index')) as f:
+      self.assertEqual(f.read(), 'variables/variables.index')
+
+  def testCachedModelPathRemovesPartialCopy(self):
+    cache_dir = os.path.join(self.get_temp_dir(), 'partial_cache')
+    tf.io.gfile.makedirs(cache_dir)
+
+    def failing_copy_dir(src, dst):
+      del src  # Unused.
+      tf.io.gfile.makedirs(dst)
+      raise IOError('copy failed')
+
+    copy_dir = model_util._copy_dir
+    model_util._copy_dir = failing_copy_dir
+    try:
+      with self.assertRaises(IOError):
+        model_util._cached_model_path('ram://model', cache_dir)
+    finally:
+      model_util._copy_dir = copy_dir
+    self.assertEmpty(tf.io.gfile.listdir(cache_dir))
+
 
 if __name__ == '__main__':
   tf.test.main()
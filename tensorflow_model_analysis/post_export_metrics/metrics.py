@@ -19,6 +19,8 @@ from __future__ import division
 from __future__ import print_function
 
 # Standard Imports
+import functools
+
 import numpy as np
 import tensorflow as tf
 from tensorflow_model_analysis import types
@@ -275,6 +277,73 @@ def calibration_plot(predictions: types.TensorType,
   return value_op, update_op
 
 
+def precision_recall_at_k_batch_stats(
+    cutoffs: List[int], classes: np.ndarray, scores: np.ndarray,
+    labels: np.ndarray,
+    weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
+  """Compute precision/recall intermediate stats for a batch.
+
+  Args:
+    cutoffs: List containing the values for the `k` at which to compute the
+      precision and recall for. Use a value of `k` = 0 to indicate that all
+      predictions should be considered.
+    classes: Tensor containing class names. Should be a BATCH_SIZE x
+      NUM_CLASSES Tensor.
+    scores: Tensor containing the associated scores. Should be a BATCH_SIZE x
+      NUM_CLASSES Tensor.
+    labels: Tensor containing the true labels. Should be a rank-2 Tensor where
+      the first dimension is BATCH_SIZE. The second dimension can be anything.
+    weights: Weights for the associated exmaples. Should be a BATCH_SIZE
+      Tesnor.
+
+  Returns:
+    True positives, predicted positives, actual positives computed for the
+    batch of examples.
+
+  Raises:
+    ValueError: classes and scores have different shapes; or labels has
+     a different batch size from classes and scores
+  """
+
+  if classes.shape != scores.shape:
+    raise ValueError('classes and scores should have same shape, but got '
+                     '%s and %s' % (classes.shape, scores.shape))
+
+  num_cutoffs = len(cutoffs)
+  batch_size = classes.shape[0]
+  num_classes = classes.shape[1]
+  if labels.shape[0] != batch_size:
+    raise ValueError('labels should have the same batch size of %d, but got '
+                     '%d instead' % (batch_size, labels.shape[0]))
+
+  # Sort classes, by row, by their associated scores, in descending order of
+  # score.
+  sorted_classes = np.flip(
+      classes[np.arange(batch_size)[:, None],
+              np.argsort(scores)], axis=1)
+
+  true_positives = np.zeros(num_cutoffs, dtype=np.float64)
+  predicted_positives = np.zeros(num_cutoffs, dtype=np.float64)
+  actual_positives = 0.0
+
+  for predicted_row, label_row, weight in zip(sorted_classes, labels,
+                                              weights):
+
+    label_set = set(label_row)
+    label_set.discard(b'')  # Remove filler elements.
+
+    for i, cutoff in enumerate(cutoffs):
+      cutoff_to_use = cutoff if cutoff > 0 else num_classes
+      cut_predicted_row = predicted_row[:cutoff_to_use]
+      true_pos = set(cut_predicted_row) & label_set
+      true_positives[i] += len(true_pos) * weight
+      predicted_positives[i] += len(cut_predicted_row) * weight
+
+    actual_positives += len(label_set) * weight
+
+  return true_positives, predicted_positives, actual_positives
+
+
 def _precision_recall_at_k(classes: types.TensorType,
                            scores: types.TensorType,
                            labels: types.TensorType,
@@ -370,67 +439,6 @@ def _precision_recall_at_k(classes: types.TensorType,
     else:
       weights_f64 = tf.ones(tf.shape(input=labels)[0], tf.float64)
 
-  def compute_batch_stats(classes: np.ndarray, scores: np.ndarray,
-                          labels: np.ndarray,
-                          weights: np.ndarray) -> np.ndarray:
-    """Compute precision/recall intermediate stats for a batch.
-
-    Args:
-      classes: Tensor containing class names. Should be a BATCH_SIZE x
-        NUM_CLASSES Tensor.
-      scores: Tensor containing the associated scores. Should be a BATCH_SIZE x
-        NUM_CLASSES Tensor.
-      labels: Tensor containing the true labels. Should be a rank-2 Tensor where
-        the first dimension is BATCH_SIZE. The second dimension can be anything.
-      weights: Weights for the associated exmaples. Should be a BATCH_SIZE
-        Tesnor.
-
-    Returns:
-      True positives, predicted positives, actual positives computed for the
-      batch of examples.
-
-    Raises:
-      ValueError: classes and scores have different shapes; or labels has
-       a different batch size from classes and scores
-    """
-
-    if classes.shape != scores.shape:
-      raise ValueError('classes and scores should have same shape, but got '
-                       '%s and %s' % (classes.shape, scores.shape))
-
-    batch_size = classes.shape[0]
-    num_classes = classes.shape[1]
-    if labels.shape[0] != batch_size:
-      raise ValueError('labels should have the same batch size of %d, but got '
-                       '%d instead' % (batch_size, labels.shape[0]))
-
-    # Sort classes, by row, by their associated scores, in descending order of
-    # score.
-    sorted_classes = np.flip(
-        classes[np.arange(batch_size)[:, None],
-                np.argsort(scores)], axis=1)
-
-    true_positives = np.zeros(num_cutoffs, dtype=np.float64)
-    predicted_positives = np.zeros(num_cutoffs, dtype=np.float64)
-    actual_positives = 0.0
-
-    for predicted_row, label_row, weight in zip(sorted_classes, labels,
-                                                weights):
-
-      label_set = set(label_row)
-      label_set.discard(b'')  # Remove filler elements.
-
-      for i, cutoff in enumerate(cutoffs):
-        cutoff_to_use = cutoff if cutoff > 0 else num_classes
-        cut_predicted_row = predicted_row[:cutoff_to_use]
-        true_pos = set(cut_predicted_row) & label_set
-        true_positives[i] += len(true_pos) * weight
-        predicted_positives[i] += len(cut_predicted_row) * weight
-
-      actual_positives += len(label_set) * weight
-
-    return true_positives, predicted_positives, actual_positives  # pytype: disable=bad-return-type
-
   # Value op returns
   # [ K | precision at K | recall at K ]
   # PyType doesn't like TF operator overloads: b/92797687
@@ -447,9 +455,10 @@ def _precision_recall_at_k(classes: types.TensorType,
     value_op = tf.transpose(a=tf.stack([cutoffs, recall_op], axis=0))
 
   true_positives_update, predicted_positives_update, actual_positives_update = (
-      tf.compat.v1.py_func(compute_batch_stats,
-                           [classes, scores, labels, weights_f64],
-                           [tf.float64, tf.float64, tf.float64]))
+      tf.compat.v1.py_func(
+          functools.partial(precision_recall_at_k_batch_stats, cutoffs),
+          [classes, scores, labels, weights_f64],
+          [tf.float64, tf.float64, tf.float64]))
 
   update_op = tf.group(
       tf.compat.v1.assign_add(true_positives, true_positives_update),
@@ -96,6 +96,11 @@ def _export(name: Text):
                                             **kwargs).populate_stats_and_pop
       callback.populate_plots_and_pop = cls(*args,
                                             **kwargs).populate_plots_and_pop
+      # Metrics that support NumPy can also be computed from the fetched
+      # features, predictions and labels instead of using their metric ops (see
+      # get_numpy_metric).
+      metric = cls(*args, **kwargs)
+      callback.numpy_metric = metric if metric.supports_numpy else None
       return callback
 
     globals()[name] = fn
@@ -137,6 +142,85 @@ def _get_target_tensor(maybe_dict: types.TensorTypeMaybeDict,
   return None
 
 
+def get_numpy_metric(
+    callback: types.AddMetricsCallbackType) -> Optional['_PostExportMetric']:
+  """Returns the metric computed by the callback if it supports NumPy.
+
+  Metrics that support NumPy can be computed from the features, predictions and
+  labels fetched from the model (see _PostExportMetric.numpy_metric_variables)
+  instead of adding their metric ops to the graph.
+
+  Args:
+    callback: Callback for adding metrics (e.g. the result of auc_plots()).
+
+  Returns:
+    The post export metric computed by the callback or None if the callback does
+    not support computing its metrics using NumPy.
+  """
+  return getattr(callback, 'numpy_metric', None)
+
+
+def graph_metrics_callbacks(
+    add_metrics_callbacks: Optional[List[types.AddMetricsCallbackType]],
+    compute_post_export_metrics_with_numpy: bool
+) -> Optional[List[types.AddMetricsCallbackType]]:
+  """Returns the callbacks whose metric ops must be added to the graph.
+
+  Args:
+    add_metrics_callbacks: Callbacks for adding metrics.
+    compute_post_export_metrics_with_numpy: True if the metrics that support
+      NumPy (see get_numpy_metric) are computed using NumPy instead of being
+      added to the graph.
+  """
+  if not compute_post_export_metrics_with_numpy or not add_metrics_callbacks:
+    return add_metrics_callbacks
+  return [
+      callback for callback in add_metrics_callbacks
+      if get_numpy_metric(callback) is None
+  ]
+
+
+def _get_target_value(maybe_dict: types.TensorValueMaybeDict,
+                      key_precedence: List[Text]) -> types.TensorValue:
+  """Returns value for fetched prediction or labels dicts.
+
+  This is the NumPy version of _get_target_tensor.
+
+  Args:
+    maybe_dict: Value or dictionary of values within which to find the target.
+    key_precedence: One or more keys to search for--we will return the first
+      value found.
+
+  Returns:
+    Predictions value, or None if none of the expected keys are found in
+    the predictions_dict.
+  """
+  if not isinstance(maybe_dict, dict):
+    return maybe_dict
+
+  for key in key_precedence:
+    value = maybe_dict.get(key)
+    if value is not None:
+      return value
+
+  return None
+
+
+def _is_string_dtype(dtype: np.dtype) -> bool:
+  # Strings are fetched as object arrays of bytes.
+  return np.dtype(dtype).kind in ('O', 'S', 'U')
+
+
+def _numpy_example_weights(features_dict: types.DictOfTensorValue,
+                           example_weight_key: Optional[Text],
+                           batch_size: int) -> np.ndarray:
+  """Returns the example weights as an N element float64 vector."""
+  if example_weight_key:
+    return np.asarray(
+        features_dict[example_weight_key], dtype=np.float64).reshape(-1)
+  return np.ones(batch_size, dtype=np.float64)
+
+
 def _check_feature_present(features_dict: types.TensorTypeMaybeDict,
                            feature_key: Text):
   """Raise ValueError if the example weight is not present."""
@@ -335,9 +419,26 @@ def _string_labels_to_class_ids(labels_tensor: tf.Tensor,
   return tf.reshape(labels_tensor, shape)
 
 
+def _numpy_string_labels_to_class_ids(labels: np.ndarray,
+                                      classes: np.ndarray) -> np.ndarray:
+  """NumPy version of _string_labels_to_class_ids."""
+  # Convert labels with shape (N) to (N, 1) if necessary
+  expanded = labels[:, np.newaxis] if labels.ndim == 1 else labels
+  onehot = np.equal(classes, expanded).astype(np.int64)
+  # Convert one-hot vector from shape (N, n_classes) to (N, 1) if expanded
+  # shape was (N, 1).
+  if expanded.shape[1] == 1:
+    return np.argmax(onehot, axis=1).reshape(labels.shape)
+  return onehot
+
+
 class _PostExportMetric(six.with_metaclass(abc.ABCMeta, object)):
   """Abstract base class for post export metrics."""
 
+  # Set to True by metrics that implement numpy_metric_variables and
+  # numpy_metric_values.
+  supports_numpy = False
+
   def __init__(self,
                target_prediction_keys: Optional[List[Text]] = None,
                labels_key: Optional[Text] = None,
@@ -454,6 +555,55 @@ class _PostExportMetric(six.with_metaclass(abc.ABCMeta, object)):
     # class to evaluate.
     return self._select_class(predictions_tensor, labels_tensor)
 
+  def _select_numpy_class(self, predictions: np.ndarray,
+                          labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """NumPy version of _select_class."""
+    if labels.ndim == 1:
+      labels = labels[:, np.newaxis]
+    if labels.ndim != 2 or predictions.ndim != 2:
+      raise ValueError(
+          'predictions and labels should have rank 2 when tensor_index is set, '
+          'but got shapes %s and %s instead' % (predictions.shape,
+                                                labels.shape))
+    if labels.shape[1] == 1 or labels.shape[1] != predictions.shape[1]:
+      # Labels are class indices, convert them to a multi-hot vector
+      # representing all classes. Out of range indices are ignored like they
+      # are by tf.one_hot.
+      depth = predictions.shape[1]
+      rows, columns = np.nonzero((labels >= 0) & (labels < depth))
+      multi_hot = np.zeros((labels.shape[0], depth), dtype=np.float32)
+      np.add.at(multi_hot,
+                (rows, labels[rows, columns].astype(np.int64)), 1.0)
+      labels = multi_hot
+    return (predictions[:, self._tensor_index],
+            labels[:, self._tensor_index].astype(np.float32))
+
+  def _get_numpy_labels_and_predictions(
+      self, predictions_dict: types.TensorValueMaybeDict,
+      labels_dict: types.TensorValueMaybeDict) -> Tuple[np.ndarray, np.ndarray]:
+    """NumPy version of _get_labels_and_predictions."""
+    predictions = _get_target_value(predictions_dict,
+                                    self._target_prediction_keys)
+    if predictions is None:
+      raise KeyError('Cannot find any of %s in predictions_dict %s.' %
+                     (self._target_prediction_keys, predictions_dict))
+    labels = _get_target_value(labels_dict, [self._labels_key])
+    if labels is None:
+      raise KeyError('Cannot find %s in labels_dict %s.' %
+                     (self._labels_key, labels_dict))
+
+    # Convert string labels
+    if _is_string_dtype(labels.dtype):
+      classes = _get_target_value(predictions_dict,
+                                  [prediction_keys.PredictionKeys.ALL_CLASSES])
+      if classes is not None:
+        labels = _numpy_string_labels_to_class_ids(labels, classes)
+
+    if self._tensor_index is None:
+      return predictions, labels
+
+    return self._select_numpy_class(predictions, labels)
+
   def _metric_key(self, base_key: Text) -> Text:
     """Constructs a metric key, including user-specified prefix if necessary.
 
@@ -553,6 +703,53 @@ class _PostExportMetric(six.with_metaclass(abc.ABCMeta, object)):
     """
     pass
 
+  def numpy_feature_keys(self) -> List[Text]:
+    """Returns the keys of the features used by numpy_metric_variables."""
+    example_weight_key = getattr(self, '_example_weight_key', None)
+    return [example_weight_key] if example_weight_key else []
+
+  def numpy_metric_variables(
+      self, features_dict: types.DictOfTensorValue,
+      predictions_dict: types.TensorValueMaybeDict,
+      labels_dict: types.TensorValueMaybeDict) -> List[np.ndarray]:
+    """Returns the metric variables for a batch of fetched values.
+
+    This is the NumPy counterpart of the update ops returned by get_metric_ops
+    and is only used if supports_numpy is True. The metric variables of
+    different batches are combined by adding them together.
+
+    Args:
+      features_dict: Dictionary containing the batch of values for the features
+        returned by numpy_feature_keys.
+      predictions_dict: Dictionary containing the batch of prediction values
+        (or the values themselves if the predictions are not a dict).
+      labels_dict: Dictionary containing the batch of label values (or the
+        values themselves if the labels are not a dict).
+
+    Returns:
+      List of metric variables for the batch, or None if the metric does not
+      support NumPy (supports_numpy is False).
+    """
+    return None
+
+  def numpy_metric_values(
+      self, metric_variables: List[np.ndarray]) -> Dict[Text, Any]:
+    """Returns the metric values for the given metric variables.
+
+    This is the NumPy counterpart of the value ops returned by get_metric_ops,
+    so the values can be converted by populate_stats_and_pop and
+    populate_plots_and_pop.
+
+    Args:
+      metric_variables: Combined metric variables as returned by
+        numpy_metric_variables.
+
+    Returns:
+      Dictionary of metric values keyed by the keys used by get_metric_ops, or
+      None if the metric does not support NumPy (supports_numpy is False).
+    """
+    return None
+
 
 # TODO(b/79364723): make metric key unique for post export metrics with
 # different params.
@@ -862,6 +1059,8 @@ class _CalibrationPlotAndPredictionHistogram(_PostExportMetric):
   _metric_tag = None  # type: Text
   _tensor_index = ...  # type: int
 
+  supports_numpy = True
+
   def __init__(self,
                example_weight_key: Optional[Text] = None,
                num_buckets: int = _DEFAULT_NUM_BUCKETS,
@@ -934,6 +1133,37 @@ class _CalibrationPlotAndPredictionHistogram(_PostExportMetric):
              tf.no_op()),
     }
 
+  def numpy_metric_variables(
+      self, features_dict: types.DictOfTensorValue,
+      predictions_dict: types.TensorValueMaybeDict,
+      labels_dict: types.TensorValueMaybeDict) -> List[np.ndarray]:
+    predictions, labels = self._get_numpy_labels_and_predictions(
+        predictions_dict, labels_dict)
+    predictions = np.asarray(predictions, dtype=np.float64).reshape(-1)
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1)
+    weights = _numpy_example_weights(features_dict, self._example_weight_key,
+                                     predictions.size)
+    # Same bucketing as metrics.calibration_plot with left=0.0 and right=1.0.
+    buckets = (np.clip(
+        np.floor(predictions / (1.0 / self._num_buckets)), -1,
+        self._num_buckets) + 1).astype(np.int64)
+    num_buckets = self._num_buckets + 2
+    return [
+        np.bincount(buckets, predictions * weights, minlength=num_buckets),
+        np.bincount(buckets, labels * weights, minlength=num_buckets),
+        np.bincount(buckets, weights, minlength=num_buckets),
+    ]
+
+  def numpy_metric_values(
+      self, metric_variables: List[np.ndarray]) -> Dict[Text, Any]:
+    return {
+        self._metric_key(metric_keys.CALIBRATION_PLOT_MATRICES):
+            np.stack(metric_variables, axis=1),
+        self._metric_key(metric_keys.CALIBRATION_PLOT_BOUNDARIES):
+            (np.arange(self._num_buckets + 1, dtype=np.float32) /
+             np.float32(self._num_buckets)),
+    }
+
   def populate_plots_and_pop(
       self, plots: Dict[Text, Any],
       output_plots: Dict[Text, metrics_pb2.PlotData]) -> None:
@@ -987,6 +1217,12 @@ def _flatten_to_one_dim(tensor):
   return tf.reshape(tensor, [tf.size(input=tensor)])
 
 
+_LABELS_RANGE_ERROR_MESSAGE = (
+    'Labels should be in the range [0, 1]. Check that the '
+    'metrics you have configured are compatible with your model type, e.g. '
+    'you should not configure AUC for a regression model.')
+
+
 def _create_predictions_labels_weights_for_fractional_labels(
     prediction_tensor, label_tensor, weight_tensor):
   """Creates updated predictions, labels, weights Tensors for fractional labels.
@@ -1011,15 +1247,11 @@ def _create_predictions_labels_weights_for_fractional_labels(
     Tuple of updated (prediction_tensor, label_tensor, weight_tensor).
   """
 
-  assert_message = (
-      'Labels should be in the range [0, 1]. Check that the '
-      'metrics you have configured are compatible with your model type, e.g. '
-      'you should not configure AUC for a regression model.')
   with tf.control_dependencies([
       tf.compat.v1.assert_greater_equal(
-          label_tensor, np.float64(0.0), message=assert_message),
+          label_tensor, np.float64(0.0), message=_LABELS_RANGE_ERROR_MESSAGE),
       tf.compat.v1.assert_less_equal(
-          label_tensor, np.float64(1.0), message=assert_message)
+          label_tensor, np.float64(1.0), message=_LABELS_RANGE_ERROR_MESSAGE)
   ]):
     return (
         tf.concat([prediction_tensor, prediction_tensor], axis=0),
@@ -1072,6 +1304,8 @@ class _ConfusionMatrixBasedMetric(_PostExportMetric):
     """
     self._example_weight_key = example_weight_key
     self._thresholds = sorted(thresholds)
+    # The TF metric ops compare the predictions to the thresholds as float32.
+    self._numpy_thresholds = np.array(self._thresholds, dtype=np.float32)
     super(_ConfusionMatrixBasedMetric, self).__init__(
         target_prediction_keys,
         labels_key,
@@ -1167,6 +1401,71 @@ class _ConfusionMatrixBasedMetric(_PostExportMetric):
                                           (values['tp'] + values['fn']))
     return (values, update_ops)  # pytype: disable=bad-return-type
 
+  def numpy_metric_variables(
+      self, features_dict: types.DictOfTensorValue,
+      predictions_dict: types.TensorValueMaybeDict,
+      labels_dict: types.TensorValueMaybeDict) -> List[np.ndarray]:
+    """Returns histograms of the weighted positives and negatives.
+
+    Bucket i of the histograms contains the examples whose predictions are
+    greater than thresholds[:i] and less than or equal to thresholds[i:], from
+    which the confusion matrices at all the thresholds can be computed (see
+    numpy_confusion_matrix_values).
+
+    Args:
+      features_dict: Features dict.
+      predictions_dict: Predictions dict.
+      labels_dict: Labels dict.
+
+    Returns:
+      [positives histogram, negatives histogram] for the batch.
+    """
+    predictions, labels = self._get_numpy_labels_and_predictions(
+        predictions_dict, labels_dict)
+    predictions = np.asarray(predictions, dtype=np.float32).reshape(-1)
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1)
+    weights = _numpy_example_weights(features_dict, self._example_weight_key,
+                                     predictions.size)
+    if np.any(labels < 0.0) or np.any(labels > 1.0):
+      raise ValueError(_LABELS_RANGE_ERROR_MESSAGE)
+    if not np.all((predictions >= 0.0) & (predictions <= 1.0)):
+      raise ValueError('predictions must be in [0, 1], but got %s' %
+                       predictions)
+    # Fractional labels are handled as in
+    # _create_predictions_labels_weights_for_fractional_labels.
+    buckets = np.searchsorted(self._numpy_thresholds, predictions, side='left')
+    num_buckets = len(self._thresholds) + 1
+    return [
+        np.bincount(buckets, weights * labels, minlength=num_buckets),
+        np.bincount(buckets, weights * (1.0 - labels), minlength=num_buckets),
+    ]
+
+  def numpy_confusion_matrix_values(
+      self, metric_variables: List[np.ndarray]) -> Dict[Text, np.ndarray]:
+    """Returns the NumPy version of the confusion_matrix_metric_ops values."""
+    positives, negatives = metric_variables
+    values = {
+        'fn': np.cumsum(positives)[:-1],
+        'tn': np.cumsum(negatives)[:-1],
+        'fp': np.cumsum(negatives[::-1])[::-1][1:],
+        'tp': np.cumsum(positives[::-1])[::-1][1:],
+    }
+    values['precision'] = math_util.divide_no_nan(values['tp'],
+                                               values['tp'] + values['fp'])
+    values['recall'] = math_util.divide_no_nan(values['tp'],
+                                            values['tp'] + values['fn'])
+    return values
+
+  def numpy_joined_confusion_matrix(
+      self, metric_variables: List[np.ndarray]) -> np.ndarray:
+    """Returns the NumPy version of joined_confusion_matrix_metric_ops."""
+    values = self.numpy_confusion_matrix_values(metric_variables)
+    columns = [
+        values['fn'], values['tn'], values['fp'], values['tp'],
+        values['precision'], values['recall']
+    ]
+    return np.stack(columns, axis=1)
+
 
 def _set_output_matrix_field(matrix_entry, output_matrix, field_name):
   """Sets bounded and double values for a component of a confusion matrix.
@@ -1225,6 +1524,8 @@ def _create_confusion_matrix_proto(
 class _ConfusionMatrixAtThresholds(_ConfusionMatrixBasedMetric):
   """Confusion matrix at thresholds."""
 
+  supports_numpy = True
+
   def get_metric_ops(
       self, features_dict: types.TensorTypeMaybeDict,
       predictions_dict: types.TensorTypeMaybeDict,
@@ -1244,6 +1545,15 @@ class _ConfusionMatrixAtThresholds(_ConfusionMatrixBasedMetric):
     }
     # pyformat: enable
 
+  def numpy_metric_values(
+      self, metric_variables: List[np.ndarray]) -> Dict[Text, Any]:
+    return {
+        self._metric_key(metric_keys.CONFUSION_MATRIX_AT_THRESHOLDS_MATRICES):
+            self.numpy_joined_confusion_matrix(metric_variables),
+        self._metric_key(metric_keys.CONFUSION_MATRIX_AT_THRESHOLDS_THRESHOLDS):
+            self._numpy_thresholds,
+    }
+
   def populate_stats_and_pop(
       self, unused_slice_key: slicer.SliceKeyType, combine_metrics: Dict[Text,
                                                                          Any],
@@ -1277,6 +1587,8 @@ class _AucPlots(_ConfusionMatrixBasedMetric):
   _metric_tag = None  # type: Text
   _tensor_index = ...  # type: int
 
+  supports_numpy = True
+
   def __init__(self,
                example_weight_key: Optional[Text] = None,
                num_buckets: int = _DEFAULT_NUM_BUCKETS,
@@ -1331,6 +1643,15 @@ class _AucPlots(_ConfusionMatrixBasedMetric):
             (tf.identity(self._thresholds), tf.no_op()),
     }
 
+  def numpy_metric_values(
+      self, metric_variables: List[np.ndarray]) -> Dict[Text, Any]:
+    return {
+        self._metric_key(metric_keys.AUC_PLOTS_MATRICES):
+            self.numpy_joined_confusion_matrix(metric_variables),
+        self._metric_key(metric_keys.AUC_PLOTS_THRESHOLDS):
+            self._numpy_thresholds,
+    }
+
   def populate_plots_and_pop(
       self, plots: Dict[Text, Any],
       output_plots: Dict[Text, metrics_pb2.PlotData]) -> None:
@@ -1490,6 +1811,43 @@ def _class_ids(probabilities: tf.Tensor) -> tf.Tensor:
       multiples=batch_multiplier)
 
 
+def _numpy_class_ids(probabilities: np.ndarray) -> np.ndarray:
+  """NumPy version of tf.as_string(_class_ids(probabilities))."""
+  class_ids = np.array([b'%d' % i for i in range(probabilities.shape[-1])],
+                       dtype=object)
+  return np.tile(class_ids, probabilities.shape[:-1] + (1,))
+
+
+def _numpy_as_string(value: Any) -> bytes:
+  """Returns value formatted the same way as by tf.as_string."""
+  if isinstance(value, (bool, np.bool_)):
+    return b'true' if value else b'false'
+  if isinstance(value, (int, np.integer)):
+    return b'%d' % value
+  return b'%f' % value
+
+
+def _numpy_cast_or_convert(original: np.ndarray,
+                           target_dtype: np.dtype) -> np.ndarray:
+  """NumPy version of _cast_or_convert."""
+  if _is_string_dtype(target_dtype) and not _is_string_dtype(original.dtype):
+    return np.array([_numpy_as_string(v) for v in original.ravel()],
+                    dtype=object).reshape(original.shape)
+  return original.astype(target_dtype)
+
+
+def _sparse_tensor_value_to_dense(
+    value: tf.compat.v1.SparseTensorValue) -> np.ndarray:
+  """NumPy version of tf.sparse.to_dense (using '' as default for strings)."""
+  values = np.asarray(value.values)
+  if _is_string_dtype(values.dtype):
+    dense = np.full(value.dense_shape, b'', dtype=object)
+  else:
+    dense = np.zeros(value.dense_shape, dtype=values.dtype)
+  dense[tuple(np.asarray(value.indices).T)] = values
+  return dense
+
+
 class _PrecisionRecallAtK(_PostExportMetric):
   """Metric that computes precision or recall at K for classification models.
 
@@ -1511,6 +1869,8 @@ class _PrecisionRecallAtK(_PostExportMetric):
   _labels_key = ...  # type: Text
   _metric_tag = None  # type: Text
 
+  supports_numpy = True
+
   def __init__(self,
                metric_name: Text,
                cutoffs: List[int],
@@ -1642,6 +2002,57 @@ class _PrecisionRecallAtK(_PostExportMetric):
 
     return {self._metric_key(self._metric_name): metric_ops}
 
+  def numpy_metric_variables(
+      self, features_dict: types.DictOfTensorValue,
+      predictions_dict: types.TensorValueMaybeDict,
+      labels_dict: types.TensorValueMaybeDict) -> List[np.ndarray]:
+    labels = labels_dict
+    if self._labels_key:
+      labels = labels_dict[self._labels_key]
+    if isinstance(labels, tf.compat.v1.SparseTensorValue):
+      labels = _sparse_tensor_value_to_dense(labels)
+
+    # Expand dims if necessary.
+    if labels.ndim == 1:
+      labels = labels[:, np.newaxis]
+
+    scores = _get_target_value(predictions_dict, self._probabilities_keys)
+    classes = _get_target_value(predictions_dict, self._classes_keys)
+    if (classes is None and
+        prediction_keys.PredictionKeys.ALL_CLASSES in self._classes_keys):
+      classes = _numpy_class_ids(scores)
+
+    # See get_metric_ops for why int labels are matched to class IDs. Models
+    # without a classes output are matched the same way.
+    if labels.dtype == np.int64 and (classes is None or
+                                     classes.shape[-1] == 1):
+      classes = _numpy_class_ids(scores)
+    if classes is None:
+      raise ValueError(
+          'no classes found in predictions for {}: classes_keys={}'.format(
+              self._metric_name, self._classes_keys))
+
+    labels = _numpy_cast_or_convert(labels, classes.dtype)
+    weights = _numpy_example_weights(features_dict, self._example_weight_key,
+                                     labels.shape[0])
+    true_positives, predicted_positives, actual_positives = (
+        metrics.precision_recall_at_k_batch_stats(self._cutoffs, classes,
+                                                  scores, labels, weights))
+    return [true_positives, predicted_positives, np.array(actual_positives)]
+
+  def numpy_metric_values(
+      self, metric_variables: List[np.ndarray]) -> Dict[Text, Any]:
+    true_positives, predicted_positives, actual_positives = metric_variables
+    with np.errstate(divide='ignore', invalid='ignore'):
+      if self._metric_name == metric_keys.PRECISION_AT_K:
+        values = true_positives / predicted_positives
+      else:
+        values = true_positives / actual_positives
+    cutoffs = np.array(self._cutoffs, dtype=np.float64)
+    return {
+        self._metric_key(self._metric_name): np.stack([cutoffs, values], axis=1)
+    }
+
   def populate_stats_and_pop(
       self, unused_slice_key: slicer.SliceKeyType, combine_metrics: Dict[Text,
                                                                          Any],
@@ -53,6 +53,7 @@ class PostExportMetricsTest(testutil.TensorflowModelAnalysisTest):
 
   def setUp(self):
     self.compute_confidence_intervals = False
+    self.compute_post_export_metrics_with_numpy = False
     self.deterministic_test_seed = _TEST_SEED
     super(testutil.TensorflowModelAnalysisTest, self).setUp()
 
@@ -71,7 +72,9 @@ class PostExportMetricsTest(testutil.TensorflowModelAnalysisTest):
     serialized_examples = [ex.SerializeToString() for ex in examples]
     eval_shared_model = self.createTestEvalSharedModel(
         eval_saved_model_path=eval_export_dir,
-        add_metrics_callbacks=metrics_callbacks)
+        add_metrics_callbacks=metrics_callbacks,
+        compute_post_export_metrics_with_numpy=(
+            self.compute_post_export_metrics_with_numpy))
     eval_config = config.EvalConfig(
         input_data_specs=[config.InputDataSpec()],
         model_specs=[config.ModelSpec(location=eval_export_dir)],
@@ -119,6 +122,38 @@ class PostExportMetricsTest(testutil.TensorflowModelAnalysisTest):
     self.assertItemsEqual(keys,
                           ['tag_1/key1', 'tag/key1', 'tag_1/key2', 'tag/key2'])
 
+  def testGetNumpyMetric(self):
+    self.assertIsInstance(
+        post_export_metrics.get_numpy_metric(post_export_metrics.auc_plots()),
+        post_export_metrics._AucPlots)
+    self.assertIsNone(
+        post_export_metrics.get_numpy_metric(post_export_metrics.auc()))
+    self.assertIsNone(
+        post_export_metrics.get_numpy_metric(lambda f, p, l: {}))
+
+  def testGraphMetricsCallbacks(self):
+    auc_plots = post_export_metrics.auc_plots()
+    auc = post_export_metrics.auc()
+    self.assertEqual(
+        post_export_metrics.graph_metrics_callbacks([auc_plots, auc], True),
+        [auc])
+    self.assertEqual(
+        post_export_metrics.graph_metrics_callbacks([auc_plots, auc], False),
+        [auc_plots, auc])
+    self.assertIsNone(post_export_metrics.graph_metrics_callbacks(None, True))
+
+  def testPrecisionAtKNumpyWithoutClasses(self):
+    metric = post_export_metrics._PrecisionAtK(
+        cutoffs=[1], classes_key='missing_classes')
+    predictions = {'probabilities': np.array([[0.1, 0.9], [0.8, 0.2]])}
+    # Integer labels are matched to the class IDs.
+    variables = metric.numpy_metric_variables(
+        {}, predictions, np.array([1, 1], dtype=np.int64))
+    self.assertLen(variables, 3)
+    with self.assertRaisesRegex(ValueError, 'no classes found'):
+      metric.numpy_metric_variables({}, predictions,
+                                    np.array([b'1', b'1']))
+
   def testExampleCountNoStandardKeys(self):
     # Test ExampleCount with a custom Estimator that doesn't have any of the
     # standard PredictionKeys.
@@ -993,6 +1028,10 @@ class PostExportMetricsTest(testutil.TensorflowModelAnalysisTest):
         ],
         custom_metrics_check=check_result)
 
+  def testPrecisionRecallAtKWeightedWithNumpy(self):
+    self.compute_post_export_metrics_with_numpy = True
+    self.testPrecisionRecallAtKWeighted()
+
   def testPrecisionRecallAtKEmptyCutoffs(self):
     temp_eval_export_dir = self._getEvalExportDir()
     _, eval_export_dir = (
@@ -1317,6 +1356,10 @@ class PostExportMetricsTest(testutil.TensorflowModelAnalysisTest):
         ],
         custom_plots_check=check_result)
 
+  def testCalibrationPlotAndPredictionHistogramWeightedWithNumpy(self):
+    self.compute_post_export_metrics_with_numpy = True
+    self.testCalibrationPlotAndPredictionHistogramWeighted()
+
   def testAucPlotsUnweighted(self):
     temp_eval_export_dir = self._getEvalExportDir()
     _, eval_export_dir = (
@@ -1435,6 +1478,10 @@ class PostExportMetricsTest(testutil.TensorflowModelAnalysisTest):
     self._runTestWithCustomCheck(
         examples, eval_export_dir, [auc_plots], custom_plots_check=check_result)
 
+  def testAucPlotsUnweightedWithNumpy(self):
+    self.compute_post_export_metrics_with_numpy = True
+    self.testAucPlotsUnweighted()
+
   def testAucPlotsWithUncertainty(self):
     self.compute_confidence_intervals = True
     temp_eval_export_dir = self._getEvalExportDir()
@@ -1625,6 +1672,10 @@ class PostExportMetricsTest(testutil.TensorflowModelAnalysisTest):
         ],
         custom_metrics_check=check_result)
 
+  def testConfusionMatrixAtThresholdsWeightedWithNumpy(self):
+    self.compute_post_export_metrics_with_numpy = True
+    self.testConfusionMatrixAtThresholdsWeighted()
+
   def testConfusionMatrixAtThresholdsWeightedUncertainty(self):
     self.compute_confidence_intervals = True
     temp_eval_export_dir = self._getEvalExportDir()
@@ -1679,6 +1730,10 @@ class PostExportMetricsTest(testutil.TensorflowModelAnalysisTest):
         ],
         custom_metrics_check=check_result)
 
+  def testConfusionMatrixAtThresholdsWeightedUncertaintyWithNumpy(self):
+    self.compute_post_export_metrics_with_numpy = True
+    self.testConfusionMatrixAtThresholdsWeightedUncertainty()
+
   def testConfusionMatrixAtThresholdsSerialization(self):
     temp_eval_export_dir = self._getEvalExportDir()
     _, eval_export_dir = (
@@ -22,6 +22,7 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
+import functools
 import itertools
 
 # Standard Imports
@@ -49,6 +50,9 @@ SliceKeyType = Union[Tuple[()], Tuple[SingletonSliceKeyType, ...]]  # pylint: di
 
 OVERALL_SLICE_NAME = 'Overall'
 
+# Fanout used by default for the overall slice when combining per slice.
+DEFAULT_OVERALL_SLICE_FANOUT = 16
+
 
 class SingleSliceSpec(object):
   """Specification for a single slice.
@@ -434,9 +438,22 @@ def _TrackDistinctSliceKeys(  # pylint: disable=invalid-name
 @beam.typehints.with_output_types(Tuple[SliceKeyType, types.Extracts])
 def FanoutSlices(
     pcoll: beam.pvalue.PCollection,
-    include_slice_keys_in_output: Optional[bool] = False
+    include_slice_keys_in_output: Optional[bool] = False,
+    track_distinct_slice_keys: Optional[bool] = True
 ) -> beam.pvalue.PCollection:  # pylint: disable=invalid-name
-  """Fan out extracts based on slice keys (slice keys removed by default)."""
+  """Fan out extracts based on slice keys (slice keys removed by default).
+
+  Args:
+    pcoll: PCollection of extracts.
+    include_slice_keys_in_output: True to keep the slice keys in the extracts.
+    track_distinct_slice_keys: True to update the num_distinct_slice_keys
+      counter. This requires an additional shuffle of the slice keys, callers
+      that group by slice anyway should set this to False and update the counter
+      from their grouped output instead.
+
+  Returns:
+    PCollection of (slice key, extracts).
+  """
   if include_slice_keys_in_output:
     key_filter_fn = lambda k: True
   else:
@@ -445,13 +462,53 @@ def FanoutSlices(
 
   result = pcoll | 'DoSlicing' >> beam.ParDo(_FanoutSlicesDoFn(key_filter_fn))
 
-  # pylint: disable=no-value-for-parameter
-  _ = result | 'TrackDistinctSliceKeys' >> _TrackDistinctSliceKeys()
-  # pylint: enable=no-value-for-parameter
+  if track_distinct_slice_keys:
+    # pylint: disable=no-value-for-parameter
+    _ = result | 'TrackDistinctSliceKeys' >> _TrackDistinctSliceKeys()
+    # pylint: enable=no-value-for-parameter
 
   return result
 
 
+def _slice_fanout(slice_key: SliceKeyType, overall_slice_fanout: int,
+                  fanout: int) -> int:
+  return fanout if slice_key else overall_slice_fanout
+
+
+def hot_key_fanout_fn(
+    hot_key_fanout: Optional[int] = None
+) -> Optional[Callable[[SliceKeyType], int]]:
+  """Returns function for the fanout to use when combining examples per slice.
+
+  All examples contribute to the overall slice so without fanout all of them
+  would be combined by a single worker.
+
+  Args:
+    hot_key_fanout: Optional fanout to use for all slices. If not set, only the
+      overall slice is fanned out (by DEFAULT_OVERALL_SLICE_FANOUT). A value <=
+      1 disables fanout.
+
+  Returns:
+    Function that returns the fanout for a slice key for use with
+    beam.CombinePerKey(...).with_hot_key_fanout or None if fanout is disabled.
+  """
+  if hot_key_fanout is None:
+    return functools.partial(
+        _slice_fanout, overall_slice_fanout=DEFAULT_OVERALL_SLICE_FANOUT,
+        fanout=1)
+  elif hot_key_fanout <= 1:
+    return None
+  return functools.partial(
+      _slice_fanout, overall_slice_fanout=hot_key_fanout, fanout=hot_key_fanout)
+
+
+def small_slice_error_message(k_anonymization_count: int) -> Text:
+  """Returns error message used for slices filtered for k-anonymity."""
+  return ('Example count for this slice key is lower than the minimum required '
+          'value: %d. No data is aggregated for this slice.' %
+          k_anonymization_count)
+
+
 @beam.ptransform_fn
 @beam.typehints.with_input_types(Tuple[SliceKeyType, types.Extracts])
 @beam.typehints.with_output_types(Tuple[SliceKeyType, types.Extracts])
@@ -508,9 +565,7 @@ def FilterOutSlices(  # pylint: disable=invalid-name
         else:
           yield (slice_key, {
               self.error_metric_key:
-                  'Example count for this slice key is lower than '
-                  'the minimum required value: %d. No data is aggregated for '
-                  'this slice.' % k_anonymization_count
+                  small_slice_error_message(k_anonymization_count)
           })
 
   return ({
@@ -421,6 +421,19 @@ class SlicerTest(testutil.TensorflowModelAnalysisTest):
               error_metric_key=metric_keys.ERROR_METRIC))
       util.assert_that(output_dict, check_output)
 
+  def testHotKeyFanoutFn(self):
+    slice_key = (('slice_key', 'slice1'),)
+
+    fanout_fn = slicer.hot_key_fanout_fn()
+    self.assertEqual(fanout_fn(()), slicer.DEFAULT_OVERALL_SLICE_FANOUT)
+    self.assertEqual(fanout_fn(slice_key), 1)
+
+    fanout_fn = slicer.hot_key_fanout_fn(4)
+    self.assertEqual(fanout_fn(()), 4)
+    self.assertEqual(fanout_fn(slice_key), 4)
+
+    self.assertIsNone(slicer.hot_key_fanout_fn(1))
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,115 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+r"""Benchmark for the import time of TFMA and its submodules.
+
+Each module is imported in a fresh python process so that the reported time
+includes the cost of every dependency the module pulls in (e.g. tensorflow,
+apache_beam). The time reported for the top level package measures the cost
+paid by processes such as Beam workers that only `import
+tensorflow_model_analysis`.
+
+To run this script from tfx source:
+
+```
+bazel run //tensorflow_model_analysis/tools:import_time_benchmark
+```
+
+To run from it on the tfma pip package:
+
+```
+python tensorflow_model_analysis/tools/import_time_benchmark.py --runs=5
+```
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import subprocess
+import sys
+
+from absl import app
+from absl import flags
+
+flags.DEFINE_integer('runs', 3,
+                     'Number of times to import each module (median is used).')
+flags.DEFINE_list(
+    'modules', None,
+    'Modules to benchmark. Defaults to the package and its public submodules.')
+
+FLAGS = flags.FLAGS
+
+# The top level package followed by the modules re-exported from it.
+_DEFAULT_MODULES = [
+    'tensorflow_model_analysis',
+    'tensorflow_model_analysis.constants',
+    'tensorflow_model_analysis.config',
+    'tensorflow_model_analysis.types',
+    'tensorflow_model_analysis.util',
+    'tensorflow_model_analysis.model_util',
+    'tensorflow_model_analysis.api.model_eval_lib',
+    'tensorflow_model_analysis.api.verifier_lib',
+    'tensorflow_model_analysis.api.tfma_unit',
+    'tensorflow_model_analysis.eval_metrics_graph.eval_metrics_graph',
+    'tensorflow_model_analysis.eval_saved_model.export',
+    'tensorflow_model_analysis.eval_saved_model.exporter',
+    'tensorflow_model_analysis.post_export_metrics.post_export_metrics',
+    'tensorflow_model_analysis.extractors',
+    'tensorflow_model_analysis.slicer',
+    'tensorflow_model_analysis.validators',
+    'tensorflow_model_analysis.evaluators',
+    'tensorflow_model_analysis.metrics',
+    'tensorflow_model_analysis.writers',
+    'tensorflow_model_analysis.view',
+]
+
+_TIMER_SCRIPT = """
+import timeit
+start = timeit.default_timer()
+import {module}
+print(timeit.default_timer() - start)
+"""
+
+
+def import_time(module: str) -> float:
+  """Returns the seconds taken to import module in a fresh process."""
+  output = subprocess.check_output(
+      [sys.executable, '-c', _TIMER_SCRIPT.format(module=module)])
+  return float(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median_import_time(module: str, runs: int) -> float:
+  """Returns the median import time over the given number of runs."""
+  times = sorted(import_time(module) for _ in range(runs))
+  return times[len(times) // 2]
+
+
+def main(args):
+  if args[1:]:
+    raise ValueError('Unrecognized command line args', args[1:])
+
+  modules = FLAGS.modules or _DEFAULT_MODULES
+  width = max(len(m) for m in modules)
+  print('{:<{width}}  {:>10}'.format('module', 'seconds', width=width))
+  for module in modules:
+    try:
+      seconds = median_import_time(module, FLAGS.runs)
+    except subprocess.CalledProcessError:
+      print('{:<{width}}  {:>10}'.format(module, 'error', width=width))
+      continue
+    print('{:<{width}}  {:>10.3f}'.format(module, seconds, width=width))
+
+
+if __name__ == '__main__':
+  app.run(main)
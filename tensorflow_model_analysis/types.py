@@ -68,6 +68,95 @@ class ValueWithTDistribution(
                               sample_degrees_of_freedom, unsampled_value)
 
 
+class ValueWithConfidenceInterval(
+    NamedTuple('ValueWithConfidenceInterval', [
+        ('value', float),
+        ('lower_bound', float),
+        ('upper_bound', float),
+    ])):
+  """Represents a value with an analytically computed confidence interval.
+
+  Unlike ValueWithTDistribution, the bounds are computed from a single pass
+  over the data (see math_util.calculate_delta_method_confidence_interval)
+  instead of from bootstrap samples.
+  """
+
+
+class ValueWithTDistributionArray(object):
+  """Represents the t-distribution values for each entry of an array.
+
+  This is equivalent to an array of ValueWithTDistribution, but each field is
+  stored as a single NumPy array (of the same shape). Indexing returns a
+  ValueWithTDistribution for a single entry and a ValueWithTDistributionArray
+  otherwise, so the value can be used in place of an array of
+  ValueWithTDistribution.
+  """
+
+  __slots__ = [
+      'sample_mean', 'sample_standard_deviation', 'sample_degrees_of_freedom',
+      'unsampled_value'
+  ]
+
+  def __init__(self, sample_mean: np.ndarray,
+               sample_standard_deviation: np.ndarray,
+               sample_degrees_of_freedom: np.ndarray,
+               unsampled_value: np.ndarray):
+    self.sample_mean = sample_mean
+    self.sample_standard_deviation = sample_standard_deviation
+    self.sample_degrees_of_freedom = sample_degrees_of_freedom
+    self.unsampled_value = unsampled_value
+
+  @property
+  def shape(self) -> Tuple[int, ...]:
+    return self.sample_mean.shape
+
+  @property
+  def ndim(self) -> int:
+    return self.sample_mean.ndim
+
+  def __len__(self) -> int:
+    return len(self.sample_mean)
+
+  def __getitem__(
+      self, index: Any
+  ) -> Union[ValueWithTDistribution, 'ValueWithTDistributionArray']:
+    sample_mean = self.sample_mean[index]
+    if np.ndim(sample_mean):
+      return ValueWithTDistributionArray(
+          sample_mean, self.sample_standard_deviation[index],
+          self.sample_degrees_of_freedom[index], self.unsampled_value[index])
+    return ValueWithTDistribution(
+        sample_mean, self.sample_standard_deviation[index],
+        int(self.sample_degrees_of_freedom[index]), self.unsampled_value[index])
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def __eq__(self, other: Any) -> bool:
+    if not isinstance(other, ValueWithTDistributionArray):
+      return False
+    for k in self.__slots__:
+      x, y = getattr(self, k), getattr(other, k)
+      # NaNs (x != x) are considered equal.
+      if (x.shape != y.shape or
+          not np.all((x == y) | ((x != x) & (y != y)))):  # pylint: disable=comparison-with-itself
+        return False
+    return True
+
+  def __ne__(self, other: Any) -> bool:
+    return not self == other
+
+  def __repr__(self) -> Text:
+    return 'ValueWithTDistributionArray(%s)' % ', '.join(
+        '%s=%r' % (k, getattr(self, k)) for k in self.__slots__)
+
+  def tolist(self) -> List[Any]:
+    """Returns (nested) lists of ValueWithTDistribution."""
+    return [v.tolist() if isinstance(v, ValueWithTDistributionArray) else v
+            for v in self]
+
+
 # AddMetricsCallback should have the following prototype:
 #   def add_metrics_callback(features_dict, predictions_dict, labels_dict):
 #
@@ -180,6 +269,7 @@ class EvalSharedModel(
             ('example_weight_key', Union[Text, Dict[Text, Text]]),
             ('additional_fetches', List[Text]),
             ('model_loader', ModelLoader),
+            ('compute_post_export_metrics_with_numpy', bool),
         ])):
   # pyformat: disable
   """Shared model used during extraction and evaluation.
@@ -200,6 +290,11 @@ class EvalSharedModel(
       "features" and "labels" tensors are handled automatically and should not
       be included in this list.
     model_loader: Model loader.
+    compute_post_export_metrics_with_numpy: True to compute the post export
+      metrics that support it (see post_export_metrics.get_numpy_metric) from
+      the fetched features, predictions and labels using NumPy instead of
+      adding their metric ops to the graph. The model_loader should not add
+      these metrics to the graph.
 
   More details on add_metrics_callbacks:
 
@@ -232,7 +327,8 @@ class EvalSharedModel(
       example_weight_key: Optional[Union[Text, Dict[Text, Text]]] = None,
       additional_fetches: Optional[List[Text]] = None,
       model_loader: Optional[ModelLoader] = None,
-      construct_fn: Optional[Callable[..., Any]] = None):
+      construct_fn: Optional[Callable[..., Any]] = None,
+      compute_post_export_metrics_with_numpy: bool = False):
     if not add_metrics_callbacks:
       add_metrics_callbacks = []
     if model_loader and construct_fn:
@@ -245,4 +341,5 @@ class EvalSharedModel(
     return super(EvalSharedModel,
                  cls).__new__(cls, model_path, add_metrics_callbacks,
                               include_default_metrics, example_weight_key,
-                              additional_fetches, model_loader)
+                              additional_fetches, model_loader,
+                              compute_post_export_metrics_with_numpy)
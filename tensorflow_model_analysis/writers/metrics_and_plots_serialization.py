@@ -31,7 +31,7 @@ from tensorflow_model_analysis.post_export_metrics import metric_keys
 from tensorflow_model_analysis.proto import metrics_for_slice_pb2
 from tensorflow_model_analysis.slicer import slicer_lib as slicer
 
-from typing import Any, Dict, List, Optional, Text, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
 
 from google.protobuf import json_format
 
@@ -120,8 +120,16 @@ def load_and_deserialize_metrics(
     path: Text,
     model_name: Optional[Text] = None) -> List[Tuple[slicer.SliceKeyType, Any]]:
   """Loads metrics from the given location and builds a metric map for it."""
+  return deserialize_metrics(
+      tf.compat.v1.python_io.tf_record_iterator(path), model_name)
+
+
+def deserialize_metrics(
+    records: Iterable[bytes],
+    model_name: Optional[Text] = None) -> List[Tuple[slicer.SliceKeyType, Any]]:
+  """Builds metric maps for the given serialized MetricsForSlice protos."""
   result = []
-  for record in tf.compat.v1.python_io.tf_record_iterator(path):
+  for record in records:
     metrics_for_slice = metrics_for_slice_pb2.MetricsForSlice.FromString(record)
 
     model_metrics_map = {}
@@ -174,8 +182,14 @@ def load_and_deserialize_metrics(
 def load_and_deserialize_plots(
     path: Text) -> List[Tuple[slicer.SliceKeyType, Any]]:
   """Returns deserialized plots loaded from given path."""
+  return deserialize_plots(tf.compat.v1.python_io.tf_record_iterator(path))
+
+
+def deserialize_plots(
+    records: Iterable[bytes]) -> List[Tuple[slicer.SliceKeyType, Any]]:
+  """Returns deserialized plots for the given serialized PlotsForSlice protos."""
   result = []
-  for record in tf.compat.v1.python_io.tf_record_iterator(path):
+  for record in records:
     plots_for_slice = metrics_for_slice_pb2.PlotsForSlice.FromString(record)
     plots_map = {}
     if plots_for_slice.plots:
@@ -261,6 +275,25 @@ def convert_slice_metrics(
       metric_value.bounded_value.upper_bound.value = upper_bound
       metric_value.bounded_value.methodology = (
           metrics_for_slice_pb2.BoundedValue.POISSON_BOOTSTRAP)
+    elif isinstance(value, types.ValueWithConfidenceInterval):
+      metric_value.bounded_value.value.value = value.value
+      metric_value.bounded_value.lower_bound.value = value.lower_bound
+      metric_value.bounded_value.upper_bound.value = value.upper_bound
+      metric_value.bounded_value.methodology = (
+          metrics_for_slice_pb2.BoundedValue.DELTA_METHOD)
+    elif isinstance(value, types.ValueWithTDistributionArray):
+      # Convert to a bounded array value (computed at 95% confidence level as
+      # for ValueWithTDistribution).
+      sample_mean, lower_bound, upper_bound = (
+          math_util.calculate_confidence_interval(value))
+      metric_value.bounded_array_value.value.CopyFrom(
+          _convert_to_array_value(np.asarray(sample_mean, dtype=np.float64)))
+      metric_value.bounded_array_value.lower_bound.CopyFrom(
+          _convert_to_array_value(np.asarray(lower_bound, dtype=np.float64)))
+      metric_value.bounded_array_value.upper_bound.CopyFrom(
+          _convert_to_array_value(np.asarray(upper_bound, dtype=np.float64)))
+      metric_value.bounded_array_value.methodology = (
+          metrics_for_slice_pb2.BoundedValue.POISSON_BOOTSTRAP)
     elif isinstance(value, (six.binary_type, six.text_type)):
       # Convert textual types to string metrics.
       metric_value.bytes_value = value
@@ -283,7 +316,7 @@ def convert_slice_metrics(
       metrics_for_slice.metrics[key].CopyFrom(metric_value)
 
 
-def _serialize_metrics(
+def serialize_metrics(
     metrics: Tuple[slicer.SliceKeyType, Dict[Any, Any]],
     post_export_metrics: List[types.AddMetricsCallbackType]) -> bytes:
   """Converts the given slice metrics into serialized proto MetricsForSlice.
@@ -311,14 +344,14 @@ def _serialize_metrics(
     metrics.slice_key.CopyFrom(slicer.serialize_slice_key(slice_key))
     metrics.metrics[metric_keys.ERROR_METRIC].debug_message = slice_metrics[
         metric_keys.ERROR_METRIC]
-    return metrics.SerializeToString()
+    return metrics.SerializeToString(deterministic=True)
 
   # Convert the slice key.
   result.slice_key.CopyFrom(slicer.serialize_slice_key(slice_key))
 
   # Convert the slice metrics.
   convert_slice_metrics(slice_key, slice_metrics, post_export_metrics, result)
-  return result.SerializeToString()
+  return result.SerializeToString(deterministic=True)
 
 
 def _convert_slice_plots(
@@ -378,7 +411,7 @@ def _convert_slice_plots(
             ]))
 
 
-def _serialize_plots(
+def serialize_plots(
     plots: Tuple[slicer.SliceKeyType, Dict[Any, Any]],
     post_export_metrics: List[types.AddMetricsCallbackType]) -> bytes:
   """Converts the given slice plots into serialized proto PlotsForSlice..
@@ -402,7 +435,7 @@ def _serialize_plots(
     metrics.slice_key.CopyFrom(slicer.serialize_slice_key(slice_key))
     metrics.plots[metric_keys.ERROR_METRIC].debug_message = slice_plots[
         metric_keys.ERROR_METRIC]
-    return metrics.SerializeToString()
+    return metrics.SerializeToString(deterministic=True)
 
   # Convert the slice key.
   result.slice_key.CopyFrom(slicer.serialize_slice_key(slice_key))
@@ -410,7 +443,7 @@ def _serialize_plots(
   # Convert the slice plots.
   _convert_slice_plots(slice_plots, post_export_metrics, result)  # pytype: disable=wrong-arg-types
 
-  return result.SerializeToString()
+  return result.SerializeToString(deterministic=True)
 
 
 class SerializeMetrics(beam.PTransform):  # pylint: disable=invalid-name
@@ -429,7 +462,7 @@ class SerializeMetrics(beam.PTransform):  # pylint: disable=invalid-name
       PCollection of serialized proto MetricsForSlice.
     """
     metrics = metrics | 'SerializeMetrics' >> beam.Map(
-        _serialize_metrics, post_export_metrics=self._post_export_metrics)
+        serialize_metrics, post_export_metrics=self._post_export_metrics)
     return metrics
 
 
@@ -449,7 +482,7 @@ class SerializePlots(beam.PTransform):  # pylint: disable=invalid-name
       PCollection of serialized proto MetricsForSlice.
     """
     plots = plots | 'SerializePlots' >> beam.Map(
-        _serialize_plots, post_export_metrics=self._post_export_metrics)
+        serialize_plots, post_export_metrics=self._post_export_metrics)
     return plots
 
 
@@ -473,7 +506,7 @@ class SerializeMetricsAndPlots(beam.PTransform):  # pylint: disable=invalid-name
     """
     metrics, plots = metrics_and_plots
     metrics = metrics | 'SerializeMetrics' >> beam.Map(
-        _serialize_metrics, post_export_metrics=self._post_export_metrics)
+        serialize_metrics, post_export_metrics=self._post_export_metrics)
     plots = plots | 'SerializePlots' >> beam.Map(
-        _serialize_plots, post_export_metrics=self._post_export_metrics)
+        serialize_plots, post_export_metrics=self._post_export_metrics)
     return (metrics, plots)
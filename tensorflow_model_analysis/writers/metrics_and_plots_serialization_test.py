@@ -135,7 +135,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
       }
     """, metrics_for_slice_pb2.PlotsForSlice())
 
-    got = metrics_and_plots_serialization._serialize_plots((slice_key, {
+    got = metrics_and_plots_serialization.serialize_plots((slice_key, {
         plot_key: calibration_plot
     }), None)
     self.assertProtoEquals(expected_plots_for_slice,
@@ -199,7 +199,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
     """
     calibration_plot = (
         post_export_metrics.calibration_plot_and_prediction_histogram())
-    serialized = metrics_and_plots_serialization._serialize_plots(
+    serialized = metrics_and_plots_serialization.serialize_plots(
         (slice_key, tfma_plots), [calibration_plot])
     self.assertProtoEquals(
         expected_plot_data,
@@ -211,7 +211,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
 
     calibration_plot = (
         post_export_metrics.calibration_plot_and_prediction_histogram())
-    actual_plot = metrics_and_plots_serialization._serialize_plots(
+    actual_plot = metrics_and_plots_serialization.serialize_plots(
         (slice_key, tfma_plots), [calibration_plot])
     expected_plot = metrics_for_slice_pb2.PlotsForSlice()
     expected_plot.slice_key.CopyFrom(slicer.serialize_slice_key(slice_key))
@@ -451,7 +451,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
         }
         """, metrics_for_slice_pb2.MetricsForSlice())
 
-    got = metrics_and_plots_serialization._serialize_metrics(
+    got = metrics_and_plots_serialization.serialize_metrics(
         (slice_key, slice_metrics),
         [post_export_metrics.confusion_matrix_at_thresholds(thresholds)])
     self.assertProtoEquals(
@@ -538,7 +538,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
         }""").substitute(auc=metric_keys.AUC, auprc=metric_keys.AUPRC),
         metrics_for_slice_pb2.MetricsForSlice())
 
-    got = metrics_and_plots_serialization._serialize_metrics(
+    got = metrics_and_plots_serialization.serialize_metrics(
         (slice_key, slice_metrics),
         [post_export_metrics.auc(),
          post_export_metrics.auc(curve='PR')])
@@ -579,7 +579,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
           }
         }""", metrics_for_slice_pb2.MetricsForSlice())
 
-    got = metrics_and_plots_serialization._serialize_metrics(
+    got = metrics_and_plots_serialization.serialize_metrics(
         (slice_key, slice_metrics), None)
     self.assertProtoEquals(
         expected_metrics_for_slice,
@@ -656,7 +656,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
         }""").substitute(auc=metric_keys.AUC, auprc=metric_keys.AUPRC),
         metrics_for_slice_pb2.MetricsForSlice())
 
-    got = metrics_and_plots_serialization._serialize_metrics(
+    got = metrics_and_plots_serialization.serialize_metrics(
         (slice_key, slice_metrics),
         [post_export_metrics.auc(),
          post_export_metrics.auc(curve='PR')])
@@ -668,7 +668,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
     slice_key = _make_slice_key('age', 5, 'language', 'english', 'price', 0.3)
     slice_metrics = {metric_keys.ERROR_METRIC: 'error_message'}
 
-    actual_metrics = metrics_and_plots_serialization._serialize_metrics(
+    actual_metrics = metrics_and_plots_serialization.serialize_metrics(
         (slice_key, slice_metrics),
         [post_export_metrics.auc(),
          post_export_metrics.auc(curve='PR')])
@@ -697,7 +697,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
     expected_metrics_for_slice.metrics[
         'invalid_unicode'].bytes_value = slice_metrics['invalid_unicode']
 
-    got = metrics_and_plots_serialization._serialize_metrics(
+    got = metrics_and_plots_serialization.serialize_metrics(
         (slice_key, slice_metrics), [])
     self.assertProtoEquals(
         expected_metrics_for_slice,
@@ -750,12 +750,107 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
           }
         }
         """, metrics_for_slice_pb2.MetricsForSlice())
-    got = metrics_and_plots_serialization._serialize_metrics(
+    got = metrics_and_plots_serialization.serialize_metrics(
         (slice_key, slice_metrics), [])
     self.assertProtoEquals(
         expected_metrics_for_slice,
         metrics_for_slice_pb2.MetricsForSlice.FromString(got))
 
+  def testAnalyticConfidenceIntervalMetrics(self):
+    slice_key = _make_slice_key()
+    slice_metrics = {
+        'mean_label': types.ValueWithConfidenceInterval(0.5, 0.4, 0.6),
+    }
+    expected_metrics_for_slice = text_format.Parse(
+        """
+        slice_key {}
+        metrics {
+          key: "mean_label"
+          value {
+            bounded_value {
+              value {
+                value: 0.5
+              }
+              lower_bound {
+                value: 0.4
+              }
+              upper_bound {
+                value: 0.6
+              }
+              methodology: DELTA_METHOD
+            }
+          }
+        }
+        """, metrics_for_slice_pb2.MetricsForSlice())
+    got = metrics_and_plots_serialization.serialize_metrics(
+        (slice_key, slice_metrics), [])
+    self.assertProtoEquals(
+        expected_metrics_for_slice,
+        metrics_for_slice_pb2.MetricsForSlice.FromString(got))
+
+  def testUncertaintyArrayValuedMetrics(self):
+    slice_key = _make_slice_key()
+    slice_metrics = {
+        'one_dim':
+            types.ValueWithTDistributionArray(
+                sample_mean=np.array([1.5, 2.5]),
+                sample_standard_deviation=np.array([0.5, 0.5]),
+                sample_degrees_of_freedom=np.array([9, 9]),
+                unsampled_value=np.array([1.0, 2.0])),
+    }
+    got = metrics_for_slice_pb2.MetricsForSlice.FromString(
+        metrics_and_plots_serialization.serialize_metrics(
+            (slice_key, slice_metrics), []))
+
+    bounded_array_value = got.metrics['one_dim'].bounded_array_value
+    self.assertEqual(bounded_array_value.methodology,
+                     metrics_for_slice_pb2.BoundedValue.POISSON_BOOTSTRAP)
+    # t-statistic for 95% confidence with 9 degrees of freedom.
+    t_stat = 2.2621571627
+    for array_value, expected in (
+        (bounded_array_value.value, [1.5, 2.5]),
+        (bounded_array_value.lower_bound,
+         [1.5 - t_stat * 0.5, 2.5 - t_stat * 0.5]),
+        (bounded_array_value.upper_bound,
+         [1.5 + t_stat * 0.5, 2.5 + t_stat * 0.5])):
+      self.assertEqual(array_value.data_type,
+                       metrics_for_slice_pb2.ArrayValue.FLOAT64)
+      self.assertEqual(list(array_value.shape), [2])
+      self.assertAllClose(array_value.float64_values, expected)
+
+  def testUncertaintyArrayValuedMetricsRoundTrip(self):
+    slice_key = _make_slice_key('age', 5)
+    slice_metrics = {
+        'two_dims':
+            types.ValueWithTDistributionArray(
+                sample_mean=np.array([[1.5, 2.5], [3.5, 4.5]]),
+                sample_standard_deviation=np.array([[0.5, 0.5], [1.0, 1.0]]),
+                sample_degrees_of_freedom=np.array([[9, 9], [9, 9]]),
+                unsampled_value=np.array([[1.0, 2.0], [3.0, 4.0]])),
+    }
+    got = metrics_and_plots_serialization.deserialize_metrics([
+        metrics_and_plots_serialization.serialize_metrics(
+            (slice_key, slice_metrics), [])
+    ])
+    self.assertLen(got, 1)
+    got_slice_key, got_metrics = got[0]
+    self.assertEqual(got_slice_key, slice_key)
+    bounded_array_value = got_metrics['']['']['two_dims']['boundedArrayValue']
+    self.assertEqual(bounded_array_value['methodology'], 'POISSON_BOOTSTRAP')
+    t_stat = 2.2621571627
+    std = np.array([[0.5, 0.5], [1.0, 1.0]])
+    for field, expected in (('value', slice_metrics['two_dims'].sample_mean),
+                            ('lowerBound',
+                             slice_metrics['two_dims'].sample_mean -
+                             t_stat * std),
+                            ('upperBound',
+                             slice_metrics['two_dims'].sample_mean +
+                             t_stat * std)):
+      self.assertEqual(bounded_array_value[field]['shape'], [2, 2])
+      self.assertAllClose(
+          np.array(bounded_array_value[field]['float64Values']).reshape(
+              (2, 2)), expected)
+
   def testTensorValuedMetrics(self):
     slice_key = _make_slice_key()
     slice_metrics = {
@@ -800,7 +895,7 @@ class EvaluateMetricsAndPlotsTest(testutil.TensorflowModelAnalysisTest):
           }
         }
         """, metrics_for_slice_pb2.MetricsForSlice())
-    got = metrics_and_plots_serialization._serialize_metrics(
+    got = metrics_and_plots_serialization.serialize_metrics(
         (slice_key, slice_metrics), [])
     self.assertProtoEquals(
         expected_metrics_for_slice,
@@ -18,7 +18,13 @@ from __future__ import division
 # Standard __future__ imports
 from __future__ import print_function
 
+import functools
+import os
+import re
+import uuid
+
 import apache_beam as beam
+import tensorflow as tf
 
 from tensorflow_model_analysis import constants
 from tensorflow_model_analysis import types
@@ -26,16 +32,247 @@ from tensorflow_model_analysis.evaluators import evaluator
 from tensorflow_model_analysis.writers import metrics_and_plots_serialization
 from tensorflow_model_analysis.writers import writer
 
-from typing import Dict, Text
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+
+_WINDOW_DIR_PATTERN = re.compile(r'^window_(-?\d+)_(-?\d+)$')
 
 
 def MetricsAndPlotsWriter(eval_shared_model: types.EvalSharedModel,
-                          output_paths: Dict[Text, Text]) -> writer.Writer:
+                          output_paths: Dict[Text, Text],
+                          deterministic_output: bool = False,
+                          windowed: bool = False) -> writer.Writer:
+  """Returns metrics and plots writer.
+
+  Args:
+    eval_shared_model: Shared model.
+    output_paths: Output paths keyed by output key (e.g. 'metrics', 'plots').
+    deterministic_output: True to write the records sorted so that the output
+      files do not depend on the order the slices were computed in. All the
+      records are collected on a single worker to sort them.
+    windowed: True if the metrics and plots are computed per (non-global)
+      window. The results for each window pane are written to separate files
+      (see window_output_path) each time the window's results are updated
+      (e.g. when early or late results are triggered) and the files of earlier
+      panes are deleted. The records are always sorted in this case.
+  """
   return writer.Writer(
       stage_name='WriteMetricsAndPlots',
       ptransform=_WriteMetricsAndPlots(  # pylint: disable=no-value-for-parameter
           eval_shared_model=eval_shared_model,
-          output_paths=output_paths))
+          output_paths=output_paths,
+          deterministic_output=deterministic_output,
+          windowed=windowed))
+
+
+def window_output_path(output_path: Text, window_start: int, window_end: int,
+                       pane_index: int) -> Text:
+  """Returns the path the results for the given window pane are written to.
+
+  Each time the results of a window are updated (e.g. by early or late
+  firings) they are written to a new file for the pane, so that results from
+  an earlier pane never replace those of a later one. Use
+  latest_window_output_path to find the latest results written for a window.
+
+  Args:
+    output_path: Output path for the results of all the windows (e.g.
+      '<output_dir>/metrics').
+    window_start: Start of the window in microseconds since the epoch.
+    window_end: End of the window in microseconds since the epoch.
+    pane_index: Index of the window pane the results were computed for.
+
+  Returns:
+    Output path for the window pane (e.g.
+    '<output_dir>/window_<window_start>_<window_end>/metrics-pane-<index>').
+  """
+  return os.path.join(
+      os.path.dirname(output_path),
+      'window_{}_{}'.format(window_start, window_end),
+      '{}-pane-{}'.format(os.path.basename(output_path), pane_index))
+
+
+def _pane_index(output_path: Text, path: Text) -> Optional[int]:
+  """Returns the pane index of a window output path (None if not a pane)."""
+  match = re.match(r'^{}-pane-(\d+)$'.format(
+      re.escape(os.path.basename(output_path))), os.path.basename(path))
+  if not match:
+    return None
+  return int(match.group(1))
+
+
+def _list_window_panes(output_path: Text, window_start: int,
+                       window_end: int) -> List[Tuple[int, Text]]:
+  """Returns the (pane index, path) of the panes written for the window."""
+  pattern = os.path.join(
+      os.path.dirname(
+          window_output_path(output_path, window_start, window_end, 0)),
+      '{}-pane-*'.format(os.path.basename(output_path)))
+  result = []
+  for path in tf.io.gfile.glob(pattern):
+    pane_index = _pane_index(output_path, path)
+    if pane_index is not None:
+      result.append((pane_index, path))
+  return sorted(result)
+
+
+def latest_window_output_path(output_path: Text, window_start: int,
+                              window_end: int) -> Optional[Text]:
+  """Returns the path of the latest pane written for the window.
+
+  Args:
+    output_path: Output path for the results of all the windows.
+    window_start: Start of the window in microseconds since the epoch.
+    window_end: End of the window in microseconds since the epoch.
+
+  Returns:
+    Path of the results of the window pane with the highest index or None if
+    no results were written for the window.
+  """
+  panes = _list_window_panes(output_path, window_start, window_end)
+  if not panes:
+    return None
+  return panes[-1][1]
+
+
+def list_windows(output_path: Text) -> List[Tuple[int, int]]:
+  """Returns the (start, end) of the windows written for the output path.
+
+  Args:
+    output_path: Output path for the results of all the windows.
+
+  Returns:
+    List of (start, end) in microseconds sorted by start and end.
+  """
+  result = set()
+  pattern = os.path.join(
+      os.path.dirname(output_path), 'window_*',
+      '{}-pane-*'.format(os.path.basename(output_path)))
+  for path in tf.io.gfile.glob(pattern):
+    match = _WINDOW_DIR_PATTERN.match(
+        os.path.basename(os.path.dirname(path)))
+    if match and _pane_index(output_path, path) is not None:
+      result.add((int(match.group(1)), int(match.group(2))))
+  return sorted(result)
+
+
+class _AddPaneIndexDoFn(beam.DoFn):
+  """Adds the index of the window pane to the (slice key, value) tuples."""
+
+  def process(
+      self,
+      element: Tuple[Any, Any],
+      pane_info: Any = beam.DoFn.PaneInfoParam
+  ) -> List[Tuple[int, Any, Any]]:
+    slice_key, value = element
+    return [(pane_info.index, slice_key, value)]
+
+
+class _LatestPanePerSliceCombineFn(beam.CombineFn):
+  """Combines (pane index, slice key, value) into the latest value per slice.
+
+  The windows of the sliced results are accumulating, so each pane contains the
+  full value for a slice and values from earlier panes can be dropped. Keeping
+  only the latest pane per slice bounds the state of the per window combine
+  (which inherits the accumulating trigger) to one value per slice instead of
+  one value per slice for every pane fired so far.
+  """
+
+  def create_accumulator(self) -> Dict[Any, Tuple[int, Any]]:
+    return {}
+
+  def add_input(self, accumulator: Dict[Any, Tuple[int, Any]],
+                element: Tuple[int, Any, Any]) -> Dict[Any, Tuple[int, Any]]:
+    pane_index, slice_key, value = element
+    if (slice_key not in accumulator or
+        pane_index >= accumulator[slice_key][0]):
+      accumulator[slice_key] = (pane_index, value)
+    return accumulator
+
+  def merge_accumulators(
+      self, accumulators: List[Dict[Any, Tuple[int, Any]]]
+  ) -> Dict[Any, Tuple[int, Any]]:
+    result = {}
+    for accumulator in accumulators:
+      for slice_key, (pane_index, value) in accumulator.items():
+        if slice_key not in result or pane_index >= result[slice_key][0]:
+          result[slice_key] = (pane_index, value)
+    return result
+
+  def extract_output(
+      self, accumulator: Dict[Any, Tuple[int, Any]]) -> List[Tuple[Any, Any]]:
+    return [(slice_key, value)
+            for slice_key, (_, value) in accumulator.items()]
+
+
+class _WriteWindowDoFn(beam.DoFn):
+  """Writes the (slice key, value) list for a window pane to the pane's file.
+
+  Each pane is written to its own file (see window_output_path) and the files
+  of earlier panes of the window are deleted once it has been written. Panes
+  that arrive after a later pane was written are dropped. Since panes that are
+  written concurrently never replace the results of a later pane and readers
+  pick the pane with the highest index, an older pane is never read in place
+  of a newer one.
+  """
+
+  def __init__(self, output_path: Text,
+               serialize_fn: Callable[[Tuple[Any, Any]], bytes]):
+    self._output_path = output_path
+    self._serialize_fn = serialize_fn
+
+  def process(self,
+              element: List[Tuple[Any, Any]],
+              window: Any = beam.DoFn.WindowParam,
+              pane_info: Any = beam.DoFn.PaneInfoParam) -> None:
+    start = window.start.micros
+    end = window.end.micros
+    panes = _list_window_panes(self._output_path, start, end)
+    if panes and panes[-1][0] > pane_info.index:
+      # A later pane of the window has already been written.
+      return
+    records = sorted(self._serialize_fn(e) for e in element)
+    path = window_output_path(self._output_path, start, end, pane_info.index)
+    tf.io.gfile.makedirs(os.path.dirname(path))
+    # Written to a temporary file first so that readers never see a partially
+    # written file.
+    tmp_path = '{}.tmp-{}'.format(path, uuid.uuid4().hex)
+    with tf.io.TFRecordWriter(tmp_path) as w:
+      for record in records:
+        w.write(record)
+    tf.io.gfile.rename(tmp_path, path, overwrite=True)
+    for pane_index, pane_path in _list_window_panes(self._output_path, start,
+                                                    end):
+      if pane_index < pane_info.index:
+        try:
+          tf.io.gfile.remove(pane_path)
+        except tf.errors.NotFoundError:
+          # Already deleted by the writer of another pane.
+          pass
+
+
+@beam.ptransform_fn
+@beam.typehints.with_output_types(beam.pvalue.PDone)
+def _WriteWindowedResults(  # pylint: disable=invalid-name
+    sliced_results: beam.pvalue.PCollection, output_path: Text,
+    serialize_fn: Callable[[Tuple[Any, Any]], bytes]) -> beam.pvalue.PDone:
+  """PTransform that writes the results of each window to a separate file."""
+  _ = (
+      sliced_results
+      | 'AddPaneIndex' >> beam.ParDo(_AddPaneIndexDoFn())
+      | 'LatestPanePerSlice' >> beam.CombineGlobally(
+          _LatestPanePerSliceCombineFn()).without_defaults()
+      | 'WriteWindow' >> beam.ParDo(
+          _WriteWindowDoFn(output_path, serialize_fn)))
+  return beam.pvalue.PDone(sliced_results.pipeline)
+
+
+@beam.ptransform_fn
+@beam.typehints.with_input_types(bytes)
+@beam.typehints.with_output_types(bytes)
+def _SortRecords(records: beam.pvalue.PCollection):  # pylint: disable=invalid-name
+  """PTransform that sorts serialized records."""
+  return (records
+          | 'ToList' >> beam.combiners.ToList()
+          | 'Sort' >> beam.FlatMap(sorted))
 
 
 @beam.ptransform_fn
@@ -43,18 +280,42 @@ def MetricsAndPlotsWriter(eval_shared_model: types.EvalSharedModel,
 @beam.typehints.with_output_types(beam.pvalue.PDone)
 def _WriteMetricsAndPlots(evaluation: evaluator.Evaluation,
                           eval_shared_model: types.EvalSharedModel,
-                          output_paths: Dict[Text, Text]):
+                          output_paths: Dict[Text, Text],
+                          deterministic_output: bool = False,
+                          windowed: bool = False):
   """PTransform to write metrics and plots."""
 
   metrics = evaluation[constants.METRICS_KEY]
   plots = evaluation[constants.PLOTS_KEY]
 
+  if windowed:
+    post_export_metrics = eval_shared_model.add_metrics_callbacks
+    # pylint: disable=no-value-for-parameter
+    if constants.METRICS_KEY in output_paths:
+      _ = metrics | 'WriteMetrics' >> _WriteWindowedResults(
+          output_path=output_paths[constants.METRICS_KEY],
+          serialize_fn=functools.partial(
+              metrics_and_plots_serialization.serialize_metrics,
+              post_export_metrics=post_export_metrics))
+    if constants.PLOTS_KEY in output_paths:
+      _ = plots | 'WritePlots' >> _WriteWindowedResults(
+          output_path=output_paths[constants.PLOTS_KEY],
+          serialize_fn=functools.partial(
+              metrics_and_plots_serialization.serialize_plots,
+              post_export_metrics=post_export_metrics))
+    # pylint: enable=no-value-for-parameter
+    return beam.pvalue.PDone(metrics.pipeline)
+
   metrics, plots = (
       (metrics, plots)
       | 'SerializeMetricsAndPlots' >>
       metrics_and_plots_serialization.SerializeMetricsAndPlots(
           post_export_metrics=eval_shared_model.add_metrics_callbacks))
 
+  if deterministic_output:
+    metrics = metrics | 'SortMetrics' >> _SortRecords()  # pylint: disable=no-value-for-parameter
+    plots = plots | 'SortPlots' >> _SortRecords()  # pylint: disable=no-value-for-parameter
+
   if constants.METRICS_KEY in output_paths:
     _ = metrics | 'WriteMetrics' >> beam.io.WriteToTFRecord(
         file_path_prefix=output_paths[constants.METRICS_KEY],
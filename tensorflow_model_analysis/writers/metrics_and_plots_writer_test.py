@@ -23,6 +23,8 @@ import tempfile
 # Standard Imports
 
 import apache_beam as beam
+from apache_beam.transforms import window as beam_window
+from apache_beam.utils import windowed_value
 import tensorflow as tf
 from tensorflow_model_analysis import config
 from tensorflow_model_analysis import constants
@@ -189,6 +191,89 @@ class MetricsAndPlotsWriterTest(testutil.TensorflowModelAnalysisTest):
     self.assertEqual(1, len(plot_records), 'plots: %s' % plot_records)
     self.assertProtoEquals(expected_plots_for_slice, plot_records[0])
 
+  def testListWindows(self):
+    output_path = os.path.join(self._getTempDir(), 'metrics')
+    self.assertEqual(metrics_and_plots_writer.list_windows(output_path), [])
+    for start, end, pane_index in ((60000000, 120000000, 0),
+                                   (0, 60000000, 0), (0, 60000000, 1)):
+      path = metrics_and_plots_writer.window_output_path(
+          output_path, start, end, pane_index)
+      tf.io.gfile.makedirs(os.path.dirname(path))
+      with tf.io.TFRecordWriter(path) as w:
+        w.write(b'record')
+    self.assertEqual(
+        metrics_and_plots_writer.window_output_path(output_path, 0, 60000000,
+                                                    1),
+        os.path.join(
+            os.path.dirname(output_path), 'window_0_60000000',
+            'metrics-pane-1'))
+    self.assertEqual(
+        metrics_and_plots_writer.list_windows(output_path),
+        [(0, 60000000), (60000000, 120000000)])
+
+  def testLatestWindowOutputPath(self):
+    output_path = os.path.join(self._getTempDir(), 'metrics')
+    self.assertIsNone(
+        metrics_and_plots_writer.latest_window_output_path(
+            output_path, 0, 60000000))
+    # Pane 10 must be picked over pane 9 (i.e. the indices are not compared
+    # as strings) and temporary files are ignored.
+    for pane_index in (9, 10):
+      path = metrics_and_plots_writer.window_output_path(
+          output_path, 0, 60000000, pane_index)
+      tf.io.gfile.makedirs(os.path.dirname(path))
+      with tf.io.TFRecordWriter(path) as w:
+        w.write(b'record')
+    with tf.io.TFRecordWriter(
+        metrics_and_plots_writer.window_output_path(output_path, 0, 60000000,
+                                                    11) + '.tmp-1') as w:
+      w.write(b'record')
+    self.assertEqual(
+        metrics_and_plots_writer.latest_window_output_path(
+            output_path, 0, 60000000),
+        metrics_and_plots_writer.window_output_path(output_path, 0, 60000000,
+                                                    10))
+
+  def testWriteWindowDoFnKeepsLatestPane(self):
+    output_path = os.path.join(self._getTempDir(), 'metrics')
+    write_fn = metrics_and_plots_writer._WriteWindowDoFn(  # pylint: disable=protected-access
+        output_path, lambda e: e[1])
+    window = beam_window.IntervalWindow(0, 60)
+    for pane_index, value in ((1, b'pane_1'), (0, b'pane_0'), (2, b'pane_2'),
+                              (1, b'pane_1')):
+      pane_info = windowed_value.PaneInfo(
+          is_first=pane_index == 0,
+          is_last=False,
+          timing=windowed_value.PaneInfoTiming.EARLY,
+          index=pane_index,
+          nonspeculative_index=-1)
+      write_fn.process([((), value)], window=window, pane_info=pane_info)
+    path = metrics_and_plots_writer.latest_window_output_path(
+        output_path, 0, 60000000)
+    self.assertEqual(
+        path,
+        metrics_and_plots_writer.window_output_path(output_path, 0, 60000000,
+                                                    2))
+    self.assertEqual(
+        list(tf.compat.v1.python_io.tf_record_iterator(path)), [b'pane_2'])
+    # The earlier panes are deleted once a later pane was written.
+    self.assertEqual(
+        tf.io.gfile.listdir(os.path.dirname(path)), ['metrics-pane-2'])
+
+  def testLatestPanePerSliceCombineFn(self):
+    combiner = metrics_and_plots_writer._LatestPanePerSliceCombineFn()  # pylint: disable=protected-access
+    first = combiner.create_accumulator()
+    for element in ((0, (), 'overall_0'), (1, (), 'overall_1'),
+                    (0, (('f', 1),), 'f1_0')):
+      first = combiner.add_input(first, element)
+    second = combiner.add_input(combiner.create_accumulator(),
+                                (2, (('f', 1),), 'f1_2'))
+    merged = combiner.merge_accumulators([first, second])
+    self.assertLen(merged, 2)
+    self.assertCountEqual(
+        combiner.extract_output(merged), [((), 'overall_1'),
+                                          ((('f', 1),), 'f1_2')])
+
 
 if __name__ == '__main__':
   tf.test.main()